@@ -1,7 +1,10 @@
+import atexit
+import base64
 import os
-import json
-import zipfile
-from datetime import datetime, date, timedelta
+import tempfile
+import time
+from datetime import datetime, date, timedelta, timezone
+from itertools import islice
 from io import BytesIO
 import requests
 import threading
@@ -13,73 +16,33 @@ from werkzeug.utils import secure_filename
 
 from sqlalchemy import (
     create_engine, MetaData, Table, Column, Integer, String, Float,
-    ForeignKey, func, select, insert, update, delete, inspect, text
+    ForeignKey, func, select, insert, update, delete, text, bindparam, or_, Text, case, tuple_, event
 )
 from sqlalchemy.engine import Engine
+import numpy as np
 import pandas as pd
-def migrate_ml_columns():
-    """Adiciona colunas do Mercado Livre nas tabelas configuracoes e vendas"""
-    try:
-        with engine.begin() as conn:
-            insp = inspect(engine)
-
-            # Migração para configuracoes
-            cfg_cols = [c["name"] for c in insp.get_columns("configuracoes")]
-            ml_config_columns = [
-                ("ml_client_id", "VARCHAR(255)" if raw_db_url else "TEXT"),
-                ("ml_client_secret", "VARCHAR(255)" if raw_db_url else "TEXT"),
-                ("ml_access_token", "VARCHAR(500)" if raw_db_url else "TEXT"),
-                ("ml_refresh_token", "VARCHAR(500)" if raw_db_url else "TEXT"),
-                ("ml_token_expira", "VARCHAR(50)" if raw_db_url else "TEXT"),
-                ("ml_user_id", "VARCHAR(100)" if raw_db_url else "TEXT"),
-                ("ml_sync_auto", "VARCHAR(10)" if raw_db_url else "TEXT DEFAULT 'false'"),
-                ("ml_ultimo_sync", "VARCHAR(50)" if raw_db_url else "TEXT"),
-            ]
-
-            for col_name, col_type in ml_config_columns:
-                if col_name not in cfg_cols:
-                    try:
-                        if raw_db_url:
-                            sql = f"ALTER TABLE configuracoes ADD COLUMN IF NOT EXISTS {col_name} {col_type}"
-                        else:
-                            sql = f"ALTER TABLE configuracoes ADD COLUMN {col_name} {col_type}"
-                        conn.execute(text(sql))
-                        print(f"[OK] Coluna {col_name} adicionada")
-                    except Exception as e:
-                        print(f"⚠️ Erro ao adicionar {col_name}: {e}")
-
-            # Migração para vendas
-            vendas_cols = [c["name"] for c in insp.get_columns("vendas")]
-            ml_vendas_columns = [
-                ("ml_order_id", "VARCHAR(50)" if raw_db_url else "TEXT"),
-                ("ml_status", "VARCHAR(50)" if raw_db_url else "TEXT"),
-            ]
-
-            for col_name, col_type in ml_vendas_columns:
-                if col_name not in vendas_cols:
-                    try:
-                        if raw_db_url:
-                            sql = f"ALTER TABLE vendas ADD COLUMN IF NOT EXISTS {col_name} {col_type}"
-                        else:
-                            sql = f"ALTER TABLE vendas ADD COLUMN {col_name} {col_type}"
-                        conn.execute(text(sql))
-                        print(f"[OK] Coluna {col_name} adicionada")
-                    except Exception as e:
-                        print(f"⚠️ Erro ao adicionar {col_name}: {e}")
 
-            # Criar índice único para ml_order_id (ignora se já existe)
-            try:
-                if raw_db_url:
-                    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS idx_vendas_ml_order_id ON vendas(ml_order_id) WHERE ml_order_id IS NOT NULL"))
-                else:
-                    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS idx_vendas_ml_order_id ON vendas(ml_order_id)"))
-                print("[OK] Índice ml_order_id criado")
-            except Exception as e:
-                print(f"[WARN] Índice ml_order_id: {e}")
+from jobs_importacao import FilaImportacao, registrar_progresso
+from leitor_excel import TAMANHO_BLOCO_PADRAO, colunas_excel, ler_excel_em_blocos
+from resumo_vendas import ResumoVendas
+from series_tempo import ROTULOS, intervalo_datas, serie_temporal
+from lucro import calcular_lucro, meses_no_periodo, totais_lucro
+from migracoes import RegistroMigracoes, adicionar_coluna
+from cache_relatorios import CacheRelatorios, VersaoDados
+from exportacao import (
+    cabecalho_consulta, escrever_xlsx, formato_da_requisicao, linhas_consulta, resposta_exportacao,
+)
+from pacote_render import gerar_pacote
+from backup_banco import fazer_backup, restaurar_banco
+from replicacao_wal import ReplicadorWAL, configurar_conexao
+from auto_import import auto_import_data_if_empty
+from mercado_livre import (
+    API_URL_PADRAO, COLUNAS_PLANILHA, STATUS_ENVIO, STATUS_PEDIDO, ClienteML, TokenML, linhas_planilha, sku_do_anuncio,
+)
+from notificacoes_ml import FilaNotificacoes, recurso_da_notificacao
+from estoque_ml import PublicadorEstoqueML
+from etiquetas_zpl import zpl_para_pdf
 
-        print("[OK] Migração ML concluída")
-    except Exception as e:
-        print(f"[WARN] Migração ML falhou: {e}")
 # Inicialização do Flask, configuração e metadata
 raw_db_url = os.environ.get("DATABASE_URL")
 if raw_db_url:
@@ -111,6 +74,32 @@ if raw_db_url:
 else:
     engine: Engine = create_engine(DATABASE_URL, future=True)
 
+# replicação contínua do SQLite (envio do WAL para SQLITE_REPLICA_DIR), ver replicacao_wal.py
+replicador_wal = None
+if not raw_db_url and os.environ.get("SQLITE_REPLICA_DIR"):
+    event.listen(engine, "connect", configurar_conexao)
+    replicador_wal = ReplicadorWAL(
+        "metrifiy.db",
+        os.environ["SQLITE_REPLICA_DIR"],
+        intervalo=float(os.environ.get("SQLITE_REPLICA_INTERVALO", "10")),
+        snapshot_horas=float(os.environ.get("SQLITE_REPLICA_SNAPSHOT_HORAS", "24")),
+    )
+    atexit.register(replicador_wal.parar)
+
+    @app.before_request
+    def _iniciar_replicador():
+        # a thread nasce no processo que atende os requests (preload_app faz fork depois)
+        replicador_wal.iniciar()
+
+# versão dos dados: sobe a cada escrita no banco e invalida o cache dos relatórios
+versao_dados = VersaoDados()
+versao_dados.monitorar(engine, ignorar=("import_jobs", "schema_version"))
+cache_relatorios = CacheRelatorios(
+    versao_dados,
+    max_bytes=int(os.environ.get("REPORT_CACHE_MB", "32")) * 1024 * 1024,
+    max_itens=int(os.environ.get("REPORT_CACHE_ITENS", "256")),
+)
+
 # Inicializa Flask-Login e Bcrypt
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
@@ -118,6 +107,41 @@ login_manager.login_view = "login_view"
 
 
 # === Backup / Restore routes (canonical implementation) ===
+# compressão dos backups SQLite: "" (nenhuma), "gzip" ou "zstd"
+BACKUP_COMPRESSAO = os.environ.get("BACKUP_COMPRESSAO") or None
+EXTENSOES_BACKUP = (".db", ".db.gz", ".db.zst")
+
+
+def _job_backup_sqlite(compressao):
+    info = fazer_backup(compressao=compressao, progresso=registrar_progresso)
+    total = sum(info["segundos"].values())
+    info["mensagem"] = (
+        f"✅ Backup {info['arquivo']} criado ({info['bytes'] / 1024:.1f} KB, "
+        f"integridade ok, {total:.1f}s)."
+    )
+    info["categoria"] = "success"
+    return info
+
+
+def restaurar_banco_sqlite(enviado):
+    """Troca o metrifiy.db pelo banco ``enviado`` (com backup do atual antes).
+
+    O banco enviado pode ser de uma versão anterior do schema: as migrações
+    pendentes rodam em seguida, e o resumo diário é montado se vier vazio.
+    """
+    fazer_backup(prefixo="metrifiy_backup_antes_restore_", manter=None)
+    # pela API de backup, não sobrescrevendo o arquivo aberto (WAL)
+    restaurar_banco(enviado, "metrifiy.db")
+    engine.dispose()
+    init_db()
+    with engine.begin() as conn:
+        _carregar_resumo_se_vazio(conn)
+    if replicador_wal is not None:
+        replicador_wal.recomecar("restore do banco")
+    tokens_ml.esquecer()
+    versao_dados.incrementar()
+
+
 @app.route("/admin/backup", methods=["GET", "POST"])
 @login_required
 def admin_backup():
@@ -157,25 +181,21 @@ def admin_backup():
 
         if action == "render_export":
             try:
-                from export_data import export_all_data
-                zip_path = export_all_data()
-                flash("Pacote Render exportado com sucesso!", "success")
-                return send_file(zip_path, as_attachment=True, download_name=os.path.basename(zip_path))
+                zip_path, zip_nome = gerar_export_render()
+                resp = send_file(zip_path, as_attachment=True, download_name=zip_nome)
+                resp.call_on_close(lambda: os.remove(zip_path))
+                return resp
             except Exception as e:
                 flash(f"Erro ao exportar: {e}", "danger")
 
         elif action == "sqlite_backup":
-            try:
-                import shutil
-                from datetime import datetime
-                os.makedirs("backups", exist_ok=True)
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                backup_filename = f"metrifiy_backup_{timestamp}.db"
-                backup_path = os.path.join("backups", backup_filename)
-                shutil.copy2("metrifiy.db", backup_path)
-                flash(f"Backup criado: {backup_filename}", "success")
-            except Exception as e:
-                flash(f"Erro ao criar backup: {e}", "danger")
+            # cópia online em segundo plano (API de backup do SQLite, ver backup_banco.py)
+            job_id = fila_backup.enviar(
+                "backup_sqlite", _job_backup_sqlite, BACKUP_COMPRESSAO,
+                arquivo="metrifiy.db", usuario_id=current_user.id,
+            )
+            flash(f"Backup em andamento (job #{job_id}).", "info")
+            return redirect(url_for("acompanhar_job", job_id=job_id))
 
         elif action == "sqlite_restore":
             if "backup_file" not in request.files:
@@ -187,23 +207,22 @@ def admin_backup():
                 elif not file.filename.endswith(".db"):
                     flash("Arquivo deve ter extensão .db", "danger")
                 else:
+                    fd, enviado = tempfile.mkstemp(prefix="metrifiy_restore_", suffix=".db")
+                    os.close(fd)
                     try:
-                        import shutil
-                        from datetime import datetime
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        backup_atual = f"metrifiy_backup_antes_restore_{timestamp}.db"
-                        os.makedirs("backups", exist_ok=True)
-                        shutil.copy2("metrifiy.db", os.path.join("backups", backup_atual))
-                        file.save("metrifiy.db")
+                        file.save(enviado)
+                        restaurar_banco_sqlite(enviado)
                         flash("Banco restaurado com sucesso! Backup anterior salvo.", "success")
                     except Exception as e:
                         flash(f"Erro ao restaurar: {e}", "danger")
+                    finally:
+                        os.remove(enviado)
 
     backups = []
     backups_dir = "backups"
     if os.path.exists(backups_dir):
         for filename in os.listdir(backups_dir):
-            if filename.startswith("metrifiy_backup_") and filename.endswith(".db"):
+            if filename.startswith("metrifiy_backup_") and filename.endswith(EXTENSOES_BACKUP):
                 filepath = os.path.join(backups_dir, filename)
                 try:
                     stat = os.stat(filepath)
@@ -232,7 +251,7 @@ def admin_backup_download(filename):
             flash("Acesso negado.", "danger")
             return redirect(url_for("dashboard"))
 
-    if not filename.startswith("metrifiy_backup_") or not filename.endswith(".db"):
+    if not filename.startswith("metrifiy_backup_") or not filename.endswith(EXTENSOES_BACKUP):
         flash("Arquivo inválido.", "danger")
         return redirect(url_for("admin_backup"))
 
@@ -258,150 +277,6 @@ usuarios = Table(
 # Definição das outras tabelas (produtos, vendas, etc.)
 # ...existing code...
 
-# Criar todas as tabelas no banco de dados
-metadata.create_all(engine)
-
-# Migração: adicionar colunas ML (PostgreSQL e SQLite)
-def migrate_ml_columns():
-    """Adiciona colunas do Mercado Livre nas tabelas configuracoes e vendas"""
-    # Migração: adicionar coluna publicidade em produtos
-    try:
-        with engine.begin() as conn:
-            insp = inspect(engine)
-            prod_cols = [c["name"] for c in insp.get_columns("produtos")]
-            if "publicidade" not in prod_cols:
-                if raw_db_url:
-                    conn.execute(text("ALTER TABLE produtos ADD COLUMN IF NOT EXISTS publicidade FLOAT DEFAULT 0"))
-                else:
-                    conn.execute(text("ALTER TABLE produtos ADD COLUMN publicidade FLOAT DEFAULT 0"))
-                print("[MIGRATION] Coluna 'publicidade' adicionada em produtos")
-    except Exception as e:
-        print(f"[MIGRATION] Erro ao adicionar coluna 'publicidade' em produtos: {e}")
-
-    try:
-        with engine.begin() as conn:
-            insp = inspect(engine)
-
-            # Migração para configuracoes
-            cfg_cols = [c["name"] for c in insp.get_columns("configuracoes")]
-            ml_config_columns = [
-                ("ml_client_id", "VARCHAR(255)" if raw_db_url else "TEXT"),
-                ("ml_client_secret", "VARCHAR(255)" if raw_db_url else "TEXT"),
-                ("ml_access_token", "VARCHAR(500)" if raw_db_url else "TEXT"),
-                ("ml_refresh_token", "VARCHAR(500)" if raw_db_url else "TEXT"),
-                ("ml_token_expira", "VARCHAR(50)" if raw_db_url else "TEXT"),
-                ("ml_user_id", "VARCHAR(100)" if raw_db_url else "TEXT"),
-                ("ml_sync_auto", "VARCHAR(10)" if raw_db_url else "TEXT DEFAULT 'false'"),
-                ("ml_ultimo_sync", "VARCHAR(50)" if raw_db_url else "TEXT"),
-            ]
-
-            for col_name, col_type in ml_config_columns:
-                if col_name not in cfg_cols:
-                    try:
-                        if raw_db_url:
-                            sql = f"ALTER TABLE configuracoes ADD COLUMN IF NOT EXISTS {col_name} {col_type}"
-                        else:
-                            sql = f"ALTER TABLE configuracoes ADD COLUMN {col_name} {col_type}"
-                        conn.execute(text(sql))
-                        print(f"[OK] Coluna {col_name} adicionada")
-                    except Exception as e:
-                        print(f"⚠️ Erro ao adicionar {col_name}: {e}")
-
-            # Migração para vendas
-            vendas_cols = [c["name"] for c in insp.get_columns("vendas")]
-            ml_vendas_columns = [
-                ("ml_order_id", "VARCHAR(50)" if raw_db_url else "TEXT"),
-                ("ml_status", "VARCHAR(50)" if raw_db_url else "TEXT"),
-            ]
-
-            for col_name, col_type in ml_vendas_columns:
-                if col_name not in vendas_cols:
-                    try:
-                        if raw_db_url:
-                            sql = f"ALTER TABLE vendas ADD COLUMN IF NOT EXISTS {col_name} {col_type}"
-                        else:
-                            sql = f"ALTER TABLE vendas ADD COLUMN {col_name} {col_type}"
-                        conn.execute(text(sql))
-                        print(f"[OK] Coluna {col_name} adicionada")
-                    except Exception as e:
-                        print(f"⚠️ Erro ao adicionar {col_name}: {e}")
-
-            # Criar índice único para ml_order_id (ignora se já existe)
-            try:
-                if raw_db_url:
-                    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS idx_vendas_ml_order_id ON vendas(ml_order_id) WHERE ml_order_id IS NOT NULL"))
-                else:
-                    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS idx_vendas_ml_order_id ON vendas(ml_order_id)"))
-                print("[OK] Índice ml_order_id criado")
-            except Exception as e:
-                print(f"[WARN] Índice ml_order_id: {e}")
-
-        print("[OK] Migração ML concluída")
-    except Exception as e:
-        print(f"[WARN] Migração ML falhou: {e}")
-
-    # migrate_ml_columns()  # chamada removida daqui; será executada após engine estar definido
-
-# Migração: adicionar colunas de papel/ativo em usuarios e garantir admin
-def migrate_user_columns_and_seed_admin():
-    try:
-        with engine.begin() as conn:
-            insp = inspect(engine)
-            cols = [c["name"] for c in insp.get_columns("usuarios")]
-
-            if "papel" not in cols:
-                try:
-                    if raw_db_url:
-                        conn.execute(text("ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS papel VARCHAR(20) DEFAULT 'vendedor'"))
-                    else:
-                        conn.execute(text("ALTER TABLE usuarios ADD COLUMN papel TEXT DEFAULT 'vendedor'"))
-                    print("[OK] Coluna 'papel' adicionada em usuarios")
-                except Exception as e:
-                    print(f"[WARN] Não foi possível adicionar coluna 'papel': {e}")
-
-            if "ativo" not in cols:
-                try:
-                    if raw_db_url:
-                        conn.execute(text("ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS ativo BOOLEAN DEFAULT TRUE"))
-                    else:
-                        conn.execute(text("ALTER TABLE usuarios ADD COLUMN ativo INTEGER DEFAULT 1"))
-                    print("[OK] Coluna 'ativo' adicionada em usuarios")
-                except Exception as e:
-                    print(f"[WARN] Não foi possível adicionar coluna 'ativo': {e}")
-
-            # Garantir que exista um usuário admin
-            has_admin = False
-            try:
-                res = conn.execute(text("SELECT id, username, papel FROM usuarios WHERE papel='admin' LIMIT 1")).mappings().first()
-                if res:
-                    has_admin = True
-            except Exception:
-                has_admin = False
-
-            if not has_admin:
-                # Se não houver usuários, criar admin padrão
-                try:
-                    any_user = conn.execute(text("SELECT id FROM usuarios LIMIT 1")).first()
-                    if not any_user:
-                        # criar usuário admin com senha 'admin' — peça para trocar depois
-                        pw_hash = bcrypt.generate_password_hash('admin').decode('utf-8')
-                        conn.execute(
-                            usuarios.insert().values(username='admin', password_hash=pw_hash, papel='admin', ativo=1)
-                        )
-                        print("[OK] Usuário 'admin' criado com senha padrão 'admin' — troque a senha imediatamente.")
-                    else:
-                        # promover primeiro usuário a admin
-                        first = conn.execute(text("SELECT id, username FROM usuarios LIMIT 1")).mappings().first()
-                        if first:
-                            conn.execute(text("UPDATE usuarios SET papel='admin' WHERE id = :id"), {"id": first['id']})
-                            print(f"[OK] Usuário {first['username']} promovido a admin")
-                except Exception as e:
-                    print(f"[WARN] Não foi possível criar/promover admin automaticamente: {e}")
-    except Exception as e:
-        print(f"[WARN] migrate_user_columns_and_seed_admin falhou: {e}")
-
-migrate_ml_columns()
-migrate_user_columns_and_seed_admin()
 
 # Helper para retry em operações de banco (SSL intermitente)
 def db_retry(func, max_attempts=3):
@@ -451,14 +326,6 @@ class User(UserMixin):
 @login_manager.user_loader
 def load_user(user_id):
     return User.get(user_id)
-def criar_usuario_inicial():
-    with engine.begin() as conn:
-        row = conn.execute(select(usuarios).where(usuarios.c.username == "julio")).first()
-        if not row:
-            senha_hash = bcrypt.generate_password_hash("12345").decode("utf-8")
-            conn.execute(usuarios.insert().values(username="julio", password_hash=senha_hash))
-
-criar_usuario_inicial()
 # Rota de login
 @app.route("/login", methods=["GET", "POST"])
 def login_view():
@@ -499,6 +366,7 @@ def excluir_lote_venda(lote):
             select(func.count()).select_from(vendas).where(vendas.c.lote_importacao == lote)
         ).scalar()
         print(f"[DEBUG] Vendas antes da exclusão: {count_before}")
+        resumo_vendas.subtrair(conn, vendas.c.lote_importacao == lote)
         deleted = conn.execute(
             delete(vendas)
             .where(vendas.c.lote_importacao == lote)
@@ -555,6 +423,7 @@ def deletar_lotes_em_massa():
                 ).scalar()
                 
                 # Deletar
+                resumo_vendas.subtrair(conn, vendas.c.lote_importacao == lote)
                 conn.execute(
                     delete(vendas)
                     .where(vendas.c.lote_importacao == lote)
@@ -647,76 +516,218 @@ finance_transactions = Table(
     Column("lote_importacao", String(50)),  # lote de importação
 )
 
+import_jobs = Table(
+    "import_jobs",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("tipo", String(50), nullable=False),  # vendas_ml, settlement_mp, mp_full, estoque_ml_full, produtos
+    Column("arquivo", String(255)),
+    Column("status", String(20), nullable=False),  # pendente, executando, concluido, erro
+    Column("linhas_processadas", Integer, server_default="0"),
+    Column("criado_em", String(50)),
+    Column("iniciado_em", String(50)),
+    Column("finalizado_em", String(50)),
+    Column("duracao_segundos", Float),
+    Column("resultado", Text),  # resumo da importação em JSON
+    Column("erro", Text),
+    Column("usuario_id", Integer),
+    Column("pid", Integer),  # processo que executa o job
+)
 
-def init_db():
-    """Cria as tabelas se não existirem e garante 1 linha em configuracoes.
-    Também aplica pequenos 'migrations' (ALTER TABLE) quando necessário.
-    """
-    metadata.create_all(engine)
+# somas diárias de vendas por produto/UF, lidas pelos relatórios (ver resumo_vendas.py)
+vendas_resumo_diario = Table(
+    "vendas_resumo_diario",
+    metadata,
+    Column("dia", String(10), primary_key=True),  # YYYY-MM-DD ("" = venda sem data)
+    Column("produto_id", Integer, primary_key=True),
+    Column("estado", String(2), primary_key=True),  # "" = sem UF
+    Column("cancelada", Integer, primary_key=True),  # 1 = receita_total <= 0
+    Column("num_vendas", Integer, nullable=False, server_default="0"),
+    Column("qtd", Integer, nullable=False, server_default="0"),
+    Column("receita", Float, nullable=False, server_default="0"),
+    Column("custo", Float, nullable=False, server_default="0"),
+    Column("comissao", Float, nullable=False, server_default="0"),  # soma de comissao_ml
+    Column("margem", Float, nullable=False, server_default="0"),
+    Column("soma_preco_unitario", Float, nullable=False, server_default="0"),  # para o ticket médio
+    Column("valor_bruto", Float, nullable=False, server_default="0"),  # soma de preço unitário * quantidade
+)
 
-    with engine.begin() as conn:
-        # garante 1 linha em configuracoes
-        row = conn.execute(select(configuracoes.c.id).limit(1)).first()
-        if not row:
-            conn.execute(insert(configuracoes).values(id=1, imposto_percent=0.0, despesas_percent=0.0))
+resumo_vendas = ResumoVendas(vendas, vendas_resumo_diario)
 
-        # ---- migrations leves (compatível com SQLite/Postgres) ----
-        insp = inspect(engine)
 
-        # vendas.comissao_ml
-        try:
-            cols = [c["name"] for c in insp.get_columns("vendas")]
-            if "comissao_ml" not in cols:
-                conn.execute(text('ALTER TABLE vendas ADD COLUMN comissao_ml FLOAT DEFAULT 0'))
-        except Exception:
-            pass
+def _carregar_resumo_se_vazio(conn):
+    """Monta o resumo diário a partir das vendas, se ele estiver vazio e houver vendas."""
+    if resumo_vendas.vazio(conn) and conn.execute(select(vendas.c.id).limit(1)).first():
+        resumo_vendas.reconstruir(conn)
 
-        # vendas.estado
-        try:
-            cols = [c["name"] for c in insp.get_columns("vendas")]
-            if "estado" not in cols:
-                conn.execute(text('ALTER TABLE vendas ADD COLUMN estado TEXT'))
-        except Exception:
-            pass
+# anúncios do Mercado Livre (atualizados pelas notificações "items", ver notificacoes_ml.py)
+ml_anuncios = Table(
+    "ml_anuncios",
+    metadata,
+    Column("item_id", String(30), primary_key=True),  # MLB...
+    Column("sku", String(100), index=True),
+    Column("titulo", String(255)),
+    Column("status", String(30)),  # active, paused, closed...
+    Column("estoque_ml", Integer),  # available_quantity no ML
+    Column("atualizado_em", String(50)),
+)
 
-        # finance_transactions.lote_importacao
-        try:
-            cols = [c["name"] for c in insp.get_columns("finance_transactions")]
-            if "lote_importacao" not in cols:
-                conn.execute(text('ALTER TABLE finance_transactions ADD COLUMN lote_importacao TEXT'))
-        except Exception:
-            pass
+# produtos com estoque alterado a enviar para os anúncios, e o resultado do último envio (ver estoque_ml.py)
+ml_estoque_envios = Table(
+    "ml_estoque_envios",
+    metadata,
+    Column("produto_id", Integer, primary_key=True),
+    Column("versao", Integer, nullable=False, server_default="1"),  # sobe a cada alteração do estoque
+    Column("pendente", Integer, nullable=False, server_default="1", index=True),
+    Column("tentativas", Integer, nullable=False, server_default="0"),  # envios com falha desde a alteração
+    Column("alterado_em", String(50)),
+    Column("enviado_em", String(50)),
+    Column("estoque_enviado", Integer),
+    Column("resultado", String(20)),  # ok, inalterado, sem_anuncio, erro, falha
+    Column("erro", Text),
+)
 
-        # produtos.criado_automaticamente
-        try:
-            cols = [c["name"] for c in insp.get_columns("produtos")]
-            if "criado_automaticamente" not in cols:
-                conn.execute(text("ALTER TABLE produtos ADD COLUMN criado_automaticamente VARCHAR(10) DEFAULT 'false'"))
-                print("[MIGRATION] Coluna criado_automaticamente criada")
-        except Exception as e:
-            print(f"[MIGRATION] Erro ao criar criado_automaticamente: {e}")
+estoque_ml = PublicadorEstoqueML(produtos, ml_anuncios, ml_estoque_envios)
 
-        # configuracoes.publicidade (valor numérico de despesa com publicidade)
-        try:
-            cfg_cols = [c["name"] for c in insp.get_columns("configuracoes")]
-            if "publicidade" not in cfg_cols:
-                # SQLite doesn't support ALTER TABLE ADD COLUMN IF NOT EXISTS with types consistently
-                if raw_db_url:
-                    conn.execute(text("ALTER TABLE configuracoes ADD COLUMN IF NOT EXISTS publicidade FLOAT DEFAULT 0"))
-                else:
-                    conn.execute(text("ALTER TABLE configuracoes ADD COLUMN publicidade FLOAT DEFAULT 0"))
-                print("[MIGRATION] Coluna 'publicidade' adicionada em configuracoes")
-        except Exception as e:
-            print(f"[MIGRATION] Erro ao adicionar coluna 'publicidade': {e}")
+# versão do schema: uma linha por migração aplicada (ver migracoes.py)
+schema_version = Table(
+    "schema_version",
+    metadata,
+    Column("versao", Integer, primary_key=True),
+    Column("nome", String(100), nullable=False),
+    Column("aplicada_em", String(50)),
+    Column("duracao_segundos", Float),
+)
+
+migracoes = RegistroMigracoes(engine, schema_version)
+
+# índices dos filtros mais usados pelos relatórios (nome, tabela, colunas);
+# as colunas extras no fim cobrem as somas, evitando ler a tabela
+INDICES_RELATORIOS = [
+    ("ix_vendas_produto_id_data", "vendas", ("produto_id", "data_venda")),
+    ("ix_vendas_lote_importacao", "vendas", ("lote_importacao", "data_venda", "receita_total")),
+    ("ix_finance_data_lancamento", "finance_transactions", ("data_lancamento", "valor")),
+    ("ix_finance_tipo_data", "finance_transactions", ("tipo", "data_lancamento", "valor")),
+    ("ix_finance_lote_importacao", "finance_transactions", ("lote_importacao", "origem", "data_lancamento")),
+]
+
+
+# --------------------------------------------------------------------
+# Migrações (em ordem; nunca altere uma já aplicada, crie a próxima)
+# --------------------------------------------------------------------
+@migracoes.migracao(1, "tabelas_iniciais")
+def _migracao_tabelas_iniciais(conn):
+    metadata.create_all(conn)
+
+
+@migracoes.migracao(2, "colunas_mercado_livre")
+def _migracao_colunas_mercado_livre(conn):
+    adicionar_coluna(conn, "produtos", "publicidade", "FLOAT DEFAULT 0")
+    for coluna, tipo in (
+        ("ml_client_id", "VARCHAR(255)"),
+        ("ml_client_secret", "VARCHAR(255)"),
+        ("ml_access_token", "VARCHAR(500)"),
+        ("ml_refresh_token", "VARCHAR(500)"),
+        ("ml_token_expira", "VARCHAR(50)"),
+        ("ml_user_id", "VARCHAR(100)"),
+        ("ml_sync_auto", "VARCHAR(10)"),
+        ("ml_ultimo_sync", "VARCHAR(50)"),
+    ):
+        tipo_sqlite = "TEXT DEFAULT 'false'" if coluna == "ml_sync_auto" else "TEXT"
+        adicionar_coluna(conn, "configuracoes", coluna, tipo, tipo_sqlite)
+    adicionar_coluna(conn, "vendas", "ml_order_id", "VARCHAR(50)", "TEXT")
+    adicionar_coluna(conn, "vendas", "ml_status", "VARCHAR(50)", "TEXT")
+
+    # índice único para ml_order_id (evita duplicar pedidos do ML)
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS idx_vendas_ml_order_id ON vendas(ml_order_id) WHERE ml_order_id IS NOT NULL"))
+    else:
+        conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS idx_vendas_ml_order_id ON vendas(ml_order_id)"))
+    # localizar vendas já importadas pelo N.º de venda (reimportação)
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_vendas_numero_venda_ml ON vendas(numero_venda_ml)"))
+
+
+@migracoes.migracao(3, "usuarios_papel_ativo_e_admin")
+def _migracao_usuarios(conn):
+    # usuário inicial
+    if not conn.execute(select(usuarios).where(usuarios.c.username == "julio")).first():
+        senha_hash = bcrypt.generate_password_hash("12345").decode("utf-8")
+        conn.execute(usuarios.insert().values(username="julio", password_hash=senha_hash))
+
+    adicionar_coluna(conn, "usuarios", "papel", "VARCHAR(20) DEFAULT 'vendedor'", "TEXT DEFAULT 'vendedor'")
+    adicionar_coluna(conn, "usuarios", "ativo", "BOOLEAN DEFAULT TRUE", "INTEGER DEFAULT 1")
+
+    # garantir que exista um usuário admin
+    if conn.execute(text("SELECT id FROM usuarios WHERE papel='admin' LIMIT 1")).first():
+        return
+    first = conn.execute(text("SELECT id, username FROM usuarios ORDER BY id LIMIT 1")).mappings().first()
+    if first:
+        # promover primeiro usuário a admin
+        conn.execute(text("UPDATE usuarios SET papel='admin' WHERE id = :id"), {"id": first["id"]})
+        print(f"[OK] Usuário {first['username']} promovido a admin")
+    else:
+        # criar usuário admin com senha 'admin' — peça para trocar depois
+        pw_hash = bcrypt.generate_password_hash("admin").decode("utf-8")
+        conn.execute(
+            text("INSERT INTO usuarios (username, password_hash, papel, ativo) VALUES ('admin', :pw, 'admin', :ativo)"),
+            {"pw": pw_hash, "ativo": True},
+        )
+        print("[OK] Usuário 'admin' criado com senha padrão 'admin' — troque a senha imediatamente.")
+
+
+@migracoes.migracao(4, "colunas_vendas_produtos_financeiro")
+def _migracao_colunas_diversas(conn):
+    adicionar_coluna(conn, "vendas", "comissao_ml", "FLOAT DEFAULT 0")
+    adicionar_coluna(conn, "vendas", "estado", "TEXT")
+    adicionar_coluna(conn, "finance_transactions", "lote_importacao", "TEXT")
+    adicionar_coluna(conn, "produtos", "criado_automaticamente", "VARCHAR(10) DEFAULT 'false'")
+    adicionar_coluna(conn, "produtos", "vinculado_a", "INTEGER")
+    # valor numérico de despesa com publicidade
+    adicionar_coluna(conn, "configuracoes", "publicidade", "FLOAT DEFAULT 0")
+
+
+@migracoes.migracao(5, "configuracoes_padrao")
+def _migracao_configuracoes_padrao(conn):
+    # garante 1 linha em configuracoes
+    if not conn.execute(select(configuracoes.c.id).limit(1)).first():
+        conn.execute(insert(configuracoes).values(id=1, imposto_percent=0.0, despesas_percent=0.0))
+
+
+@migracoes.migracao(6, "indice_vendas_data_venda_id")
+def _migracao_indice_vendas_data(conn):
+    # listagem de vendas (ordem/paginação por data_venda, id)
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_vendas_data_venda_id ON vendas (data_venda, id)"))
+
+
+@migracoes.migracao(7, "carga_resumo_vendas")
+def _migracao_carga_resumo_vendas(conn):
+    # resumo diário de vendas: primeira carga a partir das vendas existentes
+    _carregar_resumo_se_vazio(conn)
 
-        # produtos.vinculado_a
-        try:
-            cols = [c["name"] for c in insp.get_columns("produtos")]
-            if "vinculado_a" not in cols:
-                conn.execute(text("ALTER TABLE produtos ADD COLUMN vinculado_a INTEGER"))
-                print("[MIGRATION] Coluna vinculado_a criada")
-        except Exception as e:
-            print(f"[MIGRATION] Erro ao criar vinculado_a: {e}")
+
+@migracoes.migracao(8, "indices_filtros_relatorios")
+def _migracao_indices_filtros(conn):
+    # vendas: data_venda (com ou sem receita_total > 0) já usa ix_vendas_data_venda_id
+    for nome, tabela, colunas in INDICES_RELATORIOS:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {nome} ON {tabela} ({', '.join(colunas)})"))
+
+
+@migracoes.migracao(9, "tabela_ml_anuncios")
+def _migracao_tabela_ml_anuncios(conn):
+    ml_anuncios.create(conn, checkfirst=True)
+
+
+@migracoes.migracao(10, "tabela_ml_estoque_envios")
+def _migracao_tabela_ml_estoque_envios(conn):
+    ml_estoque_envios.create(conn, checkfirst=True)
+
+
+def init_db():
+    """Aplica as migrações pendentes (cria as tabelas num banco novo).
+
+    Com o schema em dia, faz só a leitura de ``schema_version``.
+    """
+    migracoes.aplicar()
 
 
 # --------------------------------------------------------------------
@@ -842,315 +853,620 @@ def normalize_df_uf(df):
 # --------------------------------------------------------------------
 # Importação de vendas do Mercado Livre
 # --------------------------------------------------------------------
-def importar_vendas_ml(caminho_arquivo, engine: Engine):
-    lote_id = datetime.now().isoformat(timespec="seconds")
+# Tamanho dos lotes usados em consultas IN (...) e executemany
+TAMANHO_LOTE_SQL = 500
 
-    df = pd.read_excel(
-        caminho_arquivo,
-        sheet_name="Vendas BR",
-        header=5
-    )
-    if "N.º de venda" not in df.columns:
-        raise ValueError("Planilha não está no formato esperado: coluna 'N.º de venda' não encontrada.")
 
-    print("Colunas encontradas:", list(df.columns))
+def _texto_coluna(df, col):
+    """Equivalente vetorizado de ``str(row.get(col) or "").strip()`` para uma coluna inteira."""
+    if col not in df.columns:
+        return pd.Series("", index=df.index, dtype=object)
+    return df[col].map(lambda v: str(v or "").strip()).astype(object)
 
-    df = df[df["N.º de venda"].notna()]
-    
-    # normaliza coluna UF se existir
-    uf_col, not_rec = normalize_df_uf(df)
-    if uf_col and not_rec:
-        # salva relatório de valores não reconhecidos
-        try:
-            rpt_path = os.path.join(app.config["UPLOAD_FOLDER"], f"uf_not_recognized_settlement_{lote_id}.csv")
-            pd.DataFrame([{'original': o, 'converted': c} for o, c in not_rec]).to_csv(rpt_path, index=False)
-            print(f"Relatório UF não reconhecidos salvo em: {rpt_path}")
-        except Exception:
-            print("Falha ao salvar relatório de UF não reconhecidos.")
 
-    vendas_importadas = 0
-    vendas_sem_sku = 0
-    vendas_sem_produto = 0
-    
-    # Listas para rastrear vendas não importadas
-    vendas_sem_sku_lista = []
-    vendas_sem_produto_lista = []
+def _numero_coluna(df, col):
+    """Converte uma coluna para float (valores inválidos/vazios viram 0.0)."""
+    if col not in df.columns:
+        return pd.Series(0.0, index=df.index)
+    return pd.to_numeric(df[col], errors="coerce").fillna(0.0).astype(float)
 
-    # Criar mapeamento de título -> SKU da própria planilha
-    titulo_para_sku = {}
-    for _, row in df.iterrows():
-        sku_temp = str(row.get("SKU") or "").strip()
-        titulo_temp = str(row.get("Título do anúncio") or "").strip()
-        if sku_temp and titulo_temp and titulo_temp not in titulo_para_sku:
-            titulo_para_sku[titulo_temp] = sku_temp
 
-    with engine.begin() as conn:
-        for _, row in df.iterrows():
-            sku = str(row.get("SKU") or "").strip()
-            titulo = str(row.get("Título do anúncio") or "").strip()
-            numero_venda = str(row.get("N.º de venda") or "")
+def _mapear_unicos(serie, func):
+    """Aplica ``func`` apenas uma vez por valor distinto da série (nulos viram None)."""
+    codigos, unicos = pd.factorize(serie)
+    valores = [func(u) for u in unicos] + [None]
+    return pd.Series(
+        np.array(valores, dtype=object)[codigos],
+        index=serie.index,
+        dtype=object,
+    )
 
-            # Se não tiver SKU mas tiver título, busca SKU de outra linha com mesmo título
-            if not sku and titulo and titulo in titulo_para_sku:
-                sku = titulo_para_sku[titulo]
-                print(f"[AUTO-PREENCHIMENTO] SKU '{sku}' encontrado para título '{titulo[:50]}...'")
 
-            produto_row = None
+def _data_venda_iso(valor):
+    dt = parse_data_venda(valor)
+    return dt.isoformat() if dt else None
 
-            if sku:
-                produto_row = conn.execute(
-                    select(produtos.c.id, produtos.c.custo_unitario)
-                    .where(produtos.c.sku == sku)
-                ).mappings().first()
-            else:
-                # tenta pelo nome do produto = título do anúncio
-                if titulo:
-                    produto_row = conn.execute(
-                        select(produtos.c.id, produtos.c.custo_unitario)
-                        .where(produtos.c.nome == titulo)
-                    ).mappings().first()
 
-            if not sku and not produto_row:
-                vendas_sem_sku += 1
-                vendas_sem_sku_lista.append({
-                    "numero_venda": numero_venda,
-                    "titulo": titulo if titulo else "(sem título)",
-                    "sku": "(vazio)"
-                })
-                continue
+def _em_lotes(itens, tamanho=TAMANHO_LOTE_SQL):
+    itens = list(itens)
+    for i in range(0, len(itens), tamanho):
+        yield itens[i:i + tamanho]
 
-            if not produto_row:
-                vendas_sem_produto += 1
-                vendas_sem_produto_lista.append({
-                    "numero_venda": numero_venda,
-                    "titulo": titulo if titulo else "(sem título)",
-                    "sku": sku if sku else "(vazio)"
-                })
-                continue
 
-            produto_id = produto_row["id"]
-            custo_unitario = float(produto_row["custo_unitario"] or 0.0)
+def _carregar_mapas_produtos(conn):
+    """Carrega numa única consulta os mapas id -> produto, SKU -> id e nome -> id."""
+    rows = conn.execute(
+        select(
+            produtos.c.id,
+            produtos.c.sku,
+            produtos.c.nome,
+            produtos.c.custo_unitario,
+            produtos.c.preco_venda_sugerido,
+        ).order_by(produtos.c.id)
+    ).mappings().all()
+
+    por_id = {}
+    por_sku = {}
+    por_nome = {}
+    for r in rows:
+        por_id[r["id"]] = r
+        if r["sku"] is not None:
+            por_sku.setdefault(r["sku"], r["id"])
+        por_nome.setdefault(r["nome"], r["id"])
+    return por_id, por_sku, por_nome
 
-            data_venda_raw = row.get("Data da venda")
-            data_venda = parse_data_venda(data_venda_raw)
-            unidades = row.get("Unidades")
-            try:
-                unidades = int(unidades) if unidades == unidades else 0
-            except Exception:
-                unidades = 0
 
-            # Receita Bruta = Receita por produtos (BRL)
-            receita_bruta = row.get("Receita por produtos (BRL)")
-            try:
-                receita_total = float(receita_bruta) if receita_bruta == receita_bruta else 0.0
-            except Exception:
-                receita_total = 0.0
-            
-            # Verificar se a venda está cancelada por outras colunas (Status, etc)
-            status_venda = str(row.get("Status") or "").strip().lower()
-            status_envio = str(row.get("Status do envio") or "").strip().lower()
-            
-            # Considerar cancelada se:
-            # 1. Receita <= 0
-            # 2. Status contém "cancelad" ou "cancelled"
-            # 3. Status de envio é "not_specified" com receita zero ou negativa
-            venda_cancelada = (
-                receita_total <= 0 or 
-                "cancelad" in status_venda or 
-                "cancelled" in status_venda or
-                (status_envio == "not_specified" and receita_total <= 0)
-            )
-            
-            if venda_cancelada and receita_total != 0:
-                print(f"[CANCELADA POR STATUS] Venda {row.get('N.º de venda')} - Status: {status_venda} - Receita: R$ {receita_total}")
-                receita_total = 0.0  # Forçar receita zero para vendas canceladas
+def _mapa_titulo_sku(df):
+    """Primeiro SKU informado para cada título de anúncio (linhas com os dois preenchidos)."""
+    sku = _texto_coluna(df, "SKU")
+    titulo = _texto_coluna(df, "Título do anúncio")
+    com_ambos = (sku != "") & (titulo != "")
+    titulo_para_sku = pd.Series(sku[com_ambos].values, index=titulo[com_ambos].values)
+    return titulo_para_sku[~titulo_para_sku.index.duplicated()]
 
-            # Captura Preço unitário para vendas canceladas
-            preco_unitario = row.get("Preço")
-            try:
-                preco_unit = float(preco_unitario) if preco_unitario == preco_unitario else 0.0
-            except Exception:
-                preco_unit = 0.0
-            
-            # Determinar o preço médio de venda
-            if receita_total > 0:
-                # Venda normal, calcula pela receita
-                preco_medio_venda = receita_total / unidades if unidades > 0 else 0.0
-            elif preco_unit > 0 and unidades > 0:
-                # Venda cancelada: usa coluna "Preço" (valor unitário original)
-                preco_medio_venda = preco_unit
-                print(f"[VENDA CANCELADA] Usando Preço unitário: R$ {preco_unit} x {unidades} = R$ {preco_unit * unidades}")
-            else:
-                # Busca preço de venda sugerido do produto
-                preco_sugerido = conn.execute(
-                    select(produtos.c.preco_venda_sugerido)
-                    .where(produtos.c.id == produto_id)
-                ).scalar()
-                preco_medio_venda = float(preco_sugerido or 0.0)
-                if receita_total == 0:
-                    print(f"[VENDA CANCELADA] Usando preço sugerido: R$ {preco_medio_venda}")
 
-            # Comissão Mercado Livre a partir da coluna 'Tarifa de venda e impostos (BRL)'
-            tarifa = row.get("Tarifa de venda e impostos (BRL)")
-            try:
-                comissao_ml = float(tarifa) if tarifa == tarifa else 0.0
-            except Exception:
-                comissao_ml = 0.0
-            if comissao_ml < 0:
-                comissao_ml = -comissao_ml
-
-            # Receita Líquida = Receita por produtos (BRL) - Tarifa de venda e impostos (BRL)
-            receita_liquida = receita_total - comissao_ml
-            custo_total = custo_unitario * unidades
-            margem_contribuicao = receita_liquida - custo_total
-            numero_venda_ml = str(row.get("N.º de venda"))
-            estado = None
-            
-            # Procurar coluna de estado/UF de forma mais flexível (case-insensitive)
-            col_estado = None
-            for col in df.columns:
-                col_lower = str(col).lower().strip()
-                if any(term in col_lower for term in ["estado", "uf", "state", "state do cliente", "estado do comprador"]):
-                    col_estado = col
-                    break
-            
-            if col_estado and row.get(col_estado):
-                estado_raw = row.get(col_estado)
-                sigla = normalize_uf(estado_raw)
-                if sigla and isinstance(sigla, str) and len(sigla) == 2:
-                    estado = sigla
-                # Se não conseguiu, não há fallback - deixa None
+def _preparar_vendas_ml(df, por_id, por_sku, por_nome, titulo_para_sku=None):
+    """Resolve produtos e calcula todas as colunas derivadas das vendas de uma vez.
 
-            conn.execute(
-                insert(vendas).values(
-                    produto_id=produto_id,
-                    data_venda=data_venda.isoformat() if data_venda else None,
-                    quantidade=unidades,
-                    preco_venda_unitario=preco_medio_venda,
-                    receita_total=receita_total,
-                    comissao_ml=comissao_ml,
-                    custo_total=custo_total,
-                    margem_contribuicao=margem_contribuicao,
-                    origem="Mercado Livre",
-                    numero_venda_ml=numero_venda_ml,
-                    lote_importacao=lote_id,
-                    estado=estado,
-                )
-            )
+    ``titulo_para_sku`` (título -> SKU) permite usar o mapa do arquivo inteiro
+    quando ``df`` é só um bloco; se omitido, é montado a partir do próprio ``df``.
 
-            # --- Insere lançamento financeiro no caixa Mercado Pago (valor líquido) ---
-            try:
-                external_id = str(numero_venda_ml) if numero_venda_ml else None
-                already = None
-                if external_id:
-                    already = conn.execute(
-                        select(finance_transactions.c.id)
-                        .where(finance_transactions.c.external_id_mp == external_id)
-                        .where(finance_transactions.c.tipo == 'MP_NET')
-                    ).mappings().first()
+    Retorna (vendas_ok, sem_sku, sem_produto): ``vendas_ok`` é um DataFrame com
+    as colunas já no formato da tabela ``vendas``; os outros dois são DataFrames
+    com numero_venda/titulo/sku das linhas que não puderam ser importadas.
+    """
+    sku = _texto_coluna(df, "SKU")
+    titulo = _texto_coluna(df, "Título do anúncio")
+
+    # Se não tiver SKU mas tiver título, usa o SKU de outra linha com mesmo título
+    if titulo_para_sku is None:
+        titulo_para_sku = _mapa_titulo_sku(df)
+    sku_preenchido = titulo.map(titulo_para_sku)
+    auto = (sku == "") & sku_preenchido.notna()
+    if auto.any():
+        print(f"[AUTO-PREENCHIMENTO] SKU encontrado pelo título em {int(auto.sum())} vendas")
+    sku = sku.mask(auto, sku_preenchido)
+
+    # Busca do produto: pelo SKU ou, sem SKU, pelo nome = título do anúncio
+    produto_id = sku.map(por_sku).where(sku != "", titulo.map(por_nome).where(titulo != ""))
+
+    sem_produto_mask = produto_id.isna()
+    sem_sku_mask = sem_produto_mask & (sku == "")
+    numero_venda = df["N.º de venda"].map(lambda v: str(v or ""))
+    pendentes = pd.DataFrame({
+        "numero_venda": numero_venda,
+        "titulo": titulo.mask(titulo == "", "(sem título)"),
+        "sku": sku.mask(sku == "", "(vazio)"),
+    })
+    sem_sku = pendentes[sem_sku_mask]
+    sem_produto = pendentes[sem_produto_mask & ~sem_sku_mask]
 
-                if not already:
-                    # Usar receita_liquida já calculada (Receita por produtos - Tarifa)
-                    conn.execute(
-                        insert(finance_transactions).values(
-                            data_lancamento=(data_venda.isoformat() if data_venda else None),
-                            tipo="MP_NET",
-                            valor=receita_liquida,
-                            origem="mercado_pago",
-                            external_id_mp=external_id,
-                            descricao=f"Venda ML {external_id}",
-                            criado_em=datetime.now().isoformat(timespec="seconds"),
-                            lote_importacao=lote_id,
-                        )
-                    )
-            except Exception as e:
-                print(f"Erro ao inserir transação financeira para venda {numero_venda_ml}: {e}")
+    ok = ~sem_produto_mask
+    df = df[ok]
+    produto_id = produto_id[ok].astype(int)
 
-            # Só deduz estoque se a venda NÃO for cancelada (receita_total > 0)
-            if receita_total > 0:
-                conn.execute(
-                    update(produtos)
-                    .where(produtos.c.id == produto_id)
-                    .values(estoque_atual=produtos.c.estoque_atual - unidades)
-                )
-            else:
-                print(f"[VENDA CANCELADA] Venda {numero_venda_ml} com receita R$ 0 - ESTOQUE NÃO DEDUZIDO")
+    custo_unitario = produto_id.map({pid: float(r["custo_unitario"] or 0.0) for pid, r in por_id.items()})
+    preco_sugerido = produto_id.map({pid: float(r["preco_venda_sugerido"] or 0.0) for pid, r in por_id.items()})
 
-            vendas_importadas += 1
+    if "Data da venda" in df.columns:
+        data_venda = _mapear_unicos(df["Data da venda"], _data_venda_iso)
+    else:
+        data_venda = pd.Series(None, index=df.index, dtype=object)
+
+    unidades = _numero_coluna(df, "Unidades").astype(int)
+    receita_total = _numero_coluna(df, "Receita por produtos (BRL)")
+
+    # Considerar cancelada se:
+    # 1. Receita <= 0
+    # 2. Status contém "cancelad" ou "cancelled"
+    # 3. Status de envio é "not_specified" com receita zero ou negativa
+    status_venda = _texto_coluna(df, "Status").str.lower()
+    status_envio = _texto_coluna(df, "Status do envio").str.lower()
+    venda_cancelada = (
+        (receita_total <= 0)
+        | status_venda.str.contains("cancelad", regex=False)
+        | status_venda.str.contains("cancelled", regex=False)
+        | ((status_envio == "not_specified") & (receita_total <= 0))
+    )
+    canceladas_com_receita = venda_cancelada & (receita_total != 0)
+    if canceladas_com_receita.any():
+        print(f"[CANCELADA POR STATUS] {int(canceladas_com_receita.sum())} vendas com receita zerada pelo status")
+    receita_total = receita_total.mask(venda_cancelada, 0.0)
+
+    # linhas da API (sincronização/notificações): o status real do ML, o do envio
+    # enquanto o pedido está pago; as da planilha ficam paid/cancelled
+    ml_status = np.where(
+        venda_cancelada,
+        "cancelled",
+        np.where(
+            (status_venda == "paid") & status_envio.isin(STATUS_ENVIO),
+            status_envio,
+            np.where(status_venda.isin(STATUS_PEDIDO), status_venda, "paid"),
+        ),
+    )
 
-    # Salvar relatório de vendas não importadas em Excel
-    relatorio_filename = None
-    if vendas_sem_sku_lista or vendas_sem_produto_lista:
-        dados_relatorio = []
-
-        # Adicionar vendas sem SKU
-        for v in vendas_sem_sku_lista:
-            dados_relatorio.append({
-                "Tipo": "Sem SKU/Título",
-                "N° da Venda": v['numero_venda'],
-                "Título do Produto": v['titulo'],
-                "SKU": v['sku'],
-                "Ação Necessária": "Cadastrar produto ou adicionar SKU na planilha"
-            })
-
-        # Adicionar vendas sem produto cadastrado
-        for v in vendas_sem_produto_lista:
-            dados_relatorio.append({
-                "Tipo": "Produto não cadastrado",
-                "N° da Venda": v['numero_venda'],
-                "Título do Produto": v['titulo'],
-                "SKU": v['sku'],
-                "Ação Necessária": "Cadastrar produto com este SKU no sistema"
-            })
-        
-        # Salvar em Excel
-        try:
-            relatorio_filename = f"vendas_nao_importadas_{lote_id.replace(':', '-')}.xlsx"
-            relatorio_path = os.path.join(app.config["UPLOAD_FOLDER"], relatorio_filename)
-            df_relatorio = pd.DataFrame(dados_relatorio)
-            df_relatorio.to_excel(relatorio_path, index=False, engine='openpyxl')
-            print(f"\n📋 Relatório Excel de vendas não importadas salvo em: {relatorio_path}")
-        except Exception as e:
-            print(f"Erro ao salvar relatório: {e}")
-            relatorio_filename = None
+    # Preço médio: receita/unidades; cancelada usa "Preço" (unitário original) ou preço sugerido
+    preco_unit = _numero_coluna(df, "Preço")
+    com_unidades = unidades > 0
+    preco_medio_venda = np.where(
+        receita_total > 0,
+        np.where(com_unidades, receita_total / unidades.where(com_unidades, 1), 0.0),
+        np.where((preco_unit > 0) & com_unidades, preco_unit, preco_sugerido),
+    )
 
-    return {
-        "lote_id": lote_id,
-        "vendas_importadas": vendas_importadas,
-        "vendas_sem_sku": vendas_sem_sku,
-        "vendas_sem_produto": vendas_sem_produto,
-        "relatorio_gerado": bool(vendas_sem_sku_lista or vendas_sem_produto_lista),
-        "relatorio_filename": relatorio_filename,
-    }
+    # Comissão Mercado Livre a partir da coluna 'Tarifa de venda e impostos (BRL)'
+    comissao_ml = _numero_coluna(df, "Tarifa de venda e impostos (BRL)").abs()
 
+    # Receita Líquida = Receita por produtos (BRL) - Tarifa de venda e impostos (BRL)
+    receita_liquida = receita_total - comissao_ml
+    custo_total = custo_unitario * unidades
+    margem_contribuicao = receita_liquida - custo_total
 
-# --------------------------------------------------------------------
-# Importação de produtos via Excel
-# --------------------------------------------------------------------
-def importar_produtos_excel(caminho_arquivo, engine: Engine):
-    df = pd.read_excel(caminho_arquivo, header=0)  # assume header in first row
+    # Procurar coluna de estado/UF de forma mais flexível (case-insensitive)
+    col_estado = None
+    for col in df.columns:
+        col_lower = str(col).lower().strip()
+        if any(term in col_lower for term in ["estado", "uf", "state", "state do cliente", "estado do comprador"]):
+            col_estado = col
+            break
 
-    # normaliza coluna UF se houver (algumas planilhas de produtos podem conter UF)
-    try:
-        uf_col, not_rec = normalize_df_uf(df)
-        if uf_col and not_rec:
-            rpt = str(caminho_arquivo).replace('.xlsx', '_uf_not_recognized.csv')
-            pd.DataFrame([{'original': o, 'converted': c} for o, c in not_rec]).to_csv(rpt, index=False)
-            print(f"Relatório UF não reconhecidos salvo em: {rpt}")
-    except Exception:
-        pass
+    if col_estado:
+        def _sigla(valor):
+            sigla = normalize_uf(valor) if valor else None
+            return sigla if sigla and isinstance(sigla, str) and len(sigla) == 2 else None
+        estado = _mapear_unicos(df[col_estado], _sigla)
+    else:
+        estado = pd.Series(None, index=df.index, dtype=object)
+
+    vendas_ok = pd.DataFrame({
+        "produto_id": produto_id,
+        "data_venda": data_venda,
+        "quantidade": unidades,
+        "preco_venda_unitario": preco_medio_venda,
+        "receita_total": receita_total,
+        "comissao_ml": comissao_ml,
+        "custo_total": custo_total,
+        "margem_contribuicao": margem_contribuicao,
+        "receita_liquida": receita_liquida,
+        "numero_venda_ml": df["N.º de venda"].map(str),
+        "estado": estado,
+        "ml_status": ml_status,
+    }, index=df.index)
+    return vendas_ok, sem_sku, sem_produto
+
+
+def _registros(df, colunas):
+    """Converte colunas de um DataFrame em lista de dicts com tipos nativos do Python."""
+    valores = [df[c].astype(object).where(df[c].notna(), None).tolist() for c in colunas]
+    return [dict(zip(colunas, linha)) for linha in zip(*valores)]
+
+
+def _gravar_vendas_ml(conn, vendas_ok, lote_id, chave_ml=False):
+    """Grava vendas, lançamentos MP_NET e baixa de estoque com executemany em lote.
+
+    Com ``chave_ml=True`` o N.º de venda também é gravado em ``ml_order_id``,
+    que tem índice único e é a chave usada na reimportação.
+    """
+    if vendas_ok.empty:
+        return
+
+    registros_vendas = _registros(
+        vendas_ok,
+        ["produto_id", "data_venda", "quantidade", "preco_venda_unitario", "receita_total",
+         "comissao_ml", "custo_total", "margem_contribuicao", "numero_venda_ml", "estado",
+         "ml_status"],
+    )
+    for r in registros_vendas:
+        r["origem"] = "Mercado Livre"
+        r["lote_importacao"] = lote_id
+        if chave_ml:
+            r["ml_order_id"] = r["numero_venda_ml"]
+    id_antes = conn.execute(select(func.coalesce(func.max(vendas.c.id), 0))).scalar_one()
+    for lote in _em_lotes(registros_vendas):
+        conn.execute(insert(vendas), lote)
+    resumo_vendas.somar(conn, vendas.c.id > id_antes, vendas.c.lote_importacao == lote_id)
+
+    # --- Lançamentos financeiros no caixa Mercado Pago (valor líquido) ---
+    fin = vendas_ok[vendas_ok["numero_venda_ml"] != ""].drop_duplicates("numero_venda_ml")
+    existentes = set()
+    for lote in _em_lotes(fin["numero_venda_ml"].tolist()):
+        existentes.update(
+            conn.execute(
+                select(finance_transactions.c.external_id_mp)
+                .where(finance_transactions.c.external_id_mp.in_(lote))
+            ).scalars()
+        )
+    fin = fin[~fin["numero_venda_ml"].isin(existentes)]
+    sem_data = fin["data_venda"].isna()
+    if sem_data.any():
+        print(f"Erro ao inserir transação financeira: {int(sem_data.sum())} vendas sem data ignoradas")
+        fin = fin[~sem_data]
+
+    criado_em = datetime.now().isoformat(timespec="seconds")
+    registros_fin = [
+        {
+            "data_lancamento": r["data_venda"],
+            "tipo": "MP_NET",
+            "valor": r["receita_liquida"],
+            "origem": "mercado_pago",
+            "external_id_mp": r["numero_venda_ml"],
+            "descricao": f"Venda ML {r['numero_venda_ml']}",
+            "criado_em": criado_em,
+            "lote_importacao": lote_id,
+        }
+        for r in _registros(fin, ["data_venda", "receita_liquida", "numero_venda_ml"])
+    ]
+    for lote in _em_lotes(registros_fin):
+        conn.execute(insert(finance_transactions), lote)
 
-    if "SKU" not in df.columns:
-        raise ValueError("Planilha deve ter uma coluna 'SKU'.")
+    # Só deduz estoque das vendas NÃO canceladas (receita_total > 0): um UPDATE por produto
+    baixas = (
+        vendas_ok[vendas_ok["receita_total"] > 0]
+        .groupby("produto_id")["quantidade"].sum()
+    )
+    canceladas = int((vendas_ok["receita_total"] <= 0).sum())
+    if canceladas:
+        print(f"[VENDA CANCELADA] {canceladas} vendas com receita R$ 0 - ESTOQUE NÃO DEDUZIDO")
+    if not baixas.empty:
+        conn.execute(
+            update(produtos)
+            .where(produtos.c.id == bindparam("b_produto_id"))
+            .values(estoque_atual=produtos.c.estoque_atual - bindparam("b_quantidade")),
+            [{"b_produto_id": int(pid), "b_quantidade": int(qtd)} for pid, qtd in baixas.items()],
+        )
 
-    produtos_importados = 0
-    produtos_atualizados = 0
-    erros = []
 
-    with engine.begin() as conn:
-        for _, row in df.iterrows():
-            sku = str(row.get("SKU") or "").strip()
-            if not sku:
+def _separar_vendas_existentes(conn, vendas_ok):
+    """Divide as vendas da planilha em novas e já importadas.
+
+    Uma consulta indexada (ml_order_id / numero_venda_ml) por lote de chaves.
+    Retorna (novas, existentes); ``existentes`` traz as colunas atuais do banco
+    com sufixo ``_atual``.
+    """
+    chaves = vendas_ok["numero_venda_ml"].tolist()
+    atuais = []
+    for lote in _em_lotes(chaves):
+        atuais.extend(
+            conn.execute(
+                select(
+                    vendas.c.id,
+                    vendas.c.numero_venda_ml,
+                    vendas.c.ml_order_id,
+                    vendas.c.produto_id,
+                    vendas.c.quantidade,
+                    vendas.c.receita_total,
+                    vendas.c.comissao_ml,
+                    vendas.c.custo_total,
+                    vendas.c.ml_status,
+                )
+                .where(or_(vendas.c.ml_order_id.in_(lote), vendas.c.numero_venda_ml.in_(lote)))
+                .order_by(vendas.c.id)
+            ).mappings().all()
+        )
+
+    if not atuais:
+        return vendas_ok, vendas_ok.iloc[0:0]
+
+    df_atuais = pd.DataFrame(atuais)
+    df_atuais["chave"] = df_atuais["ml_order_id"].fillna(df_atuais["numero_venda_ml"])
+    # vendas duplicadas por importações antigas: a primeira (menor id) é a referência
+    df_atuais["tem_chave_ml"] = df_atuais.groupby("chave")["ml_order_id"].transform(lambda s: s.notna().any())
+    df_atuais = df_atuais.drop_duplicates("chave").set_index("chave").add_suffix("_atual")
+
+    ja_importada = vendas_ok["numero_venda_ml"].isin(df_atuais.index)
+    existentes = vendas_ok[ja_importada].join(df_atuais, on="numero_venda_ml")
+    return vendas_ok[~ja_importada], existentes
+
+
+def _atualizar_vendas_existentes(conn, existentes):
+    """Atualiza status/valores das vendas que mudaram e ajusta o estoque só pela diferença.
+
+    Retorna o número de vendas atualizadas.
+    """
+    if existentes.empty:
+        return 0
+
+    status_atual = existentes["ml_status_atual"].where(
+        existentes["ml_status_atual"].notna(),
+        np.where(existentes["receita_total_atual"] > 0, "paid", "cancelled"),
+    )
+    mudou = (
+        (existentes["ml_status"] != status_atual)
+        # vendas antigas (modo inserir) ganham a chave ml_order_id
+        | ~existentes["tem_chave_ml_atual"].astype(bool)
+        | ((existentes["receita_total"] - existentes["receita_total_atual"]).abs() > 0.005)
+        | ((existentes["comissao_ml"] - existentes["comissao_ml_atual"].fillna(0)).abs() > 0.005)
+    )
+    alteradas = existentes[mudou].copy()
+    if alteradas.empty:
+        return 0
+
+    # mantém quantidade e custo originais; recalcula a margem com os novos valores
+    alteradas["margem_nova"] = (
+        alteradas["receita_total"] - alteradas["comissao_ml"] - alteradas["custo_total_atual"].fillna(0)
+    )
+    ids_alterados = [int(i) for i in alteradas["id_atual"]]
+    for lote in _em_lotes(ids_alterados):
+        resumo_vendas.subtrair(conn, vendas.c.id.in_(lote))
+    conn.execute(
+        update(vendas)
+        .where(vendas.c.id == bindparam("b_id"))
+        .values(
+            receita_total=bindparam("b_receita"),
+            comissao_ml=bindparam("b_comissao"),
+            preco_venda_unitario=bindparam("b_preco"),
+            margem_contribuicao=bindparam("b_margem"),
+            ml_status=bindparam("b_status"),
+            ml_order_id=bindparam("b_order_id"),
+        ),
+        [
+            {
+                "b_id": r["id_atual"],
+                "b_receita": r["receita_total"],
+                "b_comissao": r["comissao_ml"],
+                "b_preco": r["preco_venda_unitario"],
+                "b_margem": r["margem_nova"],
+                "b_status": r["ml_status"],
+                "b_order_id": r["ml_order_id_atual"] if r["tem_chave_ml_atual"] else r["numero_venda_ml"],
+            }
+            for r in _registros(
+                alteradas,
+                ["id_atual", "receita_total", "comissao_ml", "preco_venda_unitario", "margem_nova",
+                 "ml_status", "ml_order_id_atual", "tem_chave_ml_atual", "numero_venda_ml"],
+            )
+        ],
+    )
+    for lote in _em_lotes(ids_alterados):
+        resumo_vendas.somar(conn, vendas.c.id.in_(lote))
+
+    # lançamento MP_NET acompanha a nova receita líquida
+    conn.execute(
+        update(finance_transactions)
+        .where(finance_transactions.c.external_id_mp == bindparam("b_external_id"))
+        .where(finance_transactions.c.tipo == "MP_NET")
+        .values(valor=bindparam("b_valor")),
+        [
+            {"b_external_id": r["numero_venda_ml"], "b_valor": r["receita_liquida"]}
+            for r in _registros(alteradas, ["numero_venda_ml", "receita_liquida"])
+        ],
+    )
+
+    # estoque: só a diferença entre a baixa já feita e a baixa devida agora
+    baixa_anterior = alteradas["quantidade_atual"].where(alteradas["receita_total_atual"] > 0, 0)
+    baixa_nova = alteradas["quantidade_atual"].where(alteradas["receita_total"] > 0, 0)
+    delta = (baixa_nova - baixa_anterior).groupby(alteradas["produto_id_atual"]).sum()
+    delta = delta[delta != 0]
+    if not delta.empty:
+        conn.execute(
+            update(produtos)
+            .where(produtos.c.id == bindparam("b_produto_id"))
+            .values(estoque_atual=produtos.c.estoque_atual - bindparam("b_quantidade")),
+            [{"b_produto_id": int(pid), "b_quantidade": int(qtd)} for pid, qtd in delta.items()],
+        )
+
+    print(f"[REIMPORTAÇÃO] {len(alteradas)} vendas atualizadas, ajuste de estoque em {len(delta)} produtos")
+    return len(alteradas)
+
+
+def _blocos_vendas_ml(caminho_arquivo, tamanho_bloco, titulo_para_sku):
+    """Lê a aba "Vendas BR" em blocos, alimentando o mapa título -> SKU.
+
+    Linhas sem SKU cujo título ainda não apareceu com SKU ficam para o fim: o
+    SKU pode estar numa linha de um bloco posterior. Assim o auto-preenchimento
+    continua valendo para o arquivo inteiro com uma única leitura.
+    """
+    adiadas = []
+    for df in ler_excel_em_blocos(caminho_arquivo, sheet_name="Vendas BR", header=5, tamanho_bloco=tamanho_bloco):
+        df = df[df["N.º de venda"].notna()]
+        for titulo, sku in _mapa_titulo_sku(df).items():
+            titulo_para_sku.setdefault(titulo, sku)
+
+        sku = _texto_coluna(df, "SKU")
+        titulo = _texto_coluna(df, "Título do anúncio")
+        adiar = (sku == "") & (titulo != "") & ~titulo.isin(titulo_para_sku.keys())
+        if adiar.any():
+            adiadas.append(df[adiar])
+            df = df[~adiar]
+        yield df
+
+    if adiadas:
+        yield pd.concat(adiadas)
+
+
+def _totais_vendas_ml():
+    return {
+        "importadas": 0,
+        "atualizadas": 0,
+        "inalteradas": 0,
+        "sem_sku": [],
+        "sem_produto": [],
+        "duplicadas": [],  # N.º de venda repetido no arquivo (modo atualizar)
+        "nao_reconhecidos": [],
+        "vistas": set(),  # N.º de venda já tratados em blocos anteriores (modo atualizar)
+    }
+
+
+def _importar_bloco_vendas_ml(engine, df, lote_id, modo, mapas, titulo_para_sku, totais):
+    """Grava um bloco com as colunas da aba "Vendas BR" numa transação.
+
+    Usado pela importação da planilha e pela sincronização com a API do ML;
+    as contagens e listas de pendências são acumuladas em ``totais``.
+    """
+    por_id, por_sku, por_nome = mapas
+
+    # normaliza coluna UF se existir
+    uf_col, not_rec = normalize_df_uf(df)
+    if uf_col:
+        totais["nao_reconhecidos"].extend(not_rec)
+
+    with engine.begin() as conn:
+        vendas_ok, sem_sku, sem_produto = _preparar_vendas_ml(df, por_id, por_sku, por_nome, titulo_para_sku)
+        if modo == 'atualizar':
+            # só a primeira linha de cada N.º de venda vale; as outras vão para o relatório
+            vistas = totais["vistas"]
+            numero = vendas_ok["numero_venda_ml"]
+            repetidas = numero.isin(vistas) | numero.duplicated()
+            unicas = vendas_ok[~repetidas]
+            novas, existentes = _separar_vendas_existentes(conn, unicas)
+            atualizadas = _atualizar_vendas_existentes(conn, existentes)
+            totais["atualizadas"] += atualizadas
+            totais["inalteradas"] += len(unicas) - len(novas) - atualizadas
+            linhas = repetidas.index[repetidas]
+            titulo = _texto_coluna(df, "Título do anúncio")[linhas]
+            sku = _texto_coluna(df, "SKU")[linhas]
+            totais["duplicadas"].extend(pd.DataFrame({
+                "numero_venda": numero[linhas],
+                "titulo": titulo.mask(titulo == "", "(sem título)"),
+                "sku": sku.mask(sku == "", "(vazio)"),
+            }).to_dict("records"))
+            vistas.update(unicas["numero_venda_ml"])
+            vendas_ok = novas
+        _gravar_vendas_ml(conn, vendas_ok, lote_id, chave_ml=(modo == 'atualizar'))
+
+    totais["importadas"] += len(vendas_ok)
+    totais["sem_sku"].extend(sem_sku.to_dict("records"))
+    totais["sem_produto"].extend(sem_produto.to_dict("records"))
+
+
+def importar_vendas_ml(caminho_arquivo, engine: Engine, modo='inserir', tamanho_bloco=TAMANHO_BLOCO_PADRAO):
+    """
+    Importa a aba "Vendas BR" exportada do Mercado Livre.
+
+    modo: 'inserir' = grava todas as linhas num novo lote |
+          'atualizar' = só insere vendas novas e atualiza as já importadas (N.º de venda)
+
+    A planilha é lida e gravada em blocos de ``tamanho_bloco`` linhas, cada um
+    na sua própria transação.
+    """
+    lote_id = datetime.now().isoformat(timespec="seconds")
+
+    colunas = colunas_excel(caminho_arquivo, sheet_name="Vendas BR", header=5)
+    if "N.º de venda" not in colunas:
+        raise ValueError("Planilha não está no formato esperado: coluna 'N.º de venda' não encontrada.")
+
+    print("Colunas encontradas:", colunas)
+
+    with engine.connect() as conn:
+        por_id, por_sku, por_nome = _carregar_mapas_produtos(conn)
+
+    totais = _totais_vendas_ml()
+    titulo_para_sku = {}
+    linhas = 0
+
+    for df in _blocos_vendas_ml(caminho_arquivo, tamanho_bloco, titulo_para_sku):
+        linhas += len(df)
+        _importar_bloco_vendas_ml(engine, df, lote_id, modo, (por_id, por_sku, por_nome), titulo_para_sku, totais)
+        registrar_progresso(linhas)
+
+    vendas_sem_sku_lista = totais["sem_sku"]
+    vendas_sem_produto_lista = totais["sem_produto"]
+    vendas_duplicadas_lista = totais["duplicadas"]
+    nao_reconhecidos = totais["nao_reconhecidos"]
+
+    if nao_reconhecidos:
+        # salva relatório de valores não reconhecidos
+        try:
+            rpt_path = os.path.join(app.config["UPLOAD_FOLDER"], f"uf_not_recognized_settlement_{lote_id}.csv")
+            pd.DataFrame([{'original': o, 'converted': c} for o, c in nao_reconhecidos]).to_csv(rpt_path, index=False)
+            print(f"Relatório UF não reconhecidos salvo em: {rpt_path}")
+        except Exception:
+            print("Falha ao salvar relatório de UF não reconhecidos.")
+
+    vendas_sem_sku = len(vendas_sem_sku_lista)
+    vendas_sem_produto = len(vendas_sem_produto_lista)
+
+    # Salvar relatório de vendas não importadas em Excel
+    relatorio_filename = None
+    relatorio_gerado = bool(vendas_sem_sku_lista or vendas_sem_produto_lista or vendas_duplicadas_lista)
+    if relatorio_gerado:
+        acoes = (
+            ("Sem SKU/Título", vendas_sem_sku_lista, "Cadastrar produto ou adicionar SKU na planilha"),
+            ("Produto não cadastrado", vendas_sem_produto_lista, "Cadastrar produto com este SKU no sistema"),
+            ("N.º de venda repetido", vendas_duplicadas_lista,
+             "Conferir a planilha: só a primeira linha deste N.º de venda foi importada"),
+        )
+        linhas_relatorio = (
+            (tipo, v['numero_venda'], v['titulo'], v['sku'], acao)
+            for tipo, lista, acao in acoes
+            for v in lista
+        )
+
+        # Salvar em Excel (write-only, linha a linha)
+        try:
+            relatorio_filename = f"vendas_nao_importadas_{lote_id.replace(':', '-')}.xlsx"
+            relatorio_path = os.path.join(app.config["UPLOAD_FOLDER"], relatorio_filename)
+            escrever_xlsx(
+                relatorio_path,
+                ["Tipo", "N° da Venda", "Título do Produto", "SKU", "Ação Necessária"],
+                linhas_relatorio,
+            )
+            print(f"\n📋 Relatório Excel de vendas não importadas salvo em: {relatorio_path}")
+        except Exception as e:
+            print(f"Erro ao salvar relatório: {e}")
+            relatorio_filename = None
+
+    return {
+        "lote_id": lote_id,
+        "vendas_importadas": totais["importadas"],
+        "vendas_sem_sku": vendas_sem_sku,
+        "vendas_sem_produto": vendas_sem_produto,
+        "vendas_atualizadas": totais["atualizadas"],
+        "vendas_inalteradas": totais["inalteradas"],
+        "vendas_duplicadas": len(vendas_duplicadas_lista),
+        "relatorio_gerado": relatorio_gerado,
+        "relatorio_filename": relatorio_filename,
+    }
+
+
+# --------------------------------------------------------------------
+# Importação de produtos via Excel
+# --------------------------------------------------------------------
+def importar_produtos_excel(caminho_arquivo, engine: Engine):
+    df = pd.read_excel(caminho_arquivo, header=0)  # assume header in first row
+
+    # normaliza coluna UF se houver (algumas planilhas de produtos podem conter UF)
+    try:
+        uf_col, not_rec = normalize_df_uf(df)
+        if uf_col and not_rec:
+            rpt = str(caminho_arquivo).replace('.xlsx', '_uf_not_recognized.csv')
+            pd.DataFrame([{'original': o, 'converted': c} for o, c in not_rec]).to_csv(rpt, index=False)
+            print(f"Relatório UF não reconhecidos salvo em: {rpt}")
+    except Exception:
+        pass
+
+    if "SKU" not in df.columns:
+        raise ValueError("Planilha deve ter uma coluna 'SKU'.")
+
+    produtos_importados = 0
+    produtos_atualizados = 0
+    erros = []
+    skus_estoque_alterado = []
+
+    with engine.begin() as conn:
+        for linha, (_, row) in enumerate(df.iterrows(), start=1):
+            registrar_progresso(linha)
+            sku = str(row.get("SKU") or "").strip()
+            if not sku:
                 erros.append("Linha sem SKU")
                 continue
 
@@ -1186,6 +1502,8 @@ def importar_produtos_excel(caminho_arquivo, engine: Engine):
                     )
                 )
                 produtos_atualizados += 1
+                if produto_row["estoque_atual"] != estoque:
+                    skus_estoque_alterado.append(sku)
             else:
                 # insert
                 conn.execute(
@@ -1199,6 +1517,10 @@ def importar_produtos_excel(caminho_arquivo, engine: Engine):
                     )
                 )
                 produtos_importados += 1
+                skus_estoque_alterado.append(sku)
+
+        if skus_estoque_alterado:
+            estoque_ml.marcar(conn, produtos.c.sku.in_(skus_estoque_alterado))
 
     return {
         "produtos_importados": produtos_importados,
@@ -1210,78 +1532,53 @@ def importar_produtos_excel(caminho_arquivo, engine: Engine):
     # --------------------------------------------------------------------
     # Importação de estoque ML Full via Excel
     # --------------------------------------------------------------------
-def importar_estoque_ml_full(caminho_arquivo, engine: Engine, modo='substituir'):
-    """
-    Importa estoque do Mercado Livre Full
-    Colunas esperadas: SKU, Produto, Unidades aptas (ou similar)
-    
-    modo: 'substituir' = sobrescreve estoque | 'ajustar' = calcula diferença
-    """
-    import unicodedata
-    df = pd.read_excel(caminho_arquivo, header=10)
-    # Normalizar nomes de colunas
-    df.columns = df.columns.str.strip()
-    def normalize_colname(s):
-        s = str(s).strip().lower()
-        s = ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
-        return s
-    print("[DEBUG] Colunas pandas:", list(df.columns))
-    print("[DEBUG] Colunas normalizadas:")
-    for col in df.columns:
-        print(f"  '{col}' => '{normalize_colname(col)}'")
+def importar_estoque_ml_full(caminho_arquivo, engine: Engine, modo='substituir', tamanho_bloco=TAMANHO_BLOCO_PADRAO):
     """
     Importa estoque do Mercado Livre Full
     Colunas esperadas: SKU, Produto, Unidades aptas (ou similar)
     
     modo: 'substituir' = sobrescreve estoque | 'ajustar' = calcula diferença
+
+    O relatório é lido em blocos (cabeçalho na linha 11); as quantidades são
+    somadas por SKU e os produtos são atualizados em transações de até
+    ``tamanho_bloco`` SKUs.
     """
-    df = pd.read_excel(caminho_arquivo, header=0)
-    
-    # Normalizar nomes de colunas
-    df.columns = df.columns.str.strip()
-    
-    # Identificar colunas (busca case-insensitive e por índice)
-    
+    # Relatório geral de estoque Full: a linha 11 (header=10) tem os títulos das
+    # colunas de unidades; as colunas são identificadas por posição
+    colunas = colunas_excel(caminho_arquivo, header=10)
+
     # Debug: mostrar colunas encontradas
-    print(f"DEBUG: Total de colunas: {len(df.columns)}")
-    print(f"DEBUG: Colunas: {list(df.columns)}")
+    print(f"DEBUG: Total de colunas: {len(colunas)}")
+    print(f"DEBUG: Colunas: {colunas}")
     
     col_quantidade = None
     col_sku = None
     col_produto = None
-    
-    # Forçar uso da coluna 'Aptas para venda' se existir (normalizando acentos e espaços)
-    import unicodedata
-    def normalize_colname(s):
-        s = str(s).strip().lower()
-        s = ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
-        return s
-
-    # Forçar uso da coluna de índice 16 como quantidade
-    col_quantidade = df.columns[16]
-    print(f"[DEBUG] Forçando coluna de quantidade: {col_quantidade}")
+
+    # Forçar uso da coluna de índice 16 como quantidade ('Aptas para venda')
+    if len(colunas) > 16:
+        col_quantidade = colunas[16]
+        print(f"[DEBUG] Forçando coluna de quantidade: {col_quantidade}")
     
     # Se não encontrou, tentar por índice (ML Full: D=SKU, F=Produto, O=Unidades aptas)
-    if not col_sku and len(df.columns) > 3:
-        col_sku = df.columns[3]  # Coluna D (índice 3)
-    if not col_produto and len(df.columns) > 5:
-        col_produto = df.columns[5]  # Coluna F (índice 5)
-    if not col_quantidade and len(df.columns) > 14:
-        col_quantidade = df.columns[14]  # Coluna O (índice 14)
+    if not col_sku and len(colunas) > 3:
+        col_sku = colunas[3]  # Coluna D (índice 3)
+    if not col_produto and len(colunas) > 5:
+        col_produto = colunas[5]  # Coluna F (índice 5)
+    if not col_quantidade and len(colunas) > 14:
+        col_quantidade = colunas[14]  # Coluna O (índice 14)
     
     if not col_quantidade:
-        raise ValueError(f"Não foi possível identificar coluna de quantidade. Colunas: {list(df.columns)}")
+        raise ValueError(f"Não foi possível identificar coluna de quantidade. Colunas: {colunas}")
     
     if not col_sku:
-        raise ValueError(f"Não foi possível identificar coluna SKU. Colunas: {list(df.columns)}")
+        raise ValueError(f"Não foi possível identificar coluna SKU. Colunas: {colunas}")
     
     produtos_atualizados = 0
     produtos_nao_encontrados = []
     ajustes_registrados = []
     erros = []
     
-    # Converter quantidade para numérico ANTES de agrupar
-    print(f"DEBUG: Processando {len(df)} linhas da planilha")
     print(f"DEBUG: Coluna quantidade identificada: {col_quantidade}")
     print(f"DEBUG: Coluna SKU identificada: {col_sku}")
     
@@ -1312,19 +1609,32 @@ def importar_estoque_ml_full(caminho_arquivo, engine: Engine, modo='substituir')
         except Exception:
             return 0
 
-    # Garantir SKU sem espaços e converter quantidade usando o parser seguro
-    df[col_sku] = df[col_sku].astype(str).str.strip()
-    df[col_quantidade] = df[col_quantidade].apply(_parse_int_safe)
-
-    total_before = int(df[col_quantidade].sum()) if col_quantidade in df.columns else 0
-    print(f"DEBUG: Soma total de quantidades (antes do agrupamento): {total_before}")
-    
-    # Agrupar por SKU e somar quantidades (produtos com múltiplos anúncios)
-    df_grouped = df.groupby(col_sku, as_index=False).agg({
-        col_quantidade: 'sum',
-        col_produto: 'first' if col_produto else col_sku  # Pegar o primeiro nome ou usar SKU
+    # Agrupar por SKU e somar quantidades (produtos com múltiplos anúncios), bloco a bloco
+    usecols = [c for c in (col_sku, col_quantidade, col_produto) if c]
+    quantidades = pd.Series(dtype="int64")
+    nomes = pd.Series(dtype=object)
+    total_linhas = 0
+    for df in ler_excel_em_blocos(caminho_arquivo, header=10, tamanho_bloco=tamanho_bloco, usecols=usecols):
+        # linhas sem SKU são títulos/rodapés do relatório
+        df = df[df[col_sku].notna()]
+        total_linhas += len(df)
+        # Garantir SKU sem espaços e converter quantidade usando o parser seguro
+        skus = df[col_sku].astype(str).str.strip()
+        qtd = df[col_quantidade].apply(_parse_int_safe) if col_quantidade in df.columns else pd.Series(0, index=df.index)
+        quantidades = quantidades.add(qtd.groupby(skus).sum(), fill_value=0)
+        if col_produto in df.columns:
+            primeiro_nome = df[col_produto].groupby(skus).first()
+            nomes = pd.concat([nomes, primeiro_nome[~primeiro_nome.index.isin(nomes.index)]])
+
+    df_grouped = pd.DataFrame({
+        col_sku: quantidades.index,
+        col_quantidade: quantidades.astype(int).values,
     })
-    total_after = int(df_grouped[col_quantidade].sum()) if col_quantidade in df_grouped.columns else 0
+    if col_produto:
+        df_grouped[col_produto] = df_grouped[col_sku].map(nomes)
+
+    print(f"DEBUG: Processadas {total_linhas} linhas da planilha")
+    total_after = int(df_grouped[col_quantidade].sum())
     print(f"DEBUG: Soma total de quantidades (após agrupamento): {total_after}")
     print(f"DEBUG: Após agrupamento: {len(df_grouped)} SKUs únicos")
     
@@ -1333,84 +1643,92 @@ def importar_estoque_ml_full(caminho_arquivo, engine: Engine, modo='substituir')
         row_sample = df_grouped.iloc[i]
         print(f"DEBUG: SKU={row_sample[col_sku]}, Qtd={row_sample[col_quantidade]}")
     
-    with engine.begin() as conn:
-        for idx, row in df_grouped.iterrows():
-            try:
-                sku = str(row.get(col_sku) or "").strip()
-                if not sku:
-                    continue
-            
-                quantidade_ml = row.get(col_quantidade)
+    for inicio in range(0, len(df_grouped), tamanho_bloco):
+        with engine.begin() as conn:
+            ids_alterados = []
+            for idx, row in df_grouped.iloc[inicio:inicio + tamanho_bloco].iterrows():
                 try:
-                    quantidade_ml = int(float(quantidade_ml)) if pd.notna(quantidade_ml) else 0
-                except:
-                    quantidade_ml = 0
+                    sku = str(row.get(col_sku) or "").strip()
+                    if not sku:
+                        continue
             
-                # Buscar produto pelo SKU
-                produto_row = conn.execute(
-                    select(produtos.c.id, produtos.c.nome, produtos.c.estoque_atual)
-                    .where(produtos.c.sku == sku)
-                ).mappings().first()
+                    quantidade_ml = row.get(col_quantidade)
+                    try:
+                        quantidade_ml = int(float(quantidade_ml)) if pd.notna(quantidade_ml) else 0
+                    except:
+                        quantidade_ml = 0
             
-                if not produto_row:
-                    produtos_nao_encontrados.append({
-                        'sku': sku,
-                        'nome': row.get("Produto", ""),
-                        'quantidade_ml': quantidade_ml
-                    })
-                    continue
+                    # Buscar produto pelo SKU
+                    produto_row = conn.execute(
+                        select(produtos.c.id, produtos.c.nome, produtos.c.estoque_atual)
+                        .where(produtos.c.sku == sku)
+                    ).mappings().first()
+            
+                    if not produto_row:
+                        produtos_nao_encontrados.append({
+                            'sku': sku,
+                            'nome': row.get("Produto", ""),
+                            'quantidade_ml': quantidade_ml
+                        })
+                        continue
             
-                estoque_anterior = produto_row['estoque_atual'] or 0
+                    estoque_anterior = produto_row['estoque_atual'] or 0
             
-                if modo == 'substituir':
-                    # Substituir estoque pelo da planilha
-                    novo_estoque = quantidade_ml
-                    diferenca = novo_estoque - estoque_anterior
-                    tipo_ajuste = 'entrada' if diferenca > 0 else 'saida'
-                    quantidade_ajuste = abs(diferenca)
+                    if modo == 'substituir':
+                        # Substituir estoque pelo da planilha
+                        novo_estoque = quantidade_ml
+                        diferenca = novo_estoque - estoque_anterior
+                        tipo_ajuste = 'entrada' if diferenca > 0 else 'saida'
+                        quantidade_ajuste = abs(diferenca)
                 
-                elif modo == 'ajustar':
-                    # Calcular diferença
-                    diferenca = quantidade_ml - estoque_anterior
-                    if diferenca == 0:
-                        continue  # Sem mudança
+                    elif modo == 'ajustar':
+                        # Calcular diferença
+                        diferenca = quantidade_ml - estoque_anterior
+                        if diferenca == 0:
+                            continue  # Sem mudança
                 
-                    tipo_ajuste = 'entrada' if diferenca > 0 else 'saida'
-                    quantidade_ajuste = abs(diferenca)
-                    novo_estoque = quantidade_ml
+                        tipo_ajuste = 'entrada' if diferenca > 0 else 'saida'
+                        quantidade_ajuste = abs(diferenca)
+                        novo_estoque = quantidade_ml
             
-                # Atualizar estoque
-                conn.execute(
-                    update(produtos)
-                    .where(produtos.c.id == produto_row['id'])
-                    .values(estoque_atual=novo_estoque)
-                )
-            
-                # Registrar ajuste no histórico
-                if diferenca != 0:
+                    # Atualizar estoque
                     conn.execute(
-                        insert(ajustes_estoque).values(
-                            produto_id=produto_row['id'],
-                            tipo=tipo_ajuste,
-                            quantidade=quantidade_ajuste,
-                            custo_unitario=None,
-                            observacao=f"Ajuste automático via importação ML Full (anterior: {estoque_anterior}, novo: {novo_estoque})",
-                            data_ajuste=datetime.now()
-                        )
+                        update(produtos)
+                        .where(produtos.c.id == produto_row['id'])
+                        .values(estoque_atual=novo_estoque)
                     )
             
-                produtos_atualizados += 1
-                ajustes_registrados.append({
-                    'sku': sku,
-                    'nome': produto_row['nome'],
-                    'anterior': estoque_anterior,
-                    'novo': novo_estoque,
-                    'diferenca': diferenca
-                })
+                    # Registrar ajuste no histórico
+                    if diferenca != 0:
+                        ids_alterados.append(produto_row['id'])
+                        conn.execute(
+                            insert(ajustes_estoque).values(
+                                produto_id=produto_row['id'],
+                                tipo=tipo_ajuste,
+                                quantidade=quantidade_ajuste,
+                                custo_unitario=None,
+                                observacao=f"Ajuste automático via importação ML Full (anterior: {estoque_anterior}, novo: {novo_estoque})",
+                                data_ajuste=datetime.now()
+                            )
+                        )
             
-            except Exception as e:
-                erros.append(f"Linha {idx+2}: {str(e)}")
-    
+                    produtos_atualizados += 1
+                    ajustes_registrados.append({
+                        'sku': sku,
+                        'nome': produto_row['nome'],
+                        'anterior': estoque_anterior,
+                        'novo': novo_estoque,
+                        'diferenca': diferenca
+                    })
+            
+                except Exception as e:
+                    erros.append(f"Linha {idx+2}: {str(e)}")
+
+            if ids_alterados:
+                estoque_ml.marcar(conn, produtos.c.id.in_(ids_alterados))
+
+        registrar_progresso(min(inicio + tamanho_bloco, len(df_grouped)))
+
     return {
         "produtos_atualizados": produtos_atualizados,
         "produtos_nao_encontrados": produtos_nao_encontrados,
@@ -1421,7 +1739,24 @@ def importar_estoque_ml_full(caminho_arquivo, engine: Engine, modo='substituir')
 # --------------------------------------------------------------------
 # Rotas principais
 # --------------------------------------------------------------------
+def _filtro_resumo(data_inicio, data_fim):
+    """Filtro de período sobre ``vendas_resumo_diario``.
+
+    Equivale a ``data_venda >= data_inicio`` e ``data_venda <= data_fim + "T23:59:59"``
+    na tabela de vendas (vendas sem data ficam de fora quando há filtro).
+    """
+    filtro = []
+    if data_inicio:
+        filtro.append(vendas_resumo_diario.c.dia >= data_inicio)
+    if data_fim:
+        filtro.append(vendas_resumo_diario.c.dia <= data_fim)
+    if filtro:
+        filtro.append(vendas_resumo_diario.c.dia != "")
+    return filtro
+
+
 @app.route("/")
+@cache_relatorios.rota
 @login_required
 def dashboard():
     # --- filtro de período ---
@@ -1435,138 +1770,113 @@ def dashboard():
         data_inicio = inicio_mes.isoformat()
         data_fim = hoje.isoformat()
 
-    # cria filtro SQL
-    filtro_data = []
-    if data_inicio:
-        filtro_data.append(vendas.c.data_venda >= data_inicio)
-    if data_fim:
-        filtro_data.append(vendas.c.data_venda <= data_fim + "T23:59:59")
+    # cria filtro SQL (sobre o resumo diário de vendas)
+    resumo = vendas_resumo_diario
+    filtro_data = _filtro_resumo(data_inicio, data_fim)
 
-    with engine.connect() as conn:
+    # publicidade é mensal por produto: multiplica pelos meses do período
+    meses = meses_no_periodo(data_inicio, data_fim)
 
-        # totais de estoque (não dependem do período)
-        total_produtos = conn.execute(
-            select(func.count()).select_from(produtos)
-        ).scalar_one()
+    # Vendas canceladas = receita_total <= 0 (cancelada = 1 no resumo)
+    ativa = resumo.c.cancelada == 0
+    cancelada = resumo.c.cancelada == 1
 
-        estoque_total = conn.execute(
-            select(func.coalesce(func.sum(produtos.c.estoque_atual), 0))
-        ).scalar_one()
+    def _soma_se(condicao, coluna):
+        return func.coalesce(func.sum(case((condicao, coluna), else_=0)), 0)
 
-        # --- totais filtrados por período (EXCLUINDO VENDAS CANCELADAS) ---
-        # Vendas canceladas = receita_total <= 0
-        filtro_nao_cancelada = [vendas.c.receita_total > 0] + filtro_data
-        
-        receita_total = conn.execute(
-            select(func.coalesce(func.sum(vendas.c.receita_total), 0))
-            .where(*filtro_nao_cancelada)
-        ).scalar_one()
+    with engine.connect() as conn:
 
-        custo_total = conn.execute(
-            select(func.coalesce(func.sum(vendas.c.custo_total), 0))
-            .where(*filtro_nao_cancelada)
-        ).scalar_one()
+        # totais de estoque (não dependem do período)
+        total_produtos, estoque_total = conn.execute(
+            select(func.count(), func.coalesce(func.sum(produtos.c.estoque_atual), 0))
+            .select_from(produtos)
+        ).one()
 
-        margem_total = conn.execute(
-            select(func.coalesce(func.sum(vendas.c.margem_contribuicao), 0))
-            .where(*filtro_nao_cancelada)
-        ).scalar_one()
-        # --- publicidade total (mensal): soma por produto vendido no período vezes meses ---
-        def _months_inclusive(start_str, end_str):
-            try:
-                d1 = date.fromisoformat(start_str)
-                d2 = date.fromisoformat(end_str)
-                months = (d2.year - d1.year) * 12 + (d2.month - d1.month) + 1
-                return max(1, months)
-            except Exception:
-                return 1
+        # --- todos os totais do período numa única passada ---
+        totais = conn.execute(
+            select(
+                _soma_se(ativa, resumo.c.receita).label("receita"),
+                _soma_se(ativa, resumo.c.custo).label("custo"),
+                _soma_se(ativa, resumo.c.margem).label("margem"),
+                _soma_se(ativa, resumo.c.soma_preco_unitario).label("soma_preco"),
+                _soma_se(ativa, resumo.c.num_vendas).label("num_vendas"),
+                _soma_se(cancelada, resumo.c.num_vendas).label("canceladas_qtd"),
+                # valor bruto das canceladas (preço unitário * quantidade)
+                _soma_se(cancelada, resumo.c.valor_bruto).label("canceladas_valor"),
+            )
+            .where(*filtro_data)
+        ).mappings().one()
 
-        meses = _months_inclusive(data_inicio, data_fim)
-        query_pub = (
-            select(produtos.c.id.label("produto_id"), produtos.c.publicidade.label("publicidade"))
-            .select_from(vendas.join(produtos))
-            .where(*filtro_nao_cancelada)
-            .group_by(produtos.c.id)
+        # --- uma passada por produto (sem canceladas): publicidade e rankings ---
+        por_produto = conn.execute(
+            select(
+                produtos.c.nome,
+                produtos.c.publicidade,
+                func.sum(resumo.c.qtd).label("qtd"),
+                func.sum(resumo.c.margem).label("margem"),
+            )
+            .select_from(resumo.join(produtos, resumo.c.produto_id == produtos.c.id))
+            .where(ativa, *filtro_data)
+            .group_by(produtos.c.id, produtos.c.nome, produtos.c.publicidade)
+        ).mappings().all()
+
+        # faturamento ao longo do período (gráfico)
+        hoje = date.today()
+        inicio_grafico, fim_grafico = intervalo_datas(data_inicio, data_fim, hoje.replace(day=1), hoje)
+        serie = serie_temporal(
+            conn,
+            resumo.c.dia,
+            {"receita": func.sum(resumo.c.receita)},
+            inicio_grafico,
+            fim_grafico,
+            filtros=[ativa],
         )
-        pub_rows = conn.execute(query_pub).mappings().all()
-        publicidade_total = sum(float(r.get("publicidade") or 0) for r in pub_rows) * meses
-        
-        # --- VENDAS CANCELADAS (receita_total <= 0) ---
-        vendas_canceladas_qtd = conn.execute(
-            select(func.count())
-            .select_from(vendas)
-            .where(vendas.c.receita_total <= 0)
-            .where(*filtro_data)
-        ).scalar_one()
-        
-        # Valor bruto das vendas canceladas (preço unitário * quantidade)
-        vendas_canceladas_valor = conn.execute(
-            select(func.coalesce(func.sum(vendas.c.preco_venda_unitario * vendas.c.quantidade), 0))
-            .select_from(vendas)
-            .where(vendas.c.receita_total <= 0)
-            .where(*filtro_data)
-        ).scalar_one()
 
         cfg = conn.execute(
             select(configuracoes).where(configuracoes.c.id == 1)
         ).mappings().first()
 
-        imposto_percent = float(cfg["imposto_percent"]) if cfg else 0.0
-        despesas_percent = float(cfg["despesas_percent"]) if cfg else 0.0
-
-        comissao_total = max(0.0, (receita_total - custo_total) - margem_total)
-        imposto_total = receita_total * (imposto_percent / 100.0)
-        despesas_total = receita_total * (despesas_percent / 100.0)
-
-        lucro_liquido_total = (
-            receita_total
-            - custo_total
-            - comissao_total
-            - imposto_total
-            - despesas_total
-        )
-        # Subtrair publicidade mensal (pro rata por meses no período)
-        lucro_liquido_total = lucro_liquido_total - publicidade_total
-
-        receita_liquida_total = receita_total - comissao_total 
-
-        margem_liquida_percent = (
-            (lucro_liquido_total / receita_total) * 100.0
-            if receita_total > 0 else 0.0
-        )
-
-        ticket_medio = conn.execute(
-            select(func.coalesce(func.avg(vendas.c.preco_venda_unitario), 0))
-            .where(*filtro_nao_cancelada)
-        ).scalar_one()
-
-        # produto mais vendido no período (sem canceladas)
-        produto_mais_vendido = conn.execute(
-            select(produtos.c.nome, func.sum(vendas.c.quantidade).label("qtd"))
-            .select_from(vendas.join(produtos))
-            .where(*filtro_nao_cancelada)
-            .group_by(produtos.c.id)
-            .order_by(func.sum(vendas.c.quantidade).desc())
-            .limit(1)
-        ).first()
-
-        produto_maior_lucro = conn.execute(
-            select(produtos.c.nome, func.sum(vendas.c.margem_contribuicao).label("lucro"))
-            .select_from(vendas.join(produtos))
-            .where(*filtro_nao_cancelada)
-            .group_by(produtos.c.id)
-            .order_by(func.sum(vendas.c.margem_contribuicao).desc())
-            .limit(1)
-        ).first()
-
-        produto_pior_margem = conn.execute(
-            select(produtos.c.nome, func.sum(vendas.c.margem_contribuicao).label("margem"))
-            .select_from(vendas.join(produtos))
-            .where(*filtro_nao_cancelada)
-            .group_by(produtos.c.id)
-            .order_by(func.sum(vendas.c.margem_contribuicao).asc())
-            .limit(1)
-        ).first()
+    receita_total = totais["receita"]
+    custo_total = totais["custo"]
+    margem_total = totais["margem"]
+    vendas_canceladas_qtd = totais["canceladas_qtd"]
+    vendas_canceladas_valor = totais["canceladas_valor"]
+    # média do preço unitário das vendas = soma dos preços / número de vendas
+    ticket_medio = totais["soma_preco"] / totais["num_vendas"] if totais["num_vendas"] else 0
+
+    # produto mais vendido, maior lucro e pior margem no período
+    produto_mais_vendido = produto_maior_lucro = produto_pior_margem = None
+    if por_produto:
+        r = max(por_produto, key=lambda r: r["qtd"] or 0)
+        produto_mais_vendido = (r["nome"], r["qtd"])
+        r = max(por_produto, key=lambda r: r["margem"] or 0)
+        produto_maior_lucro = (r["nome"], r["margem"])
+        r = min(por_produto, key=lambda r: r["margem"] or 0)
+        produto_pior_margem = (r["nome"], r["margem"])
+
+    imposto_percent = float(cfg["imposto_percent"]) if cfg else 0.0
+    despesas_percent = float(cfg["despesas_percent"]) if cfg else 0.0
+
+    lucro = totais_lucro(
+        receita_total,
+        custo_total,
+        margem_total,
+        publicidade=sum(float(r["publicidade"] or 0) for r in por_produto),
+        imposto_percent=imposto_percent,
+        despesas_percent=despesas_percent,
+        meses=meses,
+    )
+    comissao_total = lucro["comissao"]
+    imposto_total = lucro["imposto"]
+    despesas_total = lucro["despesas"]
+    publicidade_total = lucro["publicidade"]
+    lucro_liquido_total = lucro["lucro_liquido"]
+    receita_liquida_total = lucro["receita_liquida"]
+
+    margem_liquida_percent = (
+        (lucro_liquido_total / receita_total) * 100.0
+        if receita_total > 0 else 0.0
+    )
 
     return render_template(
         "dashboard.html",
@@ -1590,6 +1900,9 @@ def dashboard():
         publicidade_total=publicidade_total,
         data_inicio=data_inicio,
         data_fim=data_fim,
+        grafico_labels=serie["labels"],
+        grafico_faturamento=serie["receita"],
+        grafico_rotulos=ROTULOS[serie["granularidade"]],
     )
 
 # ---------------- PRODUTOS ----------------
@@ -1622,6 +1935,8 @@ def novo_produto():
                     estoque_atual=estoque_inicial,
                 )
             )
+            estoque_ml.marcar(conn, produtos.c.sku == sku)
+        _enfileirar_estoque_ml()
         flash("Produto cadastrado com sucesso!", "success")
         return redirect(url_for("lista_produtos"))
 
@@ -1650,6 +1965,8 @@ def editar_produto(produto_id):
                     estoque_atual=estoque_atual,
                 )
             )
+            estoque_ml.marcar(conn, produtos.c.id == produto_id)
+        _enfileirar_estoque_ml()
         flash("Produto atualizado!", "success")
         return redirect(url_for("lista_produtos"))
 
@@ -1729,6 +2046,7 @@ def excluir_produto_com_vendas(produto_id):
         with engine.begin() as conn:
             # Deletar vendas vinculadas
             if vendas_count > 0:
+                resumo_vendas.subtrair(conn, vendas.c.produto_id == produto_id)
                 conn.execute(delete(vendas).where(vendas.c.produto_id == produto_id))
                 print(f"[DELETE] {vendas_count} vendas do produto {produto_id} deletadas")
             
@@ -1754,26 +2072,25 @@ def importar_produtos_view():
         if file.filename == "":
             flash("Selecione um arquivo.", "danger")
             return redirect(request.url)
-        filename = secure_filename(file.filename)
-        caminho = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-        file.save(caminho)
-
-        try:
-            resumo = importar_produtos_excel(caminho, engine)
-            flash(
-                f"Importação concluída. "
-                f"{resumo['produtos_importados']} produtos importados, "
-                f"{resumo['produtos_atualizados']} atualizados. "
-                f"Erros: {len(resumo['erros'])}",
-                "success",
-            )
-        except Exception as e:
-            flash(f"Erro na importação: {e}", "danger")
-        return redirect(url_for("lista_produtos"))
+        caminho, filename = _salvar_upload(file)
+        return _enfileirar_importacao("produtos", _job_importar_produtos, caminho, filename)
 
     return render_template("importar_produtos.html")
 
 
+def _job_importar_produtos(caminho):
+    resumo = importar_produtos_excel(caminho, engine)
+    _enfileirar_estoque_ml()
+    resumo["mensagem"] = (
+        f"Importação concluída. "
+        f"{resumo['produtos_importados']} produtos importados, "
+        f"{resumo['produtos_atualizados']} atualizados. "
+        f"Erros: {len(resumo['erros'])}"
+    )
+    resumo["categoria"] = "success"
+    return resumo
+
+
 @app.route("/estoque/importar-ml-full", methods=["GET", "POST"])
 @login_required
 def importar_estoque_ml_full_view():
@@ -1789,32 +2106,37 @@ def importar_estoque_ml_full_view():
 
         modo = request.form.get("modo", "substituir")
 
-        filename = secure_filename(file.filename)
-        caminho = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-        file.save(caminho)
+        caminho, filename = _salvar_upload(file)
+        return _enfileirar_importacao(
+            "estoque_ml_full", _job_importar_estoque_ml_full, caminho, filename, modo=modo
+        )
 
-        try:
-            resumo = importar_estoque_ml_full(caminho, engine, modo=modo)
+    # detalhes de um job já concluído (link da página de acompanhamento)
+    job_id = request.args.get("job", type=int)
+    if job_id:
+        job = fila_importacao.obter(job_id)
+        if job and job["tipo"] == "estoque_ml_full" and job["resultado"]:
+            return render_template("importar_estoque_ml.html", resumo=job["resultado"])
 
-            # Criar mensagem detalhada
-            msg = f"✅ {resumo['produtos_atualizados']} produtos atualizados."
+    return render_template("importar_estoque_ml.html")
 
-            if resumo['produtos_nao_encontrados']:
-                msg += f" ⚠️ {len(resumo['produtos_nao_encontrados'])} SKUs não encontrados no sistema."
 
-            if resumo['erros']:
-                msg += f" ❌ {len(resumo['erros'])} erros."
+def _job_importar_estoque_ml_full(caminho, modo):
+    resumo = importar_estoque_ml_full(caminho, engine, modo=modo)
+    _enfileirar_estoque_ml()
 
-            flash(msg, "success" if not resumo['erros'] else "warning")
+    # Criar mensagem detalhada
+    msg = f"✅ {resumo['produtos_atualizados']} produtos atualizados."
 
-            # Passar resumo para exibir detalhes
-            return render_template("importar_estoque_ml.html", resumo=resumo)
+    if resumo['produtos_nao_encontrados']:
+        msg += f" ⚠️ {len(resumo['produtos_nao_encontrados'])} SKUs não encontrados no sistema."
 
-        except Exception as e:
-            flash(f"Erro na importação: {e}", "danger")
-            return redirect(request.url)
+    if resumo['erros']:
+        msg += f" ❌ {len(resumo['erros'])} erros."
 
-    return render_template("importar_estoque_ml.html")
+    resumo["mensagem"] = msg
+    resumo["categoria"] = "success" if not resumo['erros'] else "warning"
+    return resumo
 
 # ---------------- VENDAS ----------------
 from flask import request, render_template
@@ -1824,12 +2146,35 @@ from math import ceil
 
 VENDAS_POR_PAGINA = 100
 
+
+def _cursor_venda(venda):
+    """Cursor de paginação da venda: "data_venda|id"."""
+    return f"{venda['data_venda']}|{venda['id']}"
+
+
+def _ler_cursor_venda(valor):
+    """Converte o cursor "data_venda|id" em tupla (None se ausente/inválido)."""
+    try:
+        data_venda, venda_id = valor.rsplit("|", 1)
+        return data_venda, int(venda_id)
+    except (AttributeError, ValueError):
+        return None
+
 @app.route("/vendas")
+@cache_relatorios.rota
 @login_required
 def lista_vendas():
     data_inicio = request.args.get("data_inicio") or ""
     data_fim = request.args.get("data_fim") or ""
-    page = int(request.args.get("page", 1))
+    # paginação por cursor (keyset) sobre (data_venda, id): "apos" avança, "antes" volta,
+    # "ultima" vai para o fim; "page" só numera a página exibida
+    apos = _ler_cursor_venda(request.args.get("apos"))
+    antes = _ler_cursor_venda(request.args.get("antes"))
+    ultima = request.args.get("ultima") == "1" and not (apos or antes)
+    try:
+        page = int(request.args.get("page", 1))
+    except ValueError:
+        page = 1
 
     # =======================
     # PERÍODO PADRÃO: ÚLTIMOS 30 DIAS
@@ -1884,16 +2229,53 @@ def lista_vendas():
         query_vendas = query_vendas.where(
             vendas.c.data_venda >= data_inicio,
             vendas.c.data_venda <= data_fim + "T23:59:59"
-        ).order_by(vendas.c.data_venda.asc())
+        )
+        chave = tuple_(vendas.c.data_venda, vendas.c.id)
 
-        vendas_all = conn.execute(query_vendas).mappings().all()
+        # agregados do período saem do resumo diário (só produtos cadastrados)
+        resumo = vendas_resumo_diario
+        resumo_produtos = resumo.join(produtos, resumo.c.produto_id == produtos.c.id)
+        filtro_periodo = _filtro_resumo(data_inicio, data_fim)
 
         # Paginação
-        total_vendas = len(vendas_all)
+        total_vendas = conn.execute(
+            select(func.coalesce(func.sum(resumo.c.num_vendas), 0))
+            .select_from(resumo_produtos)
+            .where(*filtro_periodo)
+        ).scalar_one()
         total_pages = ceil(total_vendas / VENDAS_POR_PAGINA) if total_vendas else 1
-        start = (page - 1) * VENDAS_POR_PAGINA
-        end = start + VENDAS_POR_PAGINA
-        vendas_rows = vendas_all[start:end]
+
+        if antes or ultima:
+            # de trás para frente; a última página fica com o resto, como na numeração
+            limite = VENDAS_POR_PAGINA
+            if ultima:
+                page = total_pages
+                limite = total_vendas - (total_pages - 1) * VENDAS_POR_PAGINA
+            else:
+                query_vendas = query_vendas.where(chave < antes)
+            linhas = conn.execute(
+                query_vendas.order_by(vendas.c.data_venda.desc(), vendas.c.id.desc()).limit(limite + 1)
+            ).mappings().all()
+            tem_anterior = len(linhas) > limite
+            tem_proxima = bool(antes)
+            if not tem_anterior:
+                page = 1
+            vendas_rows = linhas[:limite][::-1]
+        else:
+            if apos:
+                query_vendas = query_vendas.where(chave > apos)
+            else:
+                page = 1
+            linhas = conn.execute(
+                query_vendas.order_by(vendas.c.data_venda.asc(), vendas.c.id.asc()).limit(VENDAS_POR_PAGINA + 1)
+            ).mappings().all()
+            tem_anterior = bool(apos)
+            tem_proxima = len(linhas) > VENDAS_POR_PAGINA
+            vendas_rows = linhas[:VENDAS_POR_PAGINA]
+
+        page = min(max(page, 1), total_pages)
+        cursor_anterior = _cursor_venda(vendas_rows[0]) if vendas_rows else None
+        cursor_proxima = _cursor_venda(vendas_rows[-1]) if vendas_rows else None
 
         # =======================
         # CONSULTA LOTES (RESPEITA FILTRO)
@@ -1921,17 +2303,15 @@ def lista_vendas():
         # Usar a coluna 'estado' diretamente
         if "estado" in vendas.c:
             query_estados = select(
-                vendas.c.estado.label("uf"),
-                func.coalesce(func.sum(vendas.c.receita_total), 0).label("total_receita"),
-                func.count().label("qtd_vendas"),
+                resumo.c.estado.label("uf"),
+                func.coalesce(func.sum(resumo.c.receita), 0).label("total_receita"),
+                func.coalesce(func.sum(resumo.c.num_vendas), 0).label("qtd_vendas"),
             ).where(
-                vendas.c.data_venda >= data_inicio,
-                vendas.c.data_venda <= data_fim + "T23:59:59",
-                vendas.c.receita_total > 0,
-                vendas.c.estado.isnot(None),
-                vendas.c.estado != ""
-            ).group_by(vendas.c.estado) \
-             .order_by(func.coalesce(func.sum(vendas.c.receita_total), 0).desc())
+                *filtro_periodo,
+                resumo.c.cancelada == 0,
+                resumo.c.estado != ""
+            ).group_by(resumo.c.estado) \
+             .order_by(func.coalesce(func.sum(resumo.c.receita), 0).desc())
 
             estados_rows = conn.execute(query_estados).mappings().all()
 
@@ -1947,15 +2327,14 @@ def lista_vendas():
         query_mais_vendidos = select(
             produtos.c.sku,
             produtos.c.nome,
-            func.sum(vendas.c.quantidade).label("total_qtd")
+            func.sum(resumo.c.qtd).label("total_qtd")
         ).select_from(
-            vendas.join(produtos)
+            resumo_produtos
         ).where(
-            vendas.c.data_venda >= data_inicio,
-            vendas.c.data_venda <= data_fim + "T23:59:59",
-            vendas.c.receita_total > 0
+            *filtro_periodo,
+            resumo.c.cancelada == 0
         ).group_by(produtos.c.id, produtos.c.sku, produtos.c.nome) \
-         .order_by(func.sum(vendas.c.quantidade).desc()) \
+         .order_by(func.sum(resumo.c.qtd).desc()) \
          .limit(10)
         
         mais_vendidos = conn.execute(query_mais_vendidos).mappings().all()
@@ -1966,15 +2345,14 @@ def lista_vendas():
         query_mais_lucrativos = select(
             produtos.c.sku,
             produtos.c.nome,
-            func.sum(vendas.c.margem_contribuicao).label("total_lucro")
+            func.sum(resumo.c.margem).label("total_lucro")
         ).select_from(
-            vendas.join(produtos)
+            resumo_produtos
         ).where(
-            vendas.c.data_venda >= data_inicio,
-            vendas.c.data_venda <= data_fim + "T23:59:59",
-            vendas.c.receita_total > 0
+            *filtro_periodo,
+            resumo.c.cancelada == 0
         ).group_by(produtos.c.id, produtos.c.sku, produtos.c.nome) \
-         .order_by(func.sum(vendas.c.margem_contribuicao).desc()) \
+         .order_by(func.sum(resumo.c.margem).desc()) \
          .limit(10)
         
         mais_lucrativos = conn.execute(query_mais_lucrativos).mappings().all()
@@ -1985,101 +2363,95 @@ def lista_vendas():
         query_menos_lucrativos = select(
             produtos.c.sku,
             produtos.c.nome,
-            func.sum(vendas.c.margem_contribuicao).label("total_lucro")
+            func.sum(resumo.c.margem).label("total_lucro")
         ).select_from(
-            vendas.join(produtos)
+            resumo_produtos
         ).where(
-            vendas.c.data_venda >= data_inicio,
-            vendas.c.data_venda <= data_fim + "T23:59:59",
-            vendas.c.receita_total > 0
+            *filtro_periodo,
+            resumo.c.cancelada == 0
         ).group_by(produtos.c.id, produtos.c.sku, produtos.c.nome) \
-         .order_by(func.sum(vendas.c.margem_contribuicao).asc()) \
+         .order_by(func.sum(resumo.c.margem).asc()) \
          .limit(10)
         
         menos_lucrativos = conn.execute(query_menos_lucrativos).mappings().all()
         pizza_menos_lucrativos_labels = [f"{r['sku']}" for r in menos_lucrativos]
         pizza_menos_lucrativos_valores = [float(r["total_lucro"] or 0) for r in menos_lucrativos]
 
-    # =======================
-    # GRÁFICOS 30 DIAS (FATURAMENTO / QTD / LUCRO)
-    # =======================
-    faturamento_dia = {}
-    quantidade_dia = {}
-    lucro_dia = {}
-    receita_liquida_dia = {}
-
-    vendas_validas = [v for v in vendas_all if float(v.get("receita_total") or 0) > 0]
+        # séries dos gráficos no período filtrado (dia/semana/mês conforme o intervalo)
+        inicio_grafico, fim_grafico = intervalo_datas(data_inicio, data_fim, trinta_dias_atras, hoje)
+        serie = serie_temporal(
+            conn,
+            resumo.c.dia,
+            {
+                "qtd": func.sum(resumo.c.qtd),
+                "receita": func.sum(resumo.c.receita),
+                "custo": func.sum(resumo.c.custo),
+                "margem": func.sum(resumo.c.margem),
+            },
+            inicio_grafico,
+            fim_grafico,
+            filtros=[resumo.c.cancelada == 0],
+            select_from=resumo_produtos,
+        )
 
-    for v in vendas_validas:
-        if not v["data_venda"]:
-            continue
-        try:
-            dt = datetime.fromisoformat(str(v["data_venda"])).date()
-        except Exception:
-            continue
+        # totais do período, sem canceladas
+        totais_periodo = conn.execute(
+            select(
+                func.coalesce(func.sum(resumo.c.qtd), 0).label("qtd"),
+                func.coalesce(func.sum(resumo.c.receita), 0).label("receita"),
+                func.coalesce(func.sum(resumo.c.custo), 0).label("custo"),
+                func.coalesce(func.sum(resumo.c.margem), 0).label("margem"),
+            )
+            .select_from(resumo_produtos)
+            .where(*filtro_periodo, resumo.c.cancelada == 0)
+        ).mappings().one()
+
+        # produtos com alguma venda no período (publicidade)
+        pub_rows = conn.execute(
+            select(produtos.c.id, produtos.c.publicidade)
+            .select_from(resumo_produtos)
+            .where(*filtro_periodo)
+            .group_by(produtos.c.id, produtos.c.publicidade)
+        ).mappings().all()
 
-        receita = float(v["receita_total"] or 0)
-        custo = float(v["custo_total"] or 0)
-        margem = float(v["margem_contribuicao"] or 0)
-        qtd = float(v["quantidade"] or 0)
-
-        # lucro líquido do dia (mesma lógica do dashboard)
-        comissao_ml = max(0.0, (receita - custo) - margem)
-        imposto_val = receita * (imposto_percent / 100.0)
-        despesas_val = receita * (despesas_percent / 100.0)
-        lucro = receita - custo - comissao_ml - imposto_val - despesas_val
-
-        faturamento_dia[dt] = faturamento_dia.get(dt, 0) + receita
-        quantidade_dia[dt] = quantidade_dia.get(dt, 0) + qtd
-        lucro_dia[dt] = lucro_dia.get(dt, 0) + lucro
-        receita_liquida_dia[dt] = receita_liquida_dia.get(dt, 0) + (receita - comissao_ml)
-
-    # Últimos 30 dias ordenados
-    dias = [hoje - timedelta(days=i) for i in range(29, -1, -1)]
-    grafico_labels = [d.isoformat() for d in dias]
-    grafico_faturamento = [faturamento_dia.get(d, 0) for d in dias]
-    grafico_quantidade = [quantidade_dia.get(d, 0) for d in dias]
-    grafico_lucro = [lucro_dia.get(d, 0) for d in dias]
-    grafico_receita_liquida = [receita_liquida_dia.get(d, 0) for d in dias]
+    # =======================
+    # GRÁFICOS DO PERÍODO (FATURAMENTO / QTD / LUCRO)
+    # =======================
+    grafico_labels = serie["labels"]
+    grafico_faturamento = serie["receita"]
+    grafico_quantidade = serie["qtd"]
+    # lucro líquido de cada período (mesma lógica do dashboard, sem publicidade)
+    lucro_serie = calcular_lucro(
+        {"receita": serie["receita"], "custo": serie["custo"], "margem": serie["margem"]},
+        imposto_percent,
+        despesas_percent,
+    )
+    grafico_lucro = lucro_serie["lucro_liquido"].tolist()
+    grafico_receita_liquida = lucro_serie["receita_liquida"].tolist()
+    grafico_rotulos = ROTULOS[serie["granularidade"]]
 
     # =========================
     # TOTAIS (RESPEITAM O FILTRO DA TELA)
     # =========================
-    total_receita = sum(float(q.get("receita_total") or 0) for q in vendas_validas)
-    total_custo = sum(float(q.get("custo_total") or 0) for q in vendas_validas)
-    total_margem = sum(float(q.get("margem_contribuicao") or 0) for q in vendas_validas)
-    total_comissao = max(0.0, (total_receita - total_custo) - total_margem)
-    total_imposto = total_receita * (imposto_percent / 100.0)
-    total_despesas = total_receita * (despesas_percent / 100.0)
     # publicidade total por produto (mensal): soma única por produto vendido no período * meses
-    def _months_inclusive(start_str, end_str):
-        try:
-            d1 = date.fromisoformat(start_str)
-            d2 = date.fromisoformat(end_str)
-            months = (d2.year - d1.year) * 12 + (d2.month - d1.month) + 1
-            return max(1, months)
-        except Exception:
-            return 1
-
-    meses = _months_inclusive(data_inicio, data_fim)
-    prod_pub = {}
-    for q in vendas_all:
-        pid = q.get("produto_id")
-        if pid is None:
-            continue
-        prod_pub[pid] = float(q.get("publicidade") or 0)
-    publicidade_total = sum(prod_pub.values()) * meses
-
-    total_lucro_liquido = total_receita - total_custo - total_comissao - total_imposto - total_despesas - publicidade_total
+    lucro = totais_lucro(
+        float(totais_periodo["receita"] or 0),
+        float(totais_periodo["custo"] or 0),
+        float(totais_periodo["margem"] or 0),
+        publicidade=sum(float(r["publicidade"] or 0) for r in pub_rows),
+        imposto_percent=imposto_percent,
+        despesas_percent=despesas_percent,
+        meses=meses_no_periodo(data_inicio, data_fim),
+    )
 
     totais = {
-        "qtd": sum(float(q.get("quantidade") or 0) for q in vendas_validas),
-        "receita": total_receita,
-        "custo": total_custo,
-        "lucro_liquido": total_lucro_liquido,
-        "publicidade": publicidade_total,
-        "imposto": total_imposto,
-        "despesas": total_despesas,
+        "qtd": float(totais_periodo["qtd"] or 0),
+        "receita": lucro["receita"],
+        "custo": lucro["custo"],
+        "lucro_liquido": lucro["lucro_liquido"],
+        "publicidade": lucro["publicidade"],
+        "imposto": lucro["imposto"],
+        "despesas": lucro["despesas"],
     }
 
     return render_template(
@@ -2095,6 +2467,7 @@ def lista_vendas():
         grafico_quantidade=grafico_quantidade,
         grafico_lucro=grafico_lucro,
         grafico_receita_liquida=grafico_receita_liquida,
+        grafico_rotulos=grafico_rotulos,
         pizza_estados_labels=pizza_estados_labels,
         pizza_estados_valores=pizza_estados_valores,
         pizza_mais_vendidos_labels=pizza_mais_vendidos_labels,
@@ -2104,7 +2477,11 @@ def lista_vendas():
         pizza_menos_lucrativos_labels=pizza_menos_lucrativos_labels,
         pizza_menos_lucrativos_valores=pizza_menos_lucrativos_valores,
         total_pages=total_pages,
-        current_page=page
+        current_page=page,
+        tem_anterior=tem_anterior and cursor_anterior is not None,
+        tem_proxima=tem_proxima and cursor_proxima is not None,
+        cursor_anterior=cursor_anterior,
+        cursor_proxima=cursor_proxima,
     )
 
 
@@ -2120,26 +2497,396 @@ def importar_ml_view():
         if file.filename == "":
             flash("Selecione um arquivo.", "danger")
             return redirect(request.url)
-        filename = secure_filename(file.filename)
-        caminho = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-        file.save(caminho)
+        modo = request.form.get("modo", "atualizar")
 
-        try:
-            resumo = importar_vendas_ml(caminho, engine)
-            msg = (
-                f"Importação concluída. Lote {resumo['lote_id']} - "
-                f"{resumo['vendas_importadas']} vendas importadas, "
-                f"{resumo['vendas_sem_sku']} sem SKU/Título, "
-                f"{resumo['vendas_sem_produto']} sem produto cadastrado."
+        caminho, filename = _salvar_upload(file)
+        return _enfileirar_importacao("vendas_ml", _job_importar_vendas_ml, caminho, filename, modo=modo)
+
+    with engine.connect() as conn:
+        cfg = conn.execute(select(configuracoes).where(configuracoes.c.id == 1)).mappings().first()
+        estoque_pendente = estoque_ml.pendentes(conn)
+    return render_template("importar_ml.html", cfg=cfg, estoque_pendente=estoque_pendente)
+
+
+def _job_importar_vendas_ml(caminho, modo):
+    resumo = importar_vendas_ml(caminho, engine, modo=modo)
+    msg = (
+        f"Importação concluída. Lote {resumo['lote_id']} - "
+        f"{resumo['vendas_importadas']} vendas importadas, "
+        f"{resumo['vendas_sem_sku']} sem SKU/Título, "
+        f"{resumo['vendas_sem_produto']} sem produto cadastrado."
+    )
+    if modo == "atualizar":
+        msg += (
+            f" {resumo['vendas_atualizadas']} já importadas foram atualizadas, "
+            f"{resumo['vendas_inalteradas']} sem alteração."
+        )
+        if resumo["vendas_duplicadas"]:
+            msg += (
+                f" {resumo['vendas_duplicadas']} linhas com N.º de venda repetido no arquivo "
+                f"foram ignoradas (só a primeira de cada venda foi usada)."
             )
-            if resumo.get('relatorio_gerado') and resumo.get('relatorio_filename'):
-                msg += f' 📥 <a href="/download_relatorio/{resumo["relatorio_filename"]}" class="alert-link">Baixar relatório Excel</a>'
-            flash(msg, "success")
-        except Exception as e:
-            flash(f"Erro na importação: {e}", "danger")
+    if resumo.get('relatorio_gerado') and resumo.get('relatorio_filename'):
+        msg += f' 📥 <a href="/download_relatorio/{resumo["relatorio_filename"]}" class="alert-link">Baixar relatório Excel</a>'
+    resumo["mensagem"] = msg
+    resumo["categoria"] = "success"
+    return resumo
+
+
+# --------------------------------------------------------------------
+# Sincronização de vendas pela API do Mercado Livre (ver mercado_livre.py)
+# --------------------------------------------------------------------
+ML_API_URL = os.environ.get("ML_API_URL", API_URL_PADRAO)
+ML_SYNC_THREADS = int(os.environ.get("ML_SYNC_THREADS", "8"))
+ML_SYNC_POR_SEGUNDO = float(os.environ.get("ML_SYNC_POR_SEGUNDO", "20"))
+# com ml_sync_auto = "true", intervalo entre as sincronizações automáticas
+ML_SYNC_INTERVALO_MIN = float(os.environ.get("ML_SYNC_INTERVALO_MIN", "15"))
+ML_SYNC_DIAS_INICIAIS = 30  # primeira sincronização (sem ml_ultimo_sync)
+# relê um pouco antes da marca: pedidos indexados com atraso na busca do ML
+ML_SYNC_MARGEM = timedelta(minutes=10)
+ML_SYNC_PEDIDOS_POR_BLOCO = 500
+
+
+# endpoint de renovação do token (o stub local responde no mesmo endereço da API)
+ML_OAUTH_URL = os.environ.get("ML_OAUTH_URL", f"{ML_API_URL}/oauth/token")
+
+
+def _carregar_token_ml():
+    with engine.connect() as conn:
+        cfg = conn.execute(select(configuracoes).where(configuracoes.c.id == 1)).mappings().first()
+    if not cfg:
+        return None
+    return {
+        "access_token": cfg["ml_access_token"],
+        "refresh_token": cfg["ml_refresh_token"],
+        "expira": cfg["ml_token_expira"],
+        "client_id": cfg["ml_client_id"],
+        "client_secret": cfg["ml_client_secret"],
+    }
+
+
+def _salvar_token_ml(access_token, refresh_token, expira):
+    with engine.begin() as conn:
+        conn.execute(
+            update(configuracoes)
+            .where(configuracoes.c.id == 1)
+            .values(ml_access_token=access_token, ml_refresh_token=refresh_token, ml_token_expira=expira)
+        )
+
+
+# um por processo: a sincronização, as notificações e suas threads pegam o token daqui
+tokens_ml = TokenML(_carregar_token_ml, _salvar_token_ml, ML_OAUTH_URL)
+
+
+def _cliente_ml():
+    return ClienteML(tokens_ml.obter, ML_API_URL, ML_SYNC_POR_SEGUNDO, ML_SYNC_THREADS, renovar=tokens_ml.renovar)
+
+
+def sincronizar_vendas_ml(engine: Engine, cliente=None, pedidos_por_bloco=ML_SYNC_PEDIDOS_POR_BLOCO):
+    """Traz os pedidos do ML alterados desde ``ml_ultimo_sync`` e grava como a planilha no modo 'atualizar'.
+
+    Os ids vêm da busca paginada; cada bloco de ``pedidos_por_bloco`` pedidos
+    é detalhado em paralelo e gravado numa transação. ``ml_ultimo_sync`` só
+    avança no fim: se a sincronização parar no meio, a próxima relê o mesmo
+    intervalo (pedidos já gravados são atualizados, não duplicados).
+    """
+    with engine.connect() as conn:
+        cfg = conn.execute(select(configuracoes).where(configuracoes.c.id == 1)).mappings().first()
+        por_id, por_sku, por_nome = _carregar_mapas_produtos(conn)
+    if not cfg or not cfg["ml_access_token"] or not cfg["ml_user_id"]:
+        raise ValueError("Conta do Mercado Livre não conectada (ml_access_token / ml_user_id vazios).")
+
+    ate = datetime.now(timezone.utc)
+    if cfg["ml_ultimo_sync"]:
+        desde = datetime.fromisoformat(cfg["ml_ultimo_sync"]) - ML_SYNC_MARGEM
+    else:
+        desde = ate - timedelta(days=ML_SYNC_DIAS_INICIAIS)
+
+    lote_id = datetime.now().isoformat(timespec="seconds")
+    totais = _totais_vendas_ml()
+    titulo_para_sku = {}
+    pedidos_lidos = 0
+    proprio = cliente is None
+    cliente = cliente or _cliente_ml()
+    try:
+        ids = cliente.ids_pedidos_alterados(cfg["ml_user_id"], desde, ate)
+        while True:
+            bloco = list(islice(ids, pedidos_por_bloco))
+            if not bloco:
+                break
+            df = pd.DataFrame(
+                [linha for pedido, envio in cliente.detalhar_pedidos(bloco) for linha in linhas_planilha(pedido, envio)],
+                columns=COLUNAS_PLANILHA,
+            )
+            if not df.empty:
+                for titulo, sku in _mapa_titulo_sku(df).items():
+                    titulo_para_sku.setdefault(titulo, sku)
+                _importar_bloco_vendas_ml(engine, df, lote_id, "atualizar", (por_id, por_sku, por_nome),
+                                          titulo_para_sku, totais)
+            pedidos_lidos += len(bloco)
+            registrar_progresso(pedidos_lidos)
+    finally:
+        if proprio:
+            cliente.fechar()
+
+    marca = ate.isoformat(timespec="milliseconds")
+    with engine.begin() as conn:
+        conn.execute(update(configuracoes).where(configuracoes.c.id == 1).values(ml_ultimo_sync=marca))
+    print(f"[SYNC ML] {pedidos_lidos} pedidos de {desde.isoformat(timespec='seconds')} a {marca}")
+
+    return {
+        "lote_id": lote_id,
+        "desde": desde.isoformat(timespec="seconds"),
+        "ate": marca,
+        "pedidos_lidos": pedidos_lidos,
+        "vendas_importadas": totais["importadas"],
+        "vendas_atualizadas": totais["atualizadas"],
+        "vendas_inalteradas": totais["inalteradas"],
+        "vendas_sem_sku": len(totais["sem_sku"]),
+        "vendas_sem_produto": len(totais["sem_produto"]),
+        "vendas_duplicadas": len(totais["duplicadas"]),
+    }
+
+
+def _job_sincronizar_vendas_ml():
+    resumo = sincronizar_vendas_ml(engine)
+    resumo["mensagem"] = (
+        f"Sincronização concluída: {resumo['pedidos_lidos']} pedidos alterados desde {resumo['desde']}. "
+        f"{resumo['vendas_importadas']} vendas novas, {resumo['vendas_atualizadas']} atualizadas, "
+        f"{resumo['vendas_inalteradas']} sem alteração, {resumo['vendas_sem_sku']} sem SKU/Título, "
+        f"{resumo['vendas_sem_produto']} sem produto cadastrado."
+    )
+    resumo["categoria"] = "success"
+    return resumo
+
+
+def _enfileirar_sync_ml(usuario_id=None):
+    """Enfileira a sincronização, a menos que já exista uma pendente/em execução (retorna o id dela)."""
+    with engine.connect() as conn:
+        aberto = conn.execute(
+            select(import_jobs.c.id)
+            .where(import_jobs.c.tipo == "vendas_ml_api", import_jobs.c.status.in_(["pendente", "executando"]))
+            .order_by(import_jobs.c.id.desc())
+        ).scalar()
+    if aberto is not None and fila_importacao.obter(aberto)["status"] in ("pendente", "executando"):
+        return aberto
+    return fila_importacao.enviar(
+        "vendas_ml_api", _job_sincronizar_vendas_ml, arquivo="API Mercado Livre", usuario_id=usuario_id
+    )
+
+
+@app.route("/ml/sincronizar", methods=["POST"])
+@login_required
+def sincronizar_ml_view():
+    job_id = _enfileirar_sync_ml(current_user.id)
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"job_id": job_id, "status_url": url_for("status_job", job_id=job_id)}), 202
+    flash(f"Sincronização com o Mercado Livre em andamento (job #{job_id}).", "info")
+    return redirect(url_for("acompanhar_job", job_id=job_id))
+
+
+def _aplicar_notificacoes_ml(topico, itens):
+    """Processa um lote da fila de notificações: ``itens`` é {id do recurso: user_id}."""
+    with engine.connect() as conn:
+        cfg = conn.execute(select(configuracoes).where(configuracoes.c.id == 1)).mappings().first()
+    if not cfg or not cfg["ml_access_token"]:
+        print(f"[NOTIFICAÇÕES ML] conta não conectada; {len(itens)} avisos ignorados")
+        return
+    # a rota já filtra; a conta pode ter mudado enquanto o aviso esperava na fila
+    ids = [i for i, user_id in itens.items() if user_id == str(cfg["ml_user_id"])]
+    if not ids:
+        return
+
+    cliente = _cliente_ml()
+    try:
+        if topico == "orders_v2":
+            df = pd.DataFrame(
+                [linha for pedido, envio in cliente.detalhar_pedidos(ids) for linha in linhas_planilha(pedido, envio)],
+                columns=COLUNAS_PLANILHA,
+            )
+            if df.empty:
+                return
+            with engine.connect() as conn:
+                mapas = _carregar_mapas_produtos(conn)
+            totais = _totais_vendas_ml()
+            # um lote por dia para as vendas que chegam pelas notificações
+            lote_id = f"{date.today().isoformat()} notificações ML"
+            _importar_bloco_vendas_ml(engine, df, lote_id, "atualizar", mapas, dict(_mapa_titulo_sku(df)), totais)
+            print(f"[NOTIFICAÇÕES ML] {len(ids)} pedidos: {totais['importadas']} novos, "
+                  f"{totais['atualizadas']} atualizados, {totais['inalteradas']} sem alteração")
+        elif topico == "items":
+            total = _gravar_anuncios_ml(cliente.anuncios(ids))
+            print(f"[NOTIFICAÇÕES ML] {total} anúncios atualizados")
+    finally:
+        cliente.fechar()
+
+
+def _gravar_anuncios_ml(itens):
+    """Grava (substitui) em ``ml_anuncios`` os anúncios vindos da API; retorna quantos."""
+    agora = datetime.now().isoformat(timespec="seconds")
+    registros = [
+        {
+            "item_id": item["id"],
+            "sku": sku_do_anuncio(item),
+            "titulo": item.get("title"),
+            "status": item.get("status"),
+            "estoque_ml": item.get("available_quantity"),
+            "atualizado_em": agora,
+        }
+        for item in itens
+    ]
+    if registros:
+        with engine.begin() as conn:
+            conn.execute(delete(ml_anuncios).where(ml_anuncios.c.item_id.in_([r["item_id"] for r in registros])))
+            conn.execute(insert(ml_anuncios), registros)
+    return len(registros)
+
+
+fila_notificacoes_ml = FilaNotificacoes(
+    _aplicar_notificacoes_ml,
+    janela=float(os.environ.get("ML_NOTIFICACOES_JANELA", "2")),
+    max_pendentes=int(os.environ.get("ML_NOTIFICACOES_MAX_PENDENTES", "10000")),
+)
+
+# (versão dos dados, ml_user_id da conta conectada) para a rota de notificações
+_vendedor_ml_cache = (None, "")
+
+
+def _vendedor_ml_conectado():
+    """``ml_user_id`` da conta conectada ("" sem conta); o banco só é relido quando a versão dos dados muda."""
+    global _vendedor_ml_cache
+    versao, vendedor = _vendedor_ml_cache
+    if versao != versao_dados.atual:
+        versao = versao_dados.atual
+        with engine.connect() as conn:
+            cfg = conn.execute(
+                select(configuracoes.c.ml_access_token, configuracoes.c.ml_user_id).where(configuracoes.c.id == 1)
+            ).first()
+        vendedor = str(cfg.ml_user_id) if cfg and cfg.ml_access_token and cfg.ml_user_id else ""
+        _vendedor_ml_cache = (versao, vendedor)
+    return vendedor
+
+
+@app.route("/ml/notificacoes", methods=["POST"])
+def notificacoes_ml():
+    """Webhook do Mercado Livre (orders_v2 / items): só enfileira e responde 200.
+
+    Sem login: quem chama é o ML. O ML reenvia o aviso se a resposta demorar
+    ou não for 200, por isso nada aqui chama a API. Avisos de outro vendedor
+    (ou sem ``user_id``, ou sem conta conectada) respondem 200 e não entram
+    na fila, que é limitada.
+    """
+    aviso = recurso_da_notificacao(request.get_json(silent=True) or {})
+    if aviso is not None:
+        vendedor = _vendedor_ml_conectado()
+        if vendedor and aviso[2] == vendedor:
+            fila_notificacoes_ml.adicionar(*aviso)
+        else:
+            fila_notificacoes_ml.stats["outra_conta"] += 1
+    return "", 200
+
+
+def carregar_anuncios_ml(cliente, vendedor, bloco=ML_SYNC_PEDIDOS_POR_BLOCO):
+    """Lê todos os anúncios do vendedor para ``ml_anuncios`` (SKU -> anúncio); retorna quantos."""
+    ids = cliente.ids_anuncios(vendedor)
+    total = 0
+    while True:
+        grupo = list(islice(ids, bloco))
+        if not grupo:
+            return total
+        total += _gravar_anuncios_ml(cliente.anuncios(grupo))
+
+
+def publicar_estoque_ml(engine: Engine, cliente=None):
+    """Envia para o ML o estoque dos produtos alterados desde o último envio (ver estoque_ml.py).
+
+    Sem nenhum anúncio em ``ml_anuncios`` (conta recém-conectada, sem
+    notificações de ``items`` ainda), os anúncios do vendedor são lidos antes.
+    """
+    with engine.connect() as conn:
+        cfg = conn.execute(select(configuracoes).where(configuracoes.c.id == 1)).mappings().first()
+        sem_anuncios = conn.execute(select(ml_anuncios.c.item_id).limit(1)).first() is None
+    if not cfg or not cfg["ml_access_token"] or not cfg["ml_user_id"]:
+        raise ValueError("Conta do Mercado Livre não conectada (ml_access_token / ml_user_id vazios).")
+
+    proprio = cliente is None
+    cliente = cliente or _cliente_ml()
+    try:
+        if sem_anuncios:
+            print(f"[ESTOQUE ML] {carregar_anuncios_ml(cliente, cfg['ml_user_id'])} anúncios carregados")
+        totais = estoque_ml.publicar(engine, cliente, progresso=registrar_progresso)
+    finally:
+        if proprio:
+            cliente.fechar()
+    print(f"[ESTOQUE ML] {totais['produtos']} produtos, {totais['chamadas']} gravações em anúncios: "
+          f"{totais['ok']} ok, {totais['inalterado']} sem mudança, {totais['sem_anuncio']} sem anúncio, "
+          f"{totais['erro']} recusados, {totais['falha']} com falha")
+    return totais
+
+
+def _job_publicar_estoque_ml():
+    resumo = publicar_estoque_ml(engine)
+    resumo["mensagem"] = (
+        f"Estoque enviado ao Mercado Livre: {resumo['ok']} produtos atualizados "
+        f"({resumo['chamadas']} gravações em anúncios), {resumo['inalterado']} já estavam iguais, "
+        f"{resumo['sem_anuncio']} sem anúncio, {resumo['erro']} recusados pelo ML, "
+        f"{resumo['falha']} com falha (ficam pendentes)."
+    )
+    resumo["categoria"] = "warning" if resumo["erro"] or resumo["falha"] else "success"
+    return resumo
+
+
+def _enfileirar_estoque_ml(usuario_id=None):
+    """Enfileira o envio do estoque se a conta do ML estiver conectada (retorna o id do job ou None).
+
+    Reaproveita um envio ainda pendente; um que já está em execução pode ter
+    passado pelos produtos alterados agora, então outro é enfileirado.
+    """
+    with engine.connect() as conn:
+        cfg = conn.execute(select(configuracoes).where(configuracoes.c.id == 1)).mappings().first()
+        if not cfg or not cfg["ml_access_token"] or not cfg["ml_user_id"]:
+            return None
+        aberto = conn.execute(
+            select(import_jobs.c.id)
+            .where(import_jobs.c.tipo == "estoque_ml", import_jobs.c.status == "pendente")
+            .order_by(import_jobs.c.id.desc())
+        ).scalar()
+    if aberto is not None and fila_importacao.obter(aberto)["status"] == "pendente":
+        return aberto
+    return fila_importacao.enviar(
+        "estoque_ml", _job_publicar_estoque_ml, arquivo="Estoque para o Mercado Livre", usuario_id=usuario_id
+    )
+
+
+@app.route("/ml/estoque/publicar", methods=["POST"])
+@login_required
+def publicar_estoque_ml_view():
+    job_id = _enfileirar_estoque_ml(current_user.id)
+    if job_id is None:
+        flash("Conta do Mercado Livre não conectada.", "warning")
         return redirect(url_for("importar_ml_view"))
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"job_id": job_id, "status_url": url_for("status_job", job_id=job_id)}), 202
+    flash(f"Envio do estoque para o Mercado Livre em andamento (job #{job_id}).", "info")
+    return redirect(url_for("acompanhar_job", job_id=job_id))
 
-    return render_template("importar_ml.html")
+
+_proxima_sync_ml = [0.0]
+
+
+@app.before_request
+def _sync_ml_automatica():
+    # no máximo uma consulta à configuração por intervalo, em cada processo
+    agora = time.monotonic()
+    if agora < _proxima_sync_ml[0]:
+        return
+    _proxima_sync_ml[0] = agora + ML_SYNC_INTERVALO_MIN * 60
+    with engine.connect() as conn:
+        cfg = conn.execute(
+            select(configuracoes.c.ml_sync_auto, configuracoes.c.ml_access_token).where(configuracoes.c.id == 1)
+        ).first()
+    if cfg and cfg.ml_sync_auto == "true" and cfg.ml_access_token:
+        _enfileirar_sync_ml()
 
 
 @app.route("/download_relatorio/<filename>")
@@ -2164,38 +2911,35 @@ def download_relatorio(filename):
 
 
 @app.route("/exportar_consolidado")
+@cache_relatorios.condicional
 @login_required
 def exportar_consolidado():
-    """Exporta planilha de consolidação das vendas."""
-    with engine.connect() as conn:
-        rows = conn.execute(
-            select(
-                vendas.c.id.label("ID Venda"),
-                vendas.c.data_venda.label("Data venda"),
-                produtos.c.nome.label("Produto"),
-                produtos.c.sku.label("SKU"),
-                vendas.c.quantidade.label("Quantidade"),
-                vendas.c.preco_venda_unitario.label("Preço unitário"),
-                vendas.c.receita_total.label("Receita total"),
-                vendas.c.custo_total.label("Custo total"),
-                vendas.c.margem_contribuicao.label("Margem contribuição"),
-                vendas.c.origem.label("Origem"),
-                vendas.c.numero_venda_ml.label("Nº venda ML"),
-                vendas.c.lote_importacao.label("Lote importação"),
-            ).select_from(vendas.join(produtos))
-        ).mappings().all()
-
-    df = pd.DataFrame(rows)
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Consolidado")
-    output.seek(0)
-
-    return send_file(
-        output,
-        as_attachment=True,
-        download_name=f"consolidado_vendas_{datetime.now().date()}.xlsx",
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    """Exporta planilha de consolidação das vendas (``?formato=xlsx|csv|csv.gz``)."""
+    consulta = (
+        select(
+            vendas.c.id.label("ID Venda"),
+            vendas.c.data_venda.label("Data venda"),
+            produtos.c.nome.label("Produto"),
+            produtos.c.sku.label("SKU"),
+            vendas.c.quantidade.label("Quantidade"),
+            vendas.c.preco_venda_unitario.label("Preço unitário"),
+            vendas.c.receita_total.label("Receita total"),
+            vendas.c.custo_total.label("Custo total"),
+            vendas.c.margem_contribuicao.label("Margem contribuição"),
+            vendas.c.origem.label("Origem"),
+            vendas.c.numero_venda_ml.label("Nº venda ML"),
+            vendas.c.lote_importacao.label("Lote importação"),
+        )
+        .select_from(vendas.join(produtos))
+        .order_by(vendas.c.id)
+    )
+    # as linhas vêm do banco em lotes, direto para o arquivo
+    return resposta_exportacao(
+        cabecalho_consulta(consulta),
+        linhas_consulta(engine, consulta),
+        f"consolidado_vendas_{datetime.now().date()}",
+        formato_da_requisicao(),
+        planilha="Consolidado",
     )
 
 
@@ -2204,22 +2948,13 @@ def exportar_consolidado():
 def exportar_template():
     """Exporta o modelo de planilha para preenchimento manual (SKU, Título, Quantidade, Receita, Comissao, PrecoMedio)."""
     cols = ["SKU", "Título", "Quantidade", "Receita", "Comissao", "PrecoMedio"]
-    df = pd.DataFrame(columns=cols)
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Template")
-    output.seek(0)
-    return send_file(
-        output,
-        as_attachment=True,
-        download_name="template_consolidacao_vendas.xlsx",
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    )
+    return resposta_exportacao(cols, [], "template_consolidacao_vendas", planilha="Template")
 
 
 # ---------------- ESTOQUE / AJUSTES ----------------
 # ---------------- ESTOQUE / AJUSTES ----------------
 @app.route("/estoque")
+@cache_relatorios.rota
 @login_required
 def estoque_view():
     """Visão de estoque com médias reais dos últimos 30 dias
@@ -2233,170 +2968,112 @@ def estoque_view():
     hoje = datetime.now()
     limite_30dias = hoje - timedelta(days=JANELA_DIAS)
 
+    resumo = vendas_resumo_diario
+
+    # vendas dos últimos 30 dias por produto (dias inteiros; faixa no índice de dia do resumo)
+    janela = (
+        select(resumo.c.produto_id, func.sum(resumo.c.qtd).label("qtd"))
+        .where(*_filtro_resumo(limite_30dias.date().isoformat(), hoje.date().isoformat()))
+        .group_by(resumo.c.produto_id)
+        .subquery("janela")
+    )
+    # agregado histórico por produto (para estimar ticket, comissão, etc.)
+    historico = (
+        select(
+            resumo.c.produto_id,
+            func.sum(resumo.c.qtd).label("qtd"),
+            func.sum(resumo.c.receita).label("receita"),
+            func.sum(resumo.c.custo).label("custo"),
+            func.sum(resumo.c.margem).label("margem"),
+        )
+        .group_by(resumo.c.produto_id)
+        .subquery("historico")
+    )
+
     with engine.connect() as conn:
-        # Produtos
-        produtos_rows = conn.execute(
+        # produtos com a janela de 30 dias e o histórico numa única consulta
+        result = conn.execute(
             select(
                 produtos.c.id,
                 produtos.c.nome,
                 produtos.c.sku,
-                produtos.c.estoque_atual,
-                produtos.c.custo_unitario,
-            ).order_by(produtos.c.nome)
-        ).mappings().all()
-
-        # Vendas (para média dos últimos 30 dias)
-        vendas_rows = conn.execute(
-            select(
-                vendas.c.produto_id,
-                vendas.c.data_venda,
-                vendas.c.quantidade,
+                func.coalesce(produtos.c.estoque_atual, 0).label("estoque_atual"),
+                func.coalesce(produtos.c.custo_unitario, 0).label("custo_unitario"),
+                func.coalesce(janela.c.qtd, 0).label("qtd_30dias"),
+                func.coalesce(historico.c.qtd, 0).label("qtd_hist"),
+                func.coalesce(historico.c.receita, 0).label("receita_hist"),
+                func.coalesce(historico.c.custo, 0).label("custo_hist"),
+                func.coalesce(historico.c.margem, 0).label("margem_hist"),
             )
-        ).mappings().all()
+            .select_from(
+                produtos
+                .outerjoin(janela, janela.c.produto_id == produtos.c.id)
+                .outerjoin(historico, historico.c.produto_id == produtos.c.id)
+            )
+            .order_by(produtos.c.nome)
+        )
+        df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
 
         # Configurações de imposto e despesas
         cfg = conn.execute(
             select(configuracoes).where(configuracoes.c.id == 1)
         ).mappings().first() or {}
 
-        imposto_percent = float(cfg.get("imposto_percent") or 0)
-        despesas_percent = float(cfg.get("despesas_percent") or 0)
-
-        # Agregado histórico de vendas por produto (para estimar ticket, comissao, etc.)
-        vendas_historico = conn.execute(
-            select(
-                vendas.c.produto_id,
-                func.coalesce(func.sum(vendas.c.quantidade), 0).label("qtd"),
-                func.coalesce(func.sum(vendas.c.receita_total), 0).label("receita"),
-                func.coalesce(func.sum(vendas.c.custo_total), 0).label("custo"),
-                func.coalesce(func.sum(vendas.c.margem_contribuicao), 0).label("margem_atual"),
-            )
-            .group_by(vendas.c.produto_id)
-        ).mappings().all()
-
-    # Indexa histórico por produto_id
-    hist_por_produto = {h["produto_id"]: h for h in vendas_historico}
-
-    # Soma das vendas por produto dentro da janela (últimos 30 dias)
-    vendas_por_produto = {}
-
-    for v in vendas_rows:
-        pid = v["produto_id"]
-        qtd = int(v["quantidade"] or 0)
-        data_raw = v["data_venda"]
-
-        if not data_raw:
-            continue
-        dt = parse_data_venda(data_raw)
-        if not dt:
-            try:
-                dt = datetime.fromisoformat(str(data_raw))
-            except Exception:
-                continue
-
-        # só considera vendas dentro dos últimos 30 dias
-        if dt < limite_30dias or dt > hoje:
-            continue
-
-        vendas_por_produto[pid] = vendas_por_produto.get(pid, 0) + qtd
-
-    # Construção da tabela / totais
-    produtos_enriquecidos = []
-
-    total_unidades_estoque = 0.0
-    total_custo_estoque = 0.0
-
-    # novos totais:
-    receita_potencial_total = 0.0      # receita bruta - comissão ML (estoque)
-    lucro_estimado_total = 0.0         # lucro líquido estimado (estoque)
-
-    for p in produtos_rows:
-        pid = p["id"]
-        estoque_atual = float(p["estoque_atual"] or 0)
-        qtd_30dias = float(vendas_por_produto.get(pid, 0))
-        custo_unitario = float(p["custo_unitario"] or 0)
-        custo_estoque = estoque_atual * custo_unitario
-
-        # Média diária usando 30 dias
-        media_diaria = qtd_30dias / 30.0
-        media_mensal = media_diaria * 30.0
-
-        # Cobertura
-        dias_cobertura = estoque_atual / media_diaria if media_diaria > 0 else None
-        precisa_repor = dias_cobertura is not None and dias_cobertura < DIAS_MINIMOS
-
-        # -------- CÁLCULOS ESTIMADOS COM BASE NO HISTÓRICO --------
-        h = hist_por_produto.get(pid)
-        lucro_potencial = 0.0          # lucro líquido estimado por produto (estoque)
-        retorno_percent = 0.0
-        receita_potencial_prod = 0.0   # receita bruta - comissão ML (estoque)
-
-        if h:
-            qtd_vendida = float(h["qtd"] or 0)
-            receita_total = float(h["receita"] or 0)
-            custo_total = float(h["custo"] or 0)
-            margem_atual = float(h["margem_atual"] or 0)
-
-            # Comissão ML estimada (mesma lógica do relatório de lucro)
-            comissao_ml_total = max(0.0, (receita_total - custo_total) - margem_atual)
-
-            imposto_val_total = receita_total * (imposto_percent / 100.0)
-            despesas_val_total = receita_total * (despesas_percent / 100.0)
-
-            lucro_liquido_total_hist = (
-                receita_total
-                - custo_total
-                - comissao_ml_total
-                - imposto_val_total
-                - despesas_val_total
-            )
+    imposto_percent = float(cfg.get("imposto_percent") or 0)
+    despesas_percent = float(cfg.get("despesas_percent") or 0)
+
+    def _dividir(a, b):
+        return np.divide(a, b, out=np.zeros(len(a)), where=b > 0)
+
+    # ---------- tabela enriquecida, calculada por colunas ----------
+    estoque_atual = df["estoque_atual"].to_numpy(dtype=float)
+    custo_unitario = df["custo_unitario"].to_numpy(dtype=float)
+    custo_estoque = estoque_atual * custo_unitario
+
+    # Média diária usando 30 dias e cobertura
+    media_diaria = df["qtd_30dias"].to_numpy(dtype=float) / 30.0
+    media_mensal = media_diaria * 30.0
+    dias_cobertura = _dividir(estoque_atual, media_diaria)
+    tem_giro = media_diaria > 0
+    precisa_repor = tem_giro & (dias_cobertura < DIAS_MINIMOS)
+
+    # Estimativas com base no histórico (mesma lógica do relatório de lucro),
+    # por unidade vendida * estoque atual
+    historico_lucro = calcular_lucro(
+        {
+            "qtd": df["qtd_hist"],
+            "receita": df["receita_hist"],
+            "custo": df["custo_hist"],
+            "margem": df["margem_hist"],
+        },
+        imposto_percent,
+        despesas_percent,
+    )
+    receita_potencial = historico_lucro["receita_liquida_unit"].to_numpy() * estoque_atual
+    lucro_potencial = historico_lucro["lucro_unit"].to_numpy() * estoque_atual
+    retorno_percent = _dividir(lucro_potencial, custo_estoque) * 100.0
+
+    tabela = pd.DataFrame({
+        "id": df["id"],
+        "nome": df["nome"],
+        "sku": df["sku"],
+        "estoque_atual": estoque_atual,
+        "custo_unitario": custo_unitario,
+        "custo_estoque": custo_estoque,
+        "media_diaria": media_diaria,
+        "media_mensal": media_mensal,
+        # sem vendas na janela: cobertura indefinida
+        "dias_cobertura": pd.Series(dias_cobertura, dtype=object).where(tem_giro, None),
+        "precisa_repor": precisa_repor,
+        "lucro_potencial": lucro_potencial,
+        "retorno_percent": retorno_percent,
+    })
+    produtos_enriquecidos = tabela.to_dict("records")
 
-            if qtd_vendida > 0:
-                receita_unit = receita_total / qtd_vendida
-                custo_unit_hist = custo_total / qtd_vendida
-                comissao_unit = comissao_ml_total / qtd_vendida
-                imposto_unit = imposto_val_total / qtd_vendida
-                despesas_unit = despesas_val_total / qtd_vendida
-
-                # Receita potencial = receita bruta - comissão ML (por unidade * estoque)
-                receita_potencial_prod = (receita_unit - comissao_unit) * estoque_atual
-
-                # Lucro líquido estimado (igual ao lucro_potencial que já existia)
-                lucro_liquido_unitario = (
-                    receita_unit
-                    - custo_unit_hist
-                    - comissao_unit
-                    - imposto_unit
-                    - despesas_unit
-                )
-                lucro_potencial = lucro_liquido_unitario * estoque_atual
-            else:
-                receita_potencial_prod = 0.0
-                lucro_potencial = 0.0
-
-            if custo_estoque > 0:
-                retorno_percent = (lucro_potencial / custo_estoque) * 100.0
-
-        # acumula totais globais
-        total_unidades_estoque += estoque_atual
-        total_custo_estoque += custo_estoque
-        receita_potencial_total += receita_potencial_prod
-        lucro_estimado_total += lucro_potencial
-
-        produtos_enriquecidos.append({
-            "id": pid,
-            "nome": p["nome"],
-            "sku": p["sku"],
-            "estoque_atual": estoque_atual,
-            "custo_unitario": custo_unitario,
-            "custo_estoque": custo_estoque,
-            "media_diaria": media_diaria,
-            "media_mensal": media_mensal,
-            "dias_cobertura": dias_cobertura,
-            "precisa_repor": precisa_repor,
-            "lucro_potencial": lucro_potencial,
-            "retorno_percent": retorno_percent,
-        })
+    total_unidades_estoque = float(estoque_atual.sum())
+    total_custo_estoque = float(custo_estoque.sum())
+    receita_potencial_total = float(receita_potencial.sum())  # receita bruta - comissão ML (estoque)
+    lucro_estimado_total = float(lucro_potencial.sum())         # lucro líquido estimado (estoque)
 
     # Percentual de lucro global (lucro estimado / custo do estoque)
     if total_custo_estoque > 0:
@@ -2505,7 +3182,9 @@ def ajuste_estoque():
                 observacao=observacao,
             )
         )
+        estoque_ml.marcar(conn, produtos.c.id == produto_id)
 
+    _enfileirar_estoque_ml()
     flash("Ajuste de estoque registrado com custo médio atualizado!", "success")
     return redirect(url_for("estoque_view"))
 @app.route("/ajuste_estoque")
@@ -2537,231 +3216,60 @@ def configuracoes_view():
     return render_template("configuracoes.html", cfg=cfg)
 
 
-# ---------------- RELATÓRIO LUCRO ----------------
-@app.route("/relatorio_lucro")
-@login_required
-def relatorio_lucro():
-    """Relatório de lucro detalhado por produto, com filtro de período."""
-    data_inicio = request.args.get("data_inicio") or ""
-    data_fim = request.args.get("data_fim") or ""
-    if not data_inicio and not data_fim:
-        hoje = date.today()
-        inicio_mes = hoje.replace(day=1)
-        data_inicio = inicio_mes.isoformat()
-        data_fim = hoje.isoformat()
-    # calcular meses no período (inclusivo)
-    def _months_inclusive(start_str, end_str):
-        try:
-            d1 = date.fromisoformat(start_str)
-            d2 = date.fromisoformat(end_str)
-            months = (d2.year - d1.year) * 12 + (d2.month - d1.month) + 1
-            return max(1, months)
-        except Exception:
-            return 1
-
-    meses = _months_inclusive(data_inicio, data_fim)
-
-    with engine.connect() as conn:
-        cfg = conn.execute(
-            select(configuracoes).where(configuracoes.c.id == 1)
-        ).mappings().first() or {}
-        imposto_percent = float(cfg.get("imposto_percent") or 0)
-        despesas_percent = float(cfg.get("despesas_percent") or 0)
-        query = (
-            select(
-                produtos.c.id.label("produto_id"),
-                produtos.c.nome.label("produto"),
-                produtos.c.publicidade.label("publicidade"),
-                func.sum(vendas.c.quantidade).label("qtd"),
-                func.sum(vendas.c.receita_total).label("receita"),
-                func.sum(vendas.c.custo_total).label("custo"),
-                func.sum(vendas.c.margem_contribuicao).label("margem_atual"),
-            )
-            .select_from(vendas.join(produtos))
-            .where(vendas.c.receita_total > 0)
-        )
-        if data_inicio:
-            query = query.where(vendas.c.data_venda >= data_inicio)
-        if data_fim:
-            query = query.where(vendas.c.data_venda <= data_fim + "T23:59:59")
-        query = query.group_by(produtos.c.id)
-        rows = conn.execute(query).mappings().all()
-    linhas = []
-    totais = {"qtd": 0.0, "receita": 0.0, "custo": 0.0, "comissao": 0.0, "imposto": 0.0, "despesas": 0.0, "publicidade": 0.0, "margem_liquida": 0.0}
-    for r in rows:
-        receita = float(r["receita"] or 0)
-        custo = float(r["custo"] or 0)
-        margem_atual = float(r["margem_atual"] or 0)
-        # publicidade é mensal por produto -> multiplicar pelos meses do período
-        publicidade_prod = float(r["publicidade"] or 0) * meses
-        comissao_ml = max(0.0, (receita - custo) - margem_atual)
-        imposto_val = receita * (imposto_percent / 100.0)
-        despesas_val = receita * (despesas_percent / 100.0)
-        margem_liquida = receita - custo - comissao_ml - imposto_val - despesas_val - publicidade_prod
-        qtd = float(r["qtd"] or 0)
-        receita_liquida_unit = (receita - comissao_ml) / qtd if qtd > 0 else 0.0
-        comissao_unit = comissao_ml / qtd if qtd > 0 else 0.0
-        custo_unit = custo / qtd if qtd > 0 else 0.0
-        lucro_unit = margem_liquida / qtd if qtd > 0 else 0.0
-        linha = {
-            "produto_id": r["produto_id"],
-            "produto": r["produto"],
-            "qtd": qtd,
-            "receita": receita,
-            "custo": custo,
-            "custo_unit": custo_unit,
-            "comissao": comissao_ml,
-            "comissao_unit": comissao_unit,
-            "receita_liquida_unit": receita_liquida_unit,
-            "imposto": imposto_val,
-            "despesas": despesas_val,
-            "publicidade": publicidade_prod,
-            "margem_liquida": margem_liquida,
-            "lucro_unit": lucro_unit,
-        }
-        linhas.append(linha)
-        totais["qtd"] += linha["qtd"]
-        totais["receita"] += receita
-        totais["custo"] += custo
-        totais["comissao"] += comissao_ml
-        totais["imposto"] += imposto_val
-        totais["despesas"] += despesas_val
-        totais["publicidade"] += publicidade_prod
-        totais["margem_liquida"] += margem_liquida
-    linhas.sort(key=lambda x: x["margem_liquida"], reverse=True)
-    return render_template(
-        "relatorio_lucro.html",
-        linhas=linhas,
-        totais=totais,
-        imposto_percent=imposto_percent,
-        despesas_percent=despesas_percent,
-        data_inicio=data_inicio,
-        data_fim=data_fim,
-    )
-    # Nova rota para atualizar publicidade de produto
-    @app.route('/relatorio_lucro/publicidade_produto', methods=['POST'])
-    @login_required
-    def relatorio_lucro_publicidade_produto():
-        produto_id = request.form.get('produto_id')
-        val = request.form.get('publicidade')
-        try:
-            v = float(val) if val not in (None, '') else 0.0
-        except Exception:
-            flash('Valor de publicidade inválido', 'danger')
-            return redirect(url_for('relatorio_lucro'))
-        with engine.begin() as conn:
-            try:
-                conn.execute(update(produtos).where(produtos.c.id == produto_id).values(publicidade=v))
-                flash('Publicidade do produto atualizada.', 'success')
-            except Exception as e:
-                flash(f'Erro ao salvar publicidade: {e}', 'danger')
-        return redirect(url_for('relatorio_lucro'))
-    """Relatório de lucro detalhado por produto, com filtro de período.
-
-    Por padrão: mês vigente (do dia 1 até hoje).
-    Margem líquida = Receita - Comissão ML - Custo - Despesas - Imposto
+# ---------------- RELATÓRIO LUCRO ----------------
+def _lucro_por_produto(conn, data_inicio, data_fim, imposto_percent, despesas_percent):
+    """Lucro por produto no período (sem canceladas), a partir do resumo diário.
+
+    DataFrame com as colunas de ``calcular_lucro``, do maior lucro para o menor.
     """
+    resumo = vendas_resumo_diario
+    query = (
+        select(
+            produtos.c.id.label("produto_id"),
+            produtos.c.nome.label("produto"),
+            produtos.c.publicidade.label("publicidade"),
+            func.sum(resumo.c.qtd).label("qtd"),
+            func.sum(resumo.c.receita).label("receita"),
+            func.sum(resumo.c.custo).label("custo"),
+            func.sum(resumo.c.margem).label("margem"),
+        )
+        .select_from(resumo.join(produtos, resumo.c.produto_id == produtos.c.id))
+        .where(resumo.c.cancelada == 0, *_filtro_resumo(data_inicio, data_fim))
+        .group_by(produtos.c.id)
+    )
+    result = conn.execute(query)
+    df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+    # publicidade é mensal por produto -> multiplicar pelos meses do período
+    df = calcular_lucro(df, imposto_percent, despesas_percent, meses_no_periodo(data_inicio, data_fim))
+    return df.sort_values("lucro_liquido", ascending=False, kind="stable")
+
 
-    # --- período: vem da URL ou cai para mês vigente ---
+@app.route("/relatorio_lucro")
+@cache_relatorios.rota
+@login_required
+def relatorio_lucro():
+    """Relatório de lucro detalhado por produto, com filtro de período."""
     data_inicio = request.args.get("data_inicio") or ""
     data_fim = request.args.get("data_fim") or ""
-
     if not data_inicio and not data_fim:
         hoje = date.today()
         inicio_mes = hoje.replace(day=1)
         data_inicio = inicio_mes.isoformat()
         data_fim = hoje.isoformat()
-
     with engine.connect() as conn:
         cfg = conn.execute(
-            select(configuracoes)
-            .where(configuracoes.c.id == 1)
+            select(configuracoes).where(configuracoes.c.id == 1)
         ).mappings().first() or {}
-
         imposto_percent = float(cfg.get("imposto_percent") or 0)
         despesas_percent = float(cfg.get("despesas_percent") or 0)
+        df = _lucro_por_produto(conn, data_inicio, data_fim, imposto_percent, despesas_percent)
 
-        # monta query com filtro de datas (EXCLUINDO VENDAS CANCELADAS)
-        query = (
-            select(
-                produtos.c.nome.label("produto"),
-                func.sum(vendas.c.quantidade).label("qtd"),
-                func.sum(vendas.c.receita_total).label("receita"),
-                func.sum(vendas.c.custo_total).label("custo"),
-                func.sum(vendas.c.margem_contribuicao).label("margem_atual"),
-            )
-            .select_from(vendas.join(produtos))
-            .where(vendas.c.receita_total > 0)  # Excluir vendas canceladas
-        )
-
-        if data_inicio:
-            query = query.where(vendas.c.data_venda >= data_inicio)
-        if data_fim:
-            query = query.where(vendas.c.data_venda <= data_fim + "T23:59:59")
-
-        query = query.group_by(produtos.c.id)
-        rows = conn.execute(query).mappings().all()
-
-    linhas = []
+    linhas = df.rename(columns={"lucro_liquido": "margem_liquida"}).to_dict("records")
     totais = {
-        "qtd": 0.0,
-        "receita": 0.0,
-        "custo": 0.0,
-        "comissao": 0.0,
-        "imposto": 0.0,
-        "despesas": 0.0,
-        "publicidade": 0.0,
-        "margem_liquida": 0.0,
+        coluna: float(df[coluna].sum())
+        for coluna in ("qtd", "receita", "custo", "comissao", "imposto", "despesas", "publicidade")
     }
-
-    for r in rows:
-        receita = float(r["receita"] or 0)
-        custo = float(r["custo"] or 0)
-        margem_atual = float(r["margem_atual"] or 0)
-
-        # Comissão estimada do ML
-        comissao_ml = max(0.0, (receita - custo) - margem_atual)
-
-        imposto_val = receita * (imposto_percent / 100.0)
-        despesas_val = receita * (despesas_percent / 100.0)
-
-        margem_liquida = receita - custo - comissao_ml - imposto_val - despesas_val
-        
-        # Receita Líquida por Unidade (Receita - Comissão ML) / Quantidade
-        qtd = float(r["qtd"] or 0)
-        receita_liquida_unit = (receita - comissao_ml) / qtd if qtd > 0 else 0.0
-        comissao_unit = comissao_ml / qtd if qtd > 0 else 0.0
-        custo_unit = custo / qtd if qtd > 0 else 0.0
-        lucro_unit = margem_liquida / qtd if qtd > 0 else 0.0
-
-        linha = {
-            "produto": r["produto"],
-            "qtd": qtd,
-            "receita": receita,
-            "custo": custo,
-            "custo_unit": custo_unit,
-            "comissao": comissao_ml,
-            "comissao_unit": comissao_unit,
-            "receita_liquida_unit": receita_liquida_unit,
-            "imposto": imposto_val,
-            "despesas": despesas_val,
-            "margem_liquida": margem_liquida,
-            "lucro_unit": lucro_unit,
-        }
-        linhas.append(linha)
-
-        totais["qtd"] += linha["qtd"]
-        totais["receita"] += receita
-        totais["custo"] += custo
-        totais["comissao"] += comissao_ml
-        totais["imposto"] += imposto_val
-        totais["despesas"] += despesas_val
-        totais["publicidade"] += publicidade_prod
-        totais["margem_liquida"] += margem_liquida
-
-    # Ordena do maior lucro líquido para o menor
-    linhas.sort(key=lambda x: x["margem_liquida"], reverse=True)
-
+    totais["margem_liquida"] = float(df["lucro_liquido"].sum())
     return render_template(
         "relatorio_lucro.html",
         linhas=linhas,
@@ -2770,9 +3278,11 @@ def relatorio_lucro():
         despesas_percent=despesas_percent,
         data_inicio=data_inicio,
         data_fim=data_fim,
-        publicidade=float(cfg.get("publicidade") or 0.0),
     )
+
+
 @app.route("/relatorio_lucro/exportar")
+@cache_relatorios.condicional
 @login_required
 def relatorio_lucro_exportar():
     # mesmo critério de período do relatorio_lucro
@@ -2785,6 +3295,41 @@ def relatorio_lucro_exportar():
         data_inicio = inicio_mes.isoformat()
         data_fim = hoje.isoformat()
 
+    with engine.connect() as conn:
+        cfg = conn.execute(
+            select(configuracoes)
+            .where(configuracoes.c.id == 1)
+        ).mappings().first() or {}
+
+        imposto_percent = float(cfg.get("imposto_percent") or 0)
+        despesas_percent = float(cfg.get("despesas_percent") or 0)
+
+        df = _lucro_por_produto(conn, data_inicio, data_fim, imposto_percent, despesas_percent)
+
+    colunas = {
+        "produto": "Produto",
+        "qtd": "Quantidade",
+        "receita": "Receita (R$)",
+        "custo": "Custo (R$)",
+        "custo_unit": "Custo/Un. (R$)",
+        "comissao": "Comissão ML (R$)",
+        "comissao_unit": "Comissão/Un. (R$)",
+        "receita_liquida_unit": "Receita Líq./Un. (R$)",
+        "imposto": "Imposto (R$)",
+        "despesas": "Despesas (R$)",
+        "publicidade": "Publicidade (R$)",
+        "lucro_liquido": "Lucro líquido (R$)",
+        "lucro_unit": "Lucro Líq./Un. (R$)",
+    }
+    # uma linha por produto (já agregada no banco); só a escrita é em streaming
+    return resposta_exportacao(
+        list(colunas.values()),
+        df[list(colunas)].itertuples(index=False, name=None),
+        f"relatorio_lucro_{datetime.now().date()}",
+        formato_da_requisicao(),
+        planilha="RelatorioLucro",
+    )
+
 
 @app.route('/relatorio_lucro/publicidade', methods=['POST'])
 @login_required
@@ -2825,86 +3370,68 @@ def relatorio_lucro_publicidade_produto():
         except Exception as e:
             flash(f'Erro ao salvar publicidade: {e}', 'danger')
     return redirect(url_for('relatorio_lucro'))
+# --------------------------------------------------------------------
+# Inicialização
+# --------------------------------------------------------------------
+init_db()
+# banco novo (deploy): carrega os .ndjson.gz do export_data.py, se a pasta estiver configurada
+if os.environ.get("AUTO_IMPORT_DIR"):
+    auto_import_data_if_empty(engine, os.environ["AUTO_IMPORT_DIR"])
+    with engine.begin() as conn:
+        # as vendas importadas entram no resumo diário dos relatórios
+        _carregar_resumo_se_vazio(conn)
 
-    with engine.connect() as conn:
-        cfg = conn.execute(
-            select(configuracoes)
-            .where(configuracoes.c.id == 1)
-        ).mappings().first() or {}
-
-        imposto_percent = float(cfg.get("imposto_percent") or 0)
-        despesas_percent = float(cfg.get("despesas_percent") or 0)
+fila_importacao = FilaImportacao(engine, import_jobs, max_workers=os.environ.get("IMPORT_WORKERS", "1"))
+fila_importacao.marcar_orfaos()
+# backups têm fila própria, para não esperar uma importação longa terminar
+fila_backup = FilaImportacao(engine, import_jobs, max_workers=1)
 
-        query = (
-            select(
-                produtos.c.nome.label("produto"),
-                func.sum(vendas.c.quantidade).label("qtd"),
-                func.sum(vendas.c.receita_total).label("receita"),
-                func.sum(vendas.c.custo_total).label("custo"),
-                func.sum(vendas.c.margem_contribuicao).label("margem_atual"),
-            )
-            .select_from(vendas.join(produtos))
-            .where(vendas.c.receita_total > 0)  # Excluir vendas canceladas
-        )
 
-        if data_inicio:
-            query = query.where(vendas.c.data_venda >= data_inicio)
-        if data_fim:
-            query = query.where(vendas.c.data_venda <= data_fim + "T23:59:59")
+# --------------------------------------------------------------------
+# Jobs de importação em segundo plano
+# --------------------------------------------------------------------
+def _salvar_upload(file):
+    """Grava o arquivo enviado em UPLOAD_FOLDER com prefixo de data/hora (evita que
+    dois uploads com o mesmo nome se sobrescrevam enquanto o job está na fila)."""
+    filename = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{secure_filename(file.filename)}"
+    caminho = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+    file.save(caminho)
+    return caminho, filename
 
-        query = query.group_by(produtos.c.id)
-        rows = conn.execute(query).mappings().all()
 
-    linhas_export = []
+def _enfileirar_importacao(tipo, funcao, caminho, filename, **kwargs):
+    """Coloca a importação na fila e responde na hora com o id do job.
 
-    for r in rows:
-        receita = float(r["receita"] or 0)
-        custo = float(r["custo"] or 0)
-        margem_atual = float(r["margem_atual"] or 0)
-        qtd = float(r["qtd"] or 0)
-
-        comissao_ml = max(0.0, (receita - custo) - margem_atual)
-        imposto_val = receita * (imposto_percent / 100.0)
-        despesas_val = receita * (despesas_percent / 100.0)
-        margem_liquida = receita - custo - comissao_ml - imposto_val - despesas_val
-        
-        # Receita Líquida por Unidade e Comissão Unitária
-        receita_liquida_unit = (receita - comissao_ml) / qtd if qtd > 0 else 0.0
-        comissao_unit = comissao_ml / qtd if qtd > 0 else 0.0
-        custo_unit = custo / qtd if qtd > 0 else 0.0
-        lucro_unit = margem_liquida / qtd if qtd > 0 else 0.0
-
-        linhas_export.append({
-            "Produto": r["produto"],
-            "Quantidade": qtd,
-            "Receita (R$)": receita,
-            "Custo (R$)": custo,
-            "Custo/Un. (R$)": custo_unit,
-            "Comissão ML (R$)": comissao_ml,
-            "Comissão/Un. (R$)": comissao_unit,
-            "Receita Líq./Un. (R$)": receita_liquida_unit,
-            "Imposto (R$)": imposto_val,
-            "Despesas (R$)": despesas_val,
-            "Lucro líquido (R$)": margem_liquida,
-            "Lucro Líq./Un. (R$)": lucro_unit,
-        })
-
-    df = pd.DataFrame(linhas_export)
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="RelatorioLucro")
-    output.seek(0)
-
-    return send_file(
-        output,
-        as_attachment=True,
-        download_name=f"relatorio_lucro_{datetime.now().date()}.xlsx",
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    Clientes que pedem JSON recebem 202 + id; o navegador vai para a página
+    que acompanha o progresso.
+    """
+    job_id = fila_importacao.enviar(
+        tipo, funcao, caminho, arquivo=filename, usuario_id=current_user.id, **kwargs
     )
-# --------------------------------------------------------------------
-# Inicialização
-# --------------------------------------------------------------------
-init_db()
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"job_id": job_id, "status_url": url_for("status_job", job_id=job_id)}), 202
+    flash(f"Arquivo recebido. Importação em andamento (job #{job_id}).", "info")
+    return redirect(url_for("acompanhar_job", job_id=job_id))
+
+
+@app.route("/jobs/<int:job_id>")
+@login_required
+def status_job(job_id):
+    """Estado do job de importação em JSON (status, linhas processadas, tempos e resultado)."""
+    job = fila_importacao.obter(job_id)
+    if job is None:
+        return jsonify({"erro": "Job não encontrado."}), 404
+    return jsonify(job)
+
+
+@app.route("/jobs/<int:job_id>/acompanhar")
+@login_required
+def acompanhar_job(job_id):
+    job = fila_importacao.obter(job_id)
+    if job is None:
+        flash("Job não encontrado.", "danger")
+        return redirect(url_for("dashboard"))
+    return render_template("job_importacao.html", job=job)
 
 
 
@@ -2928,23 +3455,21 @@ def _parse_iso_or_none(value):
         return None
 
 
-def importar_settlement_mp(caminho_arquivo, engine: Engine):
+def importar_settlement_mp(caminho_arquivo, engine: Engine, tamanho_bloco=TAMANHO_BLOCO_PADRAO):
     lote_id = datetime.now().isoformat(timespec="seconds")
 
-    df = pd.read_excel(caminho_arquivo)
-    # normaliza colunas
-    df.columns = [str(c).strip().upper() for c in df.columns]
+    # normaliza colunas (só o cabeçalho; as linhas são lidas em blocos mais abaixo)
+    colunas = [str(c).strip().upper() for c in colunas_excel(caminho_arquivo)]
 
-    print(f"DEBUG: Colunas detectadas: {list(df.columns)}")
-    print(f"DEBUG: Primeiras linhas:\n{df.head()}")
+    print(f"DEBUG: Colunas detectadas: {colunas}")
 
     # Detecta qual formato de arquivo é
-    is_new_format = "RELEASE_DATE" in df.columns and "REFERENCE_ID" in df.columns
-    is_bank_summary_format = "INITIAL_BALANCE" in df.columns or "CREDITS" in df.columns or "DEBITS" in df.columns or "FINAL_BALANCE" in df.columns
+    is_new_format = "RELEASE_DATE" in colunas and "REFERENCE_ID" in colunas
+    is_bank_summary_format = "INITIAL_BALANCE" in colunas or "CREDITS" in colunas or "DEBITS" in colunas or "FINAL_BALANCE" in colunas
     
     # Se for novo formato MP Full, redireciona
     if is_new_format:
-        return importar_mp_full_excel(caminho_arquivo, engine)
+        return importar_mp_full_excel(caminho_arquivo, engine, tamanho_bloco=tamanho_bloco)
     
     # Se for resumo bancário, processa como movimento
     if is_bank_summary_format:
@@ -2952,30 +3477,20 @@ def importar_settlement_mp(caminho_arquivo, engine: Engine):
 
     # Validação para formato antigo
     # Tenta encontrar as colunas (case-insensitive)
-    id_col = next((c for c in df.columns if "ID" in c and "TRANSAÇÃO" in c.upper() or "ID TRANSACAO" in c.upper()), None)
-    tipo_col = next((c for c in df.columns if "TIPO" in c and ("TRANSAÇÃO" in c.upper() or "TRANSACAO" in c.upper() or "TRANSACTION_TYPE" in c.upper())), None)
-    valor_col = next((c for c in df.columns if "VALOR" in c and ("LÍQUIDO" in c.upper() or "LIQUIDO" in c.upper() or "TRANSACTION_NET_AMOUNT" in c.upper())), None)
-    data_col = next((c for c in df.columns if "DATA" in c and ("LIBERAÇÃO" in c.upper() or "LIBERACAO" in c.upper() or "RELEASE_DATE" in c.upper())), None)
+    id_col = next((c for c in colunas if "ID" in c and "TRANSAÇÃO" in c.upper() or "ID TRANSACAO" in c.upper()), None)
+    tipo_col = next((c for c in colunas if "TIPO" in c and ("TRANSAÇÃO" in c.upper() or "TRANSACAO" in c.upper() or "TRANSACTION_TYPE" in c.upper())), None)
+    valor_col = next((c for c in colunas if "VALOR" in c and ("LÍQUIDO" in c.upper() or "LIQUIDO" in c.upper() or "TRANSACTION_NET_AMOUNT" in c.upper())), None)
+    data_col = next((c for c in colunas if "DATA" in c and ("LIBERAÇÃO" in c.upper() or "LIBERACAO" in c.upper() or "RELEASE_DATE" in c.upper())), None)
 
     if not id_col or not tipo_col or not valor_col:
         missing = []
         if not id_col: missing.append("ID DA TRANSAÇÃO")
         if not tipo_col: missing.append("TIPO DE TRANSAÇÃO")
         if not valor_col: missing.append("VALOR LÍQUIDO DA TRANSAÇÃO")
-        raise ValueError(f"❌ Formato de arquivo não reconhecido. Colunas encontradas: {', '.join(df.columns)}. "
+        raise ValueError(f"❌ Formato de arquivo não reconhecido. Colunas encontradas: {', '.join(colunas)}. "
                         f"Envie um arquivo com: ID DA TRANSAÇÃO, TIPO DE TRANSAÇÃO, VALOR LÍQUIDO DA TRANSAÇÃO (formato antigo) "
                         f"OU RELEASE_DATE, TRANSACTION_TYPE, REFERENCE_ID, TRANSACTION_NET_AMOUNT (formato MP Full).")
 
-    # normaliza coluna UF se existir
-    try:
-        uf_col, not_rec = normalize_df_uf(df)
-        if uf_col and not_rec:
-            rpt_path = os.path.join(app.config["UPLOAD_FOLDER"], f"uf_not_recognized_settlement_{lote_id}.csv")
-            pd.DataFrame([{'original': o, 'converted': c} for o, c in not_rec]).to_csv(rpt_path, index=False)
-            print(f"Relatório UF não reconhecidos salvo em: {rpt_path}")
-    except Exception:
-        pass
-
     importadas = 0
     atualizadas = 0
     ignoradas = 0
@@ -2983,98 +3498,122 @@ def importar_settlement_mp(caminho_arquivo, engine: Engine):
     now_iso = datetime.now().isoformat(timespec="seconds")
     processed_ids = set()
 
-    with engine.begin() as conn:
-        for _, row in df.iterrows():
-            external_id = row.get(id_col)
-            try:
-                external_id = str(int(external_id)) if external_id == external_id else None
-            except Exception:
-                external_id = str(external_id).strip() if external_id == external_id else None
+    nao_reconhecidos = []
+    linhas = 0
+    for df in ler_excel_em_blocos(caminho_arquivo, tamanho_bloco=tamanho_bloco):
+        df.columns = [str(c).strip().upper() for c in df.columns]
 
-            if not external_id or external_id in processed_ids:
-                ignoradas += 1
-                continue
+        # normaliza coluna UF se existir
+        try:
+            uf_col, not_rec = normalize_df_uf(df)
+            nao_reconhecidos.extend(not_rec if uf_col else [])
+        except Exception:
+            pass
 
-            processed_ids.add(external_id)
+        # cada bloco é gravado na sua própria transação
+        with engine.begin() as conn:
+            for _, row in df.iterrows():
+                external_id = row.get(id_col)
+                try:
+                    external_id = str(int(external_id)) if external_id == external_id else None
+                except Exception:
+                    external_id = str(external_id).strip() if external_id == external_id else None
 
-            tipo_trans = str(row.get(tipo_col) or "").strip()
+                if not external_id or external_id in processed_ids:
+                    ignoradas += 1
+                    continue
 
-            # valor líquido do MP (entrada real)
-            val = row.get(valor_col)
-            try:
-                valor = float(str(val).replace(",", ".")) if val == val else 0.0
-            except Exception:
-                valor = 0.0
+                processed_ids.add(external_id)
 
-            # mapeia tipo financeiro
-            tipo_fin = "MP_NET"
-            if "estorno" in tipo_trans.lower() or "chargeback" in tipo_trans.lower() or "devolu" in tipo_trans.lower() or "contestação" in tipo_trans.lower():
-                tipo_fin = "REFUND"
-                valor = -abs(valor) if valor != 0 else 0.0
-            elif "retirada" in tipo_trans.lower() or "saque" in tipo_trans.lower() or "payouts" in tipo_trans.lower():
-                tipo_fin = "WITHDRAWAL"
-                valor = -abs(valor) if valor != 0 else 0.0
-            elif "pagamento" in tipo_trans.lower():
-                tipo_fin = "MP_NET"
-                valor = abs(valor)  # garantir positivo para vendas
+                tipo_trans = str(row.get(tipo_col) or "").strip()
+
+                # valor líquido do MP (entrada real)
+                val = row.get(valor_col)
+                try:
+                    valor = float(str(val).replace(",", ".")) if val == val else 0.0
+                except Exception:
+                    valor = 0.0
 
-            # data do caixa: preferir liberação
-            dt = None
-            if data_col:
-                dt = _parse_iso_or_none(row.get(data_col))
+                # mapeia tipo financeiro
+                tipo_fin = "MP_NET"
+                if "estorno" in tipo_trans.lower() or "chargeback" in tipo_trans.lower() or "devolu" in tipo_trans.lower() or "contestação" in tipo_trans.lower():
+                    tipo_fin = "REFUND"
+                    valor = -abs(valor) if valor != 0 else 0.0
+                elif "retirada" in tipo_trans.lower() or "saque" in tipo_trans.lower() or "payouts" in tipo_trans.lower():
+                    tipo_fin = "WITHDRAWAL"
+                    valor = -abs(valor) if valor != 0 else 0.0
+                elif "pagamento" in tipo_trans.lower():
+                    tipo_fin = "MP_NET"
+                    valor = abs(valor)  # garantir positivo para vendas
+
+                # data do caixa: preferir liberação
+                dt = None
+                if data_col:
+                    dt = _parse_iso_or_none(row.get(data_col))
             
-            if not dt:
-                data_aprovacao_col = next((c for c in df.columns if "DATA" in c and ("APROVAÇÃO" in c.upper() or "APROVACAO" in c.upper())), None)
-                if data_aprovacao_col:
-                    dt = _parse_iso_or_none(row.get(data_aprovacao_col))
+                if not dt:
+                    data_aprovacao_col = next((c for c in colunas if "DATA" in c and ("APROVAÇÃO" in c.upper() or "APROVACAO" in c.upper())), None)
+                    if data_aprovacao_col:
+                        dt = _parse_iso_or_none(row.get(data_aprovacao_col))
             
-            if not dt:
-                data_origem_col = next((c for c in df.columns if "DATA" in c and ("ORIGEM" in c.upper())), None)
-                if data_origem_col:
-                    dt = _parse_iso_or_none(row.get(data_origem_col))
+                if not dt:
+                    data_origem_col = next((c for c in colunas if "DATA" in c and ("ORIGEM" in c.upper())), None)
+                    if data_origem_col:
+                        dt = _parse_iso_or_none(row.get(data_origem_col))
             
-            if not dt:
-                dt = datetime.now()
+                if not dt:
+                    dt = datetime.now()
 
-            data_lancamento = dt.isoformat()
+                data_lancamento = dt.isoformat()
 
-            canal_col = next((c for c in df.columns if "CANAL" in c.upper()), None)
-            canal = str(row.get(canal_col) or "").strip() if canal_col else ""
-            descricao = f"{tipo_trans} - {canal}".strip(" -")
+                canal_col = next((c for c in colunas if "CANAL" in c.upper()), None)
+                canal = str(row.get(canal_col) or "").strip() if canal_col else ""
+                descricao = f"{tipo_trans} - {canal}".strip(" -")
 
-            existing = conn.execute(
-                select(finance_transactions.c.id)
-                .where(finance_transactions.c.external_id_mp == external_id)
-            ).first()
-
-            if existing:
-                conn.execute(
-                    update(finance_transactions)
+                existing = conn.execute(
+                    select(finance_transactions.c.id)
                     .where(finance_transactions.c.external_id_mp == external_id)
-                    .values(
-                        data_lancamento=data_lancamento,
-                        tipo=tipo_fin,
-                        valor=valor,
-                        origem="mercado_pago",
-                        descricao=descricao,
-                        lote_importacao=lote_id,
+                ).first()
+
+                if existing:
+                    conn.execute(
+                        update(finance_transactions)
+                        .where(finance_transactions.c.external_id_mp == external_id)
+                        .values(
+                            data_lancamento=data_lancamento,
+                            tipo=tipo_fin,
+                            valor=valor,
+                            origem="mercado_pago",
+                            descricao=descricao,
+                            lote_importacao=lote_id,
+                        )
                     )
-                )
-                atualizadas += 1
-            else:
-                conn.execute(
-                    insert(finance_transactions).values(
-                        data_lancamento=data_lancamento,
-                        tipo=tipo_fin,
-                        valor=valor,
-                        origem="mercado_pago",
-                        external_id_mp=external_id,
-                        descricao=descricao,
-                        criado_em=now_iso,
-                        lote_importacao=lote_id,
+                    atualizadas += 1
+                else:
+                    conn.execute(
+                        insert(finance_transactions).values(
+                            data_lancamento=data_lancamento,
+                            tipo=tipo_fin,
+                            valor=valor,
+                            origem="mercado_pago",
+                            external_id_mp=external_id,
+                            descricao=descricao,
+                            criado_em=now_iso,
+                            lote_importacao=lote_id,
+                        )
                     )
-                )
-                importadas += 1
+                    importadas += 1
+
+        linhas += len(df)
+        registrar_progresso(linhas)
+
+    if nao_reconhecidos:
+        try:
+            rpt_path = os.path.join(app.config["UPLOAD_FOLDER"], f"uf_not_recognized_settlement_{lote_id}.csv")
+            pd.DataFrame([{'original': o, 'converted': c} for o, c in nao_reconhecidos]).to_csv(rpt_path, index=False)
+            print(f"Relatório UF não reconhecidos salvo em: {rpt_path}")
+        except Exception:
+            pass
 
     return {"lote_id": lote_id, "importadas": importadas, "atualizadas": atualizadas, "ignoradas": ignoradas}
 
@@ -3110,7 +3649,8 @@ def importar_mp_bank_summary(caminho_arquivo, engine: Engine):
     ignorados_por_tamanho = 0
 
     with engine.begin() as conn:
-        for idx, row in df.iterrows():
+        for linha, (idx, row) in enumerate(df.iterrows(), start=1):
+            registrar_progresso(linha)
             try:
                 # Usa o índice da linha como ID único
                 reference_id = f"MP_BANK_{lote_id}_{idx}"
@@ -3244,21 +3784,8 @@ def importar_mp_view():
             flash("Selecione um arquivo.", "danger")
             return redirect(request.url)
 
-        filename = secure_filename(file.filename)
-        caminho = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-        file.save(caminho)
-
-        try:
-            resumo = importar_settlement_mp(caminho, engine)
-            flash(
-                f"Importação MP concluída. Lote {resumo['lote_id']} - "
-                f"{resumo['importadas']} novas, {resumo['atualizadas']} atualizadas, {resumo['ignoradas']} ignoradas.",
-                "success",
-            )
-        except Exception as e:
-            flash(f"Erro na importação MP: {e}", "danger")
-
-        return redirect(url_for("importar_mp_view"))
+        caminho, filename = _salvar_upload(file)
+        return _enfileirar_importacao("settlement_mp", _job_importar_settlement_mp, caminho, filename)
 
     # lotes de importação MP
     with engine.connect() as conn:
@@ -3278,6 +3805,16 @@ def importar_mp_view():
     return render_template("importar_mp.html", lotes_mp=lotes_mp)
 
 
+def _job_importar_settlement_mp(caminho):
+    resumo = importar_settlement_mp(caminho, engine)
+    resumo["mensagem"] = (
+        f"Importação MP concluída. Lote {resumo['lote_id']} - "
+        f"{resumo['importadas']} novas, {resumo['atualizadas']} atualizadas, {resumo['ignoradas']} ignoradas."
+    )
+    resumo["categoria"] = "success"
+    return resumo
+
+
 @app.route("/importar_mp_full", methods=["GET", "POST"])
 @login_required
 def importar_mp_full_view():
@@ -3291,24 +3828,19 @@ def importar_mp_full_view():
             flash("Selecione um arquivo.", "danger")
             return redirect(request.url)
 
-        filename = secure_filename(file.filename)
-        caminho = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-        file.save(caminho)
-
-        try:
-            resultado = importar_mp_full_excel(caminho, engine)
-            flash(
-                f"✅ Importação MP Full concluída! Lote {resultado['lote_id']}",
-                "success",
-            )
-            return redirect(url_for("relatorio_mp_full", lote_id=resultado['lote_id']))
-        except Exception as e:
-            flash(f"❌ Erro na importação: {str(e)}", "danger")
-            return redirect(request.url)
+        caminho, filename = _salvar_upload(file)
+        return _enfileirar_importacao("mp_full", _job_importar_mp_full, caminho, filename)
 
     return render_template("importar_mp_full.html")
 
 
+def _job_importar_mp_full(caminho):
+    resultado = importar_mp_full_excel(caminho, engine)
+    resultado["mensagem"] = f"✅ Importação MP Full concluída! Lote {resultado['lote_id']}"
+    resultado["categoria"] = "success"
+    return resultado
+
+
 @app.route("/relatorio_mp_full/<lote_id>")
 @login_required
 def relatorio_mp_full(lote_id):
@@ -3339,7 +3871,7 @@ def relatorio_mp_full(lote_id):
     return render_template("relatorio_mp_full.html", transacoes=transacoes, resumo=resumo_geral, lote_id=lote_id)
 
 
-def importar_mp_full_excel(caminho_arquivo, engine: Engine):
+def importar_mp_full_excel(caminho_arquivo, engine: Engine, tamanho_bloco=TAMANHO_BLOCO_PADRAO):
     """
     Importa planilha do Mercado Pago Full com colunas:
     RELEASE_DATE, TRANSACTION_TYPE, REFERENCE_ID, TRANSACTION_NET_AMOUNT, PARTIAL_BALANCE
@@ -3347,16 +3879,13 @@ def importar_mp_full_excel(caminho_arquivo, engine: Engine):
     lote_id = datetime.now().isoformat(timespec="seconds")
 
     try:
-        df = pd.read_excel(caminho_arquivo)
+        colunas = [str(c).strip().upper() for c in colunas_excel(caminho_arquivo)]
     except Exception as e:
         raise ValueError(f"Erro ao ler Excel: {str(e)}")
 
-    # Normaliza nomes das colunas
-    df.columns = [str(c).strip().upper() for c in df.columns]
-
     # Validação de colunas obrigatórias
     required_cols = ["RELEASE_DATE", "TRANSACTION_TYPE", "REFERENCE_ID", "TRANSACTION_NET_AMOUNT", "PARTIAL_BALANCE"]
-    missing = [c for c in required_cols if c not in df.columns]
+    missing = [c for c in required_cols if c not in colunas]
     if missing:
         raise ValueError(f"Colunas obrigatórias não encontradas: {', '.join(missing)}")
 
@@ -3366,86 +3895,95 @@ def importar_mp_full_excel(caminho_arquivo, engine: Engine):
     processed_ids = set()
     now_iso = datetime.now().isoformat(timespec="seconds")
 
-    with engine.begin() as conn:
-        for idx, row in df.iterrows():
-            try:
-                reference_id = str(row.get("REFERENCE_ID", "")).strip()
-                if not reference_id or reference_id in processed_ids:
-                    ignoradas += 1
-                    continue
-
-                processed_ids.add(reference_id)
+    linhas = 0
+    for df in ler_excel_em_blocos(caminho_arquivo, tamanho_bloco=tamanho_bloco):
+        # Normaliza nomes das colunas
+        df.columns = [str(c).strip().upper() for c in df.columns]
 
-                # Extrai dados
-                transaction_type = str(row.get("TRANSACTION_TYPE", "")).strip()
-                
-                # Converte valor para float
+        # cada bloco é gravado na sua própria transação
+        with engine.begin() as conn:
+            for idx, row in df.iterrows():
                 try:
-                    valor = float(str(row.get("TRANSACTION_NET_AMOUNT", "0")).replace(",", "."))
-                except:
-                    valor = 0.0
+                    reference_id = str(row.get("REFERENCE_ID", "")).strip()
+                    if not reference_id or reference_id in processed_ids:
+                        ignoradas += 1
+                        continue
 
-                # Data de lançamento
-                release_date = row.get("RELEASE_DATE")
-                if pd.notna(release_date):
+                    processed_ids.add(reference_id)
+
+                    # Extrai dados
+                    transaction_type = str(row.get("TRANSACTION_TYPE", "")).strip()
+                
+                    # Converte valor para float
                     try:
-                        if isinstance(release_date, str):
-                            data_lancamento = pd.to_datetime(release_date).isoformat()
-                        else:
-                            data_lancamento = pd.Timestamp(release_date).isoformat()
+                        valor = float(str(row.get("TRANSACTION_NET_AMOUNT", "0")).replace(",", "."))
                     except:
+                        valor = 0.0
+
+                    # Data de lançamento
+                    release_date = row.get("RELEASE_DATE")
+                    if pd.notna(release_date):
+                        try:
+                            if isinstance(release_date, str):
+                                data_lancamento = pd.to_datetime(release_date).isoformat()
+                            else:
+                                data_lancamento = pd.Timestamp(release_date).isoformat()
+                        except:
+                            data_lancamento = datetime.now().isoformat()
+                    else:
                         data_lancamento = datetime.now().isoformat()
-                else:
-                    data_lancamento = datetime.now().isoformat()
-
-                # Saldo parcial
-                partial_balance = row.get("PARTIAL_BALANCE", 0.0)
-                try:
-                    partial_balance = float(str(partial_balance).replace(",", ".")) if pd.notna(partial_balance) else 0.0
-                except:
-                    partial_balance = 0.0
 
-                # Descrição
-                descricao = f"{transaction_type} ({reference_id})"
+                    # Saldo parcial
+                    partial_balance = row.get("PARTIAL_BALANCE", 0.0)
+                    try:
+                        partial_balance = float(str(partial_balance).replace(",", ".")) if pd.notna(partial_balance) else 0.0
+                    except:
+                        partial_balance = 0.0
 
-                # Verifica se já existe
-                existing = conn.execute(
-                    select(finance_transactions.c.id)
-                    .where(finance_transactions.c.external_id_mp == reference_id)
-                ).first()
+                    # Descrição
+                    descricao = f"{transaction_type} ({reference_id})"
 
-                if existing:
-                    conn.execute(
-                        update(finance_transactions)
+                    # Verifica se já existe
+                    existing = conn.execute(
+                        select(finance_transactions.c.id)
                         .where(finance_transactions.c.external_id_mp == reference_id)
-                        .values(
-                            data_lancamento=data_lancamento,
-                            valor=valor,
-                            descricao=descricao,
-                            lote_importacao=lote_id,
-                            origem="mercado_pago",
+                    ).first()
+
+                    if existing:
+                        conn.execute(
+                            update(finance_transactions)
+                            .where(finance_transactions.c.external_id_mp == reference_id)
+                            .values(
+                                data_lancamento=data_lancamento,
+                                valor=valor,
+                                descricao=descricao,
+                                lote_importacao=lote_id,
+                                origem="mercado_pago",
+                            )
                         )
-                    )
-                    atualizadas += 1
-                else:
-                    conn.execute(
-                        insert(finance_transactions).values(
-                            data_lancamento=data_lancamento,
-                            valor=valor,
-                            descricao=descricao,
-                            external_id_mp=reference_id,
-                            lote_importacao=lote_id,
-                            origem="mercado_pago",
-                            tipo="MP_NET",
-                            criado_em=now_iso,
+                        atualizadas += 1
+                    else:
+                        conn.execute(
+                            insert(finance_transactions).values(
+                                data_lancamento=data_lancamento,
+                                valor=valor,
+                                descricao=descricao,
+                                external_id_mp=reference_id,
+                                lote_importacao=lote_id,
+                                origem="mercado_pago",
+                                tipo="MP_NET",
+                                criado_em=now_iso,
+                            )
                         )
-                    )
-                    importadas += 1
+                        importadas += 1
 
-            except Exception as e:
-                print(f"Erro ao processar linha {idx}: {str(e)}")
-                ignoradas += 1
-                continue
+                except Exception as e:
+                    print(f"Erro ao processar linha {idx}: {str(e)}")
+                    ignoradas += 1
+                    continue
+
+        linhas += len(df)
+        registrar_progresso(linhas)
 
     return {
         "lote_id": lote_id,
@@ -3463,6 +4001,7 @@ def _date_only(iso_str: str):
 
 
 @app.route("/financeiro", methods=["GET", "POST"])
+@cache_relatorios.rota
 @login_required
 def financeiro_view():
     # Ações (saldo inicial, devolução, retirada)
@@ -3637,17 +4176,15 @@ def excluir_lote_financeiro(lote):
 
 
 @app.route("/conciliacao", methods=["GET"])
+@cache_relatorios.rota
 @login_required
 def conciliacao_view():
     data_inicio = request.args.get("data_inicio") or (date.today().replace(day=1)).isoformat()
     data_fim = request.args.get("data_fim") or date.today().isoformat()
 
     # filtros
-    filtro_v = []
-    if data_inicio:
-        filtro_v.append(vendas.c.data_venda >= data_inicio)
-    if data_fim:
-        filtro_v.append(vendas.c.data_venda <= data_fim + "T23:59:59")
+    resumo = vendas_resumo_diario
+    filtro_v = _filtro_resumo(data_inicio, data_fim)
 
     filtro_f = []
     if data_inicio:
@@ -3658,7 +4195,7 @@ def conciliacao_view():
     with engine.connect() as conn:
         # ML: receita líquida gerencial = bruta - comissão
         ml_liquida = conn.execute(
-            select(func.coalesce(func.sum(vendas.c.receita_total - vendas.c.comissao_ml), 0.0))
+            select(func.coalesce(func.sum(resumo.c.receita - resumo.c.comissao), 0.0))
             .where(*filtro_v)
         ).scalar() or 0.0
 
@@ -3672,7 +4209,9 @@ def conciliacao_view():
 
         # Série diária (ML por data_venda; MP por data_lancamento)
         v_rows = conn.execute(
-            select(vendas.c.data_venda, vendas.c.receita_total, vendas.c.comissao_ml).where(*filtro_v)
+            select(resumo.c.dia, func.sum(resumo.c.receita), func.sum(resumo.c.comissao))
+            .where(*filtro_v)
+            .group_by(resumo.c.dia)
         ).all()
 
         f_rows = conn.execute(
@@ -3740,64 +4279,36 @@ def etiquetas_zpl():
             return redirect(url_for("etiquetas_zpl"))
         
         try:
-            import requests
-            import re
-            
-            # Converter cm para polegadas
-            largura_inch = float(largura_cm) / 2.54
-            altura_inch = float(altura_cm) / 2.54
             qtd = int(quantidade)
-            size_str = f"{largura_inch:.1f}x{altura_inch:.1f}"
-            
-            # Modificar ZPL para quantidade 1
-            zpl_sem_fim = re.sub(r'\^XZ\s*$', '', zpl_code)
-            zpl_sem_pq = re.sub(r'\^PQ\d+[^\^]*', '', zpl_sem_fim)
-            zpl_modificado = f"{zpl_sem_pq}\n^PQ1,0,1,Y^XZ"
-            
-            # Converter via API Labelary
-            labelary_url = f"http://api.labelary.com/v1/printers/8dpmm/labels/{size_str}/0/"
-            headers = {'Accept': 'application/pdf', 'Content-Type': 'application/x-www-form-urlencoded'}
-            response = requests.post(labelary_url, data=zpl_modificado.encode('utf-8'), headers=headers)
-            
-            if response.status_code == 200:
-                if qtd == 1:
-                    pdf_buffer = BytesIO(response.content)
-                    pdf_buffer.seek(0)
-                    return send_file(
-                        pdf_buffer,
-                        mimetype='application/pdf',
-                        as_attachment=True,
-                        download_name=f'etiqueta_{largura_cm}x{altura_cm}cm_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
-                    )
-                else:
-                    # Replicar etiqueta usando pypdf
-                    try:
-                        from pypdf import PdfReader, PdfWriter
-                    except ImportError:
-                        from PyPDF2 import PdfReader, PdfWriter
-                    
-                    pdf_original = BytesIO(response.content)
-                    reader = PdfReader(pdf_original)
-                    writer = PdfWriter()
-                    
-                    page = reader.pages[0]
-                    for _ in range(qtd):
-                        writer.add_page(page)
-                    
-                    output_buffer = BytesIO()
-                    writer.write(output_buffer)
-                    output_buffer.seek(0)
-                    
-                    flash(f"PDF gerado com sucesso: {qtd} etiquetas!", "success")
-                    return send_file(
-                        output_buffer,
-                        mimetype='application/pdf',
-                        as_attachment=True,
-                        download_name=f'etiquetas_{qtd}x_{largura_cm}x{altura_cm}cm_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
-                    )
+            # desenhado aqui mesmo na grade da impressora (8 pontos/mm); cada
+            # etiqueta ^XA...^XZ sai repetida qtd vezes, no lugar do ^PQ
+            pdf, ignorados = zpl_para_pdf(zpl_code, float(largura_cm) * 10, float(altura_cm) * 10, copias=qtd)
+            pdf_buffer = BytesIO(pdf)
+            if qtd == 1:
+                download_name = f'etiqueta_{largura_cm}x{altura_cm}cm_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
             else:
-                flash(f"Erro ao converter ZPL para PDF. Status: {response.status_code}", "danger")
-                return redirect(url_for("etiquetas_zpl"))
+                flash(f"PDF gerado com sucesso: {qtd} etiquetas!", "success")
+                download_name = f'etiquetas_{qtd}x_{largura_cm}x{altura_cm}cm_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
+            if ignorados:
+                # com o download direto o aviso só apareceria na próxima página:
+                # volta a própria página, com o aviso e o PDF para baixar
+                flash(f"Comandos ZPL não suportados foram ignorados (o campo deles não saiu no PDF): "
+                      f"{', '.join(ignorados)}", "warning")
+                return render_template(
+                    "etiquetas_zpl.html",
+                    pdf_base64=base64.b64encode(pdf).decode("ascii"),
+                    download_name=download_name,
+                    zpl_code=zpl_code,
+                    largura_cm=largura_cm,
+                    altura_cm=altura_cm,
+                    quantidade=qtd,
+                )
+            return send_file(
+                pdf_buffer,
+                mimetype='application/pdf',
+                as_attachment=True,
+                download_name=download_name
+            )
                 
         except Exception as e:
             flash(f"Erro ao processar etiqueta: {str(e)}", "danger")
@@ -3825,6 +4336,7 @@ def limpar_dados():
                 # Deletar na ordem correta (foreign keys)
                 r1 = conn.execute(text("DELETE FROM finance_transactions"))
                 r2 = conn.execute(text("DELETE FROM vendas"))
+                resumo_vendas.limpar(conn)
                 r3 = conn.execute(text("DELETE FROM produtos"))
                 
                 total = r1.rowcount + r2.rowcount + r3.rowcount
@@ -3931,6 +4443,7 @@ def deletar_produto_automatico(produto_id):
                 return redirect(url_for("produtos_automaticos"))
             
             # Deletar vendas relacionadas
+            resumo_vendas.subtrair(conn, vendas.c.produto_id == produto_id)
             conn.execute(delete(vendas).where(vendas.c.produto_id == produto_id))
             
             # Deletar o produto
@@ -4017,6 +4530,9 @@ def processar_vendas_sem_produto():
             
             produtos_criados = 0
             vendas_vinculadas = 0
+            ids_vendas = [venda['id'] for venda in vendas_list]
+            for lote in _em_lotes(ids_vendas):
+                resumo_vendas.subtrair(conn, vendas.c.id.in_(lote))
             
             for venda in vendas_list:
                 # Gerar nome do produto baseado na venda
@@ -4075,6 +4591,8 @@ def processar_vendas_sem_produto():
                     )
                     vendas_vinculadas += 1
             
+            for lote in _em_lotes(ids_vendas):
+                resumo_vendas.somar(conn, vendas.c.id.in_(lote))
             flash(f"✅ Sucesso! {produtos_criados} produtos criados, {vendas_vinculadas} vendas vinculadas", "success")
     except Exception as e:
         flash(f"❌ Erro ao processar: {e}", "danger")
@@ -4183,7 +4701,11 @@ def alertas_sistema():
     )
 
 def gerar_export_render():
-    """Gera um ZIP com CSVs das principais tabelas para migração/restauração no Render."""
+    """Gera um ZIP com CSVs das principais tabelas para migração/restauração no Render.
+
+    O pacote é gravado num arquivo temporário (ver ``pacote_render.py``);
+    retorna (caminho, nome para download). Quem chama apaga o arquivo.
+    """
     tabelas = [
         ("usuarios", usuarios),
         ("configuracoes", configuracoes),
@@ -4193,32 +4715,13 @@ def gerar_export_render():
         ("finance_transactions", finance_transactions),
     ]
 
-    manifest = []
-    buffer = BytesIO()
-    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-        with engine.connect() as conn:
-            for nome, tabela in tabelas:
-                df = pd.read_sql(select(tabela), conn)
-                manifest.append({"nome": nome, "linhas": int(len(df)), "colunas": list(df.columns)})
-                zf.writestr(f"{nome}.csv", df.to_csv(index=False).encode("utf-8"))
-
-        zf.writestr(
-            "manifest.json",
-            json.dumps(
-                {
-                    "gerado_em": datetime.utcnow().isoformat() + "Z",
-                    "origem": "postgres" if raw_db_url else "sqlite",
-                    "tabelas": manifest,
-                    "observacao": "Use import_render_backup.py para restaurar no Render/Postgres.",
-                },
-                ensure_ascii=False,
-                indent=2,
-            ).encode("utf-8"),
-        )
-
-    buffer.seek(0)
     filename = f"metrifiy_render_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-    return buffer, filename
+    fd, caminho = tempfile.mkstemp(prefix="metrifiy_render_export_", suffix=".zip")
+    os.close(fd)
+    manifest = gerar_pacote(engine, tabelas, caminho, origem="postgres" if raw_db_url else "sqlite")
+    print(f"[EXPORT RENDER] {sum(t['linhas'] for t in manifest['tabelas'])} linhas "
+          f"em {manifest['segundos']}s -> {caminho}")
+    return caminho, filename
 
 
 
@@ -1,12 +1,103 @@
 """
 Script otimizado para importar dados com baixo uso de memória
+
+Lê os arquivos ``<tabela>.ndjson.gz`` gerados pelo ``export_data.py`` linha a
+linha (nunca o arquivo inteiro) e insere em lotes com ``executemany``. O lote
+é fechado por tamanho em bytes (``ORCAMENTO_LOTE_BYTES`` de JSON lido), não por
+um número fixo de linhas: tabelas estreitas vão em lotes grandes e a memória
+fica limitada mesmo com linhas largas. Cada tabela entra numa transação só.
 """
-import os
+import gzip
 import json
-import gc
+import os
+import time
+
 from sqlalchemy import MetaData, inspect, text
 
-def auto_import_data_if_empty(engine):
+from export_data import EXTENSAO, FORMATO, PASTA_PADRAO, VERSAO
+
+ORCAMENTO_LOTE_BYTES = 2 * 1024 * 1024
+
+# ordem de inserção (chaves estrangeiras: produtos antes de vendas/ajustes)
+ORDEM_TABELAS = ["usuarios", "configuracoes", "produtos", "ajustes_estoque", "vendas", "finance_transactions"]
+
+
+def ler_cabecalho(arquivo, caminho):
+    """Lê e confere a primeira linha (cabeçalho) de um arquivo NDJSON."""
+    cabecalho = json.loads(arquivo.readline() or b"{}")
+    if cabecalho.get("formato") != FORMATO or cabecalho.get("versao") != VERSAO:
+        raise ValueError(f"{caminho}: cabeçalho desconhecido ({cabecalho.get('formato')} v{cabecalho.get('versao')})")
+    return cabecalho
+
+
+def importar_tabela(conn, table, caminho, orcamento_bytes=ORCAMENTO_LOTE_BYTES):
+    """Insere o conteúdo de ``caminho`` em ``table``; retorna o número de registros."""
+    total = 0
+    with gzip.open(caminho, "rb") as f:
+        cabecalho = ler_cabecalho(f, caminho)
+        # colunas que não existem mais no banco de destino são ignoradas
+        posicoes = [
+            (i, nome) for i, nome in enumerate(cabecalho["colunas"]) if nome in table.c
+        ]
+        batch = []
+        tamanho = 0
+        for linha in f:
+            valores = json.loads(linha)
+            batch.append({nome: valores[i] for i, nome in posicoes})
+            tamanho += len(linha)
+            if tamanho >= orcamento_bytes:
+                conn.execute(table.insert(), batch)
+                total += len(batch)
+                batch = []
+                tamanho = 0
+        if batch:
+            conn.execute(table.insert(), batch)
+            total += len(batch)
+    return total
+
+
+def importar_pasta(engine, pasta=PASTA_PADRAO, tabelas=None, orcamento_bytes=ORCAMENTO_LOTE_BYTES,
+                   limpar=False):
+    """Importa as ``tabelas`` (padrão: ``ORDEM_TABELAS``) que tiverem arquivo em ``pasta``.
+
+    Com ``limpar``, o conteúdo atual de cada tabela é apagado na mesma
+    transação da importação. Erros numa tabela são mostrados e a importação
+    segue com as outras.
+    Retorna [(tabela, registros, segundos)].
+    """
+    metadata = MetaData()
+    metadata.reflect(bind=engine)
+
+    estatisticas = []
+    for table_name in tabelas or ORDEM_TABELAS:
+        caminho = os.path.join(pasta, f"{table_name}{EXTENSAO}")
+        if table_name not in metadata.tables or not os.path.exists(caminho):
+            continue
+
+        print(f"  → {table_name}...")
+        inicio = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                if limpar:
+                    conn.execute(metadata.tables[table_name].delete())
+                total = importar_tabela(conn, metadata.tables[table_name], caminho, orcamento_bytes)
+        except Exception as e:
+            print(f"    ❌ Erro: {e}")
+            continue
+        segundos = time.perf_counter() - inicio
+        if engine.url.get_backend_name().startswith("postgresql") and "id" in metadata.tables[table_name].c:
+            # os ids vieram do arquivo: a sequência continua depois do maior
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), "
+                    f"COALESCE((SELECT MAX(id)+1 FROM {table_name}), 1), false)"
+                ))
+        estatisticas.append((table_name, total, segundos))
+        print(f"    ✓ {total} registros importados ({segundos:.2f}s, {total / max(segundos, 1e-9):,.0f}/s)")
+    return estatisticas
+
+
+def auto_import_data_if_empty(engine, pasta=PASTA_PADRAO):
     """
     Verifica se o banco está vazio e importa dados automaticamente
     Otimizado para ambientes com pouca memória (Render Free = 512MB)
@@ -15,121 +106,32 @@ def auto_import_data_if_empty(engine):
         # Verificar se as tabelas existem e estão vazias
         inspector = inspect(engine)
         tables = inspector.get_table_names()
-        
+
         if not tables:
             print("⚠️ Nenhuma tabela encontrada. Criando estrutura...")
             return False
-        
+
         # Verificar se há dados nas tabelas principais
         with engine.connect() as conn:
             result = conn.execute(text("SELECT COUNT(*) FROM produtos")).scalar()
             if result > 0:
                 print(f"✅ Banco já possui dados ({result} produtos encontrados)")
                 return True
-        
-        # Se chegou aqui, precisa importar
-        print("📦 Banco vazio detectado. Iniciando importação otimizada...")
-        
-        json_file = "data_export.json"
-        if not os.path.exists(json_file):
-            print(f"❌ Arquivo {json_file} não encontrado")
+
+        if not os.path.isdir(pasta):
+            print(f"❌ Pasta {pasta} não encontrada")
             return False
-        
-        # Importar apenas tabelas pequenas primeiro (prioridade)
-        priority_tables = ["usuarios", "configuracoes", "produtos", "ajustes_estoque"]
-        
-        print(f"📂 Carregando dados prioritários...")
-        with open(json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        metadata = MetaData()
-        metadata.reflect(bind=engine)
-        
-        imported_count = 0
-        
-        # Importar tabelas prioritárias primeiro
-        for table_name in priority_tables:
-            if table_name not in data or not data[table_name]:
-                continue
-            
-            if table_name not in metadata.tables:
-                continue
-            
-            rows = data[table_name]
-            table = metadata.tables[table_name]
-            
-            print(f"  → {table_name}: {len(rows)} registros...")
-            
-            try:
-                with engine.begin() as conn:
-                    # Lotes pequenos para economizar memória
-                    batch_size = 100
-                    for i in range(0, len(rows), batch_size):
-                        batch = rows[i:i+batch_size]
-                        conn.execute(table.insert(), batch)
-                        gc.collect()  # Liberar memória
-                
-                imported_count += len(rows)
-                print(f"    ✓ Importado")
-                
-            except Exception as e:
-                print(f"    ❌ Erro: {e}")
-        
-        # Liberar memória das tabelas prioritárias
-        for table_name in priority_tables:
-            if table_name in data:
-                del data[table_name]
-        gc.collect()
-        
-        # Importar tabelas grandes (vendas e transações) em lotes muito pequenos
-        large_tables = ["vendas", "finance_transactions"]
-        
-        for table_name in large_tables:
-            if table_name not in data or not data[table_name]:
-                continue
-            
-            if table_name not in metadata.tables:
-                continue
-            
-            rows = data[table_name]
-            total = len(rows)
-            table = metadata.tables[table_name]
-            
-            print(f"  → {table_name}: {total} registros (lotes de 50)...")
-            
-            try:
-                # Lotes MUITO pequenos para tabelas grandes
-                batch_size = 50
-                batches_done = 0
-                
-                for i in range(0, total, batch_size):
-                    batch = rows[i:i+batch_size]
-                    
-                    with engine.begin() as conn:
-                        conn.execute(table.insert(), batch)
-                    
-                    batches_done += 1
-                    
-                    # Progresso e limpeza de memória a cada 10 lotes
-                    if batches_done % 10 == 0:
-                        progress = min(i + batch_size, total)
-                        print(f"    ... {progress}/{total}")
-                        gc.collect()
-                
-                imported_count += total
-                print(f"    ✓ {total} registros importados")
-                
-            except Exception as e:
-                print(f"    ❌ Erro: {e}")
-                # Continuar mesmo se falhar
-        
-        # Limpar dados da memória
-        data.clear()
-        gc.collect()
-        
-        print(f"\n✅ Importação concluída! Total: {imported_count} registros")
+
+        # Se chegou aqui, precisa importar
+        print(f"📦 Banco vazio detectado. Importando de {pasta}/...")
+        # o usuário e a configuração padrão criados no banco novo dão lugar aos exportados
+        estatisticas = importar_pasta(engine, pasta, limpar=True)
+
+        total = sum(registros for _, registros, _ in estatisticas)
+        segundos = sum(s for _, _, s in estatisticas)
+        print(f"\n✅ Importação concluída! Total: {total} registros em {segundos:.2f}s")
         return True
-        
+
     except Exception as e:
         print(f"❌ Erro na importação: {e}")
         import traceback
@@ -1,44 +1,202 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-"""Script para fazer backup do banco de dados"""
+"""Script para fazer backup do banco de dados
 
+O backup usa a API de backup do SQLite (``sqlite3.Connection.backup``) em
+passos de ``PAGINAS_POR_PASSO`` páginas, em vez de copiar o arquivo com
+``shutil.copy2``: a cópia fica consistente mesmo com o app gravando, e entre
+um passo e outro o banco fica livre para os requests. Depois a cópia passa
+por ``PRAGMA integrity_check`` e pode ser compactada (gzip, ou zstd se o
+pacote ``zstandard`` estiver instalado). Só os últimos 10 backups são mantidos.
+
+Uso:
+    python backup_banco.py [--compressao gzip|zstd] [--manter 10]
+
+No app, a ação "Fazer Backup SQLite" do /admin/backup roda isto em segundo
+plano (job em ``import_jobs``, com a duração registrada).
+"""
+
+import argparse
+import gzip
 import os
+import re
 import shutil
+import sqlite3
+import time
 from datetime import datetime
 from pathlib import Path
 
-def fazer_backup():
-    """Cria backup do banco de dados SQLite"""
-    
-    db_file = 'metrifiy.db'
-    backup_dir = 'backups'
-    
+try:
+    import zstandard
+except ImportError:  # opcional
+    zstandard = None
+
+PAGINAS_POR_PASSO = 1024
+PAUSA_ENTRE_PASSOS = 0.005
+MANTER_PADRAO = 10
+
+EXTENSOES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+# só os backups com data entram na rotação (os "antes_restore" ficam)
+PADRAO_ROTACAO = re.compile(r"^metrifiy_backup_\d{8}_\d{6}\.db(\.gz|\.zst)?$")
+
+
+def _copiar_online(db_file, destino, progresso=None):
+    """Copia ``db_file`` para ``destino`` pela API de backup; retorna o total de páginas."""
+    total = [0]
+
+    def passo(_status, restantes, paginas):
+        total[0] = paginas
+        if progresso is not None:
+            progresso(paginas - restantes)
+        # libera o banco para as outras conexões entre os passos
+        time.sleep(PAUSA_ENTRE_PASSOS)
+
+    origem = sqlite3.connect(db_file)
+    copia = sqlite3.connect(destino)
+    try:
+        origem.backup(copia, pages=PAGINAS_POR_PASSO, progress=passo)
+    finally:
+        copia.close()
+        origem.close()
+    return total[0]
+
+
+def _verificar_integridade(caminho):
+    conn = sqlite3.connect(caminho)
+    try:
+        resultado = [r[0] for r in conn.execute("PRAGMA integrity_check")]
+    finally:
+        conn.close()
+    if resultado != ["ok"]:
+        raise RuntimeError(f"integrity_check falhou na cópia: {'; '.join(resultado[:5])}")
+
+
+def _compactar(caminho, compressao):
+    destino = caminho + EXTENSOES[compressao]
+    with open(caminho, "rb") as entrada:
+        if compressao == "zstd":
+            with open(destino, "wb") as saida:
+                zstandard.ZstdCompressor(level=10).copy_stream(entrada, saida)
+        else:
+            with gzip.open(destino, "wb", compresslevel=6) as saida:
+                shutil.copyfileobj(entrada, saida, 1024 * 1024)
+    os.remove(caminho)
+    return destino
+
+
+def rotacionar(backup_dir, manter=MANTER_PADRAO):
+    """Remove os backups com data mais antigos, mantendo os ``manter`` últimos."""
+    arquivos = sorted(p for p in Path(backup_dir).iterdir() if PADRAO_ROTACAO.match(p.name))
+    removidos = []
+    if len(arquivos) > manter:
+        for arquivo in arquivos[:-manter]:
+            arquivo.unlink()
+            removidos.append(arquivo.name)
+            print(f"🗑️ Backup antigo removido: {arquivo.name}")
+    return removidos
+
+
+def fazer_backup(db_file='metrifiy.db', backup_dir='backups', compressao=None,
+                 manter=MANTER_PADRAO, prefixo='metrifiy_backup_', progresso=None):
+    """Cria backup do banco de dados SQLite
+
+    ``compressao``: None, "gzip" ou "zstd" (sem ``zstandard`` instalado, usa
+    gzip). ``manter``: quantos backups com data manter (None = não rotaciona).
+    ``progresso(paginas_copiadas)`` é chamado a cada passo. Retorna um dict
+    com arquivo, tamanho e tempos de cada etapa; erros viram exceção.
+    """
+    if compressao not in EXTENSOES:
+        raise ValueError(f"Compressão desconhecida: {compressao}")
+    if compressao == "zstd" and zstandard is None:
+        print("⚠️ zstandard não instalado; usando gzip")
+        compressao = "gzip"
+    if not os.path.exists(db_file):
+        raise FileNotFoundError(f"Arquivo de banco de dados não encontrado: {db_file}")
+
     # Criar diretório de backups se não existir
     os.makedirs(backup_dir, exist_ok=True)
-    
-    if os.path.exists(db_file):
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_file = os.path.join(backup_dir, f'metrifiy_backup_{timestamp}.db')
-        
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    backup_file = os.path.join(backup_dir, f'{prefixo}{timestamp}.db')
+    parcial = backup_file + '.parcial'
+    tempos = {}
+    try:
+        inicio = time.perf_counter()
+        paginas = _copiar_online(db_file, parcial, progresso)
+        tempos['copia'] = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        _verificar_integridade(parcial)
+        tempos['integridade'] = time.perf_counter() - inicio
+
+        os.replace(parcial, backup_file)
+        if compressao:
+            inicio = time.perf_counter()
+            backup_file = _compactar(backup_file, compressao)
+            tempos['compactacao'] = time.perf_counter() - inicio
+    except Exception:
+        for caminho in (parcial, backup_file):
+            if os.path.exists(caminho):
+                os.remove(caminho)
+        raise
+
+    tamanho = os.path.getsize(backup_file)
+    print(f"✅ Backup criado: {backup_file} ({tamanho / (1024*1024):.2f} MB, "
+          f"{paginas} páginas, {sum(tempos.values()):.2f}s)")
+
+    # Manter apenas os últimos 10 backups
+    removidos = rotacionar(backup_dir, manter) if manter else []
+
+    return {
+        "arquivo": os.path.basename(backup_file),
+        "caminho": backup_file,
+        "bytes": tamanho,
+        "paginas": paginas,
+        "compressao": compressao,
+        "segundos": {etapa: round(t, 3) for etapa, t in tempos.items()},
+        "removidos": removidos,
+    }
+
+
+def restaurar_banco(arquivo, db_file='metrifiy.db'):
+    """Troca o conteúdo de ``db_file`` pelo do banco ``arquivo``, com o app no ar.
+
+    Não sobrescreve o arquivo: no modo WAL (replicação) o ``-wal``/``-shm``
+    antigos continuariam no disco e as conexões abertas reaplicariam os
+    frames antigos por cima do banco enviado. A cópia passa pela API de
+    backup, num passo só, pelas travas do próprio SQLite: quem lê vê o banco
+    antigo ou o novo inteiro. ``arquivo`` precisa passar no
+    ``integrity_check``; ele pode ser alterado (tamanho de página).
+    """
+    _verificar_integridade(arquivo)
+    origem = sqlite3.connect(arquivo, isolation_level=None)
+    try:
+        destino = sqlite3.connect(db_file, timeout=30)
         try:
-            shutil.copy2(db_file, backup_file)
-            tamanho = os.path.getsize(backup_file) / (1024*1024)  # MB
-            print(f"✅ Backup criado: {backup_file} ({tamanho:.2f} MB)")
-            
-            # Manter apenas os últimos 10 backups
-            arquivos = sorted(Path(backup_dir).glob('metrifiy_backup_*.db'))
-            if len(arquivos) > 10:
-                for arquivo in arquivos[:-10]:
-                    arquivo.unlink()
-                    print(f"🗑️ Backup antigo removido: {arquivo.name}")
-            
-            return backup_file
-        except Exception as e:
-            print(f"❌ Erro ao fazer backup: {e}")
-            return None
-    else:
-        print(f"❌ Arquivo de banco de dados não encontrado: {db_file}")
-        return None
+            # o checkpoint é do replicador (replicacao_wal.py), não desta conexão
+            destino.execute("PRAGMA wal_autocheckpoint=0")
+            tamanho_pagina = destino.execute("PRAGMA page_size").fetchone()[0]
+            if origem.execute("PRAGMA page_size").fetchone()[0] != tamanho_pagina:
+                # destino em WAL só aceita backup com o mesmo tamanho de página
+                origem.execute("PRAGMA journal_mode=DELETE")
+                origem.execute(f"PRAGMA page_size={tamanho_pagina}")
+                origem.execute("VACUUM")
+            origem.backup(destino)
+        finally:
+            destino.close()
+    finally:
+        origem.close()
+
 
 if __name__ == "__main__":
-    fazer_backup()
+    parser = argparse.ArgumentParser(description="Backup online do metrifiy.db")
+    parser.add_argument("--banco", default="metrifiy.db")
+    parser.add_argument("--pasta", default="backups")
+    parser.add_argument("--compressao", choices=["gzip", "zstd"])
+    parser.add_argument("--manter", type=int, default=MANTER_PADRAO)
+    args = parser.parse_args()
+    try:
+        fazer_backup(args.banco, args.pasta, args.compressao, args.manter)
+    except Exception as e:
+        print(f"❌ Erro ao fazer backup: {e}")
+        raise SystemExit(1)
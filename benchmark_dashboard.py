@@ -0,0 +1,203 @@
+"""
+Benchmark do dashboard (/) num banco SQLite sintético.
+
+Gera um banco temporário com N vendas (padrão: 500 mil, espalhadas pelos
+últimos 365 dias) e compara, para o mês vigente e para o último ano:
+
+- antes: as consultas que o dashboard fazia direto na tabela ``vendas``
+  (uma por total, mais três GROUP BY por produto para os rankings);
+- depois: a rota ``/`` atual (resumo diário, uma consulta de totais com
+  agregação condicional e uma passada por produto), medida pelo test client,
+  incluindo carga do usuário e renderização do template. O cache de
+  relatórios é esvaziado antes de cada repetição: mede-se o cálculo, não o
+  acerto no cache.
+
+Uso:
+    python benchmark_dashboard.py [--vendas 500000] [--produtos 2000] [--repeticoes 5]
+
+O banco de produção não é tocado: o script roda num diretório temporário.
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, func, insert, select
+
+UFS = ["SP", "RJ", "MG", "RS", "PR", "SC", "BA", "PE", "CE", "GO", "DF", "PA", "ES", "MT", "AM", None]
+
+
+def gerar_dados(app, n_vendas, n_produtos, lote=50000):
+    rnd = random.Random(42)
+    produtos_seed = []
+    for i in range(1, n_produtos + 1):
+        custo = round(rnd.uniform(5, 200), 2)
+        produtos_seed.append({
+            "id": i,
+            "nome": f"Produto sintético {i:05d}",
+            "sku": f"SKU-{i:05d}",
+            "custo_unitario": custo,
+            "preco_venda_sugerido": round(custo * 1.8, 2),
+            "estoque_inicial": 100,
+            "estoque_atual": rnd.randint(0, 500),
+            "publicidade": rnd.choice([0, 0, 0, 50, 100]),
+        })
+
+    agora = datetime.now()
+    with app.engine.begin() as conn:
+        conn.execute(insert(app.produtos), produtos_seed)
+
+        registros = []
+        for i in range(n_vendas):
+            p = produtos_seed[rnd.randrange(n_produtos)]
+            qtd = rnd.randint(1, 3)
+            preco = round(p["preco_venda_sugerido"] * rnd.uniform(0.8, 1.2), 2)
+            cancelada = rnd.random() < 0.05
+            receita = 0.0 if cancelada else round(preco * qtd, 2)
+            comissao = round(receita * 0.12, 2)
+            custo = round(p["custo_unitario"] * qtd, 2)
+            registros.append({
+                "produto_id": p["id"],
+                "data_venda": (agora - timedelta(seconds=rnd.randrange(365 * 86400))).isoformat(timespec="seconds"),
+                "quantidade": qtd,
+                "preco_venda_unitario": preco,
+                "receita_total": receita,
+                "comissao_ml": comissao,
+                "custo_total": custo,
+                "margem_contribuicao": receita - comissao - custo,
+                "origem": "Mercado Livre",
+                "numero_venda_ml": str(2000000000 + i),
+                "lote_importacao": "benchmark",
+                "estado": rnd.choice(UFS),
+            })
+            if len(registros) >= lote:
+                conn.execute(insert(app.vendas), registros)
+                registros = []
+        if registros:
+            conn.execute(insert(app.vendas), registros)
+
+        app.resumo_vendas.reconstruir(conn)
+
+
+def dashboard_legado(app, conn, data_inicio, data_fim):
+    """Consultas que o dashboard fazia sobre ``vendas`` antes do resumo diário."""
+    vendas, produtos = app.vendas, app.produtos
+    filtro_data = [vendas.c.data_venda >= data_inicio, vendas.c.data_venda <= data_fim + "T23:59:59"]
+    filtro_nao_cancelada = [vendas.c.receita_total > 0] + filtro_data
+
+    conn.execute(select(func.count()).select_from(produtos)).scalar_one()
+    conn.execute(select(func.coalesce(func.sum(produtos.c.estoque_atual), 0))).scalar_one()
+    for coluna in (vendas.c.receita_total, vendas.c.custo_total, vendas.c.margem_contribuicao):
+        conn.execute(select(func.coalesce(func.sum(coluna), 0)).where(*filtro_nao_cancelada)).scalar_one()
+    conn.execute(
+        select(produtos.c.id, produtos.c.publicidade)
+        .select_from(vendas.join(produtos))
+        .where(*filtro_nao_cancelada)
+        .group_by(produtos.c.id)
+    ).all()
+    conn.execute(
+        select(func.count()).select_from(vendas).where(vendas.c.receita_total <= 0).where(*filtro_data)
+    ).scalar_one()
+    conn.execute(
+        select(func.coalesce(func.sum(vendas.c.preco_venda_unitario * vendas.c.quantidade), 0))
+        .where(vendas.c.receita_total <= 0)
+        .where(*filtro_data)
+    ).scalar_one()
+    conn.execute(select(app.configuracoes).where(app.configuracoes.c.id == 1)).first()
+    conn.execute(
+        select(func.coalesce(func.avg(vendas.c.preco_venda_unitario), 0)).where(*filtro_nao_cancelada)
+    ).scalar_one()
+    for coluna, ordem in ((vendas.c.quantidade, "desc"), (vendas.c.margem_contribuicao, "desc"),
+                          (vendas.c.margem_contribuicao, "asc")):
+        soma = func.sum(coluna)
+        conn.execute(
+            select(produtos.c.nome, soma)
+            .select_from(vendas.join(produtos))
+            .where(*filtro_nao_cancelada)
+            .group_by(produtos.c.id)
+            .order_by(soma.desc() if ordem == "desc" else soma.asc())
+            .limit(1)
+        ).first()
+
+
+def medir(engine, funcao, repeticoes, preparar=None):
+    """Mediana de ``repeticoes`` chamadas de ``funcao`` e as consultas por chamada.
+
+    ``preparar`` roda antes de cada chamada, fora do tempo medido.
+    """
+    consultas = []
+
+    def contar(*_args, **_kwargs):
+        consultas.append(1)
+
+    event.listen(engine, "before_cursor_execute", contar)
+    try:
+        funcao()  # aquecimento (cache do SQLite / compilação das consultas)
+        consultas.clear()
+        tempos = []
+        for _ in range(repeticoes):
+            if preparar:
+                preparar()
+            inicio = time.perf_counter()
+            funcao()
+            tempos.append((time.perf_counter() - inicio) * 1000)
+    finally:
+        event.remove(engine, "before_cursor_execute", contar)
+    return len(consultas) // repeticoes, statistics.median(tempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vendas", type=int, default=500000)
+    parser.add_argument("--produtos", type=int, default=2000)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    args = parser.parse_args()
+
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    tmp = tempfile.mkdtemp(prefix="bench_dashboard_")
+    os.environ.pop("DATABASE_URL", None)  # nunca apontar para o banco real
+    os.chdir(tmp)
+    sys.path.insert(0, raiz)
+    try:
+        import app
+
+        inicio = time.perf_counter()
+        gerar_dados(app, args.vendas, args.produtos)
+        print(f"Banco sintético: {args.vendas} vendas, {args.produtos} produtos "
+              f"({time.perf_counter() - inicio:.1f}s para gerar)\n")
+
+        client = app.app.test_client()
+        with client.session_transaction() as sessao:
+            sessao["_user_id"] = "1"
+
+        hoje = date.today()
+        periodos = {
+            "mês vigente": (hoje.replace(day=1).isoformat(), hoje.isoformat()),
+            "último ano": ((hoje - timedelta(days=365)).isoformat(), hoje.isoformat()),
+        }
+        print(f"{'período':<14}{'versão':<9}{'consultas':>10}{'mediana (ms)':>15}")
+        for nome, (data_inicio, data_fim) in periodos.items():
+            def antes():
+                with app.engine.connect() as conn:
+                    dashboard_legado(app, conn, data_inicio, data_fim)
+
+            def depois():
+                resp = client.get(f"/?data_inicio={data_inicio}&data_fim={data_fim}")
+                assert resp.status_code == 200, resp.status_code
+
+            # sem limpar, a partir da 2ª chamada a rota sairia do cache de relatórios
+            for versao, funcao, preparar in (("antes", antes, None), ("depois", depois, app.cache_relatorios.limpar)):
+                n, ms = medir(app.engine, funcao, args.repeticoes, preparar)
+                print(f"{nome:<14}{versao:<9}{n:>10}{ms:>15.1f}")
+    finally:
+        os.chdir(raiz)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Microbenchmark do cálculo de lucro (lucro.py).
+
+Gera somas sintéticas por produto e dia (padrão: 10 mil produtos x 365 dias)
+e compara:
+
+- antes: a fórmula aplicada linha a linha em Python, como as rotas faziam;
+- depois: ``calcular_lucro`` sobre as colunas inteiras.
+
+Confere também que os dois dão o mesmo resultado.
+
+Uso:
+    python benchmark_lucro.py [--produtos 10000] [--dias 365] [--repeticoes 3]
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+import pandas as pd
+
+from lucro import calcular_lucro
+
+IMPOSTO_PERCENT = 5.0
+DESPESAS_PERCENT = 3.5
+MESES = 12
+
+
+def gerar_dados(n_produtos, n_dias):
+    rnd = np.random.default_rng(42)
+    n = n_produtos * n_dias
+    qtd = rnd.integers(0, 6, n).astype(float)
+    preco = np.repeat(rnd.uniform(10, 400, n_produtos), n_dias)
+    receita = qtd * preco * rnd.uniform(0.9, 1.1, n)
+    custo = receita * rnd.uniform(0.3, 0.7, n)
+    margem = receita - custo - receita * rnd.uniform(0.05, 0.2, n)
+    return pd.DataFrame({
+        "produto_id": np.repeat(np.arange(1, n_produtos + 1), n_dias),
+        "qtd": qtd,
+        "receita": receita,
+        "custo": custo,
+        "margem": margem,
+        "publicidade": np.repeat(rnd.choice([0.0, 50.0, 100.0], n_produtos), n_dias),
+    })
+
+
+def lucro_linha_a_linha(df):
+    """A fórmula como estava copiada nas rotas (uma linha por vez)."""
+    linhas = []
+    for r in df.to_dict("records"):
+        receita = float(r["receita"] or 0)
+        custo = float(r["custo"] or 0)
+        margem_atual = float(r["margem"] or 0)
+        publicidade_prod = float(r["publicidade"] or 0) * MESES
+        comissao_ml = max(0.0, (receita - custo) - margem_atual)
+        imposto_val = receita * (IMPOSTO_PERCENT / 100.0)
+        despesas_val = receita * (DESPESAS_PERCENT / 100.0)
+        margem_liquida = receita - custo - comissao_ml - imposto_val - despesas_val - publicidade_prod
+        qtd = float(r["qtd"] or 0)
+        linhas.append({
+            "comissao": comissao_ml,
+            "imposto": imposto_val,
+            "despesas": despesas_val,
+            "publicidade": publicidade_prod,
+            "lucro_liquido": margem_liquida,
+            "receita_liquida_unit": (receita - comissao_ml) / qtd if qtd > 0 else 0.0,
+            "comissao_unit": comissao_ml / qtd if qtd > 0 else 0.0,
+            "custo_unit": custo / qtd if qtd > 0 else 0.0,
+            "lucro_unit": margem_liquida / qtd if qtd > 0 else 0.0,
+        })
+    return pd.DataFrame(linhas)
+
+
+def lucro_vetorizado(df):
+    return calcular_lucro(df, IMPOSTO_PERCENT, DESPESAS_PERCENT, MESES)
+
+
+def medir(funcao, df, repeticoes):
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao(df)
+        tempos.append(time.perf_counter() - inicio)
+    return statistics.median(tempos), resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--produtos", type=int, default=10000)
+    parser.add_argument("--dias", type=int, default=365)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args()
+
+    df = gerar_dados(args.produtos, args.dias)
+    print(f"{len(df):,} linhas ({args.produtos} produtos x {args.dias} dias)\n")
+
+    t_antes, antes = medir(lucro_linha_a_linha, df, args.repeticoes)
+    t_depois, depois = medir(lucro_vetorizado, df, args.repeticoes)
+
+    for coluna in antes.columns:
+        if not np.allclose(antes[coluna].to_numpy(), depois[coluna].to_numpy(), rtol=1e-9, atol=1e-6):
+            raise SystemExit(f"Resultados diferentes na coluna {coluna}")
+
+    print(f"{'versão':<16}{'mediana (s)':>12}{'linhas/s':>16}")
+    for nome, t in (("linha a linha", t_antes), ("vetorizado", t_depois)):
+        print(f"{nome:<16}{t:>12.3f}{len(df) / t:>16,.0f}")
+    print(f"\n{t_antes / t_depois:.0f}x mais rápido; resultados iguais.")
+
+
+if __name__ == "__main__":
+    main()
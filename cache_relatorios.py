@@ -0,0 +1,236 @@
+"""
+Cache das páginas de relatório, invalidado pela versão dos dados.
+
+Dashboard, vendas, lucro, estoque, financeiro e conciliação recalculavam
+tudo a cada recarga do mesmo período, embora os dados só mudem em
+importações, exclusões de lote, ajustes, configurações e edições de produto.
+
+``VersaoDados`` é um contador que sobe sempre que uma transação que escreveu
+no banco termina: os eventos do SQLAlchemy marcam a conexão quando ela executa
+INSERT/UPDATE/DELETE/DDL, e a versão é incrementada quando a conexão volta ao
+pool (depois do commit). Assim qualquer rota ou job que grave pelo ``engine``
+invalida o cache, sem precisar lembrar de chamar nada.
+
+``CacheRelatorios`` guarda a resposta renderizada com a chave
+(rota, parâmetros normalizados, usuário, dia, versão), em LRU limitado por
+número de itens e por bytes. Páginas com mensagens flash não entram no cache.
+
+A mesma chave gera o ETag das respostas: quando o navegador reenvia
+``If-None-Match`` com o ETag atual, a resposta é um 304 sem executar a view
+(nenhuma consulta). O ETag inclui um identificador do processo, porque o
+contador recomeça a cada boot.
+
+O contador é por processo: vale para o gunicorn com um worker
+(``gunicorn_config.py``). Alterações feitas por scripts externos direto no
+banco só aparecem depois de reiniciar o app (ou de outra escrita pelo app).
+"""
+import functools
+import hashlib
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import date
+
+from flask import Response, g, make_response, message_flashed, request, session
+from sqlalchemy import event
+
+
+_ESCRITA = re.compile(r"^\s*(INSERT|UPDATE|DELETE|REPLACE|ALTER|CREATE|DROP|TRUNCATE|COPY)\b", re.IGNORECASE)
+
+
+class VersaoDados:
+    """Contador global, incrementado a cada transação que altera o banco."""
+
+    def __init__(self):
+        self._valor = 0
+        self._lock = threading.Lock()
+        # distingue os contadores de processos diferentes (ETag após reinício)
+        self.instancia = uuid.uuid4().hex
+
+    @property
+    def atual(self):
+        return self._valor
+
+    def incrementar(self):
+        with self._lock:
+            self._valor += 1
+            return self._valor
+
+    def monitorar(self, engine, ignorar=()):
+        """Incrementa a versão quando uma conexão que escreveu volta ao pool.
+
+        ``ignorar``: tabelas cujas escritas não afetam os relatórios
+        (ex.: ``import_jobs``).
+        """
+        def marcar(conn, _cursor, sql, _parametros, _contexto, _executemany):
+            if _ESCRITA.match(sql) and not any(tabela in sql for tabela in ignorar):
+                conn.info["dados_alterados"] = True
+
+        def devolvida(_dbapi_conn, registro):
+            if registro is not None and registro.info.pop("dados_alterados", False):
+                self.incrementar()
+
+        event.listen(engine, "after_cursor_execute", marcar)
+        event.listen(engine, "checkin", devolvida)
+
+
+def _flash_na_requisicao(_app, **_kwargs):
+    g.cache_relatorio_flash = True
+
+
+message_flashed.connect(_flash_na_requisicao)
+
+
+class CacheRelatorios:
+    """LRU de respostas de relatório, com limite de itens e de memória."""
+
+    # cabeçalhos que não devem ser reaproveitados entre respostas
+    CABECALHOS_IGNORADOS = {"content-length", "set-cookie", "vary"}
+
+    def __init__(self, versao, max_bytes=32 * 1024 * 1024, max_itens=256):
+        self.versao = versao
+        self.max_bytes = max_bytes
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._bytes = 0
+        self._versao_itens = versao.atual
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.faltas = 0
+
+    def chave(self):
+        """(rota, parâmetros, usuário, dia, versão) da requisição atual."""
+        parametros = tuple(sorted(
+            (nome, valor)
+            for nome, valores in request.args.lists()
+            for valor in valores
+            if valor != ""
+        ))
+        # o dia entra porque os períodos padrão dependem de hoje
+        return (
+            request.endpoint,
+            tuple(sorted((request.view_args or {}).items())),
+            parametros,
+            session.get("_user_id"),
+            date.today().isoformat(),
+            self.versao.atual,
+        )
+
+    def obter(self, chave):
+        with self._lock:
+            if self._versao_itens != self.versao.atual:
+                # os dados mudaram: nada do que está guardado serve mais
+                self._itens.clear()
+                self._bytes = 0
+                self._versao_itens = self.versao.atual
+            item = self._itens.get(chave)
+            if item is None:
+                self.faltas += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return item
+
+    def guardar(self, chave, item):
+        tamanho = len(item[0])
+        if tamanho > self.max_bytes // 4 or chave[-1] != self.versao.atual:
+            return
+        with self._lock:
+            anterior = self._itens.pop(chave, None)
+            if anterior is not None:
+                self._bytes -= len(anterior[0])
+            self._itens[chave] = item
+            self._bytes += tamanho
+            while self._itens and (self._bytes > self.max_bytes or len(self._itens) > self.max_itens):
+                _, removido = self._itens.popitem(last=False)
+                self._bytes -= len(removido[0])
+
+    def etag(self, chave):
+        return hashlib.sha1(repr((self.versao.instancia, chave)).encode("utf-8")).hexdigest()[:32]
+
+    def _condicional(self, chave):
+        """(etag, resposta 304 ou None) para a requisição atual."""
+        etag = self.etag(chave)
+        if etag in request.if_none_match:
+            resp = Response(status=304)
+            self._marcar_etag(resp, etag)
+            return etag, resp
+        return etag, None
+
+    @staticmethod
+    def _marcar_etag(resp, etag):
+        resp.set_etag(etag)
+        # o navegador guarda, mas sempre revalida; proxies não compartilham entre usuários
+        resp.headers["Cache-Control"] = "private, no-cache"
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self._bytes = 0
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                "itens": len(self._itens),
+                "bytes": self._bytes,
+                "acertos": self.acertos,
+                "faltas": self.faltas,
+                "versao": self.versao.atual,
+            }
+
+    def rota(self, view):
+        """Decorador para views GET de relatório.
+
+        Responde 304 pelo ETag ou serve do cache; senão executa a view e guarda
+        a página. Vai acima de ``@login_required``, para que o 304 e o acerto
+        no cache não façam nenhuma consulta: a chave tem o usuário da sessão
+        (assinada), então só quem recebeu a página a recebe de novo, e excluir
+        ou alterar usuários muda a versão dos dados.
+        """
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET" or "_flashes" in session:
+                return view(*args, **kwargs)
+
+            chave = self.chave()
+            etag, nao_modificado = self._condicional(chave)
+            if nao_modificado is not None:
+                return nao_modificado
+
+            item = self.obter(chave)
+            if item is not None:
+                corpo, status, cabecalhos = item
+                resp = Response(corpo, status=status, headers=cabecalhos)
+                self._marcar_etag(resp, etag)
+                return resp
+
+            g.cache_relatorio_flash = False
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code == 200 and not resp.direct_passthrough and not g.cache_relatorio_flash:
+                cabecalhos = [
+                    (nome, valor) for nome, valor in resp.headers.items()
+                    if nome.lower() not in self.CABECALHOS_IGNORADOS
+                ]
+                self.guardar(chave, (resp.get_data(), resp.status_code, cabecalhos))
+                self._marcar_etag(resp, etag)
+            return resp
+        return wrapper
+
+    def condicional(self, view):
+        """Decorador só com ETag/304, sem guardar a resposta (ex.: exportações Excel)."""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET" or "_flashes" in session:
+                return view(*args, **kwargs)
+
+            etag, nao_modificado = self._condicional(self.chave())
+            if nao_modificado is not None:
+                return nao_modificado
+
+            g.cache_relatorio_flash = False
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code == 200 and not g.cache_relatorio_flash:
+                self._marcar_etag(resp, etag)
+            return resp
+        return wrapper
@@ -0,0 +1,211 @@
+"""
+Envio do estoque (``produtos.estoque_atual``) para os anúncios do Mercado Livre.
+
+Quem altera o estoque fora das vendas (ajuste, importação de estoque / ML
+Full, cadastro de produto) chama ``marcar`` na mesma transação: o produto entra
+em ``ml_estoque_envios`` com ``pendente = 1`` e a ``versao`` sobe. O envio lê
+só os pendentes — nada de comparar o estoque inteiro com o ML — em blocos de
+``bloco`` produtos, grava cada bloco com chamadas paralelas (o ML não tem
+atualização em lote de anúncios) e registra o resultado por produto:
+
+- ``ok``: todos os anúncios do SKU receberam o estoque;
+- ``inalterado``: o anúncio já está com a mesma quantidade no ML;
+- ``sem_anuncio``: nenhum anúncio com o SKU em ``ml_anuncios``;
+- ``erro``: o ML recusou (4xx); fica registrado e só volta com a próxima
+  alteração do produto;
+- ``falha``: sem resposta ou 429/5xx depois das novas tentativas da sessão;
+  o produto continua pendente e é reenviado em até ``rodadas`` passadas,
+  com espera dobrando entre elas (``espera``, 2 × ``espera``...); o que
+  sobrar vai no próximo envio.
+
+O ML baixa o próprio estoque a cada venda sem avisar, então a quantidade
+guardada em ``ml_anuncios`` pode estar velha: antes de comparar, os anúncios
+de cada bloco são relidos pelo multiget ``/items?ids=`` (20 por chamada, bem
+menos que um PUT por anúncio) e ``ml_anuncios`` fica com o que foi lido.
+
+A ``versao`` lida vai junto na gravação do resultado: se o estoque mudou
+durante o envio, o produto continua pendente e sai no próximo.
+"""
+import time
+from datetime import datetime
+
+import requests
+from sqlalchemy import and_, bindparam, func, insert, literal, select, update
+
+BLOCO_PADRAO = 200
+RODADAS = 3
+ESPERA = 1.0
+
+
+class PublicadorEstoqueML:
+    """Mantém a tabela de alterações e envia o estoque dos pendentes."""
+
+    def __init__(self, produtos, anuncios, envios, bloco=BLOCO_PADRAO, rodadas=RODADAS, espera=ESPERA):
+        self.produtos = produtos
+        self.anuncios = anuncios
+        self.envios = envios
+        self.bloco = bloco
+        self.rodadas = rodadas
+        self.espera = espera
+
+    def marcar(self, conn, *filtros):
+        """Marca como pendentes os produtos que atendem ``filtros`` (sobre ``produtos``)."""
+        p, e = self.produtos.c, self.envios.c
+        agora = datetime.now().isoformat(timespec="seconds")
+        ids = select(p.id).where(*filtros)
+        conn.execute(
+            update(self.envios)
+            .where(e.produto_id.in_(ids))
+            .values(versao=e.versao + 1, pendente=1, tentativas=0, alterado_em=agora)
+        )
+        conn.execute(
+            insert(self.envios).from_select(
+                ["produto_id", "versao", "pendente", "tentativas", "alterado_em"],
+                select(p.id, literal(1), literal(1), literal(0), literal(agora))
+                .where(*filtros, p.id.not_in(select(e.produto_id))),
+            )
+        )
+
+    def pendentes(self, conn):
+        e = self.envios.c
+        return conn.execute(
+            select(func.count()).select_from(self.envios)
+            .where(e.pendente == 1)
+        ).scalar()
+
+    def _ler_bloco(self, conn, depois_de):
+        p, e, a = self.produtos.c, self.envios.c, self.anuncios.c
+        linhas = conn.execute(
+            select(e.produto_id, e.versao, p.sku, p.estoque_atual)
+            .join(self.produtos, p.id == e.produto_id)
+            .where(e.pendente == 1, e.produto_id > depois_de)
+            .order_by(e.produto_id)
+            .limit(self.bloco)
+        ).mappings().all()
+        skus = {l["sku"] for l in linhas if l["sku"]}
+        anuncios = {}
+        if skus:
+            for item_id, sku, estoque_ml in conn.execute(
+                select(a.item_id, a.sku, a.estoque_ml).where(a.sku.in_(skus))
+            ):
+                anuncios.setdefault(sku, []).append((item_id, estoque_ml))
+        return linhas, anuncios
+
+    def publicar(self, engine, cliente, progresso=None):
+        """Envia o estoque de todos os pendentes; retorna contagens por resultado e os erros por SKU."""
+        resultados, erros = {}, {}
+        chamadas = 0
+        for rodada in range(self.rodadas):
+            if rodada:
+                time.sleep(self.espera * 2 ** (rodada - 1))
+            chamadas += self._passada(engine, cliente, resultados, erros, progresso)
+            if "falha" not in resultados.values():
+                break
+        totais = {"produtos": len(resultados), "chamadas": chamadas}
+        for resultado in ("ok", "inalterado", "sem_anuncio", "erro", "falha"):
+            totais[resultado] = sum(1 for r in resultados.values() if r == resultado)
+        totais["erros"] = list(erros.values())
+        return totais
+
+    def _passada(self, engine, cliente, resultados, erros, progresso):
+        """Uma leitura completa dos pendentes, bloco a bloco; retorna o número de chamadas à API."""
+        chamadas = 0
+        ultimo = 0
+        while True:
+            with engine.connect() as conn:
+                linhas, anuncios = self._ler_bloco(conn, ultimo)
+            if not linhas:
+                return chamadas
+            ultimo = linhas[-1]["produto_id"]
+
+            estoque = {l["produto_id"]: max(int(l["estoque_atual"] or 0), 0) for l in linhas}
+            no_ml = self._ler_no_ml(cliente, [item_id for l in linhas for item_id, _ in anuncios.get(l["sku"], [])])
+            envios = [
+                (item_id, estoque[l["produto_id"]])
+                for l in linhas
+                for item_id, estoque_ml in anuncios.get(l["sku"], [])
+                if no_ml is None or no_ml.get(item_id, estoque_ml) != estoque[l["produto_id"]]
+            ]
+            respostas = {item_id: (status, erro) for item_id, status, erro in cliente.atualizar_estoques(envios)}
+            chamadas += len(envios)
+
+            agora = datetime.now().isoformat(timespec="seconds")
+            concluidos, falhas = [], []
+            # ml_anuncios com o que foi lido; os PUTs aceitos, gravados depois, prevalecem
+            enviados = [{"b_item_id": i, "b_estoque": q} for i, q in (no_ml or {}).items()]
+            for l in linhas:
+                itens = [i for i, _ in anuncios.get(l["sku"], [])]
+                qtd = estoque[l["produto_id"]]
+                com_erro = [(i, *respostas[i]) for i in itens if i in respostas and respostas[i][1]]
+                enviados += [{"b_item_id": i, "b_estoque": qtd} for i in itens
+                             if i in respostas and not respostas[i][1]]
+                if not itens:
+                    resultado = "sem_anuncio"
+                elif not any(i in respostas for i in itens):
+                    resultado = "inalterado"
+                elif not com_erro:
+                    resultado = "ok"
+                elif any(status is None or status == 429 or status >= 500 for _, status, _ in com_erro):
+                    resultado = "falha"
+                else:
+                    resultado = "erro"
+                texto = "; ".join(f"{i}: {erro}" for i, _, erro in com_erro)[:1000] or None
+                resultados[l["produto_id"]] = resultado
+                if texto:
+                    erros[l["produto_id"]] = {"sku": l["sku"], "resultado": resultado, "erro": texto}
+                else:
+                    erros.pop(l["produto_id"], None)
+                registro = {
+                    "b_produto_id": l["produto_id"],
+                    "b_versao": l["versao"],
+                    "b_resultado": resultado,
+                    "b_erro": texto,
+                    "b_estoque": qtd,
+                    "b_agora": agora,
+                }
+                (falhas if resultado == "falha" else concluidos).append(registro)
+            self._gravar(engine, concluidos, falhas, enviados)
+            if progresso:
+                progresso(len(resultados))
+
+    def _ler_no_ml(self, cliente, item_ids):
+        """{item_id: available_quantity} atual no ML; os não encontrados ficam de fora.
+
+        Se a leitura falhar, retorna None e o bloco é enviado sem comparar.
+        """
+        if not item_ids:
+            return {}
+        try:
+            itens = cliente.anuncios(item_ids)
+        except requests.RequestException as e:
+            print(f"[ESTOQUE ML] leitura dos anúncios falhou, enviando sem comparar: {e}")
+            return None
+        return {item["id"]: item["available_quantity"] for item in itens if item.get("available_quantity") is not None}
+
+    def _gravar(self, engine, concluidos, falhas, enviados):
+        e, a = self.envios.c, self.anuncios.c
+        with engine.begin() as conn:
+            if concluidos:
+                # só sai da fila se o estoque não mudou durante o envio (mesma versão)
+                conn.execute(
+                    update(self.envios)
+                    .where(and_(e.produto_id == bindparam("b_produto_id"), e.versao == bindparam("b_versao")))
+                    .values(pendente=0, tentativas=0, resultado=bindparam("b_resultado"), erro=bindparam("b_erro"),
+                            estoque_enviado=bindparam("b_estoque"), enviado_em=bindparam("b_agora")),
+                    concluidos,
+                )
+            if falhas:
+                conn.execute(
+                    update(self.envios)
+                    .where(e.produto_id == bindparam("b_produto_id"))
+                    .values(tentativas=e.tentativas + 1, resultado=bindparam("b_resultado"),
+                            erro=bindparam("b_erro"), enviado_em=bindparam("b_agora")),
+                    falhas,
+                )
+            if enviados:
+                conn.execute(
+                    update(self.anuncios)
+                    .where(a.item_id == bindparam("b_item_id"))
+                    .values(estoque_ml=bindparam("b_estoque")),
+                    enviados,
+                )
@@ -0,0 +1,977 @@
+"""
+Conversão local de etiquetas ZPL (impressoras Zebra) para PDF.
+
+Substitui a chamada ao Labelary na tela "Imprimir Etiquetas ZPL": a etiqueta
+é interpretada aqui e vira um PDF vetorial na grade da impressora (8 pontos
+por mm, 203 dpi), uma página por etiqueta, sem rede nem limite de uso.
+
+Cobre o que as etiquetas do Mercado Livre (Full e envio 10x15) usam:
+
+- campos: ``^FO``/``^FT`` (origem), ``^FD``/``^FV`` com ``^FH`` (hexa) e
+  ``^CI28`` (UTF-8), ``^FB`` (bloco com quebra e alinhamento), ``^FR``
+  (campo invertido), ``^FW`` e ``^LH``/``^LR``;
+- fontes ``^A`` e ``^CF``: a fonte 0 sai em Helvetica-Bold e as de bitmap
+  (A..V) em Helvetica, com largura e altura em pontos como na Zebra;
+- códigos ``^BC`` (Code 128, com os códigos de invocação ``>:``, ``>;``...)
+  e ``^BQ`` (QR Code modelo 2) com ``^BY``; as barras e módulos caem
+  exatamente em pontos inteiros;
+- ``^GB`` (caixas e linhas) e ``^GF`` (imagens, hexa com compressão ou
+  ``:Z64:``/``:B64:``);
+- ``^PQ`` (cópias) e várias etiquetas ``^XA...^XZ`` no mesmo texto.
+
+Os demais comandos (configuração da impressora, outros códigos de barras)
+são ignorados. As fontes são aproximações da CG Triumvirate da Zebra: o texto
+ocupa a mesma caixa, mas o desenho das letras difere.
+"""
+import base64
+import binascii
+import re
+import unicodedata
+import zlib
+
+PONTOS_POR_MM = 8
+PT_POR_PONTO = 72 / (25.4 * PONTOS_POR_MM)
+
+# fontes de bitmap da Zebra a 8 pontos/mm: (altura, largura) da matriz base
+FONTES_BITMAP = {
+    "A": (9, 5), "B": (11, 7), "C": (18, 10), "D": (18, 10), "E": (28, 15), "F": (26, 13),
+    "G": (60, 40), "H": (21, 13), "P": (20, 18), "Q": (28, 24), "R": (35, 31), "S": (40, 35),
+    "T": (48, 42), "U": (59, 53), "V": (80, 71),
+}
+# linha de base do texto a partir do topo da célula, em frações da altura
+ASCENDENTE = 0.78
+ROTACOES = {"N": (1, 0, 0, 1), "R": (0, 1, -1, 0), "I": (-1, 0, 0, -1), "B": (0, -1, 1, 0)}
+
+# larguras (1/1000 do corpo) dos caracteres 32..126 das fontes padrão do PDF
+_LARGURAS = {
+    "Helvetica": [
+        278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+        556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+        1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+        667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+        333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+        556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+    ],
+    "Helvetica-Bold": [
+        278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+        556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+        975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+        667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+        333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+        611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+    ],
+}
+_RECURSO_FONTE = {"Helvetica": "/F1", "Helvetica-Bold": "/F2"}
+
+
+def _n(valor):
+    """Número para o fluxo do PDF (sem zeros sobrando)."""
+    texto = f"{valor:.3f}".rstrip("0").rstrip(".")
+    return texto if texto not in ("", "-0") else "0"
+
+
+def _inteiro(valor, padrao):
+    try:
+        return int(float(valor))
+    except (TypeError, ValueError):
+        return padrao
+
+
+def _largura_texto(texto, fonte, tamanho):
+    tabela = _LARGURAS[fonte]
+    total = 0
+    for c in texto:
+        codigo = ord(c)
+        if not 32 <= codigo <= 126:
+            # acentuadas: largura da letra base (ã -> a)
+            base = unicodedata.normalize("NFD", c)[:1]
+            codigo = ord(base) if base and 32 <= ord(base) <= 126 else 110
+        total += tabela[codigo - 32]
+    return total * tamanho / 1000
+
+
+def _texto_pdf(texto):
+    dados = texto.encode("cp1252", errors="replace")
+    return "(" + dados.decode("latin-1").replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+# --------------------------------------------------------------------
+# Code 128
+# --------------------------------------------------------------------
+_CODE128 = [
+    "212222", "222122", "222221", "121223", "121322", "131222", "122213", "122312", "132212", "221213",
+    "221312", "231212", "112232", "122132", "122231", "113222", "123122", "123221", "223211", "221132",
+    "221231", "213212", "223112", "312131", "311222", "321122", "321221", "312212", "322112", "322211",
+    "212123", "212321", "232121", "111323", "131123", "131321", "112313", "132113", "132311", "211313",
+    "231113", "231311", "112133", "112331", "132131", "113123", "113321", "133121", "313121", "211331",
+    "231131", "213113", "213311", "213131", "311123", "311321", "331121", "312113", "312311", "332111",
+    "314111", "221411", "431111", "111224", "111422", "121124", "121421", "141122", "141221", "112214",
+    "112412", "122114", "122411", "142112", "142211", "241211", "221114", "413111", "241112", "134111",
+    "111242", "121142", "121241", "114212", "124112", "124211", "411212", "421112", "421211", "212141",
+    "214121", "412121", "111143", "111341", "131141", "114113", "114311", "411113", "411311", "113141",
+    "114131", "311141", "411131", "211412", "211214", "211232", "2331112",
+]
+_INICIO = {"A": 103, "B": 104, "C": 105}
+_TROCA = {"A": 101, "B": 100, "C": 99}  # código para mudar para o subconjunto (exceto de A->A etc.)
+_FNC1 = 102
+_PARADA = 106
+
+
+def _valor_128(c, subconjunto):
+    codigo = ord(c)
+    if subconjunto == "A":
+        return codigo - 32 if 32 <= codigo <= 95 else codigo + 64
+    return codigo - 32
+
+
+def _digitos_a_frente(dados, i):
+    n = 0
+    while i + n < len(dados) and dados[i + n].isdigit():
+        n += 1
+    return n
+
+
+def code128(dados, automatico=False):
+    """Larguras (barra, espaço, barra...) em módulos do Code 128 de ``dados``; e o texto legível.
+
+    Entende os códigos de invocação do ZPL no ``^FD``: ``>9``/``>:``/``>;``
+    no início (subconjunto A/B/C), ``>7``/``>6``/``>5`` (troca para A/B/C),
+    ``>8`` (FNC1) e ``>0`` (o próprio ``>``). Sem código de início, usa o
+    subconjunto B, como a Zebra no modo N; com ``automatico`` (modo A do
+    ``^BC``) escolhe C para sequências de dígitos.
+    """
+    valores = []
+    legivel = []
+    i = 0
+    subconjunto = None
+    if dados[:2] in (">9", ">:", ">;"):
+        subconjunto = {">9": "A", ">:": "B", ">;": "C"}[dados[:2]]
+        i = 2
+    elif automatico and _digitos_a_frente(dados, 0) >= 2 and _digitos_a_frente(dados, 0) % 2 == 0 \
+            and (_digitos_a_frente(dados, 0) >= 4 or len(dados) == 2):
+        subconjunto = "C"
+    else:
+        subconjunto = "B"
+    valores.append(_INICIO[subconjunto])
+
+    while i < len(dados):
+        if dados[i] == ">" and i + 1 < len(dados) and dados[i + 1] in "5678 0":
+            codigo = dados[i + 1]
+            i += 2
+            if codigo == "8":
+                valores.append(_FNC1)
+            elif codigo in "567":
+                novo = {"5": "C", "6": "B", "7": "A"}[codigo]
+                if novo != subconjunto:
+                    valores.append(_TROCA[novo])
+                    subconjunto = novo
+            elif codigo == "0":
+                valores.append(_valor_128(">", subconjunto if subconjunto != "C" else "B"))
+                legivel.append(">")
+            continue
+        if subconjunto == "C":
+            if _digitos_a_frente(dados, i) >= 2:
+                valores.append(int(dados[i:i + 2]))
+                legivel.append(dados[i:i + 2])
+                i += 2
+                continue
+            subconjunto = "B"
+            valores.append(_TROCA["B"])
+        if automatico:
+            digitos = _digitos_a_frente(dados, i)
+            if digitos >= 4 and (digitos % 2 == 0 or i + digitos == len(dados) or digitos >= 6):
+                if digitos % 2:
+                    # o dígito ímpar vai no subconjunto atual
+                    valores.append(_valor_128(dados[i], subconjunto))
+                    legivel.append(dados[i])
+                    i += 1
+                valores.append(_TROCA["C"])
+                subconjunto = "C"
+                continue
+        c = dados[i]
+        if ord(c) < 32 and subconjunto == "B":
+            valores.append(98)  # SHIFT: um caractere do subconjunto A
+            valores.append(_valor_128(c, "A"))
+        elif ord(c) > 127:
+            valores.append(_valor_128("?", subconjunto))
+        else:
+            valores.append(_valor_128(c, subconjunto))
+        legivel.append(c)
+        i += 1
+
+    soma = valores[0] + sum(v * n for n, v in enumerate(valores[1:], 1))
+    valores += [soma % 103, _PARADA]
+    larguras = [int(d) for v in valores for d in _CODE128[v]]
+    return larguras, "".join(legivel)
+
+
+# --------------------------------------------------------------------
+# QR Code (modelo 2)
+# --------------------------------------------------------------------
+_QR_NIVEIS = {"L": (0, 1), "M": (1, 0), "Q": (2, 3), "H": (3, 2)}  # índice nas tabelas, bits do formato
+_QR_ECC_POR_BLOCO = [
+    [-1, 7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28, 28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30],
+    [-1, 10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26, 26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28],
+    [-1, 13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30, 28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30],
+    [-1, 17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28, 30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30],
+]
+_QR_BLOCOS = [
+    [-1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8, 8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25],
+    [-1, 1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16, 17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49],
+    [-1, 1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20, 23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68],
+    [-1, 1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25, 25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81],
+]
+_ALFANUMERICO = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
+
+
+def _qr_modulos_dados(versao):
+    total = (16 * versao + 128) * versao + 64
+    if versao >= 2:
+        alinhamentos = versao // 7 + 2
+        total -= (25 * alinhamentos - 10) * alinhamentos - 55
+        if versao >= 7:
+            total -= 36
+    return total
+
+
+def _qr_alinhamentos(versao):
+    if versao == 1:
+        return []
+    quantos = versao // 7 + 2
+    passo = (versao * 8 + quantos * 3 + 5) // (quantos * 4 - 4) * 2
+    tamanho = versao * 4 + 17
+    return [6] + sorted(tamanho - 7 - i * passo for i in range(quantos - 1))
+
+
+def _gf_mult(x, y):
+    z = 0
+    for i in reversed(range(8)):
+        z = (z << 1) ^ ((z >> 7) * 0x11D)
+        z ^= ((y >> i) & 1) * x
+    return z
+
+
+def _rs_divisor(grau):
+    resultado = [0] * (grau - 1) + [1]
+    raiz = 1
+    for _ in range(grau):
+        for j in range(grau):
+            resultado[j] = _gf_mult(resultado[j], raiz)
+            if j + 1 < grau:
+                resultado[j] ^= resultado[j + 1]
+        raiz = _gf_mult(raiz, 0x02)
+    return resultado
+
+
+def _rs_resto(dados, divisor):
+    resultado = [0] * len(divisor)
+    for b in dados:
+        fator = b ^ resultado.pop(0)
+        resultado.append(0)
+        for i, coef in enumerate(divisor):
+            resultado[i] ^= _gf_mult(coef, fator)
+    return resultado
+
+
+def _qr_segmento(dados):
+    """(modo, bits do modo, bits por versão do contador, bits dos dados, quantidade)."""
+    texto = dados.decode("latin-1")
+    if texto and texto.isdigit() and texto.isascii():
+        bits = []
+        for i in range(0, len(texto), 3):
+            grupo = texto[i:i + 3]
+            bits.append((int(grupo), len(grupo) * 3 + 1))
+        return 0x1, (10, 12, 14), bits, len(texto)
+    if texto and all(c in _ALFANUMERICO for c in texto):
+        bits = []
+        for i in range(0, len(texto) - 1, 2):
+            bits.append((_ALFANUMERICO.index(texto[i]) * 45 + _ALFANUMERICO.index(texto[i + 1]), 11))
+        if len(texto) % 2:
+            bits.append((_ALFANUMERICO.index(texto[-1]), 6))
+        return 0x2, (9, 11, 13), bits, len(texto)
+    return 0x4, (8, 16, 16), [(b, 8) for b in dados], len(dados)
+
+
+def qr_code(dados, nivel="Q", mascara=None):
+    """Matriz (lista de linhas de bool, True = módulo escuro) do QR Code de ``dados`` (bytes)."""
+    indice, bits_nivel = _QR_NIVEIS.get(nivel, _QR_NIVEIS["Q"])
+    modo, bits_contador, bits_dados, quantidade = _qr_segmento(dados)
+    tamanho_dados = sum(n for _, n in bits_dados)
+    for versao in range(1, 41):
+        contador = bits_contador[0 if versao < 10 else 1 if versao < 27 else 2]
+        capacidade = (_qr_modulos_dados(versao) // 8
+                      - _QR_ECC_POR_BLOCO[indice][versao] * _QR_BLOCOS[indice][versao]) * 8
+        if 4 + contador + tamanho_dados <= capacidade:
+            break
+    else:
+        raise ValueError("Dados grandes demais para um QR Code.")
+
+    bits = []
+
+    def anexar(valor, n):
+        bits.extend((valor >> i) & 1 for i in reversed(range(n)))
+
+    anexar(modo, 4)
+    anexar(quantidade, contador)
+    for valor, n in bits_dados:
+        anexar(valor, n)
+    anexar(0, min(4, capacidade - len(bits)))
+    anexar(0, -len(bits) % 8)
+    palavras = [int("".join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8)]
+    enchimento = 0xEC
+    while len(palavras) * 8 < capacidade:
+        palavras.append(enchimento)
+        enchimento ^= 0xEC ^ 0x11
+
+    # blocos com correção de erros, intercalados
+    blocos_total = _QR_BLOCOS[indice][versao]
+    ecc_bloco = _QR_ECC_POR_BLOCO[indice][versao]
+    palavras_total = _qr_modulos_dados(versao) // 8
+    curtos = blocos_total - palavras_total % blocos_total
+    tamanho_curto = palavras_total // blocos_total
+    divisor = _rs_divisor(ecc_bloco)
+    blocos = []
+    k = 0
+    for i in range(blocos_total):
+        dat = palavras[k:k + tamanho_curto - ecc_bloco + (0 if i < curtos else 1)]
+        k += len(dat)
+        ecc = _rs_resto(dat, divisor)
+        if i < curtos:
+            dat = dat + [0]
+        blocos.append(dat + ecc)
+    final = [
+        bloco[i]
+        for i in range(len(blocos[0]))
+        for j, bloco in enumerate(blocos)
+        if i != tamanho_curto - ecc_bloco or j >= curtos
+    ]
+
+    lado = versao * 4 + 17
+    modulos = [[False] * lado for _ in range(lado)]
+    funcao = [[False] * lado for _ in range(lado)]
+
+    def marcar(x, y, escuro):
+        modulos[y][x] = escuro
+        funcao[y][x] = True
+
+    for i in range(lado):
+        marcar(6, i, i % 2 == 0)
+        marcar(i, 6, i % 2 == 0)
+    for cx, cy in ((3, 3), (lado - 4, 3), (3, lado - 4)):
+        for dy in range(-4, 5):
+            for dx in range(-4, 5):
+                if 0 <= cx + dx < lado and 0 <= cy + dy < lado:
+                    marcar(cx + dx, cy + dy, max(abs(dx), abs(dy)) not in (2, 4))
+    posicoes = _qr_alinhamentos(versao)
+    ultima = len(posicoes) - 1
+    for i, ax in enumerate(posicoes):
+        for j, ay in enumerate(posicoes):
+            if (i, j) in ((0, 0), (0, ultima), (ultima, 0)):
+                continue
+            for dy in range(-2, 3):
+                for dx in range(-2, 3):
+                    marcar(ax + dx, ay + dy, max(abs(dx), abs(dy)) != 1)
+
+    def desenhar_formato(mask):
+        dado = bits_nivel << 3 | mask
+        resto = dado
+        for _ in range(10):
+            resto = (resto << 1) ^ ((resto >> 9) * 0x537)
+        formato = (dado << 10 | resto) ^ 0x5412
+        bit = [(formato >> i) & 1 == 1 for i in range(15)]
+        for i in range(6):
+            marcar(8, i, bit[i])
+        marcar(8, 7, bit[6])
+        marcar(8, 8, bit[7])
+        marcar(7, 8, bit[8])
+        for i in range(9, 15):
+            marcar(14 - i, 8, bit[i])
+        for i in range(8):
+            marcar(lado - 1 - i, 8, bit[i])
+        for i in range(8, 15):
+            marcar(8, lado - 15 + i, bit[i])
+        marcar(8, lado - 8, True)
+
+    desenhar_formato(0)  # reserva as áreas do formato
+    if versao >= 7:
+        resto = versao
+        for _ in range(12):
+            resto = (resto << 1) ^ ((resto >> 11) * 0x1F25)
+        bits_versao = versao << 12 | resto
+        for i in range(18):
+            escuro = (bits_versao >> i) & 1 == 1
+            a, b = lado - 11 + i % 3, i // 3
+            marcar(a, b, escuro)
+            marcar(b, a, escuro)
+
+    i = 0
+    direita = lado - 1
+    while direita >= 1:
+        if direita == 6:
+            direita = 5
+        for vert in range(lado):
+            for j in range(2):
+                x = direita - j
+                subindo = ((direita + 1) & 2) == 0
+                y = lado - 1 - vert if subindo else vert
+                if not funcao[y][x] and i < len(final) * 8:
+                    modulos[y][x] = (final[i >> 3] >> (7 - (i & 7))) & 1 == 1
+                    i += 1
+        direita -= 2
+
+    mascaras = [
+        lambda x, y: (x + y) % 2 == 0,
+        lambda x, y: y % 2 == 0,
+        lambda x, y: x % 3 == 0,
+        lambda x, y: (x + y) % 3 == 0,
+        lambda x, y: (x // 3 + y // 2) % 2 == 0,
+        lambda x, y: x * y % 2 + x * y % 3 == 0,
+        lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+        lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+    ]
+
+    def aplicar(mask):
+        f = mascaras[mask]
+        for y in range(lado):
+            for x in range(lado):
+                if not funcao[y][x] and f(x, y):
+                    modulos[y][x] = not modulos[y][x]
+
+    if mascara is None:
+        melhor = None
+        for mask in range(8):
+            aplicar(mask)
+            desenhar_formato(mask)
+            pontos = _qr_penalidade(modulos)
+            if melhor is None or pontos < melhor[0]:
+                melhor = (pontos, mask)
+            aplicar(mask)
+        mascara = melhor[1]
+    aplicar(mascara)
+    desenhar_formato(mascara)
+    return modulos
+
+
+def _qr_penalidade(modulos):
+    lado = len(modulos)
+    pontos = 0
+    linhas = modulos
+    colunas = [[modulos[y][x] for y in range(lado)] for x in range(lado)]
+    padrao = re.compile("(?=(10111010000|00001011101))")
+    for seq in linhas + colunas:
+        anterior, corrida = None, 0
+        for m in seq:
+            if m == anterior:
+                corrida += 1
+            else:
+                if corrida >= 5:
+                    pontos += corrida - 2
+                anterior, corrida = m, 1
+        if corrida >= 5:
+            pontos += corrida - 2
+        pontos += 40 * len(padrao.findall("".join("1" if m else "0" for m in seq)))
+    for y in range(lado - 1):
+        for x in range(lado - 1):
+            if modulos[y][x] == modulos[y][x + 1] == modulos[y + 1][x] == modulos[y + 1][x + 1]:
+                pontos += 3
+    escuros = sum(map(sum, modulos))
+    total = lado * lado
+    pontos += (abs(escuros * 20 - total * 10) + total - 1) // total * 10 - 10
+    return pontos
+
+
+# --------------------------------------------------------------------
+# ^GF: imagens
+# --------------------------------------------------------------------
+_REPETICOES = {c: i + 1 for i, c in enumerate("GHIJKLMNOPQRSTUVWXY")}
+_REPETICOES.update({c: (i + 1) * 20 for i, c in enumerate("ghijklmnopqrstuvwxyz")})
+
+
+def _hexa_zebra(texto, bytes_linha, linhas):
+    """Expande o hexa com a compressão da Zebra (G..z, ``,`` ``!`` ``:``) em bytes."""
+    digitos_linha = bytes_linha * 2
+    saida = []
+    linha = ""
+    anterior = "0" * digitos_linha
+    repetir = 0
+    for c in texto:
+        if c in _REPETICOES:
+            repetir += _REPETICOES[c]
+            continue
+        if c == ",":
+            linha = linha.ljust(digitos_linha, "0")
+        elif c == "!":
+            linha = linha.ljust(digitos_linha, "F")
+        elif c == ":":
+            linha = anterior
+        elif c in "0123456789ABCDEFabcdef":
+            linha += c.upper() * (repetir or 1)
+        repetir = 0
+        while len(linha) >= digitos_linha:
+            anterior, linha = linha[:digitos_linha], linha[digitos_linha:]
+            saida.append(anterior)
+            if len(saida) == linhas:
+                return bytes.fromhex("".join(saida))
+    if linha:
+        saida.append(linha.ljust(digitos_linha, "0"))
+    while len(saida) < linhas:
+        saida.append("0" * digitos_linha)
+    return bytes.fromhex("".join(saida[:linhas]))
+
+
+def imagem_gf(formato, total, bytes_linha, dados):
+    """Bytes da imagem 1 bit (1 = preto) de um ``^GF``; linhas de ``bytes_linha`` bytes."""
+    linhas = total // bytes_linha if bytes_linha else 0
+    if dados.startswith((":Z64:", ":B64:")):
+        corpo = dados[5:].split(":", 1)[0]
+        bruto = base64.b64decode(corpo + "=" * (-len(corpo) % 4))
+        if dados.startswith(":Z64:"):
+            bruto = zlib.decompress(bruto)
+    elif formato == "A":
+        bruto = _hexa_zebra(dados, bytes_linha, linhas)
+    else:
+        bruto = dados.encode("latin-1", errors="replace")
+    return bruto[:linhas * bytes_linha].ljust(linhas * bytes_linha, b"\0"), linhas
+
+
+# --------------------------------------------------------------------
+# Interpretação
+# --------------------------------------------------------------------
+class _Pagina:
+    def __init__(self):
+        self.ops = []
+        self.imagens = []
+        self.copias = 1
+
+
+class _Campo:
+    def __init__(self):
+        self.x = self.y = 0
+        self.tipico = False  # ^FT: origem na linha de base
+        self.fonte = None
+        self.bloco = None
+        self.reverso = False
+        self.hexa = None
+        self.tipo = "texto"
+        self.params = []
+        self.dados = None
+
+
+class InterpretadorZPL:
+    """Lê o ZPL e produz as páginas (operações de desenho do PDF, em pontos da impressora)."""
+
+    def __init__(self):
+        self.paginas = []
+        self.fonte_padrao = ("A", 9, 5)
+        self.orientacao = "N"
+        self.modulo = 2
+        self.razao = 3.0
+        self.altura_barras = 10
+        self.codificacao = 0
+        self.origem = (0, 0)
+        self.reverso_tudo = False
+        self.ignorados = set()
+        self._pagina = None
+        self._campo = _Campo()
+
+    # ---- entrada ----
+    def interpretar(self, zpl):
+        zpl = zpl.replace("\r", "").replace("\n", "")
+        for comando in re.finditer(r"[\^~][^\^~]*", zpl):
+            token = comando.group(0)
+            corpo = token[1:]
+            if token[0] == "^" and corpo[:1].upper() == "A":
+                self._fonte(corpo[1:2].upper(), corpo[2:])
+                continue
+            nome, params = corpo[:2].upper(), corpo[2:]
+            metodo = getattr(self, f"_cmd_{nome}", None)
+            if metodo is not None:
+                metodo(params)
+            elif nome in ("B1", "B2", "B3", "B4", "B7", "B8", "B9", "BA", "BB", "BD", "BE", "BO", "BU", "BX", "BZ",
+                          "GC", "GD", "GE", "GS", "TB"):
+                self.ignorados.add(token[0] + nome)
+                self._campo.tipo = "ignorado"
+        if self._pagina is not None and (self._pagina.ops or self._pagina.imagens):
+            self.paginas.append(self._pagina)
+        return self.paginas
+
+    def _pag(self):
+        if self._pagina is None:
+            self._pagina = _Pagina()
+        return self._pagina
+
+    # ---- comandos de etiqueta ----
+    def _cmd_XA(self, params):
+        self._pagina = _Pagina()
+        self._campo = _Campo()
+
+    def _cmd_XZ(self, params):
+        # blocos só de configuração (^XA^MCY^CI28^LH5,15^XZ no começo das
+        # etiquetas do ML) não viram página em branco
+        if self._pagina is not None and (self._pagina.ops or self._pagina.imagens):
+            self.paginas.append(self._pagina)
+        self._pagina = None
+        self.reverso_tudo = False
+
+    def _cmd_PQ(self, params):
+        self._pag().copias = max(1, _inteiro(params.split(",")[0], 1))
+
+    def _cmd_LH(self, params):
+        p = params.split(",")
+        self.origem = (_inteiro(p[0], 0), _inteiro(p[1] if len(p) > 1 else 0, 0))
+
+    def _cmd_LR(self, params):
+        self.reverso_tudo = params.strip().upper().startswith("Y")
+
+    def _cmd_CI(self, params):
+        self.codificacao = _inteiro(params.split(",")[0], 0)
+
+    def _cmd_CF(self, params):
+        p = params.split(",")
+        fonte = (p[0].strip().upper() or self.fonte_padrao[0])[:1]
+        altura = _inteiro(p[1] if len(p) > 1 else None, None)
+        largura = _inteiro(p[2] if len(p) > 2 else None, None)
+        self.fonte_padrao = self._dimensoes_fonte(fonte, altura, largura)
+
+    def _cmd_FW(self, params):
+        o = params.strip().upper()[:1]
+        if o in ROTACOES:
+            self.orientacao = o
+
+    def _cmd_BY(self, params):
+        p = params.split(",")
+        self.modulo = max(1, _inteiro(p[0], self.modulo))
+        if len(p) > 1 and p[1].strip():
+            self.razao = float(p[1])
+        if len(p) > 2 and p[2].strip():
+            self.altura_barras = max(1, _inteiro(p[2], self.altura_barras))
+
+    # ---- campos ----
+    def _origem(self, params, tipico):
+        p = params.split(",")
+        self._campo.x = _inteiro(p[0], 0) + self.origem[0]
+        self._campo.y = _inteiro(p[1] if len(p) > 1 else 0, 0) + self.origem[1]
+        self._campo.tipico = tipico
+
+    def _cmd_FO(self, params):
+        self._origem(params, False)
+
+    def _cmd_FT(self, params):
+        self._origem(params, True)
+
+    def _dimensoes_fonte(self, fonte, altura, largura):
+        if fonte in FONTES_BITMAP:
+            base_a, base_l = FONTES_BITMAP[fonte]
+            if altura is None and largura is None:
+                return fonte, base_a, base_l
+            altura = altura or round(largura / base_l) * base_a
+            largura = largura or max(1, round(altura / base_a)) * base_l
+            return fonte, altura, largura
+        altura = altura or 9
+        return "0", altura, largura or altura
+
+    def _fonte(self, fonte, params):
+        p = params.split(",")
+        orientacao = p[0].strip().upper()[:1] or self.orientacao
+        altura = _inteiro(p[1] if len(p) > 1 else None, None)
+        largura = _inteiro(p[2] if len(p) > 2 else None, None)
+        if altura is None and largura is None:
+            altura = self.fonte_padrao[1]
+        nome, altura, largura = self._dimensoes_fonte(fonte, altura, largura)
+        self._campo.fonte = (nome, orientacao if orientacao in ROTACOES else self.orientacao, altura, largura)
+
+    def _cmd_FB(self, params):
+        p = params.split(",")
+        self._campo.bloco = (
+            _inteiro(p[0], 0),
+            max(1, _inteiro(p[1] if len(p) > 1 else 1, 1)),
+            _inteiro(p[2] if len(p) > 2 else 0, 0),
+            (p[3].strip().upper()[:1] if len(p) > 3 else "") or "L",
+        )
+
+    def _cmd_FR(self, params):
+        self._campo.reverso = True
+
+    def _cmd_FH(self, params):
+        self._campo.hexa = params[:1] or "_"
+
+    def _cmd_FD(self, params):
+        self._campo.dados = params
+
+    _cmd_FV = _cmd_FD
+
+    def _cmd_FX(self, params):
+        pass
+
+    def _cmd_BC(self, params):
+        self._campo.tipo = "code128"
+        self._campo.params = params.split(",")
+
+    def _cmd_BQ(self, params):
+        self._campo.tipo = "qr"
+        self._campo.params = params.split(",")
+
+    def _cmd_GB(self, params):
+        self._campo.tipo = "caixa"
+        self._campo.params = params.split(",")
+
+    def _cmd_GF(self, params):
+        self._campo.tipo = "imagem"
+        self._campo.params = params.split(",", 4)
+
+    def _cmd_FS(self, params):
+        campo, self._campo = self._campo, _Campo()
+        # a posição vale só para o campo; ^BY, ^CF e ^FW continuam
+        desenhar = getattr(self, f"_desenhar_{campo.tipo}", None)
+        if desenhar is not None:
+            desenhar(campo)
+
+    # ---- desenho ----
+    def _texto_campo(self, campo):
+        dados = campo.dados or ""
+        if campo.hexa:
+            escape = re.escape(campo.hexa)
+            codificacao = "utf-8" if self.codificacao == 28 else "cp1252"
+
+            def decodificar(m):
+                bruto = bytes.fromhex("".join(re.findall(r"[0-9A-Fa-f]{2}", m.group(0))))
+                return bruto.decode(codificacao, errors="replace")
+
+            dados = re.sub(f"(?:{escape}[0-9A-Fa-f]{{2}})+", decodificar, dados)
+        return dados
+
+    def _abrir(self, campo, largura, altura, ancora, orientacao="N"):
+        """``q`` + matriz que leva a caixa local (0..largura, 0..altura) para a posição do campo."""
+        a, b, c, d = ROTACOES[orientacao]
+        if campo.tipico:
+            ax, ay = ancora
+            e = campo.x - (a * ax + c * ay)
+            f = campo.y - (b * ax + d * ay)
+        else:
+            cantos = [(a * x + c * y, b * x + d * y) for x in (0, largura) for y in (0, altura)]
+            e = campo.x - min(x for x, _ in cantos)
+            f = campo.y - min(y for _, y in cantos)
+        ops = self._pag().ops
+        ops.append("q")
+        ops.append(f"{a} {b} {c} {d} {_n(e)} {_n(f)} cm")
+        if campo.reverso or self.reverso_tudo:
+            # Difference com branco inverte o que já está na etiqueta, como o ^FR da Zebra
+            ops.append("/GR gs 1 g")
+        else:
+            ops.append("0 g")
+        return ops
+
+    def _texto(self, ops, x, base, texto, fonte_pdf, tamanho, escala):
+        ops.append(f"BT {_RECURSO_FONTE[fonte_pdf]} {_n(tamanho)} Tf {_n(escala * 100)} Tz "
+                   f"1 0 0 -1 {_n(x)} {_n(base)} Tm {_texto_pdf(texto)} Tj ET")
+
+    def _desenhar_texto(self, campo):
+        texto = self._texto_campo(campo)
+        if not texto.strip():
+            return
+        nome, orientacao, altura, largura = campo.fonte or (
+            self.fonte_padrao[0], self.orientacao, self.fonte_padrao[1], self.fonte_padrao[2])
+        if nome == "0":
+            fonte_pdf, escala = "Helvetica-Bold", largura / altura
+        else:
+            # célula da fonte de bitmap ~ 0,55 da altura na Helvetica
+            fonte_pdf, escala = "Helvetica", 1.8 * largura / altura
+        medir = lambda t: _largura_texto(t, fonte_pdf, altura) * escala
+
+        if campo.bloco:
+            largura_bloco, max_linhas, espaco, alinhamento = campo.bloco
+            linhas = []
+            for paragrafo in texto.split("\\&"):
+                atual = ""
+                for palavra in paragrafo.split(" "):
+                    tentativa = f"{atual} {palavra}" if atual else palavra
+                    if atual and medir(tentativa) > largura_bloco:
+                        linhas.append(atual)
+                        atual = palavra
+                    else:
+                        atual = tentativa
+                linhas.append(atual)
+            linhas = linhas[:max_linhas]
+        else:
+            linhas = [texto]
+            largura_bloco, espaco, alinhamento = medir(texto), 0, "L"
+
+        altura_bloco = len(linhas) * altura + (len(linhas) - 1) * espaco
+        ops = self._abrir(campo, largura_bloco, altura_bloco, (0, altura * ASCENDENTE), orientacao)
+        for i, linha in enumerate(linhas):
+            sobra = largura_bloco - medir(linha)
+            x = sobra / 2 if alinhamento == "C" else sobra if alinhamento == "R" else 0
+            self._texto(ops, x, i * (altura + espaco) + altura * ASCENDENTE, linha, fonte_pdf, altura, escala)
+        ops.append("Q")
+
+    def _desenhar_code128(self, campo):
+        dados = self._texto_campo(campo)
+        if not dados:
+            return
+        p = campo.params + [""] * 6
+        orientacao = p[0].strip().upper()[:1] or self.orientacao
+        altura = _inteiro(p[1], self.altura_barras) or self.altura_barras
+        legivel = (p[2].strip().upper() or "Y") == "Y"
+        acima = p[3].strip().upper() == "Y"
+        automatico = p[5].strip().upper() in ("A", "D", "U")
+        larguras, texto = code128(dados, automatico)
+        w = self.modulo
+        largura = sum(larguras) * w
+        tamanho = 10 * w if legivel else 0
+        topo_barras = tamanho + w if acima and legivel else 0
+        altura_total = altura + (tamanho + w if legivel else 0)
+        ops = self._abrir(campo, largura, altura_total, (0, topo_barras + altura), orientacao if orientacao in ROTACOES else "N")
+        x = 0
+        retangulos = []
+        for i, n in enumerate(larguras):
+            if i % 2 == 0:
+                retangulos.append(f"{_n(x)} {_n(topo_barras)} {_n(n * w)} {_n(altura)} re")
+            x += n * w
+        ops.append(" ".join(retangulos) + " f")
+        if legivel:
+            base = (tamanho * ASCENDENTE) if acima else altura + w + tamanho * ASCENDENTE
+            sobra = largura - _largura_texto(texto, "Helvetica", tamanho)
+            self._texto(ops, sobra / 2, base, texto, "Helvetica", tamanho, 1)
+        ops.append("Q")
+
+    def _desenhar_qr(self, campo):
+        dados = self._texto_campo(campo)
+        if not dados:
+            return
+        p = campo.params + [""] * 5
+        ampliacao = min(max(_inteiro(p[2], 2) or 2, 1), 10)
+        nivel = (p[3].strip().upper()[:1] or "Q")
+        # ^FD<nível><modo>,<dados> ; modo M: <N|A|B0000|K> antes dos dados
+        m = re.match(r"([HQML]?)([AM]?),", dados)
+        if m:
+            nivel = m.group(1) or nivel
+            dados = dados[m.end():]
+            if m.group(2) == "M" and dados:
+                if dados[0] == "B":
+                    dados = dados[5:]
+                else:
+                    dados = dados[1:]
+        bruto = dados.encode("utf-8" if self.codificacao == 28 else "cp1252", errors="replace")
+        matriz = qr_code(bruto, nivel)
+        lado = len(matriz) * ampliacao
+        ops = self._abrir(campo, lado, lado, (0, lado))
+        retangulos = []
+        for y, linha in enumerate(matriz):
+            x = 0
+            while x < len(linha):
+                if linha[x]:
+                    inicio = x
+                    while x < len(linha) and linha[x]:
+                        x += 1
+                    retangulos.append(f"{inicio * ampliacao} {y * ampliacao} {(x - inicio) * ampliacao} {ampliacao} re")
+                else:
+                    x += 1
+        ops.append(" ".join(retangulos) + " f")
+        ops.append("Q")
+
+    def _desenhar_caixa(self, campo):
+        p = campo.params + [""] * 5
+        espessura = max(1, _inteiro(p[2], 1))
+        largura = max(_inteiro(p[0], espessura), espessura)
+        altura = max(_inteiro(p[1], espessura), espessura)
+        branca = p[3].strip().upper() == "W"
+        ops = self._abrir(campo, largura, altura, (0, altura))
+        if branca and not (campo.reverso or self.reverso_tudo):
+            ops.append("1 g")
+        if espessura * 2 >= largura or espessura * 2 >= altura:
+            ops.append(f"0 0 {largura} {altura} re f")
+        else:
+            ops.append(f"0 0 {largura} {altura} re {espessura} {espessura} "
+                       f"{largura - 2 * espessura} {altura - 2 * espessura} re f*")
+        ops.append("Q")
+
+    def _desenhar_imagem(self, campo):
+        p = campo.params + [""] * 5
+        formato = (p[0].strip().upper() or "A")[:1]
+        total = _inteiro(p[2], 0)
+        bytes_linha = _inteiro(p[3], 0)
+        if not total or not bytes_linha:
+            return
+        try:
+            bruto, linhas = imagem_gf(formato, total, bytes_linha, p[4].strip())
+        except (ValueError, binascii.Error, zlib.error):
+            self.ignorados.add("^GF inválido")
+            return
+        pagina = self._pag()
+        nome = f"/Im{len(pagina.imagens) + 1}"
+        pagina.imagens.append((nome, bytes_linha * 8, linhas, bruto))
+        ops = self._abrir(campo, bytes_linha * 8, linhas, (0, linhas))
+        ops.append(f"{bytes_linha * 8} 0 0 -{linhas} 0 {linhas} cm {nome} Do")
+        ops.append("Q")
+
+
+# --------------------------------------------------------------------
+# PDF
+# --------------------------------------------------------------------
+def _pdf(paginas, largura_mm, altura_mm, copias):
+    largura_pt = largura_mm * 72 / 25.4
+    altura_pt = altura_mm * 72 / 25.4
+    objetos = []
+
+    def novo(conteudo):
+        objetos.append(conteudo)
+        return len(objetos)
+
+    def fluxo(dicionario, dados):
+        compactado = zlib.compress(dados)
+        return (f"<< {dicionario} /Filter /FlateDecode /Length {len(compactado)} >>\nstream\n").encode() \
+            + compactado + b"\nendstream"
+
+    catalogo = novo(None)
+    raiz_paginas = novo(None)
+    f1 = novo(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    f2 = novo(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+    gs = novo(b"<< /Type /ExtGState /BM /Difference >>")
+
+    filhos = []
+    for pagina in paginas:
+        imagens = []
+        for nome, w, h, bruto in pagina.imagens:
+            imagens.append(f"{nome} {novo(fluxo(f'/Type /XObject /Subtype /Image /Width {w} /Height {h} /ImageMask true /BitsPerComponent 1 /Decode [1 0]', bruto))} 0 R")
+        # fundo branco (base do ^FR) e a grade em pontos da impressora, com y para baixo
+        corpo = "\n".join(
+            [f"1 g 0 0 {_n(largura_pt)} {_n(altura_pt)} re f",
+             f"{_n(PT_POR_PONTO)} 0 0 {_n(-PT_POR_PONTO)} 0 {_n(altura_pt)} cm"] + pagina.ops
+        ).encode("latin-1")
+        conteudo = novo(fluxo("", corpo))
+        recursos = (f"<< /Font << /F1 {f1} 0 R /F2 {f2} 0 R >> /ExtGState << /GR {gs} 0 R >> "
+                    f"/XObject << {' '.join(imagens)} >> >>")
+        for _ in range(copias or pagina.copias):
+            filhos.append(novo(
+                f"<< /Type /Page /Parent {raiz_paginas} 0 R /MediaBox [0 0 {_n(largura_pt)} {_n(altura_pt)}] "
+                f"/Resources {recursos} /Contents {conteudo} 0 R >>".encode()
+            ))
+    objetos[catalogo - 1] = f"<< /Type /Catalog /Pages {raiz_paginas} 0 R >>".encode()
+    objetos[raiz_paginas - 1] = (
+        f"<< /Type /Pages /Kids [{' '.join(f'{n} 0 R' for n in filhos)}] /Count {len(filhos)} >>".encode()
+    )
+
+    saida = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    posicoes = []
+    for numero, conteudo in enumerate(objetos, 1):
+        posicoes.append(len(saida))
+        saida += f"{numero} 0 obj\n".encode() + conteudo + b"\nendobj\n"
+    inicio_xref = len(saida)
+    saida += f"xref\n0 {len(objetos) + 1}\n0000000000 65535 f \n".encode()
+    saida += "".join(f"{p:010d} 00000 n \n" for p in posicoes).encode()
+    saida += f"trailer\n<< /Size {len(objetos) + 1} /Root {catalogo} 0 R >>\nstartxref\n{inicio_xref}\n%%EOF\n".encode()
+    return bytes(saida)
+
+
+def zpl_para_pdf(zpl, largura_mm, altura_mm, copias=None):
+    """(PDF em bytes, comandos ignorados) das etiquetas do ``zpl`` no tamanho ``largura_mm`` x ``altura_mm``.
+
+    ``copias`` repete cada etiqueta; sem ele vale o ``^PQ`` de cada uma. Os
+    comandos ignorados (ex.: ``["^B3", "^GF inválido"]``, em ordem) ficam
+    para quem chamou avisar o usuário: o campo deles não sai no PDF.
+    """
+    interpretador = InterpretadorZPL()
+    paginas = interpretador.interpretar(zpl)
+    if not paginas:
+        raise ValueError("Nenhuma etiqueta encontrada no ZPL (esperado ^XA ... ^XZ).")
+    return _pdf(paginas, largura_mm, altura_mm, copias), sorted(interpretador.ignorados)
@@ -1,68 +1,111 @@
 """
-Script para exportar dados do SQLite para JSON
-Para usar: python export_data.py
+Script para exportar os dados do SQLite para NDJSON compactado
+Para usar: python export_data.py [--banco metrifiy.db] [--pasta data_export]
+
+Cada tabela vira ``<pasta>/<tabela>.ndjson.gz``: uma linha JSON por registro,
+compactada com gzip. A primeira linha é um cabeçalho pequeno
+(``{"formato": "metrifiy-ndjson", "versao": 1, "tabela": ..., "colunas": [...]}``)
+e as demais são listas de valores na ordem de ``colunas``.
+
+Antes tudo ia para um único ``data_export.json`` com ``indent=2``, montado na
+memória; agora as linhas saem do cursor em blocos e vão direto para o arquivo,
+e o ``auto_import.py`` lê de volta linha a linha.
 """
-import sqlite3
+import argparse
+import gzip
 import json
 import os
+import sqlite3
+import time
+from datetime import datetime
+
+FORMATO = "metrifiy-ndjson"
+VERSAO = 1
+EXTENSAO = ".ndjson.gz"
+PASTA_PADRAO = "data_export"
+LINHAS_POR_LEITURA = 2000
+
+
+def _valor(value):
+    # Converter date/datetime (e o que mais vier) para string
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return str(value)
+
+
+def exportar_tabela(conn, tabela, pasta):
+    """Escreve ``<pasta>/<tabela>.ndjson.gz``; retorna o número de registros."""
+    caminho = os.path.join(pasta, f"{tabela}{EXTENSAO}")
+    parcial = caminho + ".parcial"
+    cursor = conn.execute(f'SELECT * FROM "{tabela}"')
+    colunas = [d[0] for d in cursor.description]
+    cabecalho = {
+        "formato": FORMATO,
+        "versao": VERSAO,
+        "tabela": tabela,
+        "colunas": colunas,
+        "gerado_em": datetime.utcnow().isoformat() + "Z",
+    }
+    linhas = 0
+    with gzip.open(parcial, "wt", encoding="utf-8", newline="\n", compresslevel=6) as f:
+        f.write(json.dumps(cabecalho, ensure_ascii=False) + "\n")
+        while True:
+            bloco = cursor.fetchmany(LINHAS_POR_LEITURA)
+            if not bloco:
+                break
+            f.write("".join(
+                json.dumps([_valor(v) for v in row], ensure_ascii=False, separators=(",", ":")) + "\n"
+                for row in bloco
+            ))
+            linhas += len(bloco)
+    os.replace(parcial, caminho)
+    return linhas
+
+
+def export_sqlite_to_ndjson(db_path="metrifiy.db", pasta=PASTA_PADRAO):
+    """Exporta todas as tabelas do SQLite para ``pasta``; retorna {tabela: registros}"""
 
-def export_sqlite_to_json():
-    """Exporta todas as tabelas do SQLite para JSON"""
-    
-    db_path = "metrifiy.db"
     if not os.path.exists(db_path):
         print(f"❌ Banco de dados não encontrado: {db_path}")
-        return
-    
+        return None
+
+    os.makedirs(pasta, exist_ok=True)
+    inicio = time.perf_counter()
     conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row  # Para acessar colunas por nome
-    cursor = conn.cursor()
-    
-    # Obter lista de tabelas
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
-    tables = [row[0] for row in cursor.fetchall()]
-    
-    print(f"📊 Encontradas {len(tables)} tabelas para exportar")
-    
-    data_export = {}
-    
-    for table in tables:
-        print(f"  → Exportando tabela: {table}")
-        
-        # Obter dados da tabela
-        cursor.execute(f"SELECT * FROM {table}")
-        rows = cursor.fetchall()
-        
-        # Converter para lista de dicionários
-        table_data = []
-        for row in rows:
-            row_dict = {}
-            for key in row.keys():
-                value = row[key]
-                # Converter date/datetime para string
-                if value is not None and isinstance(value, (int, float, str)):
-                    row_dict[key] = value
-                else:
-                    row_dict[key] = str(value) if value is not None else None
-            table_data.append(row_dict)
-        
-        data_export[table] = table_data
-        print(f"    ✓ {len(table_data)} registros exportados")
-    
-    conn.close()
-    
-    # Salvar em JSON
-    output_file = "data_export.json"
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(data_export, f, ensure_ascii=False, indent=2)
-    
-    print(f"\n✅ Dados exportados com sucesso para: {output_file}")
-    print(f"📦 Tamanho do arquivo: {os.path.getsize(output_file) / 1024:.2f} KB")
-    
+    try:
+        # Obter lista de tabelas
+        tables = [
+            row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+            )
+        ]
+        print(f"📊 Encontradas {len(tables)} tabelas para exportar")
+
+        resumo = {}
+        for table in tables:
+            print(f"  → Exportando tabela: {table}")
+            resumo[table] = exportar_tabela(conn, table, pasta)
+            print(f"    ✓ {resumo[table]} registros exportados")
+    finally:
+        conn.close()
+
+    tamanho = sum(
+        os.path.getsize(os.path.join(pasta, f"{table}{EXTENSAO}")) for table in resumo
+    )
+    print(f"\n✅ Dados exportados com sucesso para: {pasta}/ ({time.perf_counter() - inicio:.2f}s)")
+    print(f"📦 Tamanho total: {tamanho / 1024:.2f} KB")
+
     # Mostrar resumo
     print("\n📋 Resumo da exportação:")
-    for table, data in data_export.items():
-        print(f"  • {table}: {len(data)} registros")
+    for table, total in resumo.items():
+        print(f"  • {table}: {total} registros")
+    return resumo
+
 
 if __name__ == "__main__":
-    export_sqlite_to_json()
+    parser = argparse.ArgumentParser(description="Exporta o SQLite para NDJSON compactado (um arquivo por tabela)")
+    parser.add_argument("--banco", default="metrifiy.db")
+    parser.add_argument("--pasta", default=PASTA_PADRAO)
+    args = parser.parse_args()
+    if export_sqlite_to_ndjson(args.banco, args.pasta) is None:
+        raise SystemExit(1)
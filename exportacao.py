@@ -0,0 +1,147 @@
+"""
+Exportações de planilhas em streaming, com memória constante.
+
+As exportações montavam um DataFrame com todas as linhas e gravavam o XLSX
+inteiro num ``BytesIO`` antes do ``send_file``: com o histórico completo de
+vendas o pico de memória ficava duas ou três vezes o tamanho dos dados. Aqui:
+
+- as linhas saem do banco em lotes (``yield_per``, cursor no servidor no
+  Postgres), sem materializar o resultado;
+- XLSX é gravado por um workbook openpyxl em modo write-only num arquivo
+  temporário em disco, que é enviado em blocos;
+- CSV (e CSV compactado com gzip) é escrito direto no gerador da resposta,
+  um lote de linhas por vez.
+
+O formato vem do parâmetro ``?formato=`` (``xlsx``, ``csv`` ou ``csv.gz``);
+o padrão continua XLSX.
+"""
+import csv
+import io
+import tempfile
+import zlib
+
+from flask import Response, request, send_file, stream_with_context
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+
+
+TAMANHO_LOTE_PADRAO = 2000
+
+FORMATOS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",  # o Flask acrescenta charset=utf-8
+    "csv.gz": "application/gzip",
+}
+
+# mesmo estilo de cabeçalho que o pandas.to_excel usava
+_BORDA = Side(style="thin")
+_ESTILO_CABECALHO = {
+    "font": Font(bold=True),
+    "border": Border(left=_BORDA, right=_BORDA, top=_BORDA, bottom=_BORDA),
+    "alignment": Alignment(horizontal="center", vertical="top"),
+}
+
+
+def formato_da_requisicao(padrao="xlsx"):
+    """Formato pedido em ``?formato=`` (o padrão se ausente ou desconhecido)."""
+    formato = (request.args.get("formato") or "").lower()
+    return formato if formato in FORMATOS else padrao
+
+
+def cabecalho_consulta(consulta):
+    """Nomes (labels) das colunas de um ``select``."""
+    return [coluna.name for coluna in consulta.selected_columns]
+
+
+def linhas_consulta(engine, consulta, tamanho_lote=TAMANHO_LOTE_PADRAO):
+    """Gera as linhas da consulta em lotes de ``tamanho_lote`` (tuplas)."""
+    with engine.connect() as conn:
+        resultado = conn.execution_options(yield_per=tamanho_lote).execute(consulta)
+        for linha in resultado:
+            yield tuple(linha)
+
+
+def _celula(valor):
+    # NaN (linhas vindas do pandas) fica em branco, como no to_excel
+    if isinstance(valor, float) and valor != valor:
+        return None
+    return valor
+
+
+def escrever_xlsx(destino, cabecalho, linhas, planilha="Sheet1"):
+    """Grava as linhas num XLSX (caminho ou arquivo binário) em modo write-only."""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(planilha)
+    celulas = []
+    for nome in cabecalho:
+        celula = WriteOnlyCell(ws, value=nome)
+        for atributo, estilo in _ESTILO_CABECALHO.items():
+            setattr(celula, atributo, estilo)
+        celulas.append(celula)
+    ws.append(celulas)
+    for linha in linhas:
+        ws.append([_celula(v) for v in linha])
+    wb.save(destino)
+
+
+def _gerar_csv(cabecalho, linhas, tamanho_lote):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    # BOM para o Excel reconhecer o UTF-8 (acentos)
+    buffer.write("\ufeff")
+    escritor.writerow(cabecalho)
+    pendentes = 0
+    for linha in linhas:
+        escritor.writerow(linha)
+        pendentes += 1
+        if pendentes >= tamanho_lote:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pendentes = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _gzip(blocos):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = formato gzip
+    for bloco in blocos:
+        comprimido = compressor.compress(bloco)
+        if comprimido:
+            yield comprimido
+    yield compressor.flush()
+
+
+def resposta_exportacao(cabecalho, linhas, nome_arquivo, formato="xlsx", planilha="Sheet1",
+                        tamanho_lote=TAMANHO_LOTE_PADRAO):
+    """Resposta de download com ``linhas`` (iterável de tuplas) no ``formato``.
+
+    ``nome_arquivo`` vai sem extensão. O XLSX é gravado em disco antes da
+    resposta (erros ainda viram 500); o CSV é gerado enquanto é enviado.
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de exportação desconhecido: {formato}")
+
+    if formato == "xlsx":
+        arquivo = tempfile.TemporaryFile(suffix=".xlsx")
+        try:
+            escrever_xlsx(arquivo, cabecalho, linhas, planilha)
+            arquivo.seek(0)
+        except Exception:
+            arquivo.close()
+            raise
+        # o send_file fecha (e o SO apaga) o temporário ao terminar o envio
+        return send_file(
+            arquivo,
+            as_attachment=True,
+            download_name=f"{nome_arquivo}.xlsx",
+            mimetype=FORMATOS["xlsx"],
+        )
+
+    blocos = _gerar_csv(cabecalho, linhas, tamanho_lote)
+    if formato == "csv.gz":
+        blocos = _gzip(blocos)
+    resp = Response(stream_with_context(blocos), mimetype=FORMATOS[formato])
+    resp.headers["Content-Disposition"] = f'attachment; filename="{nome_arquivo}.{formato}"'
+    return resp
@@ -1,16 +1,18 @@
 """
-Script para importar dados do JSON para PostgreSQL
+Script para importar os dados exportados (data_export/*.ndjson.gz) para PostgreSQL
 Para usar depois do deploy:
 1. Configure a variável DATABASE_URL com a URL do PostgreSQL do Render
 2. Execute: python import_data.py
 """
 import os
-import json
 import sys
-from sqlalchemy import create_engine, MetaData, Table, inspect, text
+from sqlalchemy import create_engine, text
+
+from auto_import import ORDEM_TABELAS, importar_pasta
+from export_data import EXTENSAO, PASTA_PADRAO
 
 def import_json_to_postgres():
-    """Importa dados do JSON para PostgreSQL"""
+    """Importa os arquivos NDJSON para PostgreSQL"""
     
     # Obter URL do banco
     database_url = os.environ.get("DATABASE_URL")
@@ -28,54 +30,25 @@ def import_json_to_postgres():
     
     try:
         engine = create_engine(database_url)
-        metadata = MetaData()
-        metadata.reflect(bind=engine)
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
         
         print(f"✅ Conectado com sucesso!")
         
-        # Carregar dados do JSON
-        json_file = "data_export.json"
-        if not os.path.exists(json_file):
-            print(f"❌ Arquivo não encontrado: {json_file}")
+        # Arquivos gerados pelo export_data.py (um .ndjson.gz por tabela)
+        if not os.path.isdir(PASTA_PADRAO):
+            print(f"❌ Pasta não encontrada: {PASTA_PADRAO}")
             return False
         
-        print(f"\n📂 Carregando dados de: {json_file}")
-        with open(json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        print(f"📊 Encontradas {len(data)} tabelas no arquivo")
+        encontradas = sorted(
+            nome[: -len(EXTENSAO)] for nome in os.listdir(PASTA_PADRAO) if nome.endswith(EXTENSAO)
+        )
+        print(f"\n📂 Encontradas {len(encontradas)} tabelas em: {PASTA_PADRAO}/")
         
-        # Importar dados
-        with engine.begin() as conn:
-            for table_name, rows in data.items():
-                if not rows:
-                    print(f"  ⊘ {table_name}: Sem dados para importar")
-                    continue
-                
-                print(f"  → Importando {table_name}: {len(rows)} registros...")
-                
-                # Verificar se tabela existe
-                if table_name not in metadata.tables:
-                    print(f"    ⚠️ Tabela {table_name} não existe no PostgreSQL")
-                    continue
-                
-                table = metadata.tables[table_name]
-                
-                # Limpar tabela antes de importar (opcional)
-                # conn.execute(table.delete())
-                
-                try:
-                    # Inserir dados em lotes
-                    batch_size = 500
-                    for i in range(0, len(rows), batch_size):
-                        batch = rows[i:i+batch_size]
-                        conn.execute(table.insert(), batch)
-                    
-                    print(f"    ✓ {len(rows)} registros importados")
-                    
-                except Exception as e:
-                    print(f"    ❌ Erro ao importar {table_name}: {e}")
-                    continue
+        # Importar dados (tabelas principais primeiro, na ordem das chaves estrangeiras)
+        ordem = [t for t in ORDEM_TABELAS if t in encontradas]
+        ordem += [t for t in encontradas if t not in ordem]
+        importar_pasta(engine, PASTA_PADRAO, ordem)
         
         print(f"\n✅ Importação concluída com sucesso!")
         return True
@@ -1,14 +1,45 @@
 #!/usr/bin/env python
-"""Importa um pacote ZIP gerado na tela /admin/backup para um banco Postgres (Render)."""
+"""Importa um pacote ZIP gerado na tela /admin/backup para um banco Postgres (Render).
+
+Cada CSV é lido direto do ZIP, sem passar por DataFrame/lista na memória:
+
+- Postgres: ``COPY tabela (colunas) FROM STDIN`` recebe o membro do ZIP em
+  streaming (caminho rápido);
+- outros bancos (SQLite, para testes locais): ``executemany`` em blocos de
+  ``--lote`` linhas.
+
+Depois de cada tabela as linhas são contadas e comparadas com o
+``manifest.json`` (e o SHA-256 do CSV, nos pacotes que o trazem); qualquer
+divergência desfaz a importação inteira. O tempo e as linhas/s de cada tabela
+são mostrados no fim. O resumo diário (``vendas_resumo_diario``) não vai no
+pacote: é reconstruído a partir das vendas, na mesma transação.
+
+A limpeza das tabelas e as cargas rodam numa transação só (o COPY usa a
+mesma conexão): se o COPY ou a conferência falhar no meio, o banco de
+destino volta ao que era antes, sem ficar vazio. O caminho COPY é testado
+contra um Postgres de verdade em ``tests/test_import_render_backup.py``
+(``TEST_POSTGRES_URL``).
+
+Exemplo (teste local com SQLite, banco criado pelo app):
+    python import_render_backup.py pacote.zip --database-url sqlite:///teste.db
+"""
 
 import argparse
+import hashlib
 import json
 import os
+import time
 import zipfile
 from pathlib import Path
 
 import pandas as pd
-from sqlalchemy import MetaData, create_engine, text
+from sqlalchemy import MetaData, String, create_engine, func, select, text
+
+from resumo_vendas import ResumoVendas
+
+
+TAMANHO_LOTE_PADRAO = 5000
+TAMANHO_BLOCO_COPY = 1024 * 1024
 
 
 def normalize_db_url(url: str) -> str:
@@ -17,29 +48,72 @@ def normalize_db_url(url: str) -> str:
     return url
 
 
-def carregar_export(path: Path):
-    if not path.exists():
-        raise FileNotFoundError(f"Arquivo não encontrado: {path}")
-
-    with zipfile.ZipFile(path, "r") as zf:
-        try:
-            manifest = json.loads(zf.read("manifest.json"))
-        except KeyError as exc:
-            raise RuntimeError("manifest.json não encontrado no ZIP gerado pelo sistema") from exc
-
-        dfs = {}
-        for name in zf.namelist():
-            if not name.endswith(".csv"):
-                continue
-            table_name = name.replace(".csv", "")
-            with zf.open(name) as f:
-                dfs[table_name] = pd.read_csv(f)
-    return manifest, dfs
-
-
-def importar_para_postgres(engine, dfs):
+class LeituraComHash:
+    """Arquivo somente leitura que calcula o SHA-256 do que já foi lido."""
+
+    def __init__(self, arquivo):
+        self.arquivo = arquivo
+        self.sha = hashlib.sha256()
+
+    def read(self, tamanho=-1):
+        dados = self.arquivo.read(tamanho)
+        self.sha.update(dados)
+        return dados
+
+    def readline(self, tamanho=-1):
+        dados = self.arquivo.readline(tamanho)
+        self.sha.update(dados)
+        return dados
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+
+def carregar_manifest(zf):
+    try:
+        manifest = json.loads(zf.read("manifest.json"))
+    except KeyError as exc:
+        raise RuntimeError("manifest.json não encontrado no ZIP gerado pelo sistema") from exc
+    return {t["nome"]: t for t in manifest.get("tabelas", [])}, manifest
+
+
+def copiar_postgres(conn, tabela, arquivo):
+    """COPY FROM STDIN do CSV (com cabeçalho) na tabela. Retorna as linhas copiadas."""
+    cabecalho = arquivo.readline().decode("utf-8-sig").strip()
+    colunas = ", ".join(f'"{c}"' for c in cabecalho.split(","))
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f'COPY "{tabela.name}" ({colunas}) FROM STDIN WITH (FORMAT csv)',
+            arquivo,
+            size=TAMANHO_BLOCO_COPY,
+        )
+        if cursor.rowcount >= 0:
+            return cursor.rowcount
+        return conn.execute(select(func.count()).select_from(tabela)).scalar()
+    finally:
+        cursor.close()
+
+
+def inserir_em_lotes(conn, tabela, arquivo, tamanho_lote=TAMANHO_LOTE_PADRAO):
+    """executemany de ``tamanho_lote`` linhas por vez. Retorna as linhas inseridas."""
+    inseridas = 0
+    # colunas de texto continuam texto (SKU "00123" não vira 123)
+    textos = {c.name: str for c in tabela.columns if isinstance(c.type, String)}
+    for bloco in pd.read_csv(
+        arquivo, chunksize=tamanho_lote, encoding="utf-8", dtype=textos, float_precision="round_trip",
+    ):
+        registros = bloco.astype(object).where(bloco.notna(), None).to_dict(orient="records")
+        conn.execute(tabela.insert(), registros)
+        inseridas += len(registros)
+    return inseridas
+
+
+def importar_backup(engine, caminho_zip, tamanho_lote=TAMANHO_LOTE_PADRAO):
+    """Importa o pacote; retorna [(tabela, linhas, segundos, método)]."""
     meta = MetaData()
     meta.reflect(engine)
+    postgres = engine.url.get_backend_name().startswith("postgresql")
 
     ordem_delete = [
         "vendas",
@@ -58,20 +132,51 @@ def importar_para_postgres(engine, dfs):
         "finance_transactions",
     ]
 
-    with engine.begin() as conn:
+    estatisticas = []
+    # DELETE + cargas na mesma transação: qualquer falha desfaz tudo
+    with zipfile.ZipFile(caminho_zip, "r") as zf, engine.begin() as conn:
+        esperado, _ = carregar_manifest(zf)
+        membros = set(zf.namelist())
+
         for table_name in ordem_delete:
             if table_name in meta.tables:
                 conn.execute(meta.tables[table_name].delete())
                 print(f"Apagado conteúdo de {table_name}")
 
         for table_name in ordem_insert:
-            if table_name in meta.tables and table_name in dfs:
-                registros = dfs[table_name].to_dict(orient="records")
-                if registros:
-                    conn.execute(meta.tables[table_name].insert(), registros)
-                    print(f"Inseridas {len(registros)} linhas em {table_name}")
-
-        if engine.url.get_backend_name().startswith("postgresql"):
+            if table_name not in meta.tables or f"{table_name}.csv" not in membros:
+                continue
+            tabela = meta.tables[table_name]
+            inicio = time.perf_counter()
+            with zf.open(f"{table_name}.csv") as membro:
+                arquivo = LeituraComHash(membro)
+                if postgres:
+                    carregadas, metodo = copiar_postgres(conn, tabela, arquivo), "COPY"
+                else:
+                    carregadas, metodo = inserir_em_lotes(conn, tabela, arquivo, tamanho_lote), "executemany"
+                arquivo.read()  # garante o hash do arquivo inteiro
+            segundos = time.perf_counter() - inicio
+
+            # conferência: linhas no banco x manifest (e SHA-256, se houver)
+            no_banco = conn.execute(select(func.count()).select_from(tabela)).scalar()
+            info = esperado.get(table_name, {})
+            if "linhas" in info and not (carregadas == no_banco == info["linhas"]):
+                raise RuntimeError(
+                    f"{table_name}: manifest tem {info['linhas']} linhas, "
+                    f"carregadas {carregadas}, no banco {no_banco}"
+                )
+            if info.get("sha256") and info["sha256"] != arquivo.sha.hexdigest():
+                raise RuntimeError(f"{table_name}: SHA-256 do CSV não confere com o manifest")
+
+            estatisticas.append((table_name, no_banco, segundos, metodo))
+            print(f"Inseridas {no_banco} linhas em {table_name} via {metodo} "
+                  f"({segundos:.2f}s, {no_banco / max(segundos, 1e-9):,.0f} linhas/s)")
+
+        # o pacote não traz o resumo diário: é refeito a partir das vendas restauradas
+        if "vendas" in meta.tables and "vendas_resumo_diario" in meta.tables:
+            ResumoVendas(meta.tables["vendas"], meta.tables["vendas_resumo_diario"]).reconstruir(conn)
+
+        if postgres:
             for table_name in ["usuarios", "produtos", "vendas", "ajustes_estoque", "finance_transactions"]:
                 if table_name in meta.tables and "id" in meta.tables[table_name].c:
                     conn.execute(
@@ -81,6 +186,7 @@ def importar_para_postgres(engine, dfs):
                         )
                     )
                     print(f"Sequência ajustada para {table_name}")
+    return estatisticas
 
 
 def main():
@@ -91,6 +197,12 @@ def main():
         dest="database_url",
         help="DATABASE_URL do Postgres (senão usa variável de ambiente)",
     )
+    parser.add_argument(
+        "--lote",
+        type=int,
+        default=TAMANHO_LOTE_PADRAO,
+        help="Linhas por executemany quando o destino não é Postgres",
+    )
     args = parser.parse_args()
 
     db_url = args.database_url or os.environ.get("DATABASE_URL")
@@ -99,12 +211,22 @@ def main():
 
     db_url = normalize_db_url(db_url)
     export_path = Path(args.export_zip)
+    if not export_path.exists():
+        raise FileNotFoundError(f"Arquivo não encontrado: {export_path}")
 
-    manifest, dfs = carregar_export(export_path)
+    with zipfile.ZipFile(export_path, "r") as zf:
+        _, manifest = carregar_manifest(zf)
     print("Manifest carregado:", json.dumps(manifest, ensure_ascii=False, indent=2))
 
     engine = create_engine(db_url, future=True)
-    importar_para_postgres(engine, dfs)
+    estatisticas = importar_backup(engine, export_path, args.lote)
+
+    total = sum(linhas for _, linhas, _, _ in estatisticas)
+    segundos = sum(s for _, _, s, _ in estatisticas)
+    print(f"\n{'tabela':<22}{'linhas':>10}{'segundos':>10}{'linhas/s':>12}  método")
+    for tabela, linhas, s, metodo in estatisticas:
+        print(f"{tabela:<22}{linhas:>10}{s:>10.2f}{linhas / max(s, 1e-9):>12,.0f}  {metodo}")
+    print(f"{'total':<22}{total:>10}{segundos:>10.2f}{total / max(segundos, 1e-9):>12,.0f}")
     print("Importação concluída com sucesso.")
 
 
@@ -0,0 +1,183 @@
+"""
+Fila de jobs de importação em segundo plano.
+
+As planilhas grandes do Mercado Livre / Mercado Pago levam minutos para
+importar; rodando dentro do request elas seguravam o único worker do gunicorn.
+Aqui o upload só grava o arquivo e enfileira um job: um pool pequeno de threads
+executa a importação e o estado fica persistido na tabela ``import_jobs``
+(status, linhas processadas, tempos e resumo do resultado).
+
+O progresso de um job em execução fica em memória (a importação segura uma
+transação de escrita e o SQLite não aceitaria outra conexão gravando ao mesmo
+tempo); a tabela é atualizada no início e no fim de cada job.
+"""
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import insert, select, update
+
+
+STATUS_PENDENTE = "pendente"
+STATUS_EXECUTANDO = "executando"
+STATUS_CONCLUIDO = "concluido"
+STATUS_ERRO = "erro"
+
+_contexto = threading.local()
+
+
+def registrar_progresso(linhas):
+    """Informa quantas linhas o job atual já processou (sem efeito fora de um job)."""
+    fila = getattr(_contexto, "fila", None)
+    job_id = getattr(_contexto, "job_id", None)
+    if fila is not None and job_id is not None:
+        fila._atualizar_progresso(job_id, linhas)
+
+
+def _agora():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _processo_vivo(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+class FilaImportacao:
+    """Pool limitado de threads que executa importações e registra o job no banco."""
+
+    def __init__(self, engine, tabela, max_workers=1):
+        self.engine = engine
+        self.tabela = tabela
+        self.max_workers = max(1, int(max_workers))
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._progresso = {}
+
+    def _obter_executor(self):
+        # o executor é criado no processo que atende os requests: com preload_app
+        # o gunicorn faz fork depois de importar o app e threads não sobrevivem ao fork
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="importacao"
+                )
+                self._pid = os.getpid()
+                self._progresso = {}
+            return self._executor
+
+    def _atualizar_progresso(self, job_id, linhas):
+        with self._lock:
+            self._progresso[job_id] = int(linhas)
+
+    def enviar(self, tipo, funcao, *args, arquivo=None, usuario_id=None, **kwargs):
+        """Cria o registro do job e o coloca na fila. Retorna o id do job."""
+        with self.engine.begin() as conn:
+            job_id = conn.execute(
+                insert(self.tabela).values(
+                    tipo=tipo,
+                    arquivo=arquivo,
+                    status=STATUS_PENDENTE,
+                    linhas_processadas=0,
+                    criado_em=_agora(),
+                    usuario_id=usuario_id,
+                    pid=os.getpid(),
+                )
+            ).inserted_primary_key[0]
+
+        self._obter_executor().submit(self._executar, job_id, funcao, args, kwargs)
+        print(f"[JOB {job_id}] {tipo} enfileirado ({arquivo})")
+        return job_id
+
+    def _executar(self, job_id, funcao, args, kwargs):
+        inicio = time.perf_counter()
+        with self.engine.begin() as conn:
+            conn.execute(
+                update(self.tabela)
+                .where(self.tabela.c.id == job_id)
+                .values(status=STATUS_EXECUTANDO, iniciado_em=_agora(), pid=os.getpid())
+            )
+
+        self._atualizar_progresso(job_id, 0)
+        _contexto.fila = self
+        _contexto.job_id = job_id
+        try:
+            resultado = funcao(*args, **kwargs)
+            status, erro = STATUS_CONCLUIDO, None
+        except Exception as e:
+            traceback.print_exc()
+            resultado, status, erro = None, STATUS_ERRO, str(e)
+        finally:
+            _contexto.fila = None
+            _contexto.job_id = None
+
+        duracao = round(time.perf_counter() - inicio, 3)
+        with self._lock:
+            linhas = self._progresso.pop(job_id, 0)
+        with self.engine.begin() as conn:
+            conn.execute(
+                update(self.tabela)
+                .where(self.tabela.c.id == job_id)
+                .values(
+                    status=status,
+                    linhas_processadas=linhas,
+                    finalizado_em=_agora(),
+                    duracao_segundos=duracao,
+                    resultado=json.dumps(resultado, default=str, ensure_ascii=False) if resultado is not None else None,
+                    erro=erro,
+                )
+            )
+        print(f"[JOB {job_id}] {status} em {duracao:.1f}s ({linhas} linhas)")
+
+    def obter(self, job_id):
+        """Estado do job como dict (resultado já decodificado) ou None se não existir."""
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(self.tabela).where(self.tabela.c.id == job_id)
+            ).mappings().first()
+        if row is None:
+            return None
+
+        job = dict(row)
+        if job["status"] in (STATUS_PENDENTE, STATUS_EXECUTANDO):
+            with self._lock:
+                ativo = self._pid == os.getpid() and job_id in self._progresso
+                if ativo:
+                    job["linhas_processadas"] = self._progresso[job_id]
+            # job de um worker que foi reciclado/derrubado antes de terminar
+            if not ativo and job["pid"] != os.getpid() and not _processo_vivo(job["pid"]):
+                job = self._marcar_interrompido(job)
+        job["resultado"] = json.loads(job["resultado"]) if job.get("resultado") else None
+        return job
+
+    def _marcar_interrompido(self, job):
+        erro = "Job interrompido antes de terminar (o processo foi reiniciado)."
+        with self.engine.begin() as conn:
+            conn.execute(
+                update(self.tabela)
+                .where(self.tabela.c.id == job["id"])
+                .values(status=STATUS_ERRO, erro=erro, finalizado_em=_agora())
+            )
+        job.update(status=STATUS_ERRO, erro=erro, finalizado_em=_agora())
+        return job
+
+    def marcar_orfaos(self):
+        """Jobs pendentes/executando cujo processo não existe mais viram erro (chamado na subida do app)."""
+        with self.engine.connect() as conn:
+            abertos = conn.execute(
+                select(self.tabela)
+                .where(self.tabela.c.status.in_([STATUS_PENDENTE, STATUS_EXECUTANDO]))
+            ).mappings().all()
+        for job in abertos:
+            if not _processo_vivo(job["pid"]):
+                self._marcar_interrompido(dict(job))
@@ -0,0 +1,134 @@
+"""
+Leitura de planilhas Excel em blocos, com memória constante.
+
+``pd.read_excel`` carrega o workbook inteiro (e um DataFrame com todas as
+linhas) na memória; com um ano de extrato do Mercado Pago isso passa dos 512 MB
+do Render Free. Aqui o arquivo é lido com openpyxl em modo read-only e as
+linhas saem em DataFrames de ``tamanho_bloco`` linhas, de modo que o pico de
+memória depende do tamanho do bloco e não do arquivo.
+
+Os valores seguem as mesmas regras do ``pd.read_excel`` usado antes pelas
+importações (células vazias e marcadores como "N/A" viram NaN, números
+inteiros gravados como float viram int, colunas sem título viram
+"Unnamed: <n>"), para que as rotinas de importação não precisem mudar.
+"""
+import math
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+
+TAMANHO_BLOCO_PADRAO = 5000
+
+# mesmos marcadores de nulo que o pandas reconhece por padrão
+VALORES_NULOS = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+}
+
+
+def _valor(v):
+    if v is None:
+        return np.nan
+    if isinstance(v, str):
+        return np.nan if v in VALORES_NULOS else v
+    if isinstance(v, float) and not math.isnan(v) and not math.isinf(v) and v.is_integer():
+        return int(v)
+    return v
+
+
+def _nomes_colunas(cabecalho):
+    """Nomes de colunas como o pandas: vazios viram "Unnamed: n", repetidos ganham ".1", ".2"..."""
+    # colunas vazias no fim do cabeçalho são descartadas
+    fim = len(cabecalho)
+    while fim and (cabecalho[fim - 1] is None or cabecalho[fim - 1] == ""):
+        fim -= 1
+
+    nomes = []
+    vistos = {}
+    for i, v in enumerate(cabecalho[:fim]):
+        nome = f"Unnamed: {i}" if v is None or v == "" else _valor(v)
+        if nome in vistos:
+            vistos[nome] += 1
+            nome = f"{nome}.{vistos[nome]}"
+        else:
+            vistos[nome] = 0
+        nomes.append(nome)
+    return nomes
+
+
+def _abrir_aba(caminho, sheet_name):
+    wb = openpyxl.load_workbook(caminho, read_only=True, data_only=True)
+    if isinstance(sheet_name, int):
+        ws = wb.worksheets[sheet_name]
+    else:
+        ws = wb[sheet_name]
+    # algumas exportações gravam a dimensão errada (ex.: "A1:A1"); força a leitura completa
+    ws.reset_dimensions()
+    return wb, ws
+
+
+def _bloco(linhas, colunas, usecols, inicio):
+    df = pd.DataFrame(linhas, columns=colunas, index=range(inicio, inicio + len(linhas)))
+    if usecols is not None:
+        df = df[[c for c in usecols if c in df.columns]]
+    return df
+
+
+def colunas_excel(caminho, sheet_name=0, header=0):
+    """Lê apenas a linha de cabeçalho e devolve a lista de nomes de colunas."""
+    wb, ws = _abrir_aba(caminho, sheet_name)
+    try:
+        for i, linha in enumerate(ws.iter_rows(values_only=True)):
+            if i == header:
+                return _nomes_colunas(list(linha))
+        return []
+    finally:
+        wb.close()
+
+
+def ler_excel_em_blocos(caminho, sheet_name=0, header=0, tamanho_bloco=TAMANHO_BLOCO_PADRAO, usecols=None):
+    """Gera DataFrames de até ``tamanho_bloco`` linhas da aba indicada.
+
+    ``header`` é o índice (base 0) da linha de cabeçalho, como no ``pd.read_excel``
+    (5 para a aba "Vendas BR", 10 para o relatório de estoque Full). Linhas
+    totalmente vazias são ignoradas. O índice de cada bloco continua a numeração
+    do anterior, como se fosse um único DataFrame. ``usecols`` limita as colunas
+    devolvidas (nomes).
+
+    Texto com cara de número continua texto (o pandas convertia "0123" em 123);
+    as importações já convertem os valores numéricos que usam.
+    """
+    wb, ws = _abrir_aba(caminho, sheet_name)
+    try:
+        linhas = ws.iter_rows(values_only=True)
+        colunas = None
+        for i, linha in enumerate(linhas):
+            if i == header:
+                colunas = _nomes_colunas(list(linha))
+                break
+        if colunas is None:
+            return
+
+        inicio = 0
+        bloco = []
+        for linha in linhas:
+            if all(v is None or v == "" for v in linha):
+                continue
+            if len(linha) > len(colunas) and any(v is not None and v != "" for v in linha[len(colunas):]):
+                # dados além do cabeçalho: como no pandas, a coluna entra sem nome
+                if bloco:
+                    yield _bloco(bloco, colunas, usecols, inicio)
+                    inicio += len(bloco)
+                    bloco = []
+                colunas = colunas + [f"Unnamed: {i}" for i in range(len(colunas), len(linha))]
+            bloco.append([_valor(v) for v in linha[:len(colunas)]] + [np.nan] * (len(colunas) - len(linha)))
+            if len(bloco) >= tamanho_bloco:
+                yield _bloco(bloco, colunas, usecols, inicio)
+                inicio += len(bloco)
+                bloco = []
+        if bloco:
+            yield _bloco(bloco, colunas, usecols, inicio)
+    finally:
+        wb.close()
@@ -0,0 +1,90 @@
+"""
+Cálculo do lucro líquido, vetorizado (NumPy/pandas).
+
+A mesma fórmula estava copiada linha a linha no dashboard, na lista de
+vendas, no estoque, no relatório de lucro e na exportação dele, e as cópias
+já divergiam (a exportação não descontava a publicidade). Aqui ela existe
+uma vez só e roda sobre colunas inteiras:
+
+- comissão ML = max(0, (receita - custo) - margem de contribuição);
+- imposto e despesas = % da receita (configurações);
+- publicidade = valor mensal do produto * meses do período;
+- lucro líquido = receita - custo - comissão - imposto - despesas - publicidade.
+
+A entrada são somas já agregadas (por produto, por dia, ou uma linha só com o
+total do período); a comissão é inferida no nível em que os dados chegam.
+"""
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+
+def meses_no_periodo(data_inicio, data_fim):
+    """Meses do período, contando o inicial e o final (mínimo 1)."""
+    try:
+        d1 = date.fromisoformat(data_inicio)
+        d2 = date.fromisoformat(data_fim)
+        return max(1, (d2.year - d1.year) * 12 + (d2.month - d1.month) + 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def _por_unidade(valor, qtd):
+    return np.divide(valor, qtd, out=np.zeros(len(valor)), where=qtd > 0)
+
+
+def calcular_lucro(dados, imposto_percent=0.0, despesas_percent=0.0, meses=1):
+    """Devolve um DataFrame com as colunas derivadas do lucro, numa passada.
+
+    ``dados``: DataFrame (ou dict de listas) com ``receita``, ``custo`` e
+    ``margem``; opcionais ``qtd`` (gera os valores por unidade) e
+    ``publicidade`` (valor mensal, multiplicado por ``meses``). Demais
+    colunas são mantidas. Nulos contam como zero.
+
+    Colunas geradas: ``comissao``, ``imposto``, ``despesas``, ``publicidade``,
+    ``receita_liquida`` (receita - comissão), ``lucro_liquido`` e, com
+    ``qtd``, ``custo_unit``, ``comissao_unit``, ``receita_liquida_unit`` e
+    ``lucro_unit``.
+    """
+    df = pd.DataFrame(dados).copy()
+
+    def coluna(nome):
+        if nome not in df:
+            return np.zeros(len(df))
+        return pd.to_numeric(df[nome], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+
+    receita = coluna("receita")
+    custo = coluna("custo")
+    comissao = np.maximum(0.0, (receita - custo) - coluna("margem"))
+    imposto = receita * (float(imposto_percent or 0) / 100.0)
+    despesas = receita * (float(despesas_percent or 0) / 100.0)
+    publicidade = coluna("publicidade") * meses
+    lucro_liquido = receita - custo - comissao - imposto - despesas - publicidade
+
+    df["receita"] = receita
+    df["custo"] = custo
+    df["comissao"] = comissao
+    df["imposto"] = imposto
+    df["despesas"] = despesas
+    df["publicidade"] = publicidade
+    df["receita_liquida"] = receita - comissao
+    df["lucro_liquido"] = lucro_liquido
+
+    if "qtd" in df:
+        qtd = coluna("qtd")
+        df["qtd"] = qtd
+        df["custo_unit"] = _por_unidade(custo, qtd)
+        df["comissao_unit"] = _por_unidade(comissao, qtd)
+        df["receita_liquida_unit"] = _por_unidade(receita - comissao, qtd)
+        df["lucro_unit"] = _por_unidade(lucro_liquido, qtd)
+    return df
+
+
+def totais_lucro(receita, custo, margem, publicidade=0.0, imposto_percent=0.0, despesas_percent=0.0, meses=1):
+    """Atalho para um total só (comissão inferida sobre o total); devolve dict de floats."""
+    df = calcular_lucro(
+        {"receita": [receita], "custo": [custo], "margem": [margem], "publicidade": [publicidade]},
+        imposto_percent, despesas_percent, meses,
+    )
+    return {nome: float(valor) for nome, valor in df.iloc[0].items()}
@@ -0,0 +1,374 @@
+"""
+Cliente da API do Mercado Livre usado pela sincronização de vendas.
+
+- Uma ``requests.Session`` com pool de conexões (keep-alive) e novas
+  tentativas com espera crescente em 429/5xx, compartilhada pelas threads;
+- ``LimiteTaxa`` espaça as chamadas (todas as threads somadas) para ficar
+  abaixo do limite de requisições do ML;
+- os pedidos alterados num intervalo vêm de ``/orders/search`` página a
+  página; os detalhes (pedido + envio, para o estado do comprador) são
+  buscados em paralelo num pool limitado de threads;
+- ``linhas_planilha`` converte o pedido para as colunas da aba "Vendas BR",
+  para a gravação seguir o mesmo caminho da importação da planilha;
+- ``TokenML`` guarda o access token em memória e o renova pouco antes de
+  expirar, uma renovação por vez;
+- ``atualizar_estoques`` grava ``available_quantity`` de vários anúncios em
+  paralelo, devolvendo o resultado de cada um.
+
+``ML_API_URL`` troca o endereço da API (ex.: o servidor local do
+``ml_stub.py``, para testar sem a conta real).
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+API_URL_PADRAO = "https://api.mercadolibre.com"
+POR_PAGINA = 50
+ITENS_POR_CONSULTA = 20  # limite do multiget /items?ids=
+ANUNCIOS_POR_PAGINA = 100  # limite de /users/<id>/items/search
+REQUISICOES_POR_SEGUNDO = 20
+MAX_THREADS_PADRAO = 8
+TIMEOUT = 20
+# renova o access token quando faltar menos que isto para expirar
+MARGEM_RENOVACAO = 300
+
+# colunas da aba "Vendas BR" preenchidas a partir de um pedido
+COLUNAS_PLANILHA = [
+    "N.º de venda", "Data da venda", "Status", "Status do envio", "SKU", "Título do anúncio",
+    "Unidades", "Preço", "Receita por produtos (BRL)", "Tarifa de venda e impostos (BRL)", "Estado",
+]
+STATUS_CANCELADO = {"cancelled", "invalid"}
+# status da API gravados em vendas.ml_status (a planilha traz texto em português)
+STATUS_PEDIDO = {
+    "confirmed", "payment_required", "payment_in_process", "partially_paid", "paid",
+    "partially_refunded", "pending_cancel", "cancelled",
+}
+STATUS_ENVIO = {"pending", "handling", "ready_to_ship", "shipped", "delivered", "not_delivered"}
+
+
+def formatar_data_api(momento):
+    """Data/hora no formato dos filtros de data da API (``2024-05-01T10:00:00.000-00:00``)."""
+    utc = momento.astimezone(timezone.utc)
+    return f"{utc:%Y-%m-%dT%H:%M:%S}.{utc.microsecond // 1000:03d}-00:00"
+
+
+class LimiteTaxa:
+    """Limita as chamadas a ``por_segundo`` (com rajada de até ``rajada``), entre todas as threads."""
+
+    def __init__(self, por_segundo, rajada=1):
+        self.intervalo = 1.0 / por_segundo
+        self.rajada = max(1, rajada)
+        self._proximo = 0.0
+        self._lock = threading.Lock()
+
+    def aguardar(self):
+        with self._lock:
+            agora = time.monotonic()
+            # créditos acumulados enquanto ninguém chamou valem no máximo uma rajada
+            inicio = max(self._proximo, agora - (self.rajada - 1) * self.intervalo)
+            self._proximo = inicio + self.intervalo
+            espera = inicio - agora
+        if espera > 0:
+            time.sleep(espera)
+
+
+def _momento(valor):
+    """``ml_token_expira`` (ISO; sem fuso = hora local) como timestamp.
+
+    Sem data (token colado à mão na configuração) vale até o ML responder 401.
+    """
+    if not valor:
+        return float("inf")
+    try:
+        return datetime.fromisoformat(str(valor)).timestamp()
+    except ValueError:
+        return 0.0
+
+
+class TokenML:
+    """Access token do ML em memória, renovado com o refresh token antes de expirar.
+
+    ``carregar()`` devolve um dict com access_token, refresh_token, expira
+    (texto ISO), client_id e client_secret (as colunas ml_* de
+    configuracoes); ``salvar(access_token, refresh_token, expira)`` grava a
+    renovação. O banco só é lido na primeira chamada e na renovação.
+
+    Só uma thread renova por vez: o refresh token do ML vale uma vez só, e as
+    outras threads esperam e usam o token novo. Antes de chamar a API de
+    OAuth o banco é relido, caso outro processo já tenha renovado.
+    """
+
+    def __init__(self, carregar, salvar, url_oauth, margem=MARGEM_RENOVACAO, sessao=None):
+        self.carregar = carregar
+        self.salvar = salvar
+        self.url_oauth = url_oauth
+        self.margem = margem
+        self.sessao = sessao or requests.Session()
+        self.renovacoes = 0
+        self._atual = None  # (access_token, expira em timestamp)
+        self._lock = threading.Lock()
+
+    def obter(self):
+        atual = self._atual
+        if atual is not None and atual[1] - time.time() > self.margem:
+            return atual[0]
+        return self.renovar(atual[0] if atual else None)
+
+    def renovar(self, token_usado=None):
+        """Renova (se ninguém renovou desde ``token_usado``) e devolve o token válido.
+
+        Chamado por ``obter`` perto do vencimento e pelo cliente ao receber 401.
+        """
+        with self._lock:
+            atual = self._atual
+            if atual is not None and atual[0] != token_usado and atual[1] > time.time():
+                return atual[0]  # outra thread renovou enquanto esta esperava o lock
+
+            dados = self.carregar() or {}
+            if not dados.get("access_token"):
+                raise ValueError("Conta do Mercado Livre não conectada (ml_access_token vazio).")
+            expira = _momento(dados.get("expira"))
+            if dados["access_token"] != token_usado and expira - time.time() > self.margem:
+                self._atual = (dados["access_token"], expira)
+                return dados["access_token"]
+
+            try:
+                novo = self._pedir_token(dados)
+            except Exception as e:
+                if dados["access_token"] != token_usado and expira > time.time():
+                    # renovação antecipada falhou, mas o token ainda vale: tenta de novo na próxima
+                    print(f"[TOKEN ML] renovação falhou ({e}); usando o token atual até {dados.get('expira')}")
+                    self._atual = (dados["access_token"], expira)
+                    return dados["access_token"]
+                raise
+
+            expira = time.time() + int(novo.get("expires_in") or 21600)
+            expira_iso = datetime.fromtimestamp(expira, timezone.utc).isoformat(timespec="seconds")
+            self.salvar(novo["access_token"], novo.get("refresh_token") or dados.get("refresh_token"), expira_iso)
+            self._atual = (novo["access_token"], expira)
+            self.renovacoes += 1
+            print(f"[TOKEN ML] access token renovado (expira {expira_iso})")
+            return novo["access_token"]
+
+    def _pedir_token(self, dados):
+        if not dados.get("refresh_token"):
+            raise ValueError("Sem ml_refresh_token para renovar o acesso ao Mercado Livre.")
+        resp = self.sessao.post(
+            self.url_oauth,
+            data={
+                "grant_type": "refresh_token",
+                "client_id": dados.get("client_id") or "",
+                "client_secret": dados.get("client_secret") or "",
+                "refresh_token": dados["refresh_token"],
+            },
+            headers={"Accept": "application/json"},
+            timeout=TIMEOUT,
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    def esquecer(self):
+        """Descarta o token em memória (ex.: a conta foi reconectada); a próxima chamada relê o banco."""
+        with self._lock:
+            self._atual = None
+
+
+class ClienteML:
+    """Chamadas à API do ML com sessão compartilhada, limite de taxa e pool de threads.
+
+    ``token`` é uma função que devolve o access token atual (lida a cada
+    chamada, para acompanhar a renovação), normalmente ``TokenML.obter``.
+    Com ``renovar`` (``TokenML.renovar``), uma resposta 401 renova o token e
+    repete a chamada uma vez.
+    """
+
+    def __init__(self, token, base_url=API_URL_PADRAO, por_segundo=REQUISICOES_POR_SEGUNDO,
+                 max_threads=MAX_THREADS_PADRAO, renovar=None):
+        self.token = token
+        self.renovar = renovar
+        self.base_url = base_url.rstrip("/")
+        self.max_threads = max(1, int(max_threads))
+        self.limite = LimiteTaxa(por_segundo, rajada=self.max_threads)
+        self.sessao = requests.Session()
+        tentativas = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            respect_retry_after_header=True,
+        )
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_threads, max_retries=tentativas)
+        self.sessao.mount("http://", adaptador)
+        self.sessao.mount("https://", adaptador)
+
+    def _enviar(self, metodo, caminho, params, corpo, token):
+        self.limite.aguardar()
+        return self.sessao.request(
+            metodo,
+            f"{self.base_url}{caminho}",
+            params=params,
+            json=corpo,
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=TIMEOUT,
+        )
+
+    def requisitar(self, metodo, caminho, params=None, corpo=None):
+        """Resposta da chamada (sem ``raise_for_status``); 429/5xx já foram repetidos pela sessão."""
+        token = self.token()
+        resp = self._enviar(metodo, caminho, params, corpo, token)
+        if resp.status_code == 401 and self.renovar is not None:
+            # token revogado/expirado antes da hora: renova (uma vez entre as threads) e repete
+            resp = self._enviar(metodo, caminho, params, corpo, self.renovar(token))
+        return resp
+
+    def get(self, caminho, params=None):
+        resp = self.requisitar("GET", caminho, params)
+        resp.raise_for_status()
+        return resp.json()
+
+    def ids_pedidos_alterados(self, vendedor, desde, ate, por_pagina=POR_PAGINA):
+        """Gera os ids dos pedidos com ``date_last_updated`` entre ``desde`` e ``ate``, página a página.
+
+        ``ate`` fixo faz o total não mudar enquanto as páginas são lidas; o que
+        for alterado depois fica para a próxima sincronização.
+        """
+        offset = 0
+        while True:
+            pagina = self.get("/orders/search", {
+                "seller": vendedor,
+                "order.date_last_updated.from": formatar_data_api(desde),
+                "order.date_last_updated.to": formatar_data_api(ate),
+                "sort": "date_asc",
+                "offset": offset,
+                "limit": por_pagina,
+            })
+            resultados = pagina.get("results") or []
+            for pedido in resultados:
+                yield pedido["id"]
+            offset += len(resultados)
+            if not resultados or offset >= (pagina.get("paging") or {}).get("total", 0):
+                return
+
+    def pedido_completo(self, pedido_id):
+        """(pedido, envio) — o envio traz o estado do comprador e o status da entrega."""
+        pedido = self.get(f"/orders/{pedido_id}")
+        envio = None
+        envio_id = (pedido.get("shipping") or {}).get("id")
+        if envio_id:
+            envio = self.get(f"/shipments/{envio_id}")
+        return pedido, envio
+
+    def detalhar_pedidos(self, ids):
+        """``pedido_completo`` de cada id, em paralelo; a ordem de ``ids`` é mantida."""
+        ids = list(ids)
+        if not ids:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_threads, len(ids)), thread_name_prefix="ml") as executor:
+            return list(executor.map(self.pedido_completo, ids))
+
+    def anuncios(self, ids):
+        """Anúncios pelo multiget ``/items?ids=`` (20 por chamada, em paralelo); os não encontrados ficam de fora."""
+        ids = list(ids)
+        grupos = [ids[i:i + ITENS_POR_CONSULTA] for i in range(0, len(ids), ITENS_POR_CONSULTA)]
+        if not grupos:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_threads, len(grupos)), thread_name_prefix="ml") as executor:
+            respostas = list(executor.map(lambda grupo: self.get("/items", {"ids": ",".join(grupo)}), grupos))
+        return [r["body"] for resposta in respostas for r in resposta if r.get("code") == 200]
+
+    def ids_anuncios(self, vendedor, por_pagina=ANUNCIOS_POR_PAGINA):
+        """Gera os ids de todos os anúncios do vendedor (busca ``scan``, sem o limite de 1000 do offset)."""
+        params = {"search_type": "scan", "limit": por_pagina}
+        while True:
+            pagina = self.get(f"/users/{vendedor}/items/search", params)
+            resultados = pagina.get("results") or []
+            yield from resultados
+            if not resultados or not pagina.get("scroll_id"):
+                return
+            params = {"search_type": "scan", "limit": por_pagina, "scroll_id": pagina["scroll_id"]}
+
+    def _atualizar_estoque(self, envio):
+        item_id, quantidade = envio
+        try:
+            resp = self.requisitar("PUT", f"/items/{item_id}", corpo={"available_quantity": int(quantidade)})
+        except requests.RequestException as e:
+            return item_id, None, str(e)
+        if resp.ok:
+            return item_id, resp.status_code, None
+        try:
+            erro = resp.json().get("message") or resp.text
+        except ValueError:
+            erro = resp.text
+        return item_id, resp.status_code, erro[:500]
+
+    def atualizar_estoques(self, envios):
+        """Grava ``available_quantity`` de cada (item_id, quantidade), em paralelo.
+
+        Retorna [(item_id, status HTTP ou None se não houve resposta, erro ou None)]
+        na ordem de ``envios``; uma falha não interrompe as outras.
+        """
+        envios = list(envios)
+        if not envios:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_threads, len(envios)), thread_name_prefix="ml") as executor:
+            return list(executor.map(self._atualizar_estoque, envios))
+
+    def fechar(self):
+        self.sessao.close()
+
+
+def sku_do_anuncio(item):
+    """SKU do anúncio: ``seller_custom_field`` ou o atributo SELLER_SKU."""
+    if item.get("seller_custom_field"):
+        return item["seller_custom_field"]
+    for atributo in item.get("attributes") or []:
+        if atributo.get("id") == "SELLER_SKU" and atributo.get("value_name"):
+            return atributo["value_name"]
+    return None
+
+
+def _data_local(valor):
+    # 2024-05-01T10:00:00.000-03:00 -> 2024-05-01T10:00:00 (hora de Brasília, como na planilha)
+    if not valor:
+        return None
+    return datetime.fromisoformat(valor).replace(tzinfo=None).isoformat(timespec="seconds")
+
+
+def linhas_planilha(pedido, envio=None):
+    """Linhas (colunas de ``COLUNAS_PLANILHA``) de um pedido, uma por item.
+
+    Pedidos com mais de um item viram "<id>-1", "<id>-2"...: o N.º de venda
+    é a chave única da venda.
+    """
+    itens = pedido.get("order_items") or []
+    status = pedido.get("status") or ""
+    if status in STATUS_CANCELADO:
+        status = "cancelled"
+    endereco = (envio or {}).get("receiver_address") or {}
+    estado = (endereco.get("state") or {}).get("name") or ""
+
+    linhas = []
+    for n, item_pedido in enumerate(itens, 1):
+        item = item_pedido.get("item") or {}
+        unidades = int(item_pedido.get("quantity") or 0)
+        preco = float(item_pedido.get("unit_price") or 0.0)
+        linhas.append({
+            "N.º de venda": str(pedido["id"]) if len(itens) == 1 else f"{pedido['id']}-{n}",
+            "Data da venda": _data_local(pedido.get("date_closed") or pedido.get("date_created")),
+            "Status": status,
+            "Status do envio": (envio or {}).get("status") or "",
+            "SKU": item.get("seller_sku") or item.get("seller_custom_field") or "",
+            "Título do anúncio": item.get("title") or "",
+            "Unidades": unidades,
+            "Preço": preco,
+            "Receita por produtos (BRL)": preco * unidades,
+            # sale_fee é por unidade; na planilha a tarifa vem negativa
+            "Tarifa de venda e impostos (BRL)": -float(item_pedido.get("sale_fee") or 0.0) * unidades,
+            "Estado": estado,
+        })
+    return linhas
@@ -0,0 +1,116 @@
+"""
+Migrações de schema versionadas (tabela ``schema_version``).
+
+Antes, cada boot rodava ``metadata.create_all`` e várias funções de
+migração que inspecionavam as colunas de cada tabela e tentavam
+``ALTER TABLE``; com ``max_requests`` reciclando o worker do gunicorn isso
+pesava no cold start. Agora as migrações ficam numa lista ordenada e cada uma
+roda uma única vez: ``schema_version`` guarda a versão aplicada, quando e
+quanto tempo levou. Num banco em dia o boot faz só a leitura da versão.
+
+Para mudar o schema (nova tabela, coluna ou índice), registre uma nova
+migração com o próximo número (a última registrada em ``app.py`` + 1) —
+nunca altere uma já aplicada::
+
+    @migracoes.migracao(N, "vendas_nova_coluna")
+    def _migracao_vendas_nova_coluna(conn):
+        adicionar_coluna(conn, "vendas", "nova_coluna", "VARCHAR(50)", "TEXT")
+
+Se uma migração falha, ``aplicar`` levanta ``RuntimeError``: o app não sobe
+com o schema pela metade. Ela não fica registrada e roda de novo no próximo
+boot — por isso as migrações usam ``IF NOT EXISTS``/``adicionar_coluna`` (no
+SQLite o DDL que já rodou não volta com o rollback).
+"""
+import time
+from datetime import datetime
+
+from sqlalchemy import func, insert, inspect, select, text
+from sqlalchemy.exc import DBAPIError
+
+
+def adicionar_coluna(conn, tabela, coluna, tipo_postgres, tipo_sqlite=None):
+    """``ALTER TABLE ... ADD COLUMN`` se a coluna ainda não existir. Retorna True se criou."""
+    colunas = [c["name"] for c in inspect(conn).get_columns(tabela)]
+    if coluna in colunas:
+        return False
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(f"ALTER TABLE {tabela} ADD COLUMN IF NOT EXISTS {coluna} {tipo_postgres}"))
+    else:
+        conn.execute(text(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo_sqlite or tipo_postgres}"))
+    print(f"[MIGRAÇÃO] Coluna {tabela}.{coluna} adicionada")
+    return True
+
+
+class RegistroMigracoes:
+    """Lista ordenada de migrações e o controle da versão aplicada no banco."""
+
+    def __init__(self, engine, tabela):
+        self.engine = engine
+        self.tabela = tabela
+        self.migracoes = {}
+
+    def migracao(self, versao, nome):
+        """Decorador: registra ``funcao(conn)`` como a migração ``versao``."""
+        def registrar(funcao):
+            if versao in self.migracoes:
+                raise ValueError(f"Migração {versao} registrada duas vezes")
+            self.migracoes[versao] = (nome, funcao)
+            return funcao
+        return registrar
+
+    @property
+    def ultima_versao(self):
+        return max(self.migracoes, default=0)
+
+    def versao_atual(self):
+        """Versão aplicada no banco (0 se ``schema_version`` ainda não existe)."""
+        try:
+            with self.engine.connect() as conn:
+                return conn.execute(select(func.max(self.tabela.c.versao))).scalar() or 0
+        except DBAPIError:
+            return 0
+
+    def aplicar(self):
+        """Aplica as migrações pendentes, em ordem. Retorna [(versao, nome, segundos)].
+
+        Levanta ``RuntimeError`` se alguma falhar (as anteriores ficam aplicadas).
+        """
+        atual = self.versao_atual()
+        if atual >= self.ultima_versao:
+            return []
+
+        self.tabela.create(self.engine, checkfirst=True)
+        aplicadas = []
+        inicio_total = time.perf_counter()
+        for versao in sorted(v for v in self.migracoes if v > atual):
+            nome, funcao = self.migracoes[versao]
+            inicio = time.perf_counter()
+            try:
+                with self.engine.begin() as conn:
+                    funcao(conn)
+                    duracao = time.perf_counter() - inicio
+                    conn.execute(insert(self.tabela).values(
+                        versao=versao,
+                        nome=nome,
+                        aplicada_em=datetime.now().isoformat(timespec="seconds"),
+                        duracao_segundos=round(duracao, 3),
+                    ))
+            except Exception as e:
+                # as próximas dependem desta, e o código do app conta com todas:
+                # não sobe com o schema pela metade (tenta de novo no próximo boot)
+                print(f"[MIGRAÇÃO] {versao} ({nome}) falhou: {e}")
+                raise RuntimeError(
+                    f"Migração {versao} ({nome}) falhou; schema parado na versão "
+                    f"{aplicadas[-1][0] if aplicadas else atual}"
+                ) from e
+            aplicadas.append((versao, nome, duracao))
+            print(f"[MIGRAÇÃO] {versao} ({nome}) aplicada em {duracao:.2f}s")
+
+        print(f"[MIGRAÇÃO] schema na versão {aplicadas[-1][0] if aplicadas else atual} "
+              f"({len(aplicadas)} migrações em {time.perf_counter() - inicio_total:.2f}s)")
+        return aplicadas
+
+    def historico(self):
+        """Migrações aplicadas no banco, com data e duração."""
+        with self.engine.connect() as conn:
+            return conn.execute(select(self.tabela).order_by(self.tabela.c.versao)).mappings().all()
@@ -0,0 +1,428 @@
+"""
+Servidor local que imita a API do Mercado Livre, para testar a sincronização
+sem a conta real.
+
+    python ml_stub.py servidor --pedidos 2000 --banco metrifiy.db --porta 8099
+    ML_API_URL=http://127.0.0.1:8099 python app.py
+
+Responde ``/orders/search`` (filtro por ``order.date_last_updated``, paginação
+por offset/limit), ``/orders/<id>``, ``/shipments/<id>``, ``/items`` (um
+anúncio por produto, também pelo multiget ``?ids=``),
+``/users/<id>/items/search`` (``search_type=scan`` com ``scroll_id``) e
+``PUT /items/<id>`` com ``available_quantity`` (``--falhas``: fração dessas
+gravações que responde 503, para testar as novas tentativas), com latência
+(``--latencia``) e limite de requisições por segundo (``--limite``, responde
+429) opcionais. Os SKUs/títulos vêm da tabela ``produtos`` do ``--banco``
+(ou são inventados). Rotas de apoio:
+
+- ``GET /_stats``: requisições recebidas por rota (e quantas viraram 429);
+- ``POST /_expirar``: invalida os access tokens emitidos até agora (a
+  próxima chamada do app recebe 401);
+- ``POST /_falhar?caminho=/orders/search&vezes=2&status=429``: as próximas
+  ``vezes`` chamadas que começam por ``caminho`` respondem ``status`` (para
+  testar as novas tentativas; também ``ServidorStub.falhar``);
+- ``POST /_alterar/<id>?status=cancelled``: muda o pedido e o seu
+  ``date_last_updated`` para agora (entra na próxima sincronização) e, com
+  ``--webhook``, avisa o app como o ML faria.
+
+Com ``--access-token``/``--refresh-token`` as rotas exigem
+``Authorization: Bearer`` válido (401 se expirado ou desconhecido) e
+``POST /oauth/token`` (``grant_type=refresh_token``) troca o refresh token
+por um par novo, válido por ``--validade`` segundos. Como no ML, cada
+refresh token serve uma vez só: reusar dá 400 ``invalid_grant``.
+
+Avisos (notificações) avulsos, como o ML manda para o webhook do app:
+
+    python ml_stub.py notificar http://127.0.0.1:5000/ml/notificacoes --pedido 2000000001 --vezes 50
+
+Também pode ser usado de dentro de um script: ``ServidorStub(...).iniciar()``
+devolve a URL base.
+"""
+import argparse
+import json
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+FUSO_BR = timezone(timedelta(hours=-3))
+ESTADOS = ["São Paulo", "Rio de Janeiro", "Minas Gerais", "Paraná", "Bahia", "Rio Grande do Sul", "Goiás"]
+
+
+def _data(momento):
+    return momento.astimezone(FUSO_BR).isoformat(timespec="milliseconds")
+
+
+def _ler_data(valor):
+    return datetime.fromisoformat(valor)
+
+
+def notificar(webhook, topico, recurso, user_id, vezes=1, sessao=None):
+    """Envia ``vezes`` avisos iguais para o webhook; retorna a lista de (status, segundos)."""
+    sessao = sessao or requests.Session()
+    respostas = []
+    for tentativa in range(1, vezes + 1):
+        inicio = time.perf_counter()
+        resp = sessao.post(webhook, json={
+            "resource": recurso,
+            "user_id": int(user_id),
+            "topic": topico,
+            "application_id": 5503910054141466,
+            "attempts": tentativa,
+            "sent": _data(datetime.now(timezone.utc)),
+            "received": _data(datetime.now(timezone.utc)),
+        }, timeout=5)
+        respostas.append((resp.status_code, time.perf_counter() - inicio))
+    return respostas
+
+
+def produtos_do_banco(caminho):
+    conn = sqlite3.connect(caminho)
+    try:
+        return conn.execute(
+            "SELECT sku, nome FROM produtos WHERE sku IS NOT NULL AND sku != '' ORDER BY id"
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+class ServidorStub:
+    """API falsa do ML em memória (pedidos e envios gerados com ``semente``)."""
+
+    def __init__(self, pedidos=500, produtos=None, vendedor="123456", dias=30, porta=0,
+                 latencia=0.0, limite=None, semente=42, webhook=None,
+                 access_token=None, refresh_token=None, validade=21600, falhas=0.0):
+        self.vendedor = str(vendedor)
+        self.falhas = falhas
+        self._rnd = random.Random(semente)
+        self.validade = validade
+        self.refresh_token = refresh_token
+        # access token -> instante (time.time) em que expira; vazio = sem autenticação
+        self.tokens = {access_token: time.time() + validade} if access_token else {}
+        self.webhook = webhook
+        self.latencia = latencia
+        self.limite = limite
+        self.porta = porta
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._janela = []
+        self._falhas_forcadas = []  # [caminho, vezes restantes, status]
+        self._servidor = None
+        self.pedidos = {}
+        self.envios = {}
+        produtos = produtos or [(f"SKU-{i}", f"Produto {i}") for i in range(1, 21)]
+        rnd = random.Random(semente)
+        self.anuncios = {}
+        anuncio_do_sku = {}
+        for n, (sku, titulo) in enumerate(produtos):
+            item_id = f"MLB{1000000000 + n}"
+            anuncio_do_sku[sku] = item_id
+            self.anuncios[item_id] = {
+                "id": item_id,
+                "title": titulo,
+                "seller_id": int(self.vendedor),
+                "seller_custom_field": sku,
+                "available_quantity": rnd.randrange(0, 200),
+                "status": "active",
+                "last_updated": _data(datetime.now(timezone.utc)),
+            }
+        agora = datetime.now(timezone.utc)
+        for n in range(pedidos):
+            pedido_id = 2000000000 + n
+            criado = agora - timedelta(days=dias) + timedelta(seconds=n * dias * 86400 / max(pedidos, 1))
+            sku, titulo = produtos[rnd.randrange(len(produtos))]
+            preco = round(rnd.uniform(20, 300), 2)
+            cancelado = rnd.random() < 0.05
+            self.envios[40000000000 + n] = {
+                "id": 40000000000 + n,
+                "status": "cancelled" if cancelado else rnd.choice(["ready_to_ship", "shipped", "delivered"]),
+                "receiver_address": {"state": {"name": rnd.choice(ESTADOS)}},
+            }
+            self.pedidos[pedido_id] = {
+                "id": pedido_id,
+                "status": "cancelled" if cancelado else "paid",
+                "date_created": _data(criado),
+                "date_closed": _data(criado + timedelta(minutes=1)),
+                "last_updated": _data(criado + timedelta(minutes=2)),
+                "date_last_updated": _data(criado + timedelta(minutes=2)),
+                "total_amount": preco,
+                "seller": {"id": int(self.vendedor)},
+                "shipping": {"id": 40000000000 + n},
+                "order_items": [{
+                    "item": {"id": anuncio_do_sku[sku], "title": titulo, "seller_sku": sku},
+                    "quantity": 1 + (n % 3 == 0),
+                    "unit_price": preco,
+                    "sale_fee": round(preco * 0.14, 2),
+                }],
+            }
+
+    def alterar(self, pedido_id, **campos):
+        pedido = self.pedidos[int(pedido_id)]
+        pedido.update(campos)
+        pedido["date_last_updated"] = pedido["last_updated"] = _data(datetime.now(timezone.utc))
+        if self.webhook:
+            notificar(self.webhook, "orders_v2", f"/orders/{pedido['id']}", self.vendedor)
+        return pedido
+
+    def falhar(self, caminho, vezes=1, status=503):
+        """As próximas ``vezes`` chamadas da API que começam por ``caminho`` respondem ``status``."""
+        with self._lock:
+            self._falhas_forcadas.append([caminho, int(vezes), int(status)])
+
+    def _falha_forcada(self, caminho):
+        with self._lock:
+            for falha in self._falhas_forcadas:
+                if caminho.startswith(falha[0]) and falha[1] > 0:
+                    falha[1] -= 1
+                    return falha[2]
+        return None
+
+    def _autorizado(self, cabecalho):
+        if not self.tokens:
+            return True
+        token = (cabecalho or "").removeprefix("Bearer ").strip()
+        with self._lock:
+            return self.tokens.get(token, 0) > time.time()
+
+    def _renovar_token(self, corpo):
+        form = {k: v[-1] for k, v in parse_qs(corpo.decode("utf-8")).items()}
+        with self._lock:
+            if form.get("grant_type") != "refresh_token" or not self.refresh_token \
+                    or form.get("refresh_token") != self.refresh_token:
+                self.stats["oauth_recusado"] += 1
+                return 400, {"error": "invalid_grant", "message": "Error validating grant."}
+            self.stats["oauth_renovado"] += 1
+            n = self.stats["oauth_renovado"]
+            access_token = f"APP_USR-stub-{n}-{random.getrandbits(32):08x}"
+            self.refresh_token = f"TG-stub-{n}-{random.getrandbits(32):08x}"
+            self.tokens[access_token] = time.time() + self.validade
+        return 200, {
+            "access_token": access_token,
+            "token_type": "Bearer",
+            "expires_in": self.validade,
+            "scope": "offline_access read write",
+            "user_id": int(self.vendedor),
+            "refresh_token": self.refresh_token,
+        }
+
+    def _anuncios_do_vendedor(self, params):
+        ids = sorted(self.anuncios)
+        inicio = int(params.get("scroll_id") or 0)
+        limite = min(int(params.get("limit", 50)), 100)
+        pagina = ids[inicio:inicio + limite]
+        return 200, {
+            "seller_id": self.vendedor,
+            "results": pagina,
+            "paging": {"total": len(ids), "limit": limite},
+            "scroll_id": str(inicio + limite) if pagina else None,
+        }
+
+    def _gravar_estoque(self, item_id, corpo):
+        anuncio = self.anuncios.get(item_id)
+        if anuncio is None:
+            return 404, {"message": "item not found"}
+        dados = json.loads(corpo or b"{}")
+        quantidade = dados.get("available_quantity")
+        if not isinstance(quantidade, int) or quantidade < 0:
+            return 400, {"message": "available_quantity must be a non-negative integer", "error": "validation_error"}
+        if anuncio["status"] == "closed":
+            return 400, {"message": f"Item {item_id} is closed and cannot be modified", "error": "validation_error"}
+        with self._lock:
+            if self.falhas and self._rnd.random() < self.falhas:
+                self.stats["503"] += 1
+                return 503, {"message": "service unavailable"}
+            anuncio["available_quantity"] = quantidade
+            anuncio["last_updated"] = _data(datetime.now(timezone.utc))
+        return 200, anuncio
+
+    def _estourou_limite(self):
+        if not self.limite:
+            return False
+        with self._lock:
+            agora = time.monotonic()
+            self._janela = [t for t in self._janela if agora - t < 1.0]
+            if len(self._janela) >= self.limite:
+                return True
+            self._janela.append(agora)
+            return False
+
+    def _buscar(self, params):
+        if params.get("seller") != self.vendedor:
+            return 403, {"message": "invalid seller"}
+        desde = _ler_data(params["order.date_last_updated.from"]) if "order.date_last_updated.from" in params else None
+        ate = _ler_data(params["order.date_last_updated.to"]) if "order.date_last_updated.to" in params else None
+        achados = [
+            p for p in self.pedidos.values()
+            if (desde is None or _ler_data(p["date_last_updated"]) >= desde)
+            and (ate is None or _ler_data(p["date_last_updated"]) <= ate)
+        ]
+        achados.sort(key=lambda p: _ler_data(p["date_last_updated"]), reverse=params.get("sort") == "date_desc")
+        offset = int(params.get("offset", 0))
+        limit = min(int(params.get("limit", 50)), 51)
+        return 200, {
+            "results": achados[offset:offset + limit],
+            "paging": {"total": len(achados), "offset": offset, "limit": limit},
+        }
+
+    def responder(self, metodo, caminho, params, corpo):
+        """(status, dict) da rota; as subclasses/rotas novas entram aqui."""
+        partes = caminho.strip("/").split("/")
+        if metodo == "GET" and caminho == "/_stats":
+            return 200, dict(self.stats)
+        if metodo == "POST" and partes[0] == "_alterar":
+            return 200, self.alterar(partes[1], **params)
+        if metodo == "POST" and caminho == "/_falhar":
+            self.falhar(params["caminho"], params.get("vezes", 1), params.get("status", 503))
+            return 200, {"caminho": params["caminho"]}
+        if metodo == "POST" and caminho == "/_expirar":
+            with self._lock:
+                self.tokens = {t: 0 for t in self.tokens}
+            return 200, {"expirados": len(self.tokens)}
+        if metodo == "POST" and caminho == "/oauth/token":
+            return self._renovar_token(corpo)
+        if metodo == "GET" and caminho == "/orders/search":
+            return self._buscar(params)
+        if metodo == "GET" and partes[0] == "orders" and len(partes) == 2:
+            pedido = self.pedidos.get(int(partes[1]))
+            return (200, pedido) if pedido else (404, {"message": "order not found"})
+        if metodo == "GET" and caminho == "/items":
+            return 200, [
+                {"code": 200, "body": self.anuncios[i]} if i in self.anuncios
+                else {"code": 404, "body": {"message": f"Item with id {i} not found"}}
+                for i in params.get("ids", "").split(",") if i
+            ]
+        if metodo == "PUT" and partes[0] == "items" and len(partes) == 2:
+            return self._gravar_estoque(partes[1], corpo)
+        if metodo == "GET" and partes[0] == "users" and partes[2:] == ["items", "search"]:
+            if partes[1] != self.vendedor:
+                return 403, {"message": "invalid seller"}
+            return self._anuncios_do_vendedor(params)
+        if metodo == "GET" and partes[0] == "items" and len(partes) == 2:
+            anuncio = self.anuncios.get(partes[1])
+            return (200, anuncio) if anuncio else (404, {"message": "item not found"})
+        if metodo == "GET" and partes[0] == "shipments" and len(partes) == 2:
+            envio = self.envios.get(int(partes[1]))
+            return (200, envio) if envio else (404, {"message": "shipment not found"})
+        return 404, {"message": f"rota desconhecida: {metodo} {caminho}"}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _tratar(self, metodo):
+                url = urlparse(self.path)
+                params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                tamanho = int(self.headers.get("Content-Length") or 0)
+                corpo = self.rfile.read(tamanho) if tamanho else b""
+                rota = "/" + "/".join(
+                    ":id" if p.isdigit() or p.startswith("MLB") else p for p in url.path.strip("/").split("/")
+                )
+                with stub._lock:
+                    stub.stats[f"{metodo} {rota}"] += 1
+                forcada = None if url.path.startswith("/_") else stub._falha_forcada(url.path)
+                if forcada is not None:
+                    with stub._lock:
+                        stub.stats[str(forcada)] += 1
+                    status, dados = forcada, {"message": "falha forçada pelo stub"}
+                elif not url.path.startswith("/_") and stub._estourou_limite():
+                    with stub._lock:
+                        stub.stats["429"] += 1
+                    status, dados = 429, {"message": "too many requests"}
+                elif not url.path.startswith(("/_", "/oauth/")) and not stub._autorizado(
+                        self.headers.get("Authorization")):
+                    with stub._lock:
+                        stub.stats["401"] += 1
+                    status, dados = 401, {"message": "invalid access token", "error": "unauthorized"}
+                else:
+                    if stub.latencia:
+                        time.sleep(stub.latencia)
+                    status, dados = stub.responder(metodo, url.path, params, corpo)
+                saida = json.dumps(dados).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(saida)))
+                self.end_headers()
+                self.wfile.write(saida)
+
+            def do_GET(self):
+                self._tratar("GET")
+
+            def do_POST(self):
+                self._tratar("POST")
+
+            def do_PUT(self):
+                self._tratar("PUT")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def iniciar(self):
+        """Sobe o servidor numa thread; retorna a URL base."""
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", self.porta), self._handler())
+        self._servidor.daemon_threads = True
+        threading.Thread(target=self._servidor.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._servidor.server_address[1]}"
+
+    def parar(self):
+        if self._servidor is not None:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API falsa do Mercado Livre para testes locais")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("servidor", help="sobe a API falsa")
+    p.add_argument("--porta", type=int, default=8099)
+    p.add_argument("--pedidos", type=int, default=500)
+    p.add_argument("--vendedor", default="123456")
+    p.add_argument("--banco", help="metrifiy.db de onde tirar SKUs e títulos")
+    p.add_argument("--latencia", type=float, default=0.0, help="segundos por requisição")
+    p.add_argument("--limite", type=int, help="requisições por segundo antes de responder 429")
+    p.add_argument("--webhook", help="URL de notificações do app (avisada em /_alterar)")
+    p.add_argument("--access-token", help="exige este Bearer nas rotas da API")
+    p.add_argument("--refresh-token", help="refresh token aceito (uma vez) em /oauth/token")
+    p.add_argument("--validade", type=int, default=21600, help="segundos de validade dos tokens emitidos")
+    p.add_argument("--falhas", type=float, default=0.0, help="fração das gravações de estoque que respondem 503")
+
+    p = sub.add_parser("notificar", help="manda avisos para o webhook do app")
+    p.add_argument("webhook")
+    p.add_argument("--pedido", action="append", default=[])
+    p.add_argument("--anuncio", action="append", default=[])
+    p.add_argument("--vendedor", default="123456")
+    p.add_argument("--vezes", type=int, default=1, help="avisos repetidos por recurso")
+    args = parser.parse_args()
+
+    if args.comando == "notificar":
+        recursos = [("orders_v2", f"/orders/{p}") for p in args.pedido]
+        recursos += [("items", f"/items/{a}") for a in args.anuncio]
+        for topico, recurso in recursos:
+            respostas = notificar(args.webhook, topico, recurso, args.vendedor, args.vezes)
+            pior = max(s for _, s in respostas)
+            print(f"{recurso}: {len(respostas)} avisos, status {sorted({c for c, _ in respostas})}, "
+                  f"resposta mais lenta {pior * 1000:.1f} ms")
+        raise SystemExit(0)
+
+    stub = ServidorStub(
+        args.pedidos, produtos_do_banco(args.banco) if args.banco else None, args.vendedor,
+        porta=args.porta, latencia=args.latencia, limite=args.limite, webhook=args.webhook,
+        access_token=args.access_token, refresh_token=args.refresh_token, validade=args.validade,
+        falhas=args.falhas,
+    )
+    print(f"API falsa do ML em {stub.iniciar()} ({len(stub.pedidos)} pedidos, vendedor {args.vendedor})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.parar()
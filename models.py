@@ -1,9 +1,10 @@
 from flask import render_template, request, redirect, url_for
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import calendar
 from sqlalchemy import select, func
 from app import app, engine
-from app import vendas, produtos, configuracoes
+from app import vendas, produtos, configuracoes, vendas_resumo_diario
+from series_tempo import serie_temporal
 
 
 @app.route("/vendas")
@@ -129,49 +130,30 @@ def lista_vendas():
             month=inicio_mes_atual.month - 1
         )
 
-    # Recarrega dados sem filtro para comparar mês atual x anterior (exclui canceladas)
-    with engine.connect() as conn_cmp:
-        vendas_cmp_rows = conn_cmp.execute(
-            select(vendas.c.data_venda, vendas.c.receita_total)
-            .where(vendas.c.data_venda >= inicio_mes_anterior.isoformat())
-            .where(vendas.c.data_venda <= hoje.isoformat() + "T23:59:59")
-        ).mappings().all()
-
     # Limites de dias por mês
     dias_mes_atual = hoje.day  # até hoje
     dias_mes_anterior = calendar.monthrange(inicio_mes_anterior.year, inicio_mes_anterior.month)[1]
     max_dias = max(dias_mes_atual, dias_mes_anterior)
 
-    # Inicializa listas com zeros para manter alinhamento
-    faturamento_mes_atual = {d: 0 for d in range(1, max_dias + 1)}
-    faturamento_mes_anterior = {d: 0 for d in range(1, max_dias + 1)}
-
-    for v in vendas_cmp_rows:
-        if not v["data_venda"]:
-            continue
-
-        dt = datetime.fromisoformat(v["data_venda"]).date()
-        receita = float(v["receita_total"] or 0)
-        
-        # PULAR vendas canceladas
-        if receita <= 0:
-            continue
-
-        dia = dt.day
-
-        # Mês atual
-        if dt.month == inicio_mes_atual.month and dt.year == inicio_mes_atual.year and dia <= dias_mes_atual:
-            faturamento_mes_atual[dia] += receita
-
-        # Mês anterior
-        if dt.month == inicio_mes_anterior.month and dt.year == inicio_mes_anterior.year and dia <= dias_mes_anterior:
-            faturamento_mes_anterior[dia] += receita
+    # Faturamento por dia de cada mês, agregado no banco (exclui canceladas)
+    resumo = vendas_resumo_diario
+    with engine.connect() as conn_cmp:
+        serie_atual = serie_temporal(
+            conn_cmp, resumo.c.dia, {"receita": func.sum(resumo.c.receita)},
+            inicio_mes_atual, hoje,
+            filtros=[resumo.c.cancelada == 0], granularidade="dia",
+        )
+        serie_anterior = serie_temporal(
+            conn_cmp, resumo.c.dia, {"receita": func.sum(resumo.c.receita)},
+            inicio_mes_anterior, inicio_mes_atual - timedelta(days=1),
+            filtros=[resumo.c.cancelada == 0], granularidade="dia",
+        )
 
-    # Labels dia a dia (01, 02, ...)
+    # Labels dia a dia (01, 02, ...); dias que o mês não tem ficam com zero
     grafico_cmp_labels = [f"{d:02d}" for d in range(1, max_dias + 1)]
 
-    grafico_cmp_atual = [faturamento_mes_atual.get(d, 0) if d <= dias_mes_atual else 0 for d in range(1, max_dias + 1)]
-    grafico_cmp_anterior = [faturamento_mes_anterior.get(d, 0) if d <= dias_mes_anterior else 0 for d in range(1, max_dias + 1)]
+    grafico_cmp_atual = serie_atual["receita"] + [0] * (max_dias - dias_mes_atual)
+    grafico_cmp_anterior = serie_anterior["receita"] + [0] * (max_dias - dias_mes_anterior)
 
     # ======================================================
     # 5. TOTAIS GERAIS (para os cards de topo) - EXCLUINDO CANCELADAS
@@ -0,0 +1,144 @@
+"""
+Fila das notificações (webhooks) do Mercado Livre.
+
+O ML chama a URL de notificações a cada mudança de um pedido (``orders_v2``)
+ou anúncio (``items``) — muitas vezes várias seguidas para o mesmo recurso —
+e espera a resposta em menos de 500 ms, senão reenvia. Por isso a rota só
+anota o recurso aqui e responde; uma thread em segundo plano junta o que
+chegou durante ``janela`` segundos e entrega em lotes para ``processar``:
+
+- cada recurso aparece uma vez só na fila (50 avisos do mesmo pedido em
+  poucos segundos viram uma busca na API);
+- um aviso que chega enquanto o recurso está sendo processado entra de novo
+  na fila (o ML pode ter mudado o pedido depois da leitura);
+- se o lote falhar, os recursos voltam para a fila até ``max_tentativas``;
+- a fila guarda no máximo ``max_pendentes`` recursos: com a API do ML fora
+  do ar, avisos de recursos novos além disso são descartados (a sincronização
+  periódica traz o que ficar de fora).
+"""
+import os
+import threading
+import time
+import traceback
+from collections import Counter
+
+JANELA_PADRAO = 2.0
+LOTE_PADRAO = 50
+MAX_TENTATIVAS = 3
+MAX_PENDENTES = 10000
+
+# tópicos aceitos -> tópico usado na fila (o ML ainda manda "orders" em contas antigas)
+TOPICOS = {"orders_v2": "orders_v2", "orders": "orders_v2", "items": "items"}
+
+
+def recurso_da_notificacao(dados):
+    """(tópico, id do recurso, user_id) de um aviso do ML, ou None se não for de interesse.
+
+    Ex.: ``{"topic": "orders_v2", "resource": "/orders/2195160686", "user_id": 468424240}``.
+    """
+    topico = TOPICOS.get((dados or {}).get("topic"))
+    recurso = str(dados.get("resource") or "").rstrip("/") if topico else ""
+    if not recurso:
+        return None
+    return topico, recurso.rsplit("/", 1)[-1], str(dados.get("user_id") or "")
+
+
+class FilaNotificacoes:
+    """Fila sem repetição de (tópico, id) com uma thread que processa em lotes.
+
+    ``processar(topico, itens)`` recebe os itens de um tópico como
+    ``{id: user_id}``; a thread nasce no primeiro aviso de cada processo.
+    """
+
+    def __init__(self, processar, janela=JANELA_PADRAO, lote=LOTE_PADRAO, max_tentativas=MAX_TENTATIVAS,
+                 max_pendentes=MAX_PENDENTES):
+        self.processar = processar
+        self.janela = janela
+        self.lote = lote
+        self.max_tentativas = max_tentativas
+        self.max_pendentes = max_pendentes
+        self.stats = Counter()
+        self._pendentes = {}  # (tópico, id) -> user_id, na ordem de chegada
+        self._tentativas = Counter()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+    def adicionar(self, topico, recurso_id, user_id=""):
+        """Anota o recurso (sem I/O: a rota responde logo).
+
+        Retorna False se já estava na fila ou se a fila está cheia (descartado).
+        """
+        chave = (topico, str(recurso_id))
+        with self._cond:
+            self._iniciar()
+            self.stats["recebidas"] += 1
+            novo = chave not in self._pendentes
+            if novo and not self._cabe():
+                return False
+            self._pendentes[chave] = user_id
+            self._cond.notify()
+        return novo
+
+    def _cabe(self):
+        # chamado com o lock
+        if len(self._pendentes) < self.max_pendentes:
+            return True
+        self.stats["descartadas_fila_cheia"] += 1
+        if self.stats["descartadas_fila_cheia"] % 1000 == 1:
+            print(f"[NOTIFICAÇÕES ML] fila cheia ({self.max_pendentes} recursos); "
+                  f"{self.stats['descartadas_fila_cheia']} avisos novos descartados até agora")
+        return False
+
+    def _iniciar(self):
+        # chamado com o lock; o gunicorn (preload_app) faz fork depois de importar o app
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._laco, name="notificacoes-ml", daemon=True)
+            self._thread.start()
+
+    def pendentes(self):
+        with self._cond:
+            return len(self._pendentes)
+
+    def _proximo_lote(self):
+        with self._cond:
+            while not self._pendentes:
+                self._cond.wait()
+        # espera a rajada de avisos terminar antes de buscar na API
+        time.sleep(self.janela)
+        with self._cond:
+            topico = next(iter(self._pendentes))[0]
+            chaves = [c for c in self._pendentes if c[0] == topico][:self.lote]
+            return topico, {c[1]: self._pendentes.pop(c) for c in chaves}
+
+    def _laco(self):
+        while True:
+            topico, itens = self._proximo_lote()
+            try:
+                self.processar(topico, itens)
+                self.stats["lotes"] += 1
+                self.stats[f"processadas_{topico}"] += len(itens)
+                with self._cond:
+                    for recurso_id in itens:
+                        self._tentativas.pop((topico, recurso_id), None)
+            except Exception:
+                traceback.print_exc()
+                self.stats["erros"] += 1
+                self._devolver(topico, itens)
+
+    def _devolver(self, topico, itens):
+        with self._cond:
+            for recurso_id, user_id in itens.items():
+                chave = (topico, recurso_id)
+                self._tentativas[chave] += 1
+                if self._tentativas[chave] >= self.max_tentativas:
+                    del self._tentativas[chave]
+                    self.stats["descartadas"] += 1
+                    print(f"[NOTIFICAÇÕES ML] {topico} {recurso_id} descartado após {self.max_tentativas} tentativas")
+                    continue
+                if chave in self._pendentes or self._cabe():
+                    self._pendentes.setdefault(chave, user_id)
+                else:
+                    del self._tentativas[chave]
+            self._cond.notify()
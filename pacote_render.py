@@ -0,0 +1,133 @@
+"""
+Pacote ZIP (CSV por tabela + manifest.json) para migração/restauração no Render.
+
+Antes cada tabela ia inteira para um DataFrame (``pd.read_sql``), depois para
+uma string (``to_csv``) e só então para um ``BytesIO`` com o ZIP: o banco
+ficava três vezes na memória. Aqui:
+
+- cada tabela é lida em blocos pela chave primária (keyset:
+  ``WHERE id > :ultimo ORDER BY id LIMIT n``) e escrita como CSV num arquivo
+  temporário, calculando linhas, bytes e SHA-256 no caminho;
+- as tabelas são lidas em paralelo, em threads com uma conexão cada;
+- os CSVs entram no ZIP (também em disco) à medida que ficam prontos, e o
+  ``manifest.json`` registra linhas, bytes e SHA-256 de cada um, para o
+  ``import_render_backup.py`` conferir.
+
+O formato dos CSVs é o mesmo de antes (cabeçalho com os nomes das colunas,
+nulos como campo vazio).
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from sqlalchemy import select
+
+
+TAMANHO_LOTE_PADRAO = 5000
+MAX_THREADS_PADRAO = 4
+
+
+def _lotes(conn, tabela, tamanho_lote):
+    """Linhas da tabela em blocos de ``tamanho_lote``, na ordem da chave primária."""
+    chave = list(tabela.primary_key.columns)
+    if len(chave) != 1:
+        # sem chave simples: um SELECT só, lido em blocos do cursor
+        resultado = conn.execution_options(yield_per=tamanho_lote).execute(select(tabela).order_by(*chave))
+        yield from resultado.partitions()
+        return
+
+    coluna = chave[0]
+    posicao = list(tabela.columns).index(coluna)
+    ultimo = None
+    while True:
+        consulta = select(tabela).order_by(coluna).limit(tamanho_lote)
+        if ultimo is not None:
+            consulta = consulta.where(coluna > ultimo)
+        linhas = conn.execute(consulta).fetchall()
+        if not linhas:
+            return
+        yield linhas
+        if len(linhas) < tamanho_lote:
+            return
+        ultimo = linhas[-1][posicao]
+
+
+def _exportar_tabela(engine, nome, tabela, pasta, tamanho_lote):
+    """Escreve ``<pasta>/<nome>.csv``; retorna a entrada do manifest."""
+    caminho = os.path.join(pasta, f"{nome}.csv")
+    sha = hashlib.sha256()
+    total_bytes = 0
+    linhas = 0
+    colunas = [c.name for c in tabela.columns]
+    with open(caminho, "wb") as arquivo, engine.connect() as conn:
+        texto = io.StringIO()
+        escritor = csv.writer(texto, lineterminator="\n")
+        escritor.writerow(colunas)
+        for lote in _lotes(conn, tabela, tamanho_lote):
+            escritor.writerows(lote)
+            linhas += len(lote)
+            dados = texto.getvalue().encode("utf-8")
+            texto.seek(0)
+            texto.truncate()
+            sha.update(dados)
+            total_bytes += len(dados)
+            arquivo.write(dados)
+        dados = texto.getvalue().encode("utf-8")
+        sha.update(dados)
+        total_bytes += len(dados)
+        arquivo.write(dados)
+    return {
+        "nome": nome,
+        "arquivo": f"{nome}.csv",
+        "linhas": linhas,
+        "colunas": colunas,
+        "bytes": total_bytes,
+        "sha256": sha.hexdigest(),
+    }
+
+
+def gerar_pacote(engine, tabelas, destino, origem="sqlite",
+                 tamanho_lote=TAMANHO_LOTE_PADRAO, max_threads=MAX_THREADS_PADRAO):
+    """Gera o ZIP em ``destino`` a partir de ``tabelas`` [(nome, Table)]; retorna o manifest."""
+    inicio = time.perf_counter()
+    pasta = tempfile.mkdtemp(prefix="pacote_render_")
+    entradas = {}
+    try:
+        with zipfile.ZipFile(destino, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_threads, len(tabelas)))) as executor:
+                futuros = [
+                    executor.submit(_exportar_tabela, engine, nome, tabela, pasta, tamanho_lote)
+                    for nome, tabela in tabelas
+                ]
+                # a compactação (thread principal) anda junto com as leituras
+                for futuro in as_completed(futuros):
+                    entrada = futuro.result()
+                    caminho = os.path.join(pasta, entrada["arquivo"])
+                    zf.write(caminho, entrada["arquivo"])
+                    os.remove(caminho)
+                    entradas[entrada["nome"]] = entrada
+
+            manifest = {
+                "gerado_em": datetime.utcnow().isoformat() + "Z",
+                "origem": origem,
+                # mesma ordem da lista (e da restauração), não a de conclusão
+                "tabelas": [entradas[nome] for nome, _ in tabelas],
+                "segundos": round(time.perf_counter() - inicio, 2),
+                "observacao": "Use import_render_backup.py para restaurar no Render/Postgres.",
+            }
+            zf.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+    except Exception:
+        if os.path.exists(destino):
+            os.remove(destino)
+        raise
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+    return manifest
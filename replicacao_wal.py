@@ -0,0 +1,506 @@
+"""
+Replicação contínua do SQLite por envio do WAL, com restauração para um ponto no tempo.
+
+Com ``SQLITE_REPLICA_DIR`` definido, o banco passa para o modo WAL e uma
+thread do app copia para a pasta de réplica, a cada ``intervalo`` segundos,
+só os frames novos do ``metrifiy.db-wal``. De tempos em tempos ela também
+grava um snapshot base (API de backup do SQLite). Nunca copia o arquivo
+inteiro a cada rodada, e perder o banco significa perder no máximo um
+intervalo de escrita.
+
+Estrutura da réplica::
+
+    <pasta>/estado.json                       posição atual da cópia
+    <pasta>/<geracao>/base.db.gz              snapshot
+    <pasta>/<geracao>/<epoca>_<offset>_<quando>.wal.gz   trechos do WAL
+
+Uma *geração* é um snapshot mais todos os trechos de WAL gravados depois
+dele. Dentro da geração, cada *época* é um arquivo WAL (o SQLite recomeça o
+WAL depois de um checkpoint completo). Os trechos de uma época, concatenados,
+são exatamente o arquivo WAL original.
+
+Para não perder frames entre a cópia e o checkpoint, só esta thread faz
+checkpoint: as conexões do app usam ``wal_autocheckpoint=0``. A cópia roda
+com ``BEGIN IMMEDIATE`` (escritores esperam alguns milissegundos) e vai até o
+último frame de commit. O checkpoint é FULL: se ele incluiu algum frame que
+ainda não tinha sido copiado, ou se o WAL recomeçou sem um checkpoint nosso
+(outro processo, ou reinício do app sem o WAL), a continuidade não é
+garantida e começa uma nova geração, com um novo snapshot.
+
+Se a cópia falha seguidamente (pasta de réplica cheia ou sem permissão), o
+WAL cresceria sem limite. Depois de ``max_falhas`` rodadas com erro seguidas,
+ou com o WAL acima de ``wal_max_bytes``, o replicador faz um checkpoint
+PASSIVE mesmo assim: o banco não para, a réplica perde a continuidade e,
+quando a cópia voltar, começa uma nova geração.
+
+Restauração (banco parado)::
+
+    python replicacao_wal.py status
+    python replicacao_wal.py restaurar --ate 2026-10-18T14:30:00 --saida restaurado.db
+
+Restaura o snapshot da última geração anterior ao horário e aplica os
+trechos de WAL copiados até ele (transações ainda sem commit no trecho são
+descartadas pelo próprio SQLite).
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+
+CABECALHO_WAL = 32
+CABECALHO_FRAME = 24
+FORMATO_DATA = "%Y%m%dT%H%M%S%f"
+
+
+def _agora():
+    return datetime.now().strftime(FORMATO_DATA)
+
+
+def _ler_data(texto):
+    return datetime.strptime(texto, FORMATO_DATA)
+
+
+def configurar_conexao(dbapi_conn, _registro=None):
+    """Conexões do app: WAL, sem checkpoint automático (quem faz é o replicador)."""
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA wal_autocheckpoint=0")
+    # ao recomeçar o WAL, o arquivo volta a no máximo 64 MB
+    cursor.execute("PRAGMA journal_size_limit=67108864")
+    cursor.close()
+
+
+def _gravar_gz(caminho, dados):
+    parcial = caminho + ".parcial"
+    with gzip.open(parcial, "wb", compresslevel=6) as f:
+        f.write(dados)
+    os.replace(parcial, caminho)
+
+
+class ReplicadorWAL:
+    """Thread que envia os frames novos do WAL para a pasta de réplica."""
+
+    def __init__(self, banco, pasta, intervalo=10.0, checkpoint_bytes=4 * 1024 * 1024,
+                 snapshot_horas=24.0, manter_geracoes=3, max_falhas=6, wal_max_bytes=256 * 1024 * 1024):
+        self.banco = banco
+        self.wal = banco + "-wal"
+        self.pasta = Path(pasta)
+        self.intervalo = float(intervalo)
+        self.checkpoint_bytes = int(checkpoint_bytes)
+        self.snapshot_segundos = float(snapshot_horas) * 3600
+        self.manter_geracoes = int(manter_geracoes)
+        self.max_falhas = int(max_falhas)
+        self.wal_max_bytes = int(wal_max_bytes)
+        self.falhas = 0  # rodadas seguidas com erro
+        self._geracao_perdida = False  # checkpoint sem cópia: a próxima rodada boa começa outra geração
+        self.estado = None
+        self._conn = None
+        self._thread = None
+        self._pid = None
+        self._parar = threading.Event()
+        self._lock = threading.Lock()
+
+    # ---- estado ----
+    def _arquivo_estado(self):
+        return self.pasta / "estado.json"
+
+    def _salvar_estado(self):
+        parcial = str(self._arquivo_estado()) + ".parcial"
+        with open(parcial, "w", encoding="utf-8") as f:
+            json.dump(self.estado, f, indent=2)
+        os.replace(parcial, self._arquivo_estado())
+
+    def _carregar_estado(self):
+        try:
+            with open(self._arquivo_estado(), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # ---- leitura do WAL ----
+    def _cabecalho_wal(self, f):
+        """(salt, tamanho da página, sequência de checkpoint) do WAL aberto; Nones se vazio."""
+        f.seek(0)
+        cabecalho = f.read(CABECALHO_WAL)
+        if len(cabecalho) < CABECALHO_WAL:
+            return None, None, None
+        tamanho_pagina, sequencia = struct.unpack(">II", cabecalho[8:16])
+        return cabecalho[16:24].hex(), tamanho_pagina, sequencia
+
+    def _salt_atual(self):
+        try:
+            with open(self.wal, "rb") as f:
+                return self._cabecalho_wal(f)[0]
+        except FileNotFoundError:
+            return None
+
+    def _fim_confirmado(self, f, salt, inicio, tamanho_pagina):
+        """Offset logo após o último frame de commit válido a partir de ``inicio``."""
+        salt_bytes = bytes.fromhex(salt)
+        tamanho_frame = CABECALHO_FRAME + tamanho_pagina
+        posicao = fim = max(inicio, CABECALHO_WAL)
+        while True:
+            f.seek(posicao)
+            cabecalho = f.read(CABECALHO_FRAME)
+            # frames de um WAL anterior (outro salt) ou incompletos encerram a leitura
+            if len(cabecalho) < CABECALHO_FRAME or cabecalho[8:16] != salt_bytes:
+                return fim
+            if os.fstat(f.fileno()).st_size < posicao + tamanho_frame:
+                return fim
+            posicao += tamanho_frame
+            if struct.unpack(">I", cabecalho[4:8])[0] != 0:  # frame de commit
+                fim = posicao
+
+    # ---- conexão própria ----
+    def _conexao(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.banco, timeout=30, isolation_level=None,
+                                         check_same_thread=False)
+            configurar_conexao(self._conn)
+        return self._conn
+
+    # ---- gerações ----
+    def _pasta_geracao(self):
+        return self.pasta / self.estado["geracao"]
+
+    def nova_geracao(self, motivo):
+        """Snapshot base (API de backup, sem bloquear) e início de uma nova geração."""
+        inicio = time.perf_counter()
+        geracao = _agora()
+        pasta = self.pasta / geracao
+        pasta.mkdir(parents=True, exist_ok=True)
+        temporario = str(pasta / "base.db.parcial")
+        conn = self._conexao()
+        for _tentativa in range(5):
+            salt_antes = self._salt_atual()
+            copia = sqlite3.connect(temporario)
+            try:
+                conn.backup(copia, pages=1024, progress=lambda *_: time.sleep(0.005))
+            finally:
+                copia.close()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # o WAL não pode ter recomeçado durante o snapshot: os frames do
+                # WAL atual (do início) aplicados sobre ele dão o estado mais novo
+                salt = self._salt_atual()
+                if salt_antes is not None and salt != salt_antes:
+                    continue
+                self.estado = {
+                    "geracao": geracao,
+                    "epoca": 0,
+                    "salt": None,
+                    "sequencia": None,
+                    "offset": 0,
+                    "checkpoint_ok": False,
+                    "snapshot_em": geracao,
+                    "ultimo_frame": None,
+                }
+                self._copiar_trecho()
+            finally:
+                conn.execute("ROLLBACK")
+            break
+        else:
+            raise RuntimeError("WAL recomeçou durante todos os snapshots")
+
+        # compacta fora da trava; só com o base.db.gz a geração passa a valer
+        with open(temporario, "rb") as f:
+            _gravar_gz(str(pasta / "base.db.gz"), f.read())
+        os.remove(temporario)
+        self._salvar_estado()
+        self._geracao_perdida = False
+        print(f"[REPLICA] nova geração {geracao} ({motivo}) em {time.perf_counter() - inicio:.2f}s")
+        self._remover_geracoes_antigas()
+
+    def recomecar(self, motivo):
+        """Nova geração agora (o banco inteiro foi trocado, ex.: restore pelo /admin/backup).
+
+        Os trechos da geração atual não se aplicam ao banco novo; o WAL é
+        zerado antes do snapshot para ele não levar as páginas da troca.
+        """
+        with self._lock:
+            ocupado, _, _ = self._conexao().execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+            if ocupado:
+                print("[REPLICA] WAL não zerado (leitores ativos); vai junto no snapshot")
+            self.nova_geracao(motivo)
+
+    def _remover_geracoes_antigas(self):
+        geracoes = sorted(p for p in self.pasta.iterdir() if p.is_dir() and (p / "base.db.gz").exists())
+        for pasta in geracoes[:-self.manter_geracoes]:
+            shutil.rmtree(pasta, ignore_errors=True)
+            print(f"[REPLICA] geração antiga removida: {pasta.name}")
+
+    # ---- cópia dos frames ----
+    def _copiar_trecho(self):
+        """Copia os frames confirmados novos (com a trava de escrita). Retorna os bytes copiados."""
+        try:
+            f = open(self.wal, "rb")
+        except FileNotFoundError:
+            return 0
+        with f:
+            salt, tamanho_pagina, sequencia = self._cabecalho_wal(f)
+            if salt is None:
+                return 0
+            estado = self.estado
+            if estado["salt"] is None:
+                estado["salt"] = salt
+                estado["sequencia"] = sequencia
+                estado["offset"] = 0
+            elif salt != estado["salt"]:
+                # recomeço legítimo: logo depois de um checkpoint nosso, e o SQLite
+                # soma 1 à sequência (um WAL apagado e recriado, ou um recomeço
+                # que não vimos, não passa aqui)
+                if not estado["checkpoint_ok"] or sequencia != estado["sequencia"] + 1:
+                    raise _Descontinuidade("WAL recomeçou sem checkpoint do replicador")
+                estado["epoca"] += 1
+                estado["salt"] = salt
+                estado["sequencia"] = sequencia
+                estado["offset"] = 0
+                estado["checkpoint_ok"] = False
+            elif estado["ultimo_frame"] is not None:
+                # o último frame copiado ainda tem que estar lá, igual
+                f.seek(estado["offset"] - CABECALHO_FRAME - tamanho_pagina)
+                if f.read(CABECALHO_FRAME).hex() != estado["ultimo_frame"]:
+                    raise _Descontinuidade("WAL diferente do que foi copiado")
+
+            inicio = estado["offset"]
+            fim = self._fim_confirmado(f, salt, inicio, tamanho_pagina)
+            if fim <= max(inicio, CABECALHO_WAL):
+                return 0
+            f.seek(inicio)
+            dados = f.read(fim - inicio)
+            f.seek(fim - CABECALHO_FRAME - tamanho_pagina)
+            ultimo_frame = f.read(CABECALHO_FRAME).hex()
+
+        nome = f"{estado['epoca']:06d}_{inicio:012d}_{_agora()}.wal.gz"
+        _gravar_gz(str(self._pasta_geracao() / nome), dados)
+        estado["offset"] = fim
+        estado["ultimo_frame"] = ultimo_frame
+        estado["checkpoint_ok"] = False
+        return len(dados)
+
+    def sincronizar(self):
+        """Uma rodada: copia os frames novos e faz checkpoint se o WAL cresceu."""
+        with self._lock:
+            try:
+                copiados = self._rodada()
+            except Exception:
+                self.falhas += 1
+                self._checkpoint_sem_copia()
+                raise
+            self.falhas = 0
+            return copiados
+
+    def _rodada(self):
+        conn = self._conexao()
+        if self._geracao_perdida:
+            self.nova_geracao("cópia voltou depois de checkpoint sem réplica")
+        elif self.estado is None:
+            self._retomar()
+        if time.time() - _ler_data(self.estado["snapshot_em"]).timestamp() >= self.snapshot_segundos:
+            self.nova_geracao("snapshot periódico")
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                copiados = self._copiar_trecho()
+            finally:
+                conn.execute("ROLLBACK")
+        except _Descontinuidade as e:
+            self.nova_geracao(str(e))
+            return 0
+
+        if self.estado["offset"] >= self.checkpoint_bytes:
+            self._checkpoint()
+        self._salvar_estado()
+        return copiados
+
+    def _checkpoint_sem_copia(self):
+        """Depois de falhas seguidas (ou WAL grande demais), checkpoint PASSIVE sem copiar os frames.
+
+        Segura o tamanho do WAL enquanto a réplica está fora; a geração atual
+        deixa de ser contínua e a próxima rodada boa começa outra.
+        """
+        try:
+            tamanho_wal = os.path.getsize(self.wal)
+        except OSError:
+            tamanho_wal = 0
+        if self.falhas < self.max_falhas and tamanho_wal < self.wal_max_bytes:
+            return
+        try:
+            _, frames_wal, feitos = self._conexao().execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        except sqlite3.Error as e:
+            print(f"[REPLICA] checkpoint sem cópia falhou: {e}")
+            return
+        self._geracao_perdida = True
+        if self.estado is not None:
+            self.estado["checkpoint_ok"] = False
+        print(f"[REPLICA] {self.falhas} falha(s) seguida(s), WAL com {tamanho_wal / 1024 / 1024:.1f} MB: "
+              f"checkpoint sem cópia ({feitos}/{frames_wal} frames); nova geração quando a cópia voltar")
+
+    def _checkpoint(self):
+        ocupado, frames_wal, _ = self._conexao().execute("PRAGMA wal_checkpoint(FULL)").fetchone()
+        if ocupado or frames_wal < 0:
+            return
+        tamanho_pagina = self._conexao().execute("PRAGMA page_size").fetchone()[0]
+        copiados = (self.estado["offset"] - CABECALHO_WAL) // (CABECALHO_FRAME + tamanho_pagina)
+        # o próximo escritor recomeça o WAL: só é seguro se tudo já foi copiado
+        self.estado["checkpoint_ok"] = frames_wal == copiados
+        if not self.estado["checkpoint_ok"]:
+            print(f"[REPLICA] checkpoint incluiu {frames_wal - copiados} frame(s) não copiados")
+
+    def _retomar(self):
+        """Continua a geração do estado salvo, se o WAL ainda é o mesmo; senão, nova geração."""
+        self.pasta.mkdir(parents=True, exist_ok=True)
+        estado = self._carregar_estado()
+        if estado and (self.pasta / estado["geracao"] / "base.db.gz").exists():
+            self.estado = estado
+            conn = self._conexao()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._copiar_trecho()
+                finally:
+                    conn.execute("ROLLBACK")
+                self._salvar_estado()
+                print(f"[REPLICA] retomando geração {estado['geracao']} (época {estado['epoca']})")
+                return
+            except _Descontinuidade as e:
+                motivo = str(e)
+        else:
+            motivo = "início"
+        self.nova_geracao(motivo)
+
+    # ---- thread ----
+    def _executar(self):
+        while True:
+            try:
+                self.sincronizar()
+            except Exception as e:
+                print(f"[REPLICA] erro na sincronização: {e}")
+            if self._parar.wait(self.intervalo):
+                return
+
+    def iniciar(self):
+        """Garante a thread rodando neste processo (o gunicorn faz fork depois do import)."""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._conn = None
+        self.estado = None
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name="replica-wal", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        """Para a thread, com uma última sincronização."""
+        self._parar.set()
+        if self._pid == os.getpid() and self.estado is not None:
+            self.sincronizar()
+
+
+class _Descontinuidade(Exception):
+    """O WAL no disco não continua o que foi copiado."""
+
+
+# ---------------------------------------------------------------- restauração
+def listar_geracoes(pasta):
+    """[(geracao, [trechos ordenados])] da réplica."""
+    geracoes = []
+    for item in sorted(Path(pasta).iterdir()):
+        if item.is_dir() and (item / "base.db.gz").exists():
+            trechos = sorted(item.glob("*.wal.gz"))
+            geracoes.append((item.name, trechos))
+    return geracoes
+
+
+def restaurar(pasta, saida, ate=None):
+    """Gera ``saida`` com o banco como estava em ``ate`` (datetime; None = mais recente)."""
+    ate = ate or datetime.max
+    candidatas = [(g, t) for g, t in listar_geracoes(pasta) if _ler_data(g) <= ate]
+    if not candidatas:
+        raise RuntimeError("Nenhuma geração com snapshot anterior ao horário pedido")
+    geracao, trechos = candidatas[-1]
+
+    for sufixo in ("", "-wal", "-shm"):
+        if os.path.exists(saida + sufixo):
+            os.remove(saida + sufixo)
+    with gzip.open(Path(pasta) / geracao / "base.db.gz", "rb") as origem, open(saida, "wb") as destino:
+        shutil.copyfileobj(origem, destino, 1024 * 1024)
+    conn = sqlite3.connect(saida)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+
+    epocas = {}
+    for trecho in trechos:
+        epoca, offset, quando = trecho.name[:-len(".wal.gz")].split("_")
+        epocas.setdefault(int(epoca), []).append((int(offset), _ler_data(quando), trecho))
+
+    aplicados = 0
+    ultimo = _ler_data(geracao)
+    for epoca in sorted(epocas):
+        todos = sorted(epocas[epoca])
+        usados = [t for t in todos if t[1] <= ate]
+        if not usados:
+            break
+        for sufixo in ("-wal", "-shm"):
+            if os.path.exists(saida + sufixo):
+                os.remove(saida + sufixo)
+        with open(saida + "-wal", "wb") as wal:
+            for offset, quando, trecho in usados:
+                if wal.tell() != offset:
+                    raise RuntimeError(f"Trecho faltando antes de {trecho.name}")
+                with gzip.open(trecho, "rb") as f:
+                    shutil.copyfileobj(f, wal)
+                ultimo = quando
+        conn = sqlite3.connect(saida)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+        aplicados += len(usados)
+        if len(usados) < len(todos):
+            break
+
+    conn = sqlite3.connect(saida)
+    try:
+        conn.execute("PRAGMA journal_mode=DELETE")
+        integridade = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+    if integridade != "ok":
+        raise RuntimeError(f"integrity_check falhou no banco restaurado: {integridade}")
+    return {"geracao": geracao, "trechos": aplicados, "ate": ultimo.isoformat(timespec="seconds")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pasta", default=os.environ.get("SQLITE_REPLICA_DIR", "replica"))
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("status", help="lista gerações e trechos")
+    p_restaurar = sub.add_parser("restaurar", help="restaura para um ponto no tempo")
+    p_restaurar.add_argument("--ate", help="YYYY-MM-DDTHH:MM:SS (padrão: o mais recente)")
+    p_restaurar.add_argument("--saida", default="metrifiy_restaurado.db")
+    args = parser.parse_args()
+
+    if args.comando == "status":
+        for geracao, trechos in listar_geracoes(args.pasta):
+            tamanho = sum(t.stat().st_size for t in trechos)
+            ultimo = _ler_data(trechos[-1].name[:-len(".wal.gz")].split("_")[2]) if trechos else _ler_data(geracao)
+            print(f"{geracao}: snapshot {_ler_data(geracao):%Y-%m-%d %H:%M:%S}, {len(trechos)} trechos "
+                  f"({tamanho / 1024:.1f} KB), até {ultimo:%Y-%m-%d %H:%M:%S}")
+        return
+
+    ate = datetime.fromisoformat(args.ate) if args.ate else None
+    info = restaurar(args.pasta, args.saida, ate)
+    print(f"✅ {args.saida} restaurado da geração {info['geracao']} "
+          f"({info['trechos']} trechos de WAL, dados até {info['ate']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Resumo diário de vendas (tabela ``vendas_resumo_diario``).
+
+Os relatórios (dashboard, vendas, lucro, estoque, conciliação) somavam a
+tabela ``vendas`` inteira a cada request. O resumo guarda as somas por
+(dia, produto, UF, cancelada) e é mantido junto com as escritas em ``vendas``,
+na mesma transação: antes de apagar/alterar vendas o agregado delas é
+subtraído, depois de inserir/alterar é somado de volta.
+
+As chaves seguem os critérios dos relatórios:
+
+- ``dia``: os 10 primeiros caracteres de ``data_venda`` ("" se não houver data);
+- ``estado``: UF da venda ("" se não houver);
+- ``cancelada``: 1 quando ``receita_total <= 0``.
+
+Se o resumo sair de sincronia (ex.: UPDATE manual no banco), reconstrua com::
+
+    python resumo_vendas.py
+"""
+import os
+import time
+
+from sqlalchemy import case, delete, func, insert, select, true
+
+
+COLUNAS_SOMA = (
+    "num_vendas", "qtd", "receita", "custo", "comissao", "margem",
+    "soma_preco_unitario", "valor_bruto",
+)
+
+
+class ResumoVendas:
+    """Mantém ``vendas_resumo_diario`` em dia com a tabela ``vendas``."""
+
+    def __init__(self, vendas, resumo):
+        self.vendas = vendas
+        self.resumo = resumo
+
+    def _agregado(self, filtros, sinal=1):
+        v = self.vendas.c
+        dia = func.coalesce(func.substr(v.data_venda, 1, 10), "")
+        produto_id = func.coalesce(v.produto_id, 0)
+        estado = func.coalesce(v.estado, "")
+        cancelada = case((v.receita_total <= 0, 1), else_=0)
+        somas = [
+            func.count(),
+            func.coalesce(func.sum(v.quantidade), 0),
+            func.coalesce(func.sum(v.receita_total), 0.0),
+            func.coalesce(func.sum(v.custo_total), 0.0),
+            func.coalesce(func.sum(func.coalesce(v.comissao_ml, 0.0)), 0.0),
+            func.coalesce(func.sum(v.margem_contribuicao), 0.0),
+            func.coalesce(func.sum(v.preco_venda_unitario), 0.0),
+            func.coalesce(func.sum(v.preco_venda_unitario * v.quantidade), 0.0),
+        ]
+        return (
+            select(
+                dia.label("dia"),
+                produto_id.label("produto_id"),
+                estado.label("estado"),
+                cancelada.label("cancelada"),
+                *[(s * sinal).label(nome) for s, nome in zip(somas, COLUNAS_SOMA)],
+            )
+            .where(*filtros)
+            .group_by(dia, produto_id, estado, cancelada)
+        )
+
+    def _aplicar(self, conn, filtros, sinal):
+        if conn.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as insert_upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as insert_upsert
+
+        colunas = ["dia", "produto_id", "estado", "cancelada", *COLUNAS_SOMA]
+        stmt = insert_upsert(self.resumo).from_select(colunas, self._agregado(filtros, sinal))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["dia", "produto_id", "estado", "cancelada"],
+            set_={nome: self.resumo.c[nome] + stmt.excluded[nome] for nome in COLUNAS_SOMA},
+        )
+        conn.execute(stmt)
+        if sinal < 0:
+            conn.execute(delete(self.resumo).where(self.resumo.c.num_vendas <= 0))
+
+    def somar(self, conn, *filtros):
+        """Soma ao resumo as vendas que atendem ``filtros`` (chamar depois de inserir/alterar)."""
+        self._aplicar(conn, filtros or [true()], 1)
+
+    def subtrair(self, conn, *filtros):
+        """Tira do resumo as vendas que atendem ``filtros`` (chamar antes de apagar/alterar)."""
+        self._aplicar(conn, filtros or [true()], -1)
+
+    def limpar(self, conn):
+        conn.execute(delete(self.resumo))
+
+    def reconstruir(self, conn):
+        """Recalcula o resumo inteiro a partir de ``vendas``. Retorna o número de linhas."""
+        inicio = time.perf_counter()
+        self.limpar(conn)
+        colunas = ["dia", "produto_id", "estado", "cancelada", *COLUNAS_SOMA]
+        conn.execute(insert(self.resumo).from_select(colunas, self._agregado([])))
+        linhas = conn.execute(select(func.count()).select_from(self.resumo)).scalar_one()
+        print(f"[RESUMO VENDAS] reconstruído: {linhas} linhas em {time.perf_counter() - inicio:.1f}s")
+        return linhas
+
+    def vazio(self, conn):
+        return conn.execute(select(self.resumo.c.dia).limit(1)).first() is None
+
+
+if __name__ == "__main__":
+    from sqlalchemy import MetaData, Table, create_engine
+
+    raw_db_url = os.environ.get("DATABASE_URL")
+    if raw_db_url and raw_db_url.startswith("postgres://"):
+        raw_db_url = raw_db_url.replace("postgres://", "postgresql+psycopg2://", 1)
+    engine = create_engine(raw_db_url or "sqlite:///metrifiy.db")
+
+    meta = MetaData()
+    resumo = ResumoVendas(
+        Table("vendas", meta, autoload_with=engine),
+        Table("vendas_resumo_diario", meta, autoload_with=engine),
+    )
+    with engine.begin() as conn:
+        resumo.reconstruir(conn)
@@ -0,0 +1,133 @@
+"""
+Séries temporais agregadas no banco para os gráficos (Chart.js).
+
+Os gráficos montavam as séries em Python, venda a venda. Aqui o GROUP BY por
+dia, semana ou mês é feito em SQL sobre uma coluna de data em texto ISO
+("YYYY-MM-DD" ou "YYYY-MM-DDTHH:MM:SS"):
+
+- SQLite: ``substr`` para dia/mês e ``date(..., 'weekday 0', '-6 days')`` para semana;
+- Postgres: ``date_trunc``.
+
+O tamanho do período sai do intervalo pedido (até 62 dias: dia; até 26
+semanas: semana; acima disso: mês) e as séries voltam densas, com zero nos
+períodos sem vendas, prontas para ``labels``/``data`` do Chart.js.
+"""
+from datetime import date, timedelta
+
+from sqlalchemy import Date, String, cast, func, literal, select
+
+
+DIAS_MAX_DIARIO = 62
+DIAS_MAX_SEMANAL = 26 * 7
+
+# textos usados nos títulos dos gráficos
+ROTULOS = {
+    "dia": {"adjetivo": "diário", "unidade": "dia"},
+    "semana": {"adjetivo": "semanal", "unidade": "semana"},
+    "mes": {"adjetivo": "mensal", "unidade": "mês"},
+}
+
+
+def escolher_granularidade(inicio, fim):
+    """'dia', 'semana' ou 'mes' conforme o tamanho do intervalo (datas inclusivas)."""
+    dias = (fim - inicio).days + 1
+    if dias <= DIAS_MAX_DIARIO:
+        return "dia"
+    if dias <= DIAS_MAX_SEMANAL:
+        return "semana"
+    return "mes"
+
+
+def inicio_periodo(d, granularidade):
+    """Primeiro dia do período que contém ``d`` (semanas começam na segunda-feira)."""
+    if granularidade == "semana":
+        return d - timedelta(days=d.weekday())
+    if granularidade == "mes":
+        return d.replace(day=1)
+    return d
+
+
+def periodos(inicio, fim, granularidade):
+    """Lista com o início de cada período entre ``inicio`` e ``fim``."""
+    atual = inicio_periodo(inicio, granularidade)
+    lista = []
+    while atual <= fim:
+        lista.append(atual)
+        if granularidade == "dia":
+            atual += timedelta(days=1)
+        elif granularidade == "semana":
+            atual += timedelta(days=7)
+        else:
+            atual = (atual.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return lista
+
+
+def rotulo_periodo(d, granularidade):
+    return d.strftime("%Y-%m") if granularidade == "mes" else d.isoformat()
+
+
+def expressao_periodo(coluna, granularidade, dialeto):
+    """Expressão SQL com o início do período da data ISO em ``coluna``, como texto "YYYY-MM-DD"."""
+    dia = func.substr(coluna, 1, 10)
+    if granularidade == "dia":
+        return dia
+    if dialeto == "postgresql":
+        campo = "week" if granularidade == "semana" else "month"
+        return func.to_char(func.date_trunc(campo, cast(dia, Date)), "YYYY-MM-DD")
+    if granularidade == "semana":
+        return func.date(dia, "weekday 0", "-6 days")
+    return func.substr(coluna, 1, 7, type_=String).concat(literal("-01"))
+
+
+def serie_temporal(conn, coluna, medidas, inicio, fim, filtros=(), select_from=None, granularidade=None):
+    """Agrega ``medidas`` por período entre ``inicio`` e ``fim`` (``date``, inclusivos).
+
+    ``coluna`` é a coluna de data em texto ISO; ``medidas`` é um dict
+    {nome: expressão de agregação}, ex.: ``{"receita": func.sum(resumo.c.receita)}``.
+    ``filtros`` são condições extras e ``select_from`` o FROM/JOIN, se
+    necessário. Sem ``granularidade``, ela é escolhida pelo intervalo.
+
+    Retorna {"granularidade", "labels", "inicios", <nome>: [valores]}, uma
+    posição por período, com 0 onde não houve dados.
+    """
+    if granularidade is None:
+        granularidade = escolher_granularidade(inicio, fim)
+
+    periodo = expressao_periodo(coluna, granularidade, conn.dialect.name).label("periodo")
+    query = select(periodo, *[expr.label(nome) for nome, expr in medidas.items()])
+    if select_from is not None:
+        query = query.select_from(select_from)
+    query = query.where(
+        coluna >= inicio.isoformat(),
+        coluna <= fim.isoformat() + "T23:59:59",
+        *filtros,
+    ).group_by(periodo)
+
+    por_periodo = {row["periodo"]: row for row in conn.execute(query).mappings()}
+
+    inicios = periodos(inicio, fim, granularidade)
+    serie = {
+        "granularidade": granularidade,
+        "labels": [rotulo_periodo(d, granularidade) for d in inicios],
+        "inicios": inicios,
+    }
+    for nome in medidas:
+        valores = []
+        for d in inicios:
+            row = por_periodo.get(d.isoformat())
+            valores.append(float(row[nome] or 0) if row is not None else 0)
+        serie[nome] = valores
+    return serie
+
+
+def intervalo_datas(data_inicio, data_fim, padrao_inicio, padrao_fim):
+    """Converte as datas do filtro (texto ISO) em ``date``, com os padrões se inválidas/ausentes."""
+    try:
+        inicio = date.fromisoformat(data_inicio) if data_inicio else padrao_inicio
+    except ValueError:
+        inicio = padrao_inicio
+    try:
+        fim = date.fromisoformat(data_fim) if data_fim else padrao_fim
+    except ValueError:
+        fim = padrao_fim
+    return inicio, max(inicio, fim)
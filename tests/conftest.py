@@ -0,0 +1,98 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+from sqlalchemy import delete, insert, update
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# os módulos do app ficam na raiz do repositório
+sys.path.insert(0, RAIZ)
+
+from ml_stub import ServidorStub  # noqa: E402
+
+# tabelas com o que os testes gravam (usuários, configuração e schema ficam)
+TABELAS_DADOS = ("ml_estoque_envios", "ml_anuncios", "vendas_resumo_diario", "finance_transactions",
+                 "vendas", "ajustes_estoque", "produtos", "import_jobs")
+
+
+@pytest.fixture(scope="session")
+def app_modulo(tmp_path_factory):
+    """O ``app.py`` importado uma vez, com um metrifiy.db novo numa pasta temporária.
+
+    O banco é relativo à pasta atual (``sqlite:///metrifiy.db``), então os
+    testes rodam dentro dela.
+    """
+    pasta = tmp_path_factory.mktemp("app")
+    anterior = os.getcwd()
+    os.chdir(pasta)
+    os.environ.pop("DATABASE_URL", None)
+    os.environ.pop("SQLITE_REPLICA_DIR", None)
+    os.environ["ML_NOTIFICACOES_JANELA"] = "0.05"
+    spec = importlib.util.spec_from_file_location("app", os.path.join(RAIZ, "app.py"))
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules["app"] = modulo
+    spec.loader.exec_module(modulo)
+    modulo.app.config["TESTING"] = True
+    yield modulo
+    os.chdir(anterior)
+
+
+@pytest.fixture
+def app_limpo(app_modulo):
+    """App com as tabelas de dados vazias e a conta do ML desconectada."""
+    app = app_modulo
+    with app.engine.begin() as conn:
+        for nome in TABELAS_DADOS:
+            conn.execute(delete(app.metadata.tables[nome]))
+        conn.execute(update(app.configuracoes).where(app.configuracoes.c.id == 1).values(
+            ml_access_token=None, ml_refresh_token=None, ml_token_expira=None,
+            ml_user_id=None, ml_ultimo_sync=None, ml_sync_auto="false",
+        ))
+    app.tokens_ml.esquecer()
+    app.versao_dados.incrementar()
+    return app
+
+
+@pytest.fixture
+def cliente_web(app_limpo):
+    """Cliente de teste do Flask já logado (usuário 1, criado pela migração)."""
+    cliente = app_limpo.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao["_user_id"] = "1"
+    return cliente
+
+
+@pytest.fixture
+def ml(app_limpo):
+    """Fábrica: sobe um ``ServidorStub`` e conecta a conta do app a ele; retorna o stub.
+
+    Os produtos do stub são cadastrados com estoque 100.
+    """
+    app = app_limpo
+    stubs = []
+
+    def conectar(pedidos=100, produtos=None, access_token="tok", por_segundo=1000, **opcoes):
+        stub = ServidorStub(pedidos, produtos, access_token=access_token, **opcoes)
+        url = stub.iniciar()
+        stubs.append(stub)
+        app.ML_API_URL = url
+        app.ML_SYNC_POR_SEGUNDO = por_segundo
+        app.tokens_ml.url_oauth = f"{url}/oauth/token"
+        app.tokens_ml.esquecer()
+        skus = sorted({a["seller_custom_field"] for a in stub.anuncios.values()})
+        with app.engine.begin() as conn:
+            conn.execute(update(app.configuracoes).where(app.configuracoes.c.id == 1).values(
+                ml_access_token=access_token, ml_refresh_token=opcoes.get("refresh_token"),
+                ml_user_id=stub.vendedor,
+            ))
+            conn.execute(insert(app.produtos), [
+                {"nome": f"Produto {sku}", "sku": sku, "custo_unitario": 10.0,
+                 "estoque_inicial": 100, "estoque_atual": 100}
+                for sku in skus
+            ])
+        return stub
+
+    yield conectar
+    for stub in stubs:
+        stub.parar()
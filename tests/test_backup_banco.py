@@ -0,0 +1,192 @@
+import sqlite3
+
+import pytest
+
+import replicacao_wal
+from backup_banco import fazer_backup, restaurar_banco
+from replicacao_wal import ReplicadorWAL, configurar_conexao
+
+
+def _conexao_app(caminho):
+    # como as conexões do app com a replicação ligada: WAL sem checkpoint automático
+    conn = sqlite3.connect(caminho, isolation_level=None)
+    configurar_conexao(conn)
+    return conn
+
+
+def _banco_enviado(caminho, page_size=1024):
+    conn = sqlite3.connect(caminho)
+    conn.execute(f"PRAGMA page_size={page_size}")
+    conn.execute("CREATE TABLE produtos (id INTEGER PRIMARY KEY, sku TEXT, estoque INTEGER)")
+    conn.executemany("INSERT INTO produtos (sku, estoque) VALUES (?, ?)", [(f"NOVO-{i}", i) for i in range(500)])
+    conn.commit()
+    conn.close()
+
+
+def _banco_vivo(caminho):
+    """Banco no ar com frames ainda só no -wal (sem checkpoint)."""
+    conn = _conexao_app(caminho)
+    conn.execute("CREATE TABLE antiga (id INTEGER PRIMARY KEY, valor TEXT)")
+    conn.execute("CREATE TABLE produtos (id INTEGER PRIMARY KEY, sku TEXT, estoque INTEGER, extra TEXT)")
+    for i in range(300):
+        conn.execute("INSERT INTO antiga (valor) VALUES (?)", (f"velho {i}" * 20,))
+        conn.execute("INSERT INTO produtos (sku, estoque) VALUES (?, ?)", (f"VELHO-{i}", -i))
+    return conn
+
+
+def _conteudo(caminho):
+    conn = sqlite3.connect(caminho)
+    try:
+        tabelas = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")]
+        skus = [r[0] for r in conn.execute("SELECT sku FROM produtos ORDER BY id")]
+        integridade = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+    return tabelas, skus, integridade
+
+
+def test_restore_sobre_wal_pendente(tmp_path):
+    vivo = str(tmp_path / "metrifiy.db")
+    enviado = str(tmp_path / "enviado.db")
+    app = _banco_vivo(vivo)
+    assert (tmp_path / "metrifiy.db-wal").stat().st_size > 0
+    _banco_enviado(enviado)
+
+    restaurar_banco(enviado, vivo)
+
+    esperado = (["produtos"], [f"NOVO-{i}" for i in range(500)], "ok")
+    # a conexão que já estava aberta vê o banco novo...
+    assert [r[0] for r in app.execute("SELECT name FROM sqlite_master WHERE type='table'")] == ["produtos"]
+    assert app.execute("SELECT count(*), min(sku) FROM produtos").fetchone() == (500, "NOVO-0")
+    # ...e o banco continua novo depois de fechar tudo (nada do WAL antigo volta)
+    app.close()
+    assert _conteudo(vivo) == esperado
+    app = _conexao_app(vivo)
+    app.execute("INSERT INTO produtos (sku, estoque) VALUES ('DEPOIS', 1)")
+    app.close()
+    assert _conteudo(vivo)[1][-1] == "DEPOIS"
+
+
+def test_restore_invalido_nao_mexe_no_banco(tmp_path):
+    vivo = str(tmp_path / "metrifiy.db")
+    app = _banco_vivo(vivo)
+    enviado = tmp_path / "enviado.db"
+    enviado.write_bytes(b"nao sou um banco" * 100)
+    with pytest.raises(sqlite3.DatabaseError):
+        restaurar_banco(str(enviado), vivo)
+    app.close()
+    assert _conteudo(vivo)[0] == ["antiga", "produtos"]
+
+
+def test_restore_comeca_nova_geracao_na_replica(tmp_path):
+    vivo = str(tmp_path / "metrifiy.db")
+    pasta = tmp_path / "replica"
+    app = _banco_vivo(vivo)
+    replicador = ReplicadorWAL(vivo, str(pasta), checkpoint_bytes=1 << 40)
+    replicador.sincronizar()
+    app.execute("INSERT INTO antiga (valor) VALUES ('antes do restore')")
+    replicador.sincronizar()
+    geracao_antiga = replicador.estado["geracao"]
+
+    enviado = str(tmp_path / "enviado.db")
+    _banco_enviado(enviado)
+    restaurar_banco(enviado, vivo)
+    replicador.recomecar("restore do banco")
+    assert replicador.estado["geracao"] != geracao_antiga
+
+    app.execute("INSERT INTO produtos (sku, estoque) VALUES ('DEPOIS', 1)")
+    replicador.sincronizar()
+    app.close()
+
+    saida = str(tmp_path / "pitr.db")
+    info = replicacao_wal.restaurar(str(pasta), saida)
+    assert info["geracao"] == replicador.estado["geracao"]
+    tabelas, skus, integridade = _conteudo(saida)
+    assert tabelas == ["produtos"] and integridade == "ok"
+    assert skus == [f"NOVO-{i}" for i in range(500)] + ["DEPOIS"]
+
+
+def test_backup_antes_do_restore(tmp_path):
+    vivo = str(tmp_path / "metrifiy.db")
+    app = _banco_vivo(vivo)
+    info = fazer_backup(vivo, str(tmp_path / "backups"), prefixo="metrifiy_backup_antes_restore_", manter=None)
+    enviado = str(tmp_path / "enviado.db")
+    _banco_enviado(enviado)
+    restaurar_banco(enviado, vivo)
+    app.close()
+    # o backup guarda o banco de antes, com o que estava só no WAL
+    tabelas, skus, _ = _conteudo(info["caminho"])
+    assert tabelas == ["antiga", "produtos"] and skus[-1] == "VELHO-299"
+
+
+@pytest.mark.parametrize("limites, falhas_ate_o_checkpoint", [
+    ({"max_falhas": 3}, 3),
+    ({"max_falhas": 100, "wal_max_bytes": 1}, 1),  # WAL acima do limite: já na primeira falha
+])
+def test_replica_fora_do_ar_nao_deixa_o_wal_crescer(tmp_path, monkeypatch, limites, falhas_ate_o_checkpoint):
+    vivo = str(tmp_path / "metrifiy.db")
+    pasta = tmp_path / "replica"
+    app = _banco_vivo(vivo)
+    replicador = ReplicadorWAL(vivo, str(pasta), checkpoint_bytes=1 << 40, **limites)
+    replicador.sincronizar()
+    geracao_antiga = replicador.estado["geracao"]
+
+    def disco_cheio(caminho, dados):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(replicacao_wal, "_gravar_gz", disco_cheio)
+    salt = replicador._salt_atual()
+    for i in range(1, falhas_ate_o_checkpoint + 1):
+        # sem checkpoint, o WAL só cresce (mesmo salt)
+        assert replicador._salt_atual() == salt
+        app.execute("INSERT INTO produtos (sku, estoque) VALUES (?, ?)", (f"FALHA-{i}", i))
+        with pytest.raises(OSError):
+            replicador.sincronizar()
+    assert replicador.falhas == falhas_ate_o_checkpoint
+    # o checkpoint PASSIVE forçado deixa o próximo escritor recomeçar o WAL
+    app.execute("INSERT INTO produtos (sku, estoque) VALUES ('FALHA-FIM', 0)")
+    assert replicador._salt_atual() != salt
+
+    # a cópia volta: nova geração, com o que foi gravado durante as falhas
+    monkeypatch.undo()
+    app.execute("INSERT INTO produtos (sku, estoque) VALUES ('DEPOIS', 1)")
+    replicador.sincronizar()
+    assert replicador.falhas == 0 and replicador.estado["geracao"] != geracao_antiga
+    app.close()
+
+    saida = str(tmp_path / "pitr.db")
+    info = replicacao_wal.restaurar(str(pasta), saida)
+    assert info["geracao"] == replicador.estado["geracao"]
+    _, skus, integridade = _conteudo(saida)
+    assert integridade == "ok"
+    assert skus[-falhas_ate_o_checkpoint - 2:] == (
+        [f"FALHA-{i}" for i in range(1, falhas_ate_o_checkpoint + 1)] + ["FALHA-FIM", "DEPOIS"])
+
+
+def test_restore_pelo_app_migra_o_banco_antigo(app_limpo, tmp_path):
+    app = app_limpo
+    with app.engine.begin() as conn:
+        produto_id = conn.execute(app.produtos.insert().values(nome="P", sku="P-1", estoque_atual=5)).inserted_primary_key[0]
+        # gravadas por fora do app: o resumo diário fica vazio, como num backup de antes dele
+        conn.execute(app.vendas.insert(), [
+            {"produto_id": produto_id, "data_venda": f"2025-03-0{d}", "quantidade": d, "preco_venda_unitario": 10.0,
+             "receita_total": 10.0 * d, "custo_total": 0.0, "margem_contribuicao": 10.0 * d}
+            for d in range(1, 4)
+        ])
+    enviado = fazer_backup("metrifiy.db", str(tmp_path), manter=None)["caminho"]
+    # backup de antes da migração 10 (sem a tabela ml_estoque_envios)
+    conn = sqlite3.connect(enviado)
+    conn.execute("DROP TABLE ml_estoque_envios")
+    conn.execute("DELETE FROM schema_version WHERE versao = 10")
+    conn.commit()
+    conn.close()
+
+    app.restaurar_banco_sqlite(enviado)
+
+    assert app.migracoes.versao_atual() == app.migracoes.ultima_versao
+    with app.engine.connect() as conn:
+        assert conn.execute(app.ml_estoque_envios.select()).all() == []
+        resumo = conn.execute(app.vendas_resumo_diario.select().order_by(app.vendas_resumo_diario.c.dia)).all()
+    assert [(r.dia, r.num_vendas, r.qtd, r.receita) for r in resumo] == [
+        ("2025-03-01", 1, 1, 10.0), ("2025-03-02", 1, 2, 20.0), ("2025-03-03", 1, 3, 30.0),
+    ]
@@ -0,0 +1,234 @@
+"""Envio do estoque para os anúncios (``estoque_ml.py`` / ``publicar_estoque_ml``) contra o ``ml_stub``."""
+import time
+
+import pytest
+from sqlalchemy import select, update
+
+from jobs_importacao import STATUS_CONCLUIDO, STATUS_ERRO
+
+
+@pytest.fixture
+def publicar(app_limpo, monkeypatch):
+    """``publicar_estoque_ml`` com um cliente sem espera entre as novas tentativas."""
+    app = app_limpo
+    monkeypatch.setattr(app.estoque_ml, "espera", 0.01)
+
+    def publicar():
+        cliente = app._cliente_ml()
+        for adaptador in cliente.sessao.adapters.values():
+            adaptador.max_retries.backoff_factor = 0
+        try:
+            return app.publicar_estoque_ml(app.engine, cliente)
+        finally:
+            cliente.fechar()
+
+    return publicar
+
+
+def _envios(app):
+    e, p = app.ml_estoque_envios.c, app.produtos.c
+    with app.engine.connect() as conn:
+        return {
+            r.sku: r for r in conn.execute(
+                select(p.sku, e.versao, e.pendente, e.tentativas, e.resultado, e.estoque_enviado)
+                .join(app.produtos, p.id == e.produto_id)
+            )
+        }
+
+
+def _item(stub, sku):
+    return next(i for i, a in stub.anuncios.items() if a["seller_custom_field"] == sku)
+
+
+def _marcar(app, estoques):
+    """Grava o estoque dos SKUs e marca como pendentes, como as rotas fazem."""
+    with app.engine.begin() as conn:
+        for sku, qtd in estoques.items():
+            conn.execute(update(app.produtos).where(app.produtos.c.sku == sku).values(estoque_atual=qtd))
+        app.estoque_ml.marcar(conn, app.produtos.c.sku.in_(list(estoques)))
+
+
+def _esperar_job(app, tipo):
+    j = app.import_jobs.c
+    fim = time.monotonic() + 10
+    while time.monotonic() < fim:
+        with app.engine.connect() as conn:
+            job = conn.execute(select(j.status, j.erro).where(j.tipo == tipo).order_by(j.id.desc())).first()
+        if job and job.status in (STATUS_CONCLUIDO, STATUS_ERRO):
+            return job
+        time.sleep(0.02)
+    raise AssertionError("job não terminou")
+
+
+def test_ajuste_de_estoque_marca_e_envia(ml, cliente_web):
+    stub = ml(pedidos=1)
+    import app
+    with app.engine.connect() as conn:
+        produto_id = conn.execute(select(app.produtos.c.id).where(app.produtos.c.sku == "SKU-3")).scalar()
+
+    resp = cliente_web.post("/estoque/ajuste", data={
+        "produto_id": produto_id, "tipo": "entrada", "quantidade": 5, "custo_unitario": "10",
+    })
+    assert resp.status_code == 302
+
+    # o ajuste marca só o produto ajustado e enfileira o envio (job em segundo plano)
+    assert _esperar_job(app, "estoque_ml").status == STATUS_CONCLUIDO
+    envios = _envios(app)
+    assert list(envios) == ["SKU-3"]
+    assert envios["SKU-3"].pendente == 0 and envios["SKU-3"].resultado == "ok"
+    assert envios["SKU-3"].estoque_enviado == 105
+    assert stub.anuncios[_item(stub, "SKU-3")]["available_quantity"] == 105
+    assert stub.stats["PUT /items/:id"] == 1
+
+
+def test_um_put_por_anuncio_alterado(ml, publicar):
+    stub = ml(pedidos=1)
+    import app
+    # SKU-1 com dois anúncios; SKU-2 já com o estoque do ML; SKU-99 sem anúncio
+    extra = dict(stub.anuncios[_item(stub, "SKU-1")], id="MLB1999999999", available_quantity=7)
+    stub.anuncios[extra["id"]] = extra
+    with app.engine.begin() as conn:
+        conn.execute(app.produtos.insert().values(nome="Sem anúncio", sku="SKU-99", estoque_atual=3))
+    igual = stub.anuncios[_item(stub, "SKU-2")]["available_quantity"]
+    _marcar(app, {"SKU-1": 40, "SKU-2": igual, "SKU-4": 41, "SKU-99": 3})
+
+    totais = publicar()
+
+    assert (totais["ok"], totais["inalterado"], totais["sem_anuncio"]) == (2, 1, 1)
+    assert totais["chamadas"] == 3 and stub.stats["PUT /items/:id"] == 3
+    assert stub.anuncios[_item(stub, "SKU-1")]["available_quantity"] == 40
+    assert stub.anuncios["MLB1999999999"]["available_quantity"] == 40
+    assert stub.anuncios[_item(stub, "SKU-4")]["available_quantity"] == 41
+    assert not any(e.pendente for e in _envios(app).values())
+
+
+def test_put_com_falha_fica_para_o_proximo_envio(ml, publicar):
+    stub = ml(pedidos=1)
+    import app
+    _marcar(app, {"SKU-1": 11, "SKU-2": 12})
+    # 3 passadas × (1 chamada + 3 novas tentativas da sessão)
+    stub.falhar(f"/items/{_item(stub, 'SKU-1')}", vezes=12, status=503)
+
+    totais = publicar()
+
+    assert totais["ok"] == 1 and totais["falha"] == 1
+    assert stub.stats["503"] == 12
+    envios = _envios(app)
+    assert envios["SKU-1"].pendente == 1 and envios["SKU-1"].tentativas == 3
+    assert envios["SKU-1"].resultado == "falha"
+    assert envios["SKU-2"].pendente == 0
+    assert stub.anuncios[_item(stub, "SKU-1")]["available_quantity"] != 11
+
+    # o próximo envio leva só o que ficou pendente
+    puts = stub.stats["PUT /items/:id"]
+    totais = publicar()
+    assert totais["produtos"] == 1 and totais["ok"] == 1
+    assert stub.stats["PUT /items/:id"] == puts + 1
+    assert stub.anuncios[_item(stub, "SKU-1")]["available_quantity"] == 11
+    assert _envios(app)["SKU-1"].pendente == 0 and _envios(app)["SKU-1"].tentativas == 0
+
+
+def test_recusa_do_ml_nao_fica_pendente(ml, publicar):
+    stub = ml(pedidos=1)
+    import app
+    _marcar(app, {"SKU-1": 11})
+    stub.falhar(f"/items/{_item(stub, 'SKU-1')}", vezes=1, status=400)
+
+    totais = publicar()
+
+    assert totais["erro"] == 1 and totais["erros"][0]["sku"] == "SKU-1"
+    assert stub.stats["PUT /items/:id"] == 1
+    assert _envios(app)["SKU-1"].pendente == 0 and _envios(app)["SKU-1"].resultado == "erro"
+
+
+def test_sem_alteracao_nada_e_reenviado(ml, publicar):
+    stub = ml(pedidos=1)
+    import app
+    _marcar(app, {"SKU-1": 11, "SKU-2": 12})
+    assert publicar()["ok"] == 2
+    puts = stub.stats["PUT /items/:id"]
+
+    # nada pendente: nem leitura nem gravação no ML
+    totais = publicar()
+    assert totais["produtos"] == 0 and totais["chamadas"] == 0
+    # marcado de novo com o mesmo estoque: o ML já tem a quantidade enviada
+    _marcar(app, {"SKU-1": 11})
+    totais = publicar()
+    assert totais["inalterado"] == 1 and totais["chamadas"] == 0
+    assert stub.stats["PUT /items/:id"] == puts
+    assert _envios(app)["SKU-1"].versao == 2
+
+
+def test_venda_no_ml_nao_deixa_o_estoque_para_tras(ml, publicar):
+    stub = ml(pedidos=1)
+    import app
+    item = _item(stub, "SKU-1")
+    _marcar(app, {"SKU-1": 10})
+    assert publicar()["ok"] == 1 and stub.anuncios[item]["available_quantity"] == 10
+
+    # o ML vende 2 e baixa o próprio estoque, sem avisar: ml_anuncios continua com 10
+    stub.anuncios[item]["available_quantity"] = 8
+    # reposição volta o produto para 10: igual ao ml_anuncios, mas o ML está com 8
+    _marcar(app, {"SKU-1": 10})
+    puts, leituras = stub.stats["PUT /items/:id"], stub.stats["GET /items"]
+    totais = publicar()
+
+    assert totais["ok"] == 1 and totais["chamadas"] == 1
+    assert stub.stats["PUT /items/:id"] == puts + 1 and stub.stats["GET /items"] == leituras + 1
+    assert stub.anuncios[item]["available_quantity"] == 10
+
+
+def test_leitura_do_ml_atualiza_ml_anuncios(ml, publicar):
+    stub = ml(pedidos=1)
+    import app
+    item = _item(stub, "SKU-1")
+    _marcar(app, {"SKU-1": 10})
+    publicar()
+    stub.anuncios[item]["available_quantity"] = 8
+    _marcar(app, {"SKU-1": 8})
+
+    # o ML já está com 8: nada a enviar, e o cache passa a mostrar 8
+    totais = publicar()
+    assert totais["inalterado"] == 1 and totais["chamadas"] == 0
+    with app.engine.connect() as conn:
+        assert conn.execute(
+            select(app.ml_anuncios.c.estoque_ml).where(app.ml_anuncios.c.item_id == item)
+        ).scalar() == 8
+
+
+def test_leitura_do_ml_falhou_envia_sem_comparar(ml, publicar):
+    stub = ml(pedidos=1)
+    import app
+    _marcar(app, {"SKU-1": 10})
+    publicar()
+    _marcar(app, {"SKU-1": 10})
+    # 1 chamada + 3 novas tentativas da sessão
+    stub.falhar("/items", vezes=4, status=503)
+    puts = stub.stats["PUT /items/:id"]
+
+    totais = publicar()
+    assert totais["ok"] == 1 and stub.stats["PUT /items/:id"] == puts + 1
+
+
+def test_estoque_alterado_durante_o_envio_continua_pendente(ml, publicar):
+    stub = ml(pedidos=1)
+    import app
+    _marcar(app, {"SKU-1": 11})
+
+    cliente = app._cliente_ml()
+    original = cliente.atualizar_estoques
+
+    def atualizar_e_alterar(envios):
+        respostas = original(envios)
+        _marcar(app, {"SKU-1": 12})  # outro ajuste enquanto o PUT estava no ar
+        return respostas
+
+    cliente.atualizar_estoques = atualizar_e_alterar
+    try:
+        app.publicar_estoque_ml(app.engine, cliente)
+    finally:
+        cliente.fechar()
+    assert _envios(app)["SKU-1"].pendente == 1
+
+    assert publicar()["ok"] == 1
+    assert stub.anuncios[_item(stub, "SKU-1")]["available_quantity"] == 12
@@ -0,0 +1,263 @@
+"""Etiquetas ZPL -> PDF (``etiquetas_zpl.py``): saídas de referência conferidas com um leitor de códigos.
+
+Os códigos abaixo (Code 128 nos quatro sentidos e QR) foram conferidos
+renderizando o PDF a 203 dpi e lendo com um leitor de códigos (zxing), e as
+demais operações de desenho olhando a etiqueta renderizada, quando fixados;
+uma mudança nelas precisa ser conferida do mesmo jeito antes de atualizar.
+"""
+import base64
+import re
+import zlib
+
+import pytest
+
+from etiquetas_zpl import InterpretadorZPL, code128, qr_code, zpl_para_pdf
+
+
+def _paginas(zpl):
+    interpretador = InterpretadorZPL()
+    return interpretador.interpretar(zpl), interpretador.ignorados
+
+
+def _ops(zpl):
+    paginas, _ = _paginas(zpl)
+    assert len(paginas) == 1
+    return paginas[0].ops
+
+
+def _paginas_pdf(pdf):
+    assert pdf.startswith(b"%PDF-1.4") and pdf.rstrip().endswith(b"%%EOF")
+    total = int(re.search(rb"/Type /Pages /Kids \[[^\]]*\] /Count (\d+)", pdf).group(1))
+    assert total == len(re.findall(rb"/Type /Page\b(?!s)", pdf))
+    return total
+
+
+# ---- ^BC (Code 128) ----
+
+def test_code128_subconjunto_b():
+    # Start B, A, B, C, dígito verificador (1), Stop
+    assert code128("ABC") == ([
+        2, 1, 1, 2, 1, 4,
+        1, 1, 1, 3, 2, 3,
+        1, 3, 1, 1, 2, 3,
+        1, 3, 1, 3, 2, 1,
+        2, 2, 2, 1, 2, 2,
+        2, 3, 3, 1, 1, 1, 2,
+    ], "ABC")
+
+
+def test_code128_automatico_usa_subconjunto_c():
+    # Start C, 12, 34, 56, dígito verificador, Stop: 3 símbolos para 6 dígitos
+    assert code128("123456", automatico=True) == ([
+        2, 1, 1, 2, 3, 2,
+        1, 1, 2, 2, 3, 2,
+        1, 3, 1, 1, 2, 3,
+        3, 3, 1, 1, 2, 1,
+        1, 3, 2, 1, 3, 1,
+        2, 3, 3, 1, 1, 1, 2,
+    ], "123456")
+
+
+def test_code128_campo():
+    ops = _ops(r"^XA^FO40,40^BY2^BCN,60,N^FDROT^FS^XZ")
+    larguras, _ = code128("ROT")
+    # barras em pontos inteiros: módulo 2 × larguras, 60 de altura, sem texto
+    x, barras = 0, []
+    for i, n in enumerate(larguras):
+        if i % 2 == 0:
+            barras.append(f"{x} 0 {n * 2} 60 re")
+        x += n * 2
+    assert ops == ["q", "1 0 0 1 40 40 cm", "0 g", " ".join(barras) + " f", "Q"]
+
+
+def test_code128_com_texto_legivel():
+    ops = _ops(r"^XA^FO10,10^BY2^BCN,50,Y,N^FDAB1^FS^XZ")
+    # abaixo das barras (50 + módulo), centralizado, corpo 10 × módulo
+    assert ops[-2] == "BT /F1 20 Tf 100 Tz 1 0 0 -1 49.1 67.6 Tm (AB1) Tj ET"
+
+
+# ---- ^BQ (QR) ----
+
+QR_MLB123 = [
+    "#######.#.#.#.#######",
+    "#.....#.#..#..#.....#",
+    "#.###.#.##....#.###.#",
+    "#.###.#.#.....#.###.#",
+    "#.###.#.#...#.#.###.#",
+    "#.....#....##.#.....#",
+    "#######.#.#.#.#######",
+    "........##.##........",
+    ".##.#.##....#.#.#####",
+    ".#.#.#..##.##.#..#..#",
+    ".##..####.......##..#",
+    "#.#.#.....##..#...#.#",
+    "#..#.##..#....#.#..#.",
+    "........####.#.#.#..#",
+    "#######.###.####..#.#",
+    "#.....#....#.#.###..#",
+    "#.###.#.#...####.##.#",
+    "#.###.#...#...##...#.",
+    "#.###.#.#.#.#...##..#",
+    "#.....#.#.....##...##",
+    "#######.....#.#.#.#.#",
+]
+
+
+def test_qr_code():
+    matriz = qr_code(b"MLB123", "Q")
+    assert ["".join("#" if m else "." for m in linha) for linha in matriz] == QR_MLB123
+
+
+def test_qr_campo():
+    ops = _ops(r"^XA^FO10,10^BQN,2,3^FDQA,MLB123^FS^XZ")
+    assert ops[:3] == ["q", "1 0 0 1 10 10 cm", "0 g"] and ops[-1] == "Q"
+    # cada trecho escuro de uma linha vira um retângulo de 3 pontos de altura
+    modulos = set()
+    for x, y, w, h in re.findall(r"(\d+) (\d+) (\d+) (\d+) re", ops[3]):
+        assert int(h) == 3 and int(x) % 3 == 0 and int(w) % 3 == 0
+        modulos |= {(int(y) // 3, int(x) // 3 + i) for i in range(int(w) // 3)}
+    esperado = {(y, x) for y, linha in enumerate(QR_MLB123) for x, m in enumerate(linha) if m == "#"}
+    assert modulos == esperado
+
+
+# ---- ^FO, ^FT e fontes ^A ----
+
+def test_texto_fonte_0():
+    assert _ops(r"^XA^FO20,30^A0N,40,30^FDTeste^FS^XZ") == [
+        "q", "1 0 0 1 20 30 cm", "0 g",
+        "BT /F2 40 Tf 75 Tz 1 0 0 -1 0 31.2 Tm (Teste) Tj ET",
+        "Q",
+    ]
+
+
+def test_texto_fonte_bitmap_na_linha_de_base():
+    # ^FT: y é a linha de base; fonte D (18×10) ampliada 2×
+    assert _ops(r"^XA^FT20,70^ADN,36,20^FDBitmap^FS^XZ") == [
+        "q", "1 0 0 1 20 41.92 cm", "0 g",
+        "BT /F1 36 Tf 100 Tz 1 0 0 -1 0 28.08 Tm (Bitmap) Tj ET",
+        "Q",
+    ]
+
+
+def test_texto_com_hexa_utf8():
+    ops = _ops(r"^XA^CI28^FO0,0^A0N,20,20^FH^FDS_C3_A3o Jo_C3_A3o^FS^XZ")
+    assert "(São João) Tj" in ops[3]
+
+
+def test_caixa():
+    assert _ops(r"^XA^FO10,10^GB100,50,3^FS^XZ") == [
+        "q", "1 0 0 1 10 10 cm", "0 g", "0 0 100 50 re 3 3 94 44 re f*", "Q",
+    ]
+
+
+# ---- ^GF ----
+
+@pytest.mark.parametrize("dados", [
+    "FFFF80018001FFFF",
+    "FFFF8001:FFFF",  # ':' repete a linha anterior
+    ":Z64:" + base64.b64encode(zlib.compress(bytes.fromhex("FFFF80018001FFFF"))).decode() + ":0000",
+])
+def test_imagem_gf(dados):
+    paginas, ignorados = _paginas(rf"^XA^FO60,80^GFA,8,8,2,{dados}^FS^XZ")
+    assert paginas[0].ops == ["q", "1 0 0 1 60 80 cm", "0 g", "16 0 0 -4 0 4 cm /Im1 Do", "Q"]
+    assert paginas[0].imagens == [("/Im1", 16, 4, bytes.fromhex("FFFF80018001FFFF"))]
+    assert not ignorados
+
+
+def test_imagem_gf_invalida_e_ignorada():
+    paginas, ignorados = _paginas(r"^XA^FO0,0^A0N,20,20^FDok^FS^FO60,80^GFA,8,8,2,:Z64:!!!!:0000^FS^XZ")
+    assert paginas[0].imagens == [] and ignorados == {"^GF inválido"}
+
+
+# ---- rotação ----
+
+@pytest.mark.parametrize("orientacao, matriz", [
+    ("N", "1 0 0 1 40 40 cm"),
+    ("R", "0 1 -1 0 100 40 cm"),
+    ("I", "-1 0 0 -1 176 100 cm"),
+    ("B", "0 -1 1 0 40 176 cm"),
+])
+def test_rotacao_code128(orientacao, matriz):
+    # o canto de cima à esquerda do código girado fica no ^FO (40,40) nas quatro
+    assert _ops(rf"^XA^FO40,40^BY2^BC{orientacao},60,N^FDROT^FS^XZ")[1] == matriz
+
+
+def test_rotacao_texto_e_fw():
+    assert _ops(r"^XA^FO100,50^A0R,40,40^FDGIRADO^FS^XZ")[1] == "0 1 -1 0 140 50 cm"
+    # ^FW vale para os campos sem orientação própria
+    assert _ops(r"^XA^FWR^FO100,50^A0,40,40^FDGIRADO^FS^XZ")[1] == "0 1 -1 0 140 50 cm"
+
+
+# ---- várias etiquetas, cópias e comandos ignorados ----
+
+def test_varias_etiquetas():
+    zpl = "\n".join([
+        r"^XA^FO10,10^A0N,20,20^FDum^FS^XZ",
+        r"^XA^FO10,10^A0N,20,20^FDdois^FS^PQ3^XZ",
+        r"^XA^FO10,10^GB50,50,50^FS^XZ",
+    ])
+    paginas, _ = _paginas(zpl)
+    assert [p.copias for p in paginas] == [1, 3, 1]
+    assert "(um)" in paginas[0].ops[3] and "(dois)" in paginas[1].ops[3]
+
+    pdf, ignorados = zpl_para_pdf(zpl, 40, 25)
+    assert _paginas_pdf(pdf) == 5 and ignorados == []
+    # copias substitui o ^PQ de cada etiqueta
+    pdf, _ = zpl_para_pdf(zpl, 40, 25, copias=2)
+    assert _paginas_pdf(pdf) == 6
+
+
+def test_cabecalho_de_configuracao_do_ml_nao_vira_pagina():
+    # as etiquetas do ML começam com um bloco só de configuração
+    zpl = "^XA^MCY^CI28^LH5,15^XZ\n^XA^FO10,10^A0N,20,20^FH^FDS_C3_A3o^FS^PQ1,0,1,Y^XZ"
+    paginas, ignorados = _paginas(zpl)
+    assert len(paginas) == 1 and not ignorados
+    # ^LH e ^CI do cabeçalho continuam valendo na etiqueta
+    assert paginas[0].ops[1] == "1 0 0 1 15 25 cm" and "(São) Tj" in paginas[0].ops[3]
+    pdf, _ = zpl_para_pdf(zpl, 40, 25)
+    assert _paginas_pdf(pdf) == 1
+
+
+def test_tamanho_da_pagina():
+    pdf, _ = zpl_para_pdf(r"^XA^FO0,0^GB10,10,10^FS^XZ", 100, 150)
+    assert b"/MediaBox [0 0 283.465 425.197]" in pdf
+
+
+def test_comandos_ignorados_voltam_sem_print(capsys):
+    pdf, ignorados = zpl_para_pdf(
+        r"^XA^FO10,10^B3N,N,50^FDX^FS^FO10,80^GC40,2^FS^FO10,150^A0N,20,20^FDok^FS^XZ", 40, 25)
+    assert ignorados == ["^B3", "^GC"]
+    assert _paginas_pdf(pdf) == 1 and b"(ok) Tj" in zlib.decompress(
+        re.search(rb"stream\n(.*?)\nendstream", pdf, re.S).group(1))
+    assert capsys.readouterr().out == ""
+
+
+def test_sem_etiqueta():
+    with pytest.raises(ValueError, match="Nenhuma etiqueta"):
+        zpl_para_pdf("^FO10,10^FS", 40, 25)
+
+
+# ---- rota ----
+
+def test_rota_avisa_os_comandos_ignorados(cliente_web):
+    resp = cliente_web.post("/etiquetas_zpl", data={
+        "zpl_code": r"^XA^FO10,10^B3N,N,50^FDX^FS^FO10,80^A0N,20,20^FDok^FS^XZ",
+        "largura_cm": "4", "altura_cm": "2.5", "quantidade": "2",
+    })
+    # o aviso sai na mesma resposta: a página volta com ele e o link do PDF
+    assert resp.status_code == 200 and resp.mimetype == "text/html"
+    html = resp.get_data(as_text=True)
+    assert "Comandos ZPL não suportados foram ignorados (o campo deles não saiu no PDF): ^B3" in html
+    assert "PDF gerado com sucesso: 2 etiquetas!" in html
+    pdf = re.search(r'href="data:application/pdf;base64,([^"]+)" download="etiquetas_2x_4x2.5cm_\d+_\d+\.pdf"', html)
+    assert _paginas_pdf(base64.b64decode(pdf.group(1))) == 2
+    with cliente_web.session_transaction() as sessao:
+        assert not sessao.get("_flashes")
+
+
+def test_rota_sem_avisos_baixa_o_pdf(cliente_web):
+    resp = cliente_web.post("/etiquetas_zpl", data={
+        "zpl_code": r"^XA^FO10,80^A0N,20,20^FDok^FS^XZ", "largura_cm": "4", "altura_cm": "2.5", "quantidade": "1",
+    })
+    assert resp.status_code == 200 and resp.mimetype == "application/pdf"
+    assert _paginas_pdf(resp.data) == 1
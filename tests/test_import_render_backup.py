@@ -0,0 +1,176 @@
+"""Restauração do pacote do Render (import_render_backup.py).
+
+O caminho COPY precisa de um Postgres: defina ``TEST_POSTGRES_URL`` (um banco
+descartável — as tabelas do teste são recriadas nele), senão esses casos são
+pulados. O caminho executemany roda sempre, num SQLite.
+"""
+import os
+import zipfile
+
+import pytest
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, create_engine, select, text
+
+import import_render_backup
+from pacote_render import gerar_pacote
+from resumo_vendas import COLUNAS_SOMA
+
+POSTGRES_URL = os.environ.get("TEST_POSTGRES_URL")
+
+
+def _tabelas():
+    meta = MetaData()
+    Table("usuarios", meta,
+          Column("id", Integer, primary_key=True), Column("username", String(100)), Column("password_hash", String(200)))
+    Table("produtos", meta,
+          Column("id", Integer, primary_key=True), Column("sku", String(100)), Column("nome", String(255)),
+          Column("estoque_atual", Integer), Column("custo_unitario", Float))
+    Table("vendas", meta,
+          Column("id", Integer, primary_key=True), Column("produto_id", Integer), Column("data_venda", String(50)),
+          Column("quantidade", Integer), Column("preco_venda_unitario", Float), Column("receita_total", Float),
+          Column("custo_total", Float), Column("comissao_ml", Float), Column("margem_contribuicao", Float),
+          Column("estado", String(2)), Column("ml_order_id", String(50)))
+    return meta
+
+
+def _resumo(meta):
+    """``vendas_resumo_diario`` como no app: só existe no destino, o pacote não a traz."""
+    return Table("vendas_resumo_diario", meta,
+                 Column("dia", String(10), primary_key=True), Column("produto_id", Integer, primary_key=True),
+                 Column("estado", String(2), primary_key=True), Column("cancelada", Integer, primary_key=True),
+                 *[Column(nome, Integer if nome in ("num_vendas", "qtd") else Float, nullable=False)
+                   for nome in COLUNAS_SOMA])
+
+
+def _origem(tmp_path, n_vendas=3000):
+    meta = _tabelas()
+    engine = create_engine(f"sqlite:///{tmp_path / 'origem.db'}", future=True)
+    meta.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(meta.tables["usuarios"].insert(), [{"id": 1, "username": "julio", "password_hash": "$2b$x,y\"z"}])
+        conn.execute(meta.tables["produtos"].insert(), [
+            {"id": 1, "sku": "00123", "nome": "Cabo, 2m \"USB\"", "estoque_atual": 5, "custo_unitario": 0.1 + 0.2},
+            {"id": 2, "sku": "A-1", "nome": "Ação ç", "estoque_atual": None, "custo_unitario": None},
+        ])
+        conn.execute(meta.tables["vendas"].insert(), [
+            {"id": i, "produto_id": 1 + i % 2, "data_venda": f"2025-01-{1 + i % 28:02d}", "quantidade": 1 + i % 3,
+             "preco_venda_unitario": 1.25, "receita_total": i * 1.25 if i % 7 else 0.0, "custo_total": 0.5,
+             "comissao_ml": None, "margem_contribuicao": 0.75, "estado": "SP" if i % 5 else None,
+             "ml_order_id": str(2000000000 + i) if i % 3 else None}
+            for i in range(1, n_vendas + 1)
+        ])
+    pacote = tmp_path / "pacote.zip"
+    gerar_pacote(engine, [(t.name, t) for t in meta.sorted_tables], pacote)
+    return engine, meta, pacote
+
+
+def _conteudo(engine, meta):
+    with engine.connect() as conn:
+        return {
+            nome: [tuple(l) for l in conn.execute(select(tabela).order_by(tabela.c.id))]
+            for nome, tabela in meta.tables.items()
+        }
+
+
+def _destino(tmp_path, backend):
+    meta = _tabelas()
+    _resumo(meta)
+    if backend == "sqlite":
+        engine = create_engine(f"sqlite:///{tmp_path / 'destino.db'}", future=True)
+    else:
+        engine = create_engine(POSTGRES_URL, future=True)
+        meta.drop_all(engine)
+    meta.create_all(engine)
+    return engine, meta
+
+
+backends = pytest.mark.parametrize("backend", [
+    "sqlite",
+    pytest.param("postgres", marks=pytest.mark.skipif(not POSTGRES_URL, reason="TEST_POSTGRES_URL não definido")),
+])
+
+
+@backends
+def test_restaura_igual_a_origem(tmp_path, backend):
+    origem, meta, pacote = _origem(tmp_path)
+    destino, meta_destino = _destino(tmp_path, backend)
+    resumo = meta_destino.tables["vendas_resumo_diario"]
+    with destino.begin() as conn:
+        # resumo de antes do restore: não pode sobrar
+        conn.execute(resumo.insert().values(dia="2024-12-31", produto_id=9, estado="", cancelada=0,
+                                            **{nome: 1 for nome in COLUNAS_SOMA}))
+    estatisticas = import_render_backup.importar_backup(destino, pacote, tamanho_lote=500)
+
+    metodo = "COPY" if backend == "postgres" else "executemany"
+    assert [(t, n, m) for t, n, _, m in estatisticas] == [
+        ("usuarios", 1, metodo), ("produtos", 2, metodo), ("vendas", 3000, metodo),
+    ]
+    assert _conteudo(destino, meta) == _conteudo(origem, meta)
+    assert _somas_resumo(destino, resumo) == _somas_vendas(origem, meta.tables["vendas"])
+    if backend == "postgres":
+        # sequência ajustada: o próximo id não colide com os restaurados
+        with destino.begin() as conn:
+            novo = conn.execute(meta.tables["vendas"].insert().values(receita_total=1).returning(text("id"))).scalar()
+        assert novo == 3001
+
+
+def _somas_vendas(engine, vendas):
+    somas = {}
+    with engine.connect() as conn:
+        for v in conn.execute(select(vendas)):
+            chave = (v.data_venda[:10], v.produto_id, v.estado or "", int(v.receita_total <= 0))
+            n, qtd, receita = somas.get(chave, (0, 0, 0.0))
+            somas[chave] = (n + 1, qtd + v.quantidade, receita + v.receita_total)
+    return {chave: (n, qtd, round(receita, 2)) for chave, (n, qtd, receita) in somas.items()}
+
+
+def _somas_resumo(engine, resumo):
+    with engine.connect() as conn:
+        return {
+            (r.dia, r.produto_id, r.estado, r.cancelada): (r.num_vendas, r.qtd, round(r.receita, 2))
+            for r in conn.execute(select(resumo))
+        }
+
+
+def _pacote_alterado(pacote, destino, alterar):
+    with zipfile.ZipFile(pacote) as zi, zipfile.ZipFile(destino, "w") as zo:
+        for nome in zi.namelist():
+            zo.writestr(nome, alterar(nome, zi.read(nome)))
+
+
+@backends
+def test_falha_no_meio_mantem_o_banco(tmp_path, backend):
+    origem, meta, pacote = _origem(tmp_path)
+    destino, _ = _destino(tmp_path, backend)
+    import_render_backup.importar_backup(destino, pacote)
+    antes = _conteudo(destino, meta)
+
+    def quebrar(nome, dados):
+        # id inválido perto do fim de vendas.csv: usuarios e produtos já entraram
+        if nome != "vendas.csv":
+            return dados
+        linhas = dados.split(b"\n")
+        linhas[2900] = b"xx" + linhas[2900][linhas[2900].index(b","):]
+        return b"\n".join(linhas)
+
+    ruim = tmp_path / "ruim.zip"
+    _pacote_alterado(pacote, ruim, quebrar)
+    with pytest.raises(Exception):
+        import_render_backup.importar_backup(destino, ruim)
+    # o DELETE e as cargas estão na mesma transação: nada mudou
+    assert _conteudo(destino, meta) == antes
+
+
+def test_manifest_divergente_desfaz(tmp_path):
+    origem, meta, pacote = _origem(tmp_path, n_vendas=10)
+    destino, _ = _destino(tmp_path, "sqlite")
+    import_render_backup.importar_backup(destino, pacote)
+    antes = _conteudo(destino, meta)
+
+    def sem_ultima_venda(nome, dados):
+        return dados.rsplit(b"\n", 2)[0] + b"\n" if nome == "vendas.csv" else dados
+
+    ruim = tmp_path / "ruim.zip"
+    _pacote_alterado(pacote, ruim, sem_ultima_venda)
+    with pytest.raises(RuntimeError, match="vendas"):
+        import_render_backup.importar_backup(destino, ruim)
+    assert _conteudo(destino, meta) == antes
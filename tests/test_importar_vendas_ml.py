@@ -0,0 +1,52 @@
+"""Importação da aba "Vendas BR" (``importar_vendas_ml``) no modo atualizar."""
+import os
+
+import openpyxl
+from sqlalchemy import func, insert, select
+
+from mercado_livre import COLUNAS_PLANILHA
+
+
+def _planilha(pasta, linhas):
+    """Grava uma planilha no formato do ML: cabeçalho na 6ª linha da aba "Vendas BR"."""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Vendas BR"
+    ws.append(["Vendas"])
+    for _ in range(4):
+        ws.append([])
+    ws.append(COLUNAS_PLANILHA)
+    for numero, sku, unidades in linhas:
+        ws.append([numero, "", "Entregue", "delivered", sku, f"Produto {sku}", unidades, 50.0,
+                   50.0 * unidades, -5.0, "São Paulo"])
+    caminho = os.path.join(pasta, "vendas.xlsx")
+    wb.save(caminho)
+    return caminho
+
+
+def test_numero_de_venda_repetido_vai_para_o_relatorio(app_limpo, tmp_path):
+    app = app_limpo
+    with app.engine.begin() as conn:
+        conn.execute(insert(app.produtos), [
+            {"nome": "Produto A", "sku": "A", "estoque_atual": 10, "custo_unitario": 10},
+            {"nome": "Produto B", "sku": "B", "estoque_atual": 10, "custo_unitario": 10},
+        ])
+    caminho = _planilha(tmp_path, [("1", "A", 1), ("2", "B", 1), ("1", "B", 3), ("3", "A", 2), ("1", "A", 1)])
+
+    resumo = app.importar_vendas_ml(caminho, app.engine, modo="atualizar", tamanho_bloco=2)
+
+    # a primeira linha de cada venda vale; as repetidas (no mesmo bloco ou não) não contam como inalteradas
+    assert resumo["vendas_importadas"] == 3 and resumo["vendas_inalteradas"] == 0
+    assert resumo["vendas_duplicadas"] == 2 and resumo["relatorio_gerado"]
+    with app.engine.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(app.vendas)).scalar() == 3
+    relatorio = openpyxl.load_workbook(os.path.join(app.app.config["UPLOAD_FOLDER"], resumo["relatorio_filename"]))
+    linhas = list(relatorio.active.iter_rows(min_row=2, values_only=True))
+    assert [(tipo, numero, sku) for tipo, numero, _, sku, _ in linhas] == [
+        ("N.º de venda repetido", "1", "B"), ("N.º de venda repetido", "1", "A"),
+    ]
+
+    # reimportada, cada venda é lida uma vez (inalterada) e as repetidas seguem à parte
+    resumo = app.importar_vendas_ml(caminho, app.engine, modo="atualizar", tamanho_bloco=2)
+    assert resumo["vendas_importadas"] == 0 and resumo["vendas_atualizadas"] == 0
+    assert resumo["vendas_inalteradas"] == 3 and resumo["vendas_duplicadas"] == 2
@@ -0,0 +1,71 @@
+import pytest
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, create_engine, inspect, text
+
+from migracoes import RegistroMigracoes
+
+
+def _registro(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'm.db'}", future=True)
+    tabela = Table(
+        "schema_version",
+        MetaData(),
+        Column("versao", Integer, primary_key=True),
+        Column("nome", String(100), nullable=False),
+        Column("aplicada_em", String(50)),
+        Column("duracao_segundos", Float),
+    )
+    return engine, RegistroMigracoes(engine, tabela)
+
+
+def test_aplica_em_ordem_e_uma_vez(tmp_path):
+    engine, migracoes = _registro(tmp_path)
+    chamadas = []
+
+    @migracoes.migracao(2, "segunda")
+    def _m2(conn):
+        chamadas.append(2)
+        conn.execute(text("ALTER TABLE t ADD COLUMN b INTEGER"))
+
+    @migracoes.migracao(1, "primeira")
+    def _m1(conn):
+        chamadas.append(1)
+        conn.execute(text("CREATE TABLE t (a INTEGER)"))
+
+    assert [v for v, _, _ in migracoes.aplicar()] == [1, 2]
+    assert migracoes.aplicar() == []
+    assert chamadas == [1, 2]
+    assert migracoes.versao_atual() == 2
+
+
+def test_versao_repetida(tmp_path):
+    _, migracoes = _registro(tmp_path)
+    migracoes.migracao(1, "a")(lambda conn: None)
+    with pytest.raises(ValueError):
+        migracoes.migracao(1, "b")(lambda conn: None)
+
+
+def test_falha_interrompe_o_boot(tmp_path):
+    engine, migracoes = _registro(tmp_path)
+
+    @migracoes.migracao(1, "tabela")
+    def _m1(conn):
+        conn.execute(text("CREATE TABLE t (a INTEGER)"))
+
+    @migracoes.migracao(2, "quebrada")
+    def _m2(conn):
+        conn.execute(text("CREATE TABLE IF NOT EXISTS u (a INTEGER)"))
+        conn.execute(text("ALTER TABLE inexistente ADD COLUMN b INTEGER"))
+
+    @migracoes.migracao(3, "depois")
+    def _m3(conn):
+        conn.execute(text("CREATE TABLE v (a INTEGER)"))
+
+    with pytest.raises(RuntimeError, match="Migração 2"):
+        migracoes.aplicar()
+    # a 2 não fica registrada e a 3 nem roda
+    assert migracoes.versao_atual() == 1
+    assert "v" not in inspect(engine).get_table_names()
+
+    # corrigida, o próximo boot continua de onde parou
+    migracoes.migracoes[2] = ("quebrada", lambda conn: conn.execute(text("CREATE TABLE IF NOT EXISTS u (a INTEGER)")))
+    assert [v for v, _, _ in migracoes.aplicar()] == [2, 3]
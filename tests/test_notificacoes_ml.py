@@ -0,0 +1,231 @@
+"""Fila de notificações (``notificacoes_ml.py``) e o webhook ``/ml/notificacoes`` contra o ``ml_stub``."""
+import threading
+import time
+
+import pytest
+from sqlalchemy import select
+
+from notificacoes_ml import FilaNotificacoes, recurso_da_notificacao
+
+
+def _esperar(condicao, limite=5.0):
+    fim = time.monotonic() + limite
+    while not condicao():
+        if time.monotonic() > fim:
+            raise AssertionError("tempo esgotado")
+        time.sleep(0.01)
+
+
+class Registro:
+    """``processar`` falso: guarda os lotes e falha as primeiras ``falhas`` chamadas."""
+
+    def __init__(self, falhas=0):
+        self.lotes = []
+        self.falhas = falhas
+
+    def __call__(self, topico, itens):
+        self.lotes.append((topico, dict(itens)))
+        if len(self.lotes) <= self.falhas:
+            raise RuntimeError("API fora do ar")
+
+
+def test_recurso_da_notificacao():
+    assert recurso_da_notificacao({"topic": "orders", "resource": "/orders/77/", "user_id": 9}) == ("orders_v2", "77", "9")
+    assert recurso_da_notificacao({"topic": "items", "resource": "/items/MLB1"}) == ("items", "MLB1", "")
+    assert recurso_da_notificacao({"topic": "questions", "resource": "/questions/1"}) is None
+    assert recurso_da_notificacao({"topic": "orders_v2"}) is None
+
+
+def test_avisos_repetidos_viram_um_item():
+    registro = Registro()
+    fila = FilaNotificacoes(registro, janela=0.2)
+    novos = [fila.adicionar("orders_v2", "1", "9") for _ in range(50)]
+    fila.adicionar("orders_v2", "2", "9")
+    fila.adicionar("items", "MLB1", "9")
+
+    _esperar(lambda: fila.stats["lotes"] == 2)
+    assert novos == [True] + [False] * 49
+    # um lote por tópico, na ordem de chegada
+    assert registro.lotes == [("orders_v2", {"1": "9", "2": "9"}), ("items", {"MLB1": "9"})]
+    assert fila.stats["recebidas"] == 52 and fila.stats["processadas_orders_v2"] == 2
+    assert fila.pendentes() == 0
+
+
+def test_lote_limitado():
+    registro = Registro()
+    fila = FilaNotificacoes(registro, janela=0.1, lote=3)
+    for i in range(7):
+        fila.adicionar("orders_v2", str(i), "9")
+    _esperar(lambda: fila.stats["lotes"] == 3)
+    assert [list(itens) for _, itens in registro.lotes] == [["0", "1", "2"], ["3", "4", "5"], ["6"]]
+
+
+def test_lote_que_falha_volta_para_a_fila():
+    registro = Registro(falhas=1)
+    fila = FilaNotificacoes(registro, janela=0.05, max_tentativas=3)
+    fila.adicionar("orders_v2", "1", "9")
+    _esperar(lambda: fila.stats["lotes"] == 1)
+    assert len(registro.lotes) == 2 and fila.stats["erros"] == 1
+    assert fila.stats["descartadas"] == 0 and not fila._tentativas
+
+
+def test_descarta_depois_de_max_tentativas():
+    registro = Registro(falhas=100)
+    fila = FilaNotificacoes(registro, janela=0.05, max_tentativas=3)
+    fila.adicionar("orders_v2", "1", "9")
+    _esperar(lambda: fila.stats["descartadas"] == 1)
+    time.sleep(0.2)
+    assert len(registro.lotes) == 3 and fila.stats["erros"] == 3
+    assert fila.pendentes() == 0 and not fila._tentativas
+
+
+def test_fila_limitada():
+    liberar = threading.Event()
+    fila = FilaNotificacoes(lambda topico, itens: liberar.wait(), janela=0.05, lote=2, max_pendentes=3)
+    try:
+        fila.adicionar("orders_v2", "0", "9")
+        fila.adicionar("orders_v2", "1", "9")
+        # o primeiro lote (0 e 1) está preso no processamento; cabem mais 3
+        _esperar(lambda: fila.pendentes() == 0)
+        resultados = [fila.adicionar("orders_v2", str(i), "9") for i in range(2, 7)]
+        assert resultados == [True, True, True, False, False]
+        assert fila.pendentes() == 3 and fila.stats["descartadas_fila_cheia"] == 2
+        # aviso repetido de um recurso que já está na fila não é descartado
+        assert fila.adicionar("orders_v2", "2", "9") is False
+        assert fila.stats["descartadas_fila_cheia"] == 2
+    finally:
+        liberar.set()
+    _esperar(lambda: fila.pendentes() == 0 and fila.stats["lotes"] == 3)
+
+
+def test_devolvidos_respeitam_o_limite():
+    liberar = threading.Event()
+    lotes = []
+
+    def processar(topico, itens):
+        lotes.append(list(itens))
+        if len(lotes) == 1:
+            liberar.wait()
+            raise RuntimeError("API fora do ar")
+
+    fila = FilaNotificacoes(processar, janela=0.05, lote=2, max_pendentes=2)
+    fila.adicionar("orders_v2", "1", "9")
+    fila.adicionar("orders_v2", "2", "9")
+    # enquanto o lote (1, 2) está na API, a fila enche com outros dois; depois ele falha
+    _esperar(lambda: fila.pendentes() == 0)
+    fila.adicionar("orders_v2", "3", "9")
+    fila.adicionar("orders_v2", "4", "9")
+    liberar.set()
+    _esperar(lambda: fila.stats["lotes"] == 1)
+    assert lotes == [["1", "2"], ["3", "4"]]
+    assert fila.stats["descartadas_fila_cheia"] == 2 and not fila._tentativas
+
+
+# webhook do app
+
+def _avisar(cliente, stub, pedido_id, user_id=None, vezes=1):
+    for _ in range(vezes):
+        resp = cliente.post("/ml/notificacoes", json={
+            "resource": f"/orders/{pedido_id}",
+            "user_id": int(user_id or stub.vendedor),
+            "topic": "orders_v2",
+        })
+        assert resp.status_code == 200
+
+
+def _venda(app, pedido_id):
+    with app.engine.connect() as conn:
+        return conn.execute(
+            select(app.vendas.c.ml_status).where(app.vendas.c.ml_order_id == str(pedido_id))
+        ).first()
+
+
+def _status_ml(stub, pedido_id):
+    """O que vai para ml_status: o status do envio, com o pedido pago."""
+    pedido = stub.pedidos[pedido_id]
+    return stub.envios[pedido["shipping"]["id"]]["status"] if pedido["status"] == "paid" else pedido["status"]
+
+
+@pytest.fixture
+def fila(app_limpo):
+    fila = app_limpo.fila_notificacoes_ml
+    _esperar(lambda: fila.pendentes() == 0)
+    fila.stats.clear()
+    return fila
+
+
+def test_webhook_grava_o_pedido(ml, cliente_web, fila):
+    stub = ml(pedidos=10)
+    import app
+    pedido = next(iter(stub.pedidos))
+
+    _avisar(cliente_web, stub, pedido, vezes=20)
+    _esperar(lambda: fila.stats["lotes"] == 1)
+
+    assert _venda(app, pedido).ml_status == _status_ml(stub, pedido)
+    # 20 avisos, uma busca na API
+    assert stub.stats["GET /orders/:id"] == 1 and fila.stats["recebidas"] == 20
+
+    stub.alterar(pedido, status="cancelled")
+    _avisar(cliente_web, stub, pedido)
+    _esperar(lambda: fila.stats["lotes"] == 2)
+    assert _venda(app, pedido).ml_status == "cancelled"
+
+
+def test_webhook_ignora_outro_vendedor(ml, cliente_web, fila):
+    stub = ml(pedidos=10)
+    import app
+    pedido = next(iter(stub.pedidos))
+
+    _avisar(cliente_web, stub, pedido, user_id="999", vezes=5)
+    resp = cliente_web.post("/ml/notificacoes", json={"resource": f"/orders/{pedido}", "topic": "orders_v2"})
+    assert resp.status_code == 200
+
+    assert fila.pendentes() == 0 and fila.stats["recebidas"] == 0
+    assert fila.stats["outra_conta"] == 6
+    time.sleep(0.2)
+    assert _venda(app, pedido) is None and stub.stats["GET /orders/:id"] == 0
+
+
+def test_webhook_sem_conta_conectada(ml, cliente_web, fila):
+    stub = ml(pedidos=10)
+    import app
+    with app.engine.begin() as conn:
+        conn.execute(app.configuracoes.update().values(ml_access_token=None))
+
+    _avisar(cliente_web, stub, next(iter(stub.pedidos)))
+    assert fila.pendentes() == 0 and fila.stats["outra_conta"] == 1
+
+
+def test_webhook_acompanha_troca_de_conta(ml, cliente_web, fila):
+    stub = ml(pedidos=10)
+    import app
+    pedido = next(iter(stub.pedidos))
+    _avisar(cliente_web, stub, pedido, user_id="999")
+    assert fila.stats["outra_conta"] == 1
+
+    # a conta conectada passa a ser a 999: o cache do vendedor é relido
+    with app.engine.begin() as conn:
+        conn.execute(app.configuracoes.update().values(ml_user_id="999"))
+    _avisar(cliente_web, stub, pedido, user_id="999")
+    assert fila.stats["outra_conta"] == 1 and fila.stats["recebidas"] == 1
+    _esperar(lambda: fila.stats["lotes"] == 1)
+
+
+def test_webhook_grava_a_entrega(ml, cliente_web, fila, capsys):
+    stub = ml(pedidos=10)
+    import app
+    pedido = next(p for p, d in stub.pedidos.items()
+                  if d["status"] == "paid" and stub.envios[d["shipping"]["id"]]["status"] == "ready_to_ship")
+    _avisar(cliente_web, stub, pedido)
+    _esperar(lambda: fila.stats["lotes"] == 1)
+    assert _venda(app, pedido).ml_status == "ready_to_ship"
+
+    # o envio foi entregue: o aviso do pedido atualiza a venda (não conta como inalterada)
+    stub.envios[stub.pedidos[pedido]["shipping"]["id"]]["status"] = "delivered"
+    stub.alterar(pedido)
+    capsys.readouterr()
+    _avisar(cliente_web, stub, pedido)
+    _esperar(lambda: fila.stats["lotes"] == 2)
+    assert _venda(app, pedido).ml_status == "delivered"
+    assert "1 pedidos: 0 novos, 1 atualizados, 0 sem alteração" in capsys.readouterr().out
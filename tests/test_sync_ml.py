@@ -0,0 +1,229 @@
+"""Sincronização incremental dos pedidos (``sincronizar_vendas_ml``) contra o ``ml_stub``."""
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+from sqlalchemy import func, select, update
+
+from mercado_livre import ClienteML, LimiteTaxa
+
+
+def _vendas(app):
+    with app.engine.connect() as conn:
+        return {
+            r.ml_order_id: r for r in conn.execute(
+                select(app.vendas.c.ml_order_id, app.vendas.c.ml_status, app.vendas.c.quantidade,
+                       app.vendas.c.receita_total, app.produtos.c.sku)
+                .join(app.produtos, app.produtos.c.id == app.vendas.c.produto_id)
+            )
+        }
+
+
+def _estoques(app):
+    with app.engine.connect() as conn:
+        return dict(conn.execute(select(app.produtos.c.sku, app.produtos.c.estoque_atual)).all())
+
+
+def _baixas_esperadas(stub):
+    baixas = {}
+    for pedido in stub.pedidos.values():
+        if pedido["status"] != "cancelled":
+            item = pedido["order_items"][0]
+            baixas[item["item"]["seller_sku"]] = baixas.get(item["item"]["seller_sku"], 0) + item["quantity"]
+    return baixas
+
+
+def _ultimo_sync(app):
+    with app.engine.connect() as conn:
+        return conn.execute(select(app.configuracoes.c.ml_ultimo_sync)).scalar()
+
+
+def test_primeira_sincronizacao_completa(ml):
+    stub = ml(pedidos=120)
+    import app
+
+    resumo = app.sincronizar_vendas_ml(app.engine)
+
+    assert resumo["pedidos_lidos"] == 120
+    assert resumo["vendas_importadas"] == 120 and resumo["vendas_sem_produto"] == 0
+    vendas = _vendas(app)
+    assert set(vendas) == {str(i) for i in stub.pedidos}
+    cancelado = next(p for p in stub.pedidos.values() if p["status"] == "cancelled")
+    assert vendas[str(cancelado["id"])].receita_total == 0
+    # estoque baixado só pelas vendas não canceladas
+    baixas = _baixas_esperadas(stub)
+    assert _estoques(app) == {sku: 100 - baixas.get(sku, 0) for sku in _estoques(app)}
+    # 50 por página (o stub limita a 51): 3 páginas, e um pedido + um envio por venda
+    assert stub.stats["GET /orders/search"] == 3
+    assert stub.stats["GET /orders/:id"] == 120 and stub.stats["GET /shipments/:id"] == 120
+    assert datetime.fromisoformat(resumo["ate"]) == datetime.fromisoformat(_ultimo_sync(app))
+
+
+def test_incremental_retoma_do_cursor_e_ajusta_estoque(ml):
+    stub = ml(pedidos=60)
+    import app
+    app.sincronizar_vendas_ml(app.engine)
+    estoque_antes = _estoques(app)
+    marca = datetime.fromisoformat(_ultimo_sync(app))
+
+    # um pedido cancelado depois da última sincronização
+    pedido = next(p for p in stub.pedidos.values() if p["status"] == "paid")
+    item = pedido["order_items"][0]
+    stub.alterar(pedido["id"], status="cancelled", total_amount=0)
+    item["unit_price"] = 0
+    stub.stats.clear()
+
+    resumo = app.sincronizar_vendas_ml(app.engine)
+
+    # só o intervalo desde a marca (menos a margem) é relido: um pedido, uma página
+    assert datetime.fromisoformat(resumo["desde"]) == (marca - app.ML_SYNC_MARGEM).replace(microsecond=0)
+    assert resumo["pedidos_lidos"] == 1
+    assert resumo["vendas_atualizadas"] == 1 and resumo["vendas_importadas"] == 0
+    assert stub.stats["GET /orders/search"] == 1 and stub.stats["GET /orders/:id"] == 1
+    assert _vendas(app)[str(pedido["id"])].ml_status == "cancelled"
+    # o estoque volta só pela diferença (a venda cancelada devolve o que tinha baixado)
+    sku = item["item"]["seller_sku"]
+    esperado = dict(estoque_antes)
+    esperado[sku] += item["quantity"]
+    assert _estoques(app) == esperado
+    assert datetime.fromisoformat(_ultimo_sync(app)) > marca
+
+    # sem alterações no ML: a margem relê o mesmo pedido, que fica como está
+    resumo = app.sincronizar_vendas_ml(app.engine)
+    assert resumo["pedidos_lidos"] == 1 and resumo["vendas_inalteradas"] == 1
+    assert _estoques(app) == esperado
+
+
+def test_status_do_envio_atualiza_a_venda(ml):
+    stub = ml(pedidos=30)
+    import app
+    app.sincronizar_vendas_ml(app.engine)
+    pedido = next(p for p in stub.pedidos.values()
+                  if p["status"] == "paid" and stub.envios[p["shipping"]["id"]]["status"] == "shipped")
+    assert _vendas(app)[str(pedido["id"])].ml_status == "shipped"
+    estoque_antes = _estoques(app)
+
+    # entregue: muda só o status, sem mexer em valores nem no estoque
+    stub.envios[pedido["shipping"]["id"]]["status"] = "delivered"
+    stub.alterar(pedido["id"])
+    resumo = app.sincronizar_vendas_ml(app.engine)
+
+    assert resumo["vendas_atualizadas"] == 1 and resumo["vendas_inalteradas"] == resumo["pedidos_lidos"] - 1
+    assert _vendas(app)[str(pedido["id"])].ml_status == "delivered"
+    assert _estoques(app) == estoque_antes
+
+
+def test_sincronizacao_interrompida_nao_avanca_o_cursor(ml):
+    stub = ml(pedidos=120)
+    import app
+
+    class ClienteQueCai(ClienteML):
+        blocos = 0
+
+        def detalhar_pedidos(self, ids):
+            ClienteQueCai.blocos += 1
+            if ClienteQueCai.blocos == 2:
+                raise requests.ConnectionError("rede caiu")
+            return super().detalhar_pedidos(ids)
+
+    cliente = ClienteQueCai(app.tokens_ml.obter, app.ML_API_URL, 1000)
+    with pytest.raises(requests.ConnectionError):
+        app.sincronizar_vendas_ml(app.engine, cliente, pedidos_por_bloco=50)
+    cliente.fechar()
+    assert _ultimo_sync(app) is None
+    assert len(_vendas(app)) == 50  # o primeiro bloco ficou gravado
+
+    # a próxima relê o mesmo intervalo sem duplicar nem baixar o estoque duas vezes
+    resumo = app.sincronizar_vendas_ml(app.engine)
+    assert resumo["pedidos_lidos"] == 120
+    assert resumo["vendas_importadas"] == 70 and resumo["vendas_inalteradas"] == 50
+    with app.engine.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(app.vendas)).scalar() == 120
+    baixas = _baixas_esperadas(stub)
+    assert _estoques(app) == {sku: 100 - baixas.get(sku, 0) for sku in _estoques(app)}
+
+
+def test_paginacao_da_busca(ml):
+    stub = ml(pedidos=230)
+    import app
+    cliente = ClienteML(app.tokens_ml.obter, app.ML_API_URL, 1000)
+    agora = datetime.now(timezone.utc)
+    try:
+        ids = list(cliente.ids_pedidos_alterados(stub.vendedor, agora - timedelta(days=31), agora))
+        # só a primeira metade do período
+        metade = list(cliente.ids_pedidos_alterados(stub.vendedor, agora - timedelta(days=31), agora - timedelta(days=15)))
+    finally:
+        cliente.fechar()
+    por_data = sorted(stub.pedidos.values(), key=lambda p: p["date_last_updated"])
+    assert ids == [p["id"] for p in por_data]
+    assert stub.stats["GET /orders/search"] == 5 + 3
+    assert 100 < len(metade) < 130 and metade == ids[:len(metade)]
+
+
+def test_429_e_5xx_sao_repetidos(ml):
+    stub = ml(pedidos=30)
+    import app
+    stub.falhar("/orders/search", vezes=2, status=429)
+    stub.falhar("/shipments/", vezes=3, status=503)
+    stub.falhar("/orders/2000000005", vezes=1, status=500)
+
+    resumo = app.sincronizar_vendas_ml(app.engine)
+
+    assert resumo["pedidos_lidos"] == 30 and resumo["vendas_importadas"] == 30
+    assert stub.stats["429"] == 2 and stub.stats["503"] == 3 and stub.stats["500"] == 1
+    assert stub.stats["GET /orders/search"] == 1 + 2
+
+
+def test_falha_persistente_interrompe_sem_avancar(ml):
+    stub = ml(pedidos=10)
+    import app
+    stub.falhar("/orders/search", vezes=10, status=503)
+    with pytest.raises(requests.RequestException):
+        app.sincronizar_vendas_ml(app.engine)
+    assert _ultimo_sync(app) is None
+    # 1 chamada + 3 novas tentativas da sessão
+    assert stub.stats["GET /orders/search"] == 4
+
+
+def test_limite_de_taxa_evita_429(ml):
+    # o stub recusa acima de 20 em 1s; o cliente faz no máximo a rajada
+    # (uma chamada por thread, 8) mais 10/s, somando as threads
+    stub = ml(pedidos=15, limite=20, por_segundo=10)
+    import app
+    inicio = time.monotonic()
+    resumo = app.sincronizar_vendas_ml(app.engine)
+    duracao = time.monotonic() - inicio
+
+    assert resumo["pedidos_lidos"] == 15
+    assert stub.stats["429"] == 0
+    chamadas = stub.stats["GET /orders/search"] + stub.stats["GET /orders/:id"] + stub.stats["GET /shipments/:id"]
+    assert duracao >= (chamadas - 8) / 10 * 0.9
+
+
+def test_limite_taxa_entre_threads():
+    limite = LimiteTaxa(50, rajada=1)
+    momentos = []
+
+    def chamar():
+        for _ in range(5):
+            limite.aguardar()
+            momentos.append(time.monotonic())
+
+    threads = [threading.Thread(target=chamar) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    momentos.sort()
+    assert len(momentos) == 20
+    # 4 threads dividindo a mesma taxa: 20 chamadas levam 19 intervalos de 1/50s
+    assert momentos[-1] - momentos[0] >= 19 / 50 * 0.9
+
+
+def test_conta_desconectada(app_limpo):
+    with app_limpo.engine.begin() as conn:
+        conn.execute(update(app_limpo.configuracoes).values(ml_access_token=None))
+    with pytest.raises(ValueError, match="não conectada"):
+        app_limpo.sincronizar_vendas_ml(app_limpo.engine)
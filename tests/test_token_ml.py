@@ -0,0 +1,180 @@
+"""Renovação do access token (``mercado_livre.TokenML``) contra o ``ml_stub``."""
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+from sqlalchemy import select, update
+
+from mercado_livre import ClienteML, TokenML
+from ml_stub import ServidorStub
+
+
+def _iso(segundos):
+    return (datetime.now(timezone.utc) + timedelta(seconds=segundos)).isoformat(timespec="seconds")
+
+
+class Banco:
+    """As colunas ml_* de configuracoes, em memória."""
+
+    def __init__(self, access_token, refresh_token, expira):
+        self.dados = {"access_token": access_token, "refresh_token": refresh_token, "expira": expira,
+                      "client_id": "1", "client_secret": "s"}
+        self.leituras = 0
+        self.gravacoes = []
+
+    def carregar(self):
+        self.leituras += 1
+        return dict(self.dados)
+
+    def salvar(self, access_token, refresh_token, expira):
+        self.gravacoes.append(access_token)
+        self.dados.update(access_token=access_token, refresh_token=refresh_token, expira=expira)
+
+
+@pytest.fixture
+def stub():
+    # latência para as threads se sobreporem enquanto a renovação está no ar
+    stub = ServidorStub(pedidos=5, access_token="velho", refresh_token="TG-1", latencia=0.05)
+    stub.url = stub.iniciar()
+    yield stub
+    stub.parar()
+
+
+def _token(stub, banco):
+    return TokenML(banco.carregar, banco.salvar, f"{stub.url}/oauth/token")
+
+
+def _em_paralelo(funcao, n=16):
+    barreira = threading.Barrier(n)
+    resultados, erros = [], []
+
+    def rodar():
+        barreira.wait()
+        try:
+            resultados.append(funcao())
+        except Exception as e:
+            erros.append(e)
+
+    threads = [threading.Thread(target=rodar) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not erros
+    return resultados
+
+
+def test_threads_renovam_uma_vez(stub):
+    # vence em 60s, dentro da margem de 300s: a primeira chamada renova
+    banco = Banco("velho", "TG-1", _iso(60))
+    tokens = _token(stub, banco)
+
+    resultados = _em_paralelo(tokens.obter)
+
+    assert stub.stats["POST /oauth/token"] == 1
+    assert stub.stats["oauth_renovado"] == 1 and stub.stats["oauth_recusado"] == 0
+    assert len(set(resultados)) == 1 and resultados[0].startswith("APP_USR-stub-1-")
+    assert banco.gravacoes == resultados[:1] and banco.dados["refresh_token"] == stub.refresh_token
+    assert tokens.renovacoes == 1
+    # depois, o token fica em memória: nem banco nem OAuth
+    leituras = banco.leituras
+    assert tokens.obter() == resultados[0] and banco.leituras == leituras
+
+
+def test_401_em_paralelo_renova_uma_vez(stub):
+    # o banco diz que vale por horas, mas o ML não aceita mais o token
+    banco = Banco("revogado", "TG-1", _iso(3600))
+    tokens = _token(stub, banco)
+    assert tokens.obter() == "revogado"
+
+    resultados = _em_paralelo(lambda: tokens.renovar("revogado"))
+
+    assert stub.stats["oauth_renovado"] == 1 and len(set(resultados)) == 1
+    assert resultados[0] != "revogado"
+
+
+def test_cliente_renova_no_401_e_repete(stub):
+    banco = Banco("revogado", "TG-1", _iso(3600))
+    tokens = _token(stub, banco)
+    cliente = ClienteML(tokens.obter, stub.url, 1000, 8, renovar=tokens.renovar)
+    try:
+        pedidos = list(cliente.detalhar_pedidos(list(stub.pedidos)))
+    finally:
+        cliente.fechar()
+
+    assert len(pedidos) == len(stub.pedidos)
+    assert stub.stats["oauth_renovado"] == 1
+    # 401 na primeira rajada (uma chamada por thread, no máximo), depois o token novo
+    assert 1 <= stub.stats["401"] <= 8
+
+
+def test_outro_processo_ja_renovou(stub):
+    banco = Banco("velho", "TG-1", _iso(60))
+    tokens = _token(stub, banco)
+    tokens.obter()
+    assert stub.stats["oauth_renovado"] == 1
+    novo = banco.dados["access_token"]
+
+    # outro worker, ainda com o token velho perto de vencer: relê o banco
+    # (já renovado pelo primeiro) em vez de gastar o refresh token de novo
+    outro = _token(stub, banco)
+    outro._atual = ("velho", time.time() + 60)
+    assert outro.obter() == novo
+    assert stub.stats["POST /oauth/token"] == 1 and outro.renovacoes == 0
+
+
+def test_renovacao_falhou_mantem_o_token_atual(stub, capsys):
+    banco = Banco("velho", "TG-1", _iso(60))
+    tokens = _token(stub, banco)
+    stub.falhar("/oauth/token", vezes=1, status=503)
+
+    assert tokens.obter() == "velho"
+    assert "renovação falhou" in capsys.readouterr().out
+    assert tokens.renovacoes == 0 and banco.gravacoes == []
+
+    # a próxima chamada (ainda dentro da margem) tenta de novo e consegue
+    novo = tokens.obter()
+    assert novo != "velho" and tokens.renovacoes == 1
+    assert stub.stats["503"] == 1 and stub.stats["oauth_renovado"] == 1
+
+
+def test_refresh_recusado_mantem_o_token_atual(stub):
+    # refresh token já usado: o ML responde 400 invalid_grant
+    banco = Banco("velho", "TG-usado", _iso(60))
+    tokens = _token(stub, banco)
+    assert tokens.obter() == "velho"
+    assert stub.stats["oauth_recusado"] == 1 and banco.gravacoes == []
+
+
+def test_renovacao_falhou_com_token_vencido(stub):
+    banco = Banco("velho", "TG-1", _iso(-10))
+    tokens = _token(stub, banco)
+    stub.falhar("/oauth/token", vezes=1, status=503)
+    with pytest.raises(requests.HTTPError):
+        tokens.obter()
+    # sem token em memória: a próxima chamada tenta de novo
+    assert tokens.obter().startswith("APP_USR-stub-1-")
+
+
+def test_sem_conta_ou_sem_refresh_token(stub):
+    with pytest.raises(ValueError, match="não conectada"):
+        _token(stub, Banco(None, None, None)).obter()
+    with pytest.raises(ValueError, match="ml_refresh_token"):
+        _token(stub, Banco("velho", None, _iso(-10))).obter()
+    assert stub.stats["POST /oauth/token"] == 0
+
+
+def test_sincronizacao_renova_uma_vez(ml):
+    stub = ml(pedidos=40, access_token="velho", refresh_token="TG-1", latencia=0.01)
+    import app
+    with app.engine.begin() as conn:
+        conn.execute(update(app.configuracoes).values(ml_token_expira=_iso(60)))
+
+    assert app.sincronizar_vendas_ml(app.engine)["pedidos_lidos"] == 40
+
+    assert stub.stats["oauth_renovado"] == 1 and stub.stats["401"] == 0
+    with app.engine.connect() as conn:
+        cfg = conn.execute(select(app.configuracoes)).mappings().first()
+    assert cfg["ml_access_token"].startswith("APP_USR-stub-1-") and cfg["ml_refresh_token"] == stub.refresh_token
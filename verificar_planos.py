@@ -0,0 +1,153 @@
+"""
+Verifica os planos de execução das consultas dos relatórios.
+
+Abre cada rota de relatório pelo test client do Flask, captura os SELECTs
+executados e roda ``EXPLAIN QUERY PLAN`` (SQLite) ou ``EXPLAIN`` (Postgres)
+em cada um. Falha (código de saída 1) se alguma consulta fizer varredura
+completa de uma das tabelas grandes (``vendas``, ``finance_transactions``),
+ou seja, se faltar índice para algum filtro. Varrer um índice de cobertura
+(``SCAN ... USING COVERING INDEX``) é aceito.
+
+No Postgres o ``enable_seqscan`` é desligado na sessão, para que o plano
+mostre ``Seq Scan`` só quando não houver índice utilizável (com poucas linhas
+o planejador preferiria a varredura mesmo com índice).
+
+Uso:
+    python verificar_planos.py [--inicio 2025-11-01] [--fim 2025-12-23]
+
+Sem ``DATABASE_URL`` roda numa cópia temporária do ``metrifiy.db``; com
+``DATABASE_URL`` usa o banco indicado (só leituras, além das migrações
+pendentes que o app aplicaria no boot).
+"""
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+from datetime import date, timedelta
+
+from sqlalchemy import event
+
+TABELAS_GRANDES = ("vendas", "finance_transactions")
+
+ROTAS = [
+    "/?data_inicio={inicio}&data_fim={fim}",
+    "/vendas?data_inicio={inicio}&data_fim={fim}",
+    "/vendas?data_inicio={inicio}&data_fim={fim}&ultima=1",
+    "/relatorio_lucro?data_inicio={inicio}&data_fim={fim}",
+    "/relatorio_lucro/exportar?data_inicio={inicio}&data_fim={fim}",
+    "/estoque",
+    "/financeiro?data_inicio={inicio}&data_fim={fim}",
+    "/conciliacao?data_inicio={inicio}&data_fim={fim}",
+    "/gerenciar_lotes",
+    "/alertas",
+    "/produtos_automaticos",
+    "/api/produto-vendas/1",
+]
+
+
+def capturar_consultas(app, client, url):
+    """SELECTs (sql, parâmetros) executados ao abrir ``url``."""
+    consultas = []
+
+    def capturar(_conn, _cursor, sql, parametros, _contexto, executemany):
+        if not executemany and sql.lstrip().upper().startswith("SELECT"):
+            consultas.append((sql, parametros))
+
+    event.listen(app.engine, "before_cursor_execute", capturar)
+    try:
+        resp = client.get(url)
+    finally:
+        event.remove(app.engine, "before_cursor_execute", capturar)
+    if resp.status_code != 200:
+        raise RuntimeError(f"{url} respondeu {resp.status_code}")
+    return consultas
+
+
+def plano(conn, sql, parametros):
+    """Linhas do plano de execução da consulta."""
+    if conn.dialect.name == "postgresql":
+        return [r[0] for r in conn.exec_driver_sql("EXPLAIN " + sql, parametros)]
+    return [r[-1] for r in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, parametros)]
+
+
+def varreduras_completas(dialeto, linhas):
+    """Tabelas grandes lidas por inteiro, segundo o plano."""
+    if dialeto == "postgresql":
+        padrao = re.compile(r"Seq Scan on (\w+)")
+    else:
+        # "SCAN vendas" (sem "USING ... INDEX")
+        padrao = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+    tabelas = []
+    for linha in linhas:
+        m = padrao.search(linha.strip())
+        if m and m.group(1) in TABELAS_GRANDES:
+            tabelas.append(m.group(1))
+    return tabelas
+
+
+def verificar(app, inicio, fim):
+    """Retorna a lista de problemas [(url, sql, plano)]."""
+    client = app.app.test_client()
+    with client.session_transaction() as sessao:
+        sessao["_user_id"] = "1"
+
+    problemas = []
+    vistas = set()
+    with app.engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.exec_driver_sql("SET enable_seqscan = off")
+        for rota in ROTAS:
+            url = rota.format(inicio=inicio, fim=fim)
+            consultas = capturar_consultas(app, client, url)
+            ruins = 0
+            for sql, parametros in consultas:
+                if sql in vistas:
+                    continue
+                vistas.add(sql)
+                linhas = plano(conn, sql, parametros)
+                if varreduras_completas(conn.dialect.name, linhas):
+                    problemas.append((url, sql, linhas))
+                    ruins += 1
+            print(f"{'FALHOU' if ruins else 'ok':<7} {url} ({len(consultas)} consultas)")
+    return problemas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    hoje = date.today()
+    parser.add_argument("--inicio", default=(hoje - timedelta(days=29)).isoformat())
+    parser.add_argument("--fim", default=hoje.isoformat())
+    args = parser.parse_args()
+
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    tmp = None
+    if not os.environ.get("DATABASE_URL"):
+        # nunca mexer no banco local: as migrações rodam numa cópia
+        tmp = tempfile.mkdtemp(prefix="planos_")
+        if os.path.exists(os.path.join(raiz, "metrifiy.db")):
+            shutil.copy2(os.path.join(raiz, "metrifiy.db"), tmp)
+        os.chdir(tmp)
+    sys.path.insert(0, raiz)
+    try:
+        import app
+
+        problemas = verificar(app, args.inicio, args.fim)
+    finally:
+        os.chdir(raiz)
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    for url, sql, linhas in problemas:
+        print(f"\nVarredura completa em {url}:\n  {' '.join(sql.split())}")
+        for linha in linhas:
+            print(f"    {linha}")
+    if problemas:
+        print(f"\n{len(problemas)} consulta(s) sem índice nas tabelas grandes.")
+        sys.exit(1)
+    print("\nNenhuma varredura completa nas tabelas grandes.")
+
+
+if __name__ == "__main__":
+    main()